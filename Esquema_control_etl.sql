@@ -0,0 +1,61 @@
+-- ==========================================
+-- ESQUEMA DE CONTROL DEL ETL
+-- ==========================================
+-- Tablas de metadatos que el ETL actualiza al terminar cada carga.
+-- La API y el agente las leen para invalidar cachés y exponer frescura.
+
+CREATE SCHEMA IF NOT EXISTS etl;
+
+-- 1. VERSIÓN DE DATOS (una sola fila)
+-- Se incrementa cada vez que termina una carga de dw.fact_ventas / dw.fact_transacciones
+CREATE TABLE IF NOT EXISTS etl.data_version (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    origen VARCHAR(100),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+INSERT INTO etl.data_version (id, version, origen)
+VALUES (1, 0, 'inicial')
+ON CONFLICT (id) DO NOTHING;
+
+-- 2. PARTICIONES (fecha_key) MODIFICADAS POR EL ETL Y AÚN NO MATERIALIZADAS
+-- El refresco de agregados (materialized_aggregates.py) las consume
+CREATE TABLE IF NOT EXISTS etl.dirty_partitions (
+    fecha_key INTEGER PRIMARY KEY,
+    marked_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- 3. ESTADO DE LOS AGREGADOS MATERIALIZADOS (frescura expuesta por la API)
+CREATE TABLE IF NOT EXISTS etl.materialization_status (
+    aggregate_name VARCHAR(100) PRIMARY KEY,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    data_version BIGINT NOT NULL DEFAULT 0,
+    full_refresh BOOLEAN NOT NULL DEFAULT false,
+    partitions_refreshed INTEGER NOT NULL DEFAULT 0,
+    rows_written BIGINT NOT NULL DEFAULT 0,
+    duration_ms INTEGER NOT NULL DEFAULT 0
+);
+
+-- 4. MARCAS DE AGUA DE LA CARGA INCREMENTAL (etl_incremental.py)
+-- Último valor de la columna de watermark ya cargado desde cada tabla fuente
+CREATE TABLE IF NOT EXISTS etl.watermarks (
+    source_table VARCHAR(100) PRIMARY KEY,
+    watermark_column VARCHAR(100) NOT NULL,
+    last_value BIGINT NOT NULL DEFAULT 0,
+    rows_loaded BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- 5. VERSIÓN DE FILA DE LAS TABLAS FUENTE (marca de agua de etl_incremental.py)
+-- Un trigger asigna etl_row_version = nextval(etl.row_version_seq) en cada
+-- INSERT y en cada UPDATE que cambia la fila: las correcciones de filas ya
+-- cargadas vuelven a entrar en la siguiente carga incremental.
+CREATE SEQUENCE IF NOT EXISTS etl.row_version_seq;
+
+CREATE OR REPLACE FUNCTION etl.touch_row_version() RETURNS trigger AS $$
+BEGIN
+    NEW.etl_row_version := nextval('etl.row_version_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
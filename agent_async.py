@@ -0,0 +1,279 @@
+import asyncio
+import time
+import traceback
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool
+from langgraph.errors import GraphRecursionError
+from langgraph.graph import StateGraph, END
+
+from agent_budget import (
+    best_effort_message, final_instruction, graph_config, kpi_fallback_match, kpi_fallback_message,
+    record_outcome, record_recursion_limit,
+)
+from agent_prelude import record_question
+from answer_cache import answer_cache
+from db_pool import DatabaseError, DatabasePool, QueryTimeoutError
+from etl_control import DATA_VERSION_POLL_SECONDS, DATA_VERSION_QUERY
+from kpi_fast_path import try_fast_path_async
+from main import (
+    AgentState,
+    KPI_REGISTRY,
+    build_initial_state,
+    build_state_context,
+    build_static_prompt,
+    get_kpi_sql,
+    observer_node,
+    should_continue,
+    sql_repairer,
+    sql_security_error,
+)
+from model_router import ModelRouter, classify_step, compile_router
+from parallel_tools import AsyncParallelToolNode
+from result_encoding import RESULT_MAX_ROWS, ResultSet, encode_for_llm
+from sql_cost_gate import AGENT_STATEMENT_TIMEOUT_MS, SQLCostRejected, timeout_feedback
+from sql_executor import execute_streaming_async
+from sql_repair import execute_with_repair_async, repair_note
+from sql_result_cache import fingerprint_sql, sql_result_cache
+
+# ========================================================================
+# AGENTE REACT ASYNC (varias sesiones concurrentes en un mismo proceso)
+# ========================================================================
+# Misma lógica que create_react_graph_real, pero:
+#   - LLM con ainvoke y SQL con el DatabasePool compartido (asyncpg / threads)
+#   - Sin _lazy_components: cada pregunta lleva su AgentContext en
+#     config["configurable"]["agent_context"], que los nodos y tools leen
+#   - El grafo compilado es inmutable y se comparte entre todas las sesiones
+AGENT_MAX_ROWS = RESULT_MAX_ROWS
+AGENT_VERSION_POLL_SECONDS = DATA_VERSION_POLL_SECONDS
+
+
+@dataclass
+class AgentContext:
+    """Dependencias de una sesión (una pregunta en curso)"""
+    llm: Any
+    router: ModelRouter  # Preludios por tier (tools + prompt estático), compartidos por todas las sesiones
+    db: DatabasePool
+    session_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    statement_timeout_ms: int = AGENT_STATEMENT_TIMEOUT_MS
+    data_version: Optional[int] = None  # etl.data_version leída por el agente al recibir la pregunta
+
+
+def agent_context(config: RunnableConfig) -> AgentContext:
+    context = (config or {}).get("configurable", {}).get("agent_context")
+    if context is None:
+        raise ValueError("agent_context no presente en config['configurable']")
+    return context
+
+
+# ========================================================================
+# TOOLS ASYNC
+# ========================================================================
+@tool("execute_sql", response_format="content_and_artifact")
+async def execute_sql_async(query: str, config: RunnableConfig) -> Tuple[str, Dict[str, Any]]:
+    """
+    Ejecuta una consulta SQL contra la base de datos.
+
+    Args:
+        query: Consulta SQL a ejecutar
+
+    Returns:
+        Tabla compacta con los resultados (columnas una sola vez) o mensaje de error
+    """
+    context = agent_context(config)
+    fingerprint = fingerprint_sql(query)[:12]
+    artifact = {"cache_hit": False, "query": query, "fingerprint": fingerprint, "result": None}
+
+    cached = sql_result_cache.get(query, context.data_version)
+    if cached is not None and sql_security_error(query) is None:
+        print(f"♻️ [{context.session_id}] RESULTADO SQL DESDE CACHÉ ({fingerprint})")
+        result = ResultSet.from_json(cached)
+        return encode_for_llm(result), {**artifact, "cache_hit": True, "result": result}
+
+    async def run(sql: str):
+        security_error = sql_security_error(sql)
+        if security_error:
+            return security_error
+        start = time.perf_counter()
+        try:
+            result = await execute_streaming_async(context.db, sql, sample_rows=AGENT_MAX_ROWS,
+                                                   statement_timeout_ms=context.statement_timeout_ms,
+                                                   log_prefix=f"[{context.session_id}] ")
+        except SQLCostRejected as e:
+            return e.decision.feedback()
+        except QueryTimeoutError:
+            print(f"⏱️ [{context.session_id}] CONSULTA CANCELADA ({context.statement_timeout_ms} ms)")
+            return timeout_feedback(context.statement_timeout_ms)
+        except DatabaseError as e:
+            print(f"💥 [{context.session_id}] ERROR EN CONSULTA: {e}")
+            return f"SQL_ERROR: {e}"
+        print(f"✅ [{context.session_id}] CONSULTA COMPLETADA en {time.perf_counter() - start:.2f}s "
+              f"({result.total_rows}{'+' if result.capped else ''} filas)")
+        return result
+
+    # 🩹 Un identificador mal escrito se corrige localmente y se reintenta una vez
+    result, executed_query, fixes = await execute_with_repair_async(query, run, sql_repairer)
+    if isinstance(result, str):
+        return result, artifact
+    sql_result_cache.put(executed_query, result.to_json(), context.data_version)
+    content = encode_for_llm(result)
+    if fixes:
+        content = f"{repair_note(fixes)}\n{content}"
+    return content, {**artifact, "query": executed_query, "repairs": fixes, "result": result}
+
+
+# ========================================================================
+# NODOS ASYNC
+# ========================================================================
+async def assistant_node_async(state: AgentState, config: RunnableConfig) -> Dict[str, Any]:
+    """assistant_node con ainvoke y el LLM (ya con tools) de la sesión"""
+    context = agent_context(config)
+    budget = state.get("budget")
+    decision = budget.plan() if budget is not None else "continue"
+    record_outcome(budget, decision)
+    if decision != "continue":
+        fallback = await budget_fallback_async(state, decision, context)
+        if fallback is not None:
+            return {"messages": [fallback]}
+
+    router = context.router
+    prelude = router.prelude
+    state_context = build_state_context(state)
+    step = classify_step(state, decision, KPI_REGISTRY)
+    if decision == "final":
+        llm_messages = prelude.messages(state["messages"], [state_context, final_instruction(budget)])
+        response = await router.ainvoke(step, llm_messages, kind="final", budget=budget)
+    else:
+        response = await router.ainvoke(step, prelude.messages(state["messages"], [state_context]), budget=budget)
+    return {"messages": [response]}
+
+
+async def budget_fallback_async(state: AgentState, decision: str, context: AgentContext):
+    """budget_fallback de main.py con el KPI de respaldo leído desde el pool"""
+    budget = state["budget"]
+    if decision == "final" and state.get("result_set") is None:
+        kpi_name = kpi_fallback_match(state.get("question", ""), KPI_REGISTRY)
+        if kpi_name:
+            try:
+                rows = await context.db.fetch_all(KPI_REGISTRY[kpi_name]["sql_template"])
+                return kpi_fallback_message(kpi_name, KPI_REGISTRY[kpi_name], rows)
+            except DatabaseError as e:
+                print(f"⚠️ [{context.session_id}] KPI de respaldo falló: {e}")
+    if decision == "stop":
+        return best_effort_message(state, budget)
+    return None
+
+
+async def observer_node_async(state: AgentState) -> Dict[str, Any]:
+    # observer_node es puro (solo lee el estado): se reutiliza sin hilo extra
+    return observer_node(state)
+
+
+def create_async_graph(tools: List[Any]):
+    """Grafo assistant → tools → observer → assistant, compartido por todas las sesiones"""
+    workflow = StateGraph(AgentState)
+    workflow.add_node("assistant", assistant_node_async)
+    workflow.add_node("tools", AsyncParallelToolNode(tools))
+    workflow.add_node("observer", observer_node_async)
+
+    workflow.set_entry_point("assistant")
+    workflow.add_conditional_edges("assistant", should_continue, {"tools": "tools", "end": END})
+    workflow.add_edge("tools", "observer")
+    workflow.add_edge("observer", "assistant")
+    return workflow.compile()
+
+
+# ========================================================================
+# AGENTE
+# ========================================================================
+class AsyncAgent:
+    """Punto de entrada async: caché de respuestas → ruta rápida → grafo"""
+
+    def __init__(self, llm, db: DatabasePool, retriever_tool=None, small_llm=None):
+        self.llm = llm
+        self.db = db
+        self.tools = [execute_sql_async, get_kpi_sql]
+        if retriever_tool:
+            self.tools.append(retriever_tool)
+        self.router = compile_router(llm, small_llm, self.tools, build_static_prompt,
+                                     kpi_names=list(KPI_REGISTRY), sql_check=sql_security_error)
+        self.graph = create_async_graph(self.tools)
+
+        self._data_version = 0
+        self._version_checked_at = 0.0
+        self._version_lock = asyncio.Lock()
+
+    async def refresh_data_version(self) -> int:
+        """Lee etl.data_version como máximo cada AGENT_VERSION_POLL_SECONDS"""
+        if time.time() - self._version_checked_at < AGENT_VERSION_POLL_SECONDS:
+            return self._data_version
+        async with self._version_lock:
+            if time.time() - self._version_checked_at < AGENT_VERSION_POLL_SECONDS:
+                return self._data_version
+            try:
+                rows = await self.db.fetch_all(DATA_VERSION_QUERY)
+                self._data_version = int(rows[0]["version"]) if rows else 0
+            except DatabaseError as e:
+                print(f"⚠️ etl.data_version no disponible: {e}")
+            self._version_checked_at = time.time()
+        return self._data_version
+
+    async def ask(self, question: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Responde una pregunta; es seguro llamarlo de forma concurrente.
+
+        Returns:
+            Mismo formato que process_question_react más session_id y elapsed_ms
+        """
+        start = time.perf_counter()
+        context = AgentContext(llm=self.llm, router=self.router, db=self.db)
+        if session_id:
+            context.session_id = session_id
+
+        # Las cachés reciben la versión ya consultada (sin lecturas síncronas a la BD)
+        context.data_version = await self.refresh_data_version()
+        # lookup/store pueden pedir embeddings (HTTP síncrono): van a un thread
+        result = await asyncio.to_thread(answer_cache.lookup, question, context.data_version)
+        if result is None:
+            result = await self._answer_uncached(question, context)
+            await asyncio.to_thread(answer_cache.store, question, result, (time.perf_counter() - start) * 1000,
+                                    context.data_version)
+
+        result["session_id"] = context.session_id
+        result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+
+    async def _answer_uncached(self, question: str, context: AgentContext) -> Dict[str, Any]:
+        fast_result = await try_fast_path_async(question, KPI_REGISTRY, self.db.fetch_all, self.llm)
+        if fast_result:
+            return fast_result
+
+        print(f"\n💬 [{context.session_id}] '{question}'")
+        config = graph_config({"configurable": {"agent_context": context, "thread_id": context.session_id}})
+        initial_state = build_initial_state(question)
+        record_question(self.router.prelude)
+        try:
+            final_state = await self.graph.ainvoke(initial_state, config=config)
+        except GraphRecursionError:
+            record_recursion_limit()
+            print(f"⏳ [{context.session_id}] recursion_limit alcanzado ({initial_state['budget'].describe()})")
+            return {"response": "No alcancé a completar el análisis dentro del límite de pasos. Intenta acotar la pregunta.",
+                    "messages": [], "attempts": 0, "budget": initial_state["budget"].summary()}
+        except Exception as e:
+            error_msg = f"Error en proceso ReAct: {str(e)}"
+            print(f"❌ [{context.session_id}] {error_msg}")
+            traceback.print_exc()
+            return {"response": error_msg, "messages": [], "attempts": 0}
+
+        messages = final_state.get("messages", [])
+        return {
+            "response": messages[-1].content if messages else "No se pudo generar respuesta.",
+            "messages": messages,
+            "attempts": final_state.get("attempt_count", 0),
+            "sql_query": final_state.get("sql_query"),
+            "result_rows": final_state.get("result_rows"),
+            "budget": initial_state["budget"].summary(),
+        }
@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, SystemMessage
+
+from kpi_fast_path import match_kpi, render_template
+
+# ========================================================================
+# PRESUPUESTO POR PREGUNTA (tiempo, llamadas LLM, tokens, consultas SQL)
+# ========================================================================
+# compiled_graph.max_iterations no lo lee LangGraph: el único límite real es
+# recursion_limit en el config de invoke/stream. Además de ese tope, cada
+# pregunta lleva un AgentBudget en el estado que los nodos consultan antes de
+# llamar al LLM:
+#   continue → ciclo normal con tools
+#   final    → queda poco (plazo, última llamada LLM, SQL agotado): se responde
+#              con lo que hay; sin resultados aún, se salta a un KPI registrado
+#   stop     → presupuesto agotado: respuesta de mejor esfuerzo sin LLM
+AGENT_DEADLINE_SECONDS = float(os.getenv("AGENT_DEADLINE_SECONDS", "45"))
+AGENT_MAX_LLM_CALLS = int(os.getenv("AGENT_MAX_LLM_CALLS", "8"))
+AGENT_MAX_TOKENS = int(os.getenv("AGENT_MAX_TOKENS", "60000"))
+AGENT_MAX_SQL = int(os.getenv("AGENT_MAX_SQL", "6"))
+# Tiempo que se reserva para redactar la respuesta final
+AGENT_FINAL_RESERVE_SECONDS = float(os.getenv("AGENT_FINAL_RESERVE_SECONDS", "8"))
+# Cada iteración son 3 pasos (assistant → tools → observer); el presupuesto corta antes
+AGENT_RECURSION_LIMIT = int(os.getenv("AGENT_RECURSION_LIMIT", str(3 * AGENT_MAX_LLM_CALLS + 3)))
+# Umbral más laxo que la ruta rápida: solo se usa cuando ya no hay margen para el grafo
+BUDGET_KPI_THRESHOLD = float(os.getenv("AGENT_BUDGET_KPI_THRESHOLD", "0.6"))
+TOKEN_FINAL_RATIO = 0.85
+
+_stats_lock = threading.Lock()
+budget_stats = {"questions": 0, "final": 0, "stopped": 0, "kpi_fallbacks": 0, "recursion_limit": 0}
+_reason_counts: Dict[str, int] = {}
+
+
+@dataclass
+class AgentBudget:
+    """Límites y consumo de una pregunta; vive en el estado del grafo"""
+    deadline_seconds: float = AGENT_DEADLINE_SECONDS
+    max_llm_calls: int = AGENT_MAX_LLM_CALLS
+    max_tokens: int = AGENT_MAX_TOKENS
+    max_sql: int = AGENT_MAX_SQL
+    started: float = field(default_factory=time.monotonic)
+    llm_calls: int = 0
+    tokens: int = 0
+    sql_executions: int = 0
+    exhausted_reason: Optional[str] = None
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def remaining_seconds(self) -> float:
+        return self.deadline_seconds - self.elapsed_seconds
+
+    def charge_llm(self, message: Any) -> None:
+        """Suma una llamada y sus tokens (usage_metadata del AIMessage, si viene)"""
+        self.llm_calls += 1
+        usage = getattr(message, "usage_metadata", None) or {}
+        self.tokens += int(usage.get("total_tokens", 0))
+
+    def charge_sql(self, executions: int = 1) -> None:
+        self.sql_executions += executions
+
+    def plan(self) -> str:
+        """'continue', 'final' o 'stop' según lo que queda del presupuesto"""
+        if self.remaining_seconds <= 0:
+            return self._exhaust("stop", "plazo")
+        if self.llm_calls >= self.max_llm_calls:
+            return self._exhaust("stop", "llamadas_llm")
+        if self.tokens >= self.max_tokens:
+            return self._exhaust("stop", "tokens")
+        if self.remaining_seconds < AGENT_FINAL_RESERVE_SECONDS:
+            return self._exhaust("final", "plazo")
+        if self.llm_calls == self.max_llm_calls - 1:
+            return self._exhaust("final", "llamadas_llm")
+        if self.tokens >= self.max_tokens * TOKEN_FINAL_RATIO:
+            return self._exhaust("final", "tokens")
+        if self.sql_executions >= self.max_sql:
+            return self._exhaust("final", "consultas_sql")
+        return "continue"
+
+    def _exhaust(self, decision: str, reason: str) -> str:
+        if self.exhausted_reason is None:
+            self.exhausted_reason = reason
+            print(f"⏳ Presupuesto: {reason} → {decision} ({self.describe()})")
+        return decision
+
+    def describe(self) -> str:
+        return (f"{self.elapsed_seconds:.1f}/{self.deadline_seconds:.0f}s, LLM {self.llm_calls}/{self.max_llm_calls}, "
+                f"tokens {self.tokens}/{self.max_tokens}, SQL {self.sql_executions}/{self.max_sql}")
+
+    def prompt_hint(self) -> str:
+        """Línea para el contexto del LLM: planificar contra lo que queda"""
+        return (f"PRESUPUESTO RESTANTE: {max(self.remaining_seconds, 0):.0f}s, "
+                f"{self.max_llm_calls - self.llm_calls} llamadas LLM, "
+                f"{max(self.max_sql - self.sql_executions, 0)} consultas SQL. "
+                f"Prefiere get_kpi_sql y una sola consulta bien filtrada a varias exploratorias.")
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "elapsed_s": round(self.elapsed_seconds, 2),
+            "llm_calls": self.llm_calls,
+            "tokens": self.tokens,
+            "sql_executions": self.sql_executions,
+            "exhausted": self.exhausted_reason,
+        }
+
+
+def new_budget() -> AgentBudget:
+    with _stats_lock:
+        budget_stats["questions"] += 1
+    return AgentBudget()
+
+
+def graph_config(config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Config de invoke/stream con el recursion_limit que LangGraph sí aplica"""
+    return {**(config or {}), "recursion_limit": AGENT_RECURSION_LIMIT}
+
+
+# ========================================================================
+# RESPUESTAS CUANDO SE ACABA EL PRESUPUESTO
+# ========================================================================
+def final_instruction(budget: AgentBudget) -> SystemMessage:
+    """Para la última llamada LLM: responder ya, sin más herramientas"""
+    return SystemMessage(content=(
+        f"PRESUPUESTO CASI AGOTADO ({budget.exhausted_reason}). No llames más herramientas: "
+        "responde ahora al usuario con la información ya obtenida. Si es parcial, dilo y explica qué faltó."))
+
+
+def kpi_fallback_match(question: str, registry: Dict[str, Dict[str, Any]]) -> Optional[str]:
+    """KPI registrado que aproxima la pregunta (umbral laxo), o None"""
+    match = match_kpi(question, registry, threshold=BUDGET_KPI_THRESHOLD)
+    return match["kpi"] if match else None
+
+
+def kpi_fallback_message(kpi_name: str, kpi_info: Dict[str, Any], rows: List[Dict[str, Any]]) -> AIMessage:
+    with _stats_lock:
+        budget_stats["kpi_fallbacks"] += 1
+    print(f"⚡ Presupuesto: respuesta desde el KPI registrado '{kpi_name}'")
+    return AIMessage(content=(f"{render_template(kpi_name, kpi_info, rows)}\n\n"
+                              "(Respuesta aproximada con el KPI registrado más cercano: no hubo tiempo para "
+                              "una consulta a medida.)"))
+
+
+def best_effort_message(state: Dict[str, Any], budget: AgentBudget) -> AIMessage:
+    """Respuesta sin LLM con el último resultado disponible"""
+    result_set = state.get("result_set")
+    texto = f"No alcancé a completar el análisis dentro del presupuesto ({budget.exhausted_reason})."
+    if result_set is not None and result_set.rows:
+        texto += f"\n\nÚltimo resultado obtenido:\n{result_set.encode('markdown')}"
+    else:
+        texto += " Intenta acotar la pregunta (sede, rango de fechas o métrica concreta)."
+    return AIMessage(content=texto)
+
+
+def record_outcome(budget: Optional[AgentBudget], decision: str) -> None:
+    if budget is None or decision == "continue":
+        return
+    with _stats_lock:
+        budget_stats["final" if decision == "final" else "stopped"] += 1
+        _reason_counts[budget.exhausted_reason] = _reason_counts.get(budget.exhausted_reason, 0) + 1
+
+
+def record_recursion_limit() -> None:
+    with _stats_lock:
+        budget_stats["recursion_limit"] += 1
+
+
+def format_budget_stats() -> str:
+    with _stats_lock:
+        stats = dict(budget_stats)
+        reasons = ", ".join(f"{k}: {v}" for k, v in sorted(_reason_counts.items())) or "—"
+    return (f"⏳ Presupuesto: {stats['questions']} preguntas | {stats['final']} cerradas antes de tiempo, "
+            f"{stats['stopped']} cortadas, {stats['kpi_fallbacks']} vía KPI, {stats['recursion_limit']} por "
+            f"recursion_limit | motivos: {reasons}")
@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from typing import Any, Dict, List
+
+# ========================================================================
+# PRUEBA DE CARGA: SESIONES CONCURRENTES vs LATENCIA p95
+# ========================================================================
+# Cada sesión simula un dueño/administrador que hace N preguntas seguidas.
+# Para cada nivel de concurrencia se lanzan esas sesiones a la vez y se
+# reporta p50 / p95 / máx por pregunta y el throughput total.
+#
+#   python agent_load_test.py --concurrencias 1 2 4 8 16
+#   python agent_load_test.py --modo sync        # línea base: grafo síncrono serializado
+#   python agent_load_test.py --sin-cache        # mide el grafo, no las cachés
+#   python agent_load_test.py --histograma       # distribución de latencias vs el plazo por pregunta
+DEFAULT_QUESTIONS = [
+    "¿Cuáles son las ventas por sede?",
+    "¿Cuáles son los productos más vendidos?",
+    "¿Cuáles son las horas pico?",
+    "¿Cómo se distribuyen los medios de pago?",
+    "¿Cuánto dejan las propinas por sede?",
+    "¿Qué sede tiene el mayor ticket promedio?",
+    "¿Qué productos venden más en la tarde en Merced?",
+    "¿Cuántos clientes vuelven a comprar?",
+]
+
+
+HISTOGRAM_BUCKETS_S = [1, 2, 5, 10, 15, 20, 30, 45, 60, 90]
+
+
+def histogram(latencies_ms: List[float], width: int = 40) -> List[str]:
+    """Líneas de un histograma de texto por tramos de segundos"""
+    if not latencies_ms:
+        return []
+    conteos = [0] * (len(HISTOGRAM_BUCKETS_S) + 1)
+    for ms in latencies_ms:
+        tramo = next((i for i, limite in enumerate(HISTOGRAM_BUCKETS_S) if ms <= limite * 1000), len(HISTOGRAM_BUCKETS_S))
+        conteos[tramo] += 1
+    mayor = max(conteos)
+    lineas = []
+    for i, conteo in enumerate(conteos):
+        etiqueta = f"≤{HISTOGRAM_BUCKETS_S[i]}s" if i < len(HISTOGRAM_BUCKETS_S) else f">{HISTOGRAM_BUCKETS_S[-1]}s"
+        lineas.append(f"   {etiqueta:>6} | {'█' * round(width * conteo / mayor):<{width}} {conteo}")
+    return lineas
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(pct) - 1]
+
+
+async def run_level(ask, concurrency: int, questions: List[str], per_session: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+
+    async def session(index: int):
+        nonlocal errors
+        for turn in range(per_session):
+            question = questions[(index * per_session + turn) % len(questions)]
+            start = time.perf_counter()
+            try:
+                result = await ask(question, f"s{concurrency}-{index}")
+                if result["response"].startswith("Error en proceso ReAct"):
+                    errors += 1
+            except Exception as e:
+                print(f"⚠️ sesión {index}: {e}")
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(concurrency)))
+    wall = time.perf_counter() - start
+    return {
+        "sesiones": concurrency,
+        "preguntas": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "max_ms": round(max(latencies), 1) if latencies else 0.0,
+        "throughput_qps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "errores": errors,
+        "latencias_ms": [round(ms, 1) for ms in latencies],
+    }
+
+
+async def build_async_ask(llm):
+    from agent_async import AsyncAgent
+    from db_pool import init_pool
+    from model_router import create_small_llm
+
+    agent = AsyncAgent(llm, await init_pool(), small_llm=create_small_llm())
+    return agent.ask
+
+
+def build_sync_ask(llm):
+    """Grafo síncrono de main.py: _lazy_components es global, así que se serializa"""
+    from database import create_database_connection
+    from main import create_react_graph_real, process_question_react
+    from model_router import create_small_llm
+
+    graph = create_react_graph_real(llm, create_database_connection(), create_small_llm())
+    lock = asyncio.Lock()
+
+    async def ask(question: str, session_id: str) -> Dict[str, Any]:
+        async with lock:
+            return await asyncio.to_thread(process_question_react, question, graph)
+
+    return ask
+
+
+async def main_async(args) -> List[Dict[str, Any]]:
+    from langchain_openai import ChatOpenAI
+
+    from config.environment import setup_environment
+    from model_router import ROUTER_LARGE_MODEL
+
+    setup_environment()
+    llm = ChatOpenAI(model=ROUTER_LARGE_MODEL, temperature=0, max_tokens=1500)
+    ask = await build_async_ask(llm) if args.modo == "async" else build_sync_ask(llm)
+
+    print(f"🚀 Prueba de carga ({args.modo}) | {args.preguntas_por_sesion} preguntas por sesión")
+    print(f"   {'sesiones':>8} {'preguntas':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'máx ms':>9} {'q/s':>6} {'errores':>7}")
+    resultados = []
+    for concurrency in args.concurrencias:
+        fila = await run_level(ask, concurrency, DEFAULT_QUESTIONS, args.preguntas_por_sesion)
+        resultados.append(fila)
+        print(f"   {fila['sesiones']:>8} {fila['preguntas']:>9} {fila['p50_ms']:>9.0f} {fila['p95_ms']:>9.0f} "
+              f"{fila['p99_ms']:>9.0f} {fila['max_ms']:>9.0f} {fila['throughput_qps']:>6.2f} {fila['errores']:>7}")
+
+    if args.histograma:
+        from agent_budget import AGENT_DEADLINE_SECONDS, format_budget_stats
+
+        todas = [ms for fila in resultados for ms in fila["latencias_ms"]]
+        print(f"\n📊 Latencia por pregunta ({len(todas)} preguntas, plazo {AGENT_DEADLINE_SECONDS:.0f}s):")
+        for linea in histogram(todas):
+            print(linea)
+        sobre_plazo = sum(1 for ms in todas if ms > AGENT_DEADLINE_SECONDS * 1000)
+        print(f"   p99 {percentile(todas, 99) / 1000:.1f}s | máx {max(todas, default=0) / 1000:.1f}s | "
+              f"{sobre_plazo} sobre el plazo")
+        print(format_budget_stats())
+
+    from model_router import format_router_stats
+
+    # Latencia y costo por tier (modelo pequeño vs grande) acumulados en la prueba
+    print(format_router_stats())
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sesiones concurrentes vs latencia p95 del agente")
+    parser.add_argument("--concurrencias", nargs="+", type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument("--preguntas-por-sesion", type=int, default=3)
+    parser.add_argument("--modo", choices=["async", "sync"], default="async")
+    parser.add_argument("--sin-cache", action="store_true", help="Desactivar cachés de respuestas y SQL")
+    parser.add_argument("--sin-ruta-rapida", action="store_true", help="Enviar todo por el grafo")
+    parser.add_argument("--histograma", action="store_true", help="Histograma de latencias y p99 vs el plazo")
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    # Las cachés y la ruta rápida leen su configuración al importarse
+    if args.sin_cache:
+        os.environ["ANSWER_CACHE_ENABLED"] = "0"
+        os.environ["SQL_CACHE_ENABLED"] = "0"
+    if args.sin_ruta_rapida:
+        os.environ["KPI_FAST_PATH"] = "0"
+
+    resultados = asyncio.run(main_async(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"modo": args.modo, "resultados": resultados}, f, indent=2)
+        print(f"📝 Resultados guardados en {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from context_budget import count_tokens, prepare_llm_messages
+
+# ========================================================================
+# PRELUDIO DEL AGENTE: MODELO, TOOLS Y PROMPT ESTÁTICO COMPILADOS UNA VEZ
+# ========================================================================
+# Antes, cada llamada del assistant hacía llm.bind_tools(...) (re-deriva los
+# esquemas OpenAI de execute_sql, get_kpi_sql y el retriever) y cada pregunta
+# volvía a renderizar el system prompt desde KPI_REGISTRY. Ahora se preparan
+# al construir el grafo y los mensajes van de lo más estable a lo más volátil:
+#   [tools (esquemas fijos)] [prompt estático: reglas + KPIs] [esquema de la
+#   pregunta] [pregunta] [historial] [contexto operacional del turno]
+# Así el proveedor puede reutilizar su caché de prefijo (OpenAI: ≥1024 tokens
+# idénticos) entre turnos y entre preguntas.
+_stats_lock = threading.Lock()
+prelude_stats = {"turns": 0, "questions": 0, "saved_ms": 0.0, "input_tokens": 0, "cached_tokens": 0}
+
+
+@dataclass
+class AgentPrelude:
+    """Modelo con tools ya enlazadas + prefijo estático del prompt"""
+    llm: Any
+    tools: List[Any]
+    bound_llm: Any
+    final_llm: Any  # Mismas tools con tool_choice="none" (última llamada del presupuesto)
+    static_prefix: SystemMessage
+    tool_schemas: List[Dict[str, Any]]
+    structured_llm: Optional[Any] = None
+    bind_ms: float = 0.0    # Costo de un bind_tools (lo que se ahorra cada turno)
+    render_ms: float = 0.0  # Costo de renderizar el prompt estático (se ahorra cada pregunta)
+    prefix_tokens: int = 0
+    tool_schema_tokens: int = 0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def messages(self, state_messages: Sequence[BaseMessage], suffix: Sequence[BaseMessage] = (),
+                 node: str = "assistant") -> List[BaseMessage]:
+        """Prefijo estático + historial compactado + contexto volátil al final"""
+        return prepare_llm_messages([self.static_prefix], state_messages, node, suffix=suffix)
+
+
+def compile_prelude(llm, tools: Sequence[Any], render_static_prompt, structured_schema=None) -> AgentPrelude:
+    """
+    Enlaza las tools y renderiza el prompt estático una sola vez.
+
+    Args:
+        render_static_prompt: función sin argumentos que devuelve el prompt (reglas + KPIs)
+        structured_schema: modelo pydantic para with_structured_output (reasoning estructurado)
+    """
+    tools = list(tools)
+
+    start = time.perf_counter()
+    bound_llm = llm.bind_tools(tools)
+    bind_ms = (time.perf_counter() - start) * 1000
+    final_llm = llm.bind_tools(tools, tool_choice="none")
+    structured_llm = None
+    if structured_schema is not None:
+        structured_llm = llm.with_structured_output(structured_schema, method="function_calling", include_raw=True)
+
+    start = time.perf_counter()
+    static_prompt = render_static_prompt()
+    render_ms = (time.perf_counter() - start) * 1000
+
+    tool_schemas = [convert_to_openai_tool(t) for t in tools]
+    prelude = AgentPrelude(
+        llm=llm,
+        tools=tools,
+        bound_llm=bound_llm,
+        final_llm=final_llm,
+        static_prefix=SystemMessage(content=static_prompt),
+        tool_schemas=tool_schemas,
+        structured_llm=structured_llm,
+        bind_ms=bind_ms,
+        render_ms=render_ms,
+        prefix_tokens=count_tokens(static_prompt),
+        tool_schema_tokens=sum(count_tokens(str(schema)) for schema in tool_schemas),
+    )
+    print(f"🧩 Preludio compilado: {len(tools)} tools ({prelude.tool_schema_tokens} tokens de esquema), "
+          f"prompt estático {prelude.prefix_tokens} tokens | bind {bind_ms:.1f} ms, render {render_ms:.1f} ms")
+    return prelude
+
+
+# ========================================================================
+# MÉTRICAS
+# ========================================================================
+def record_question(prelude: AgentPrelude) -> None:
+    """Una pregunta que ya no re-renderiza el prompt estático"""
+    with _stats_lock:
+        prelude_stats["questions"] += 1
+        prelude_stats["saved_ms"] += prelude.render_ms
+
+
+def record_turn(prelude: AgentPrelude, response: Any) -> None:
+    """Un turno sin bind_tools + tokens de entrada servidos desde la caché del proveedor"""
+    usage = getattr(response, "usage_metadata", None) or {}
+    cached = (usage.get("input_token_details") or {}).get("cache_read", 0)
+    with _stats_lock:
+        prelude_stats["turns"] += 1
+        prelude_stats["saved_ms"] += prelude.bind_ms
+        prelude_stats["input_tokens"] += int(usage.get("input_tokens", 0))
+        prelude_stats["cached_tokens"] += int(cached or 0)
+
+
+def format_prelude_stats() -> str:
+    with _stats_lock:
+        stats = dict(prelude_stats)
+    pct = stats["cached_tokens"] / stats["input_tokens"] * 100 if stats["input_tokens"] else 0.0
+    return (f"🧩 Preludio: {stats['turns']} turnos y {stats['questions']} preguntas sin re-enlazar tools ni "
+            f"re-renderizar el prompt (~{stats['saved_ms']:.0f} ms ahorrados) | {stats['cached_tokens']} de "
+            f"{stats['input_tokens']} tokens de entrada desde la caché del proveedor ({pct:.1f}%)")
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+from agent_load_test import percentile
+
+# ========================================================================
+# BENCHMARK / REGRESIÓN OFFLINE DEL CICLO REACT (cassette del LLM)
+# ========================================================================
+# --grabar corre las preguntas contra OpenAI y la BD real, guarda cada
+# llamada al LLM y la respuesta final en el cassette y, con --duckdb, copia
+# las tablas del agente a un archivo DuckDB. Sin --grabar reproduce el
+# cassette sin red: el grafo completo (assistant → tools → observer) corre
+# contra la BD local y se compara SQL y respuesta final con lo grabado.
+# Sale con código 1 si hay llamadas sin grabar o respuestas distintas.
+#
+#   python agent_replay_benchmark.py --grabar --duckdb
+#   python agent_replay_benchmark.py --latencia 1 --repeticiones 3 --json replay.json
+def run_questions(graph, cassette, questions: List[str], repetitions: int, record: bool) -> Dict[str, Any]:
+    from agent_budget import graph_config
+    from llm_cassette import CassetteMissError
+    from main import build_initial_state
+    from reasoning_benchmark import LLMCallCounter
+
+    latencies: List[float] = []
+    calls: List[int] = []
+    tools: List[int] = []
+    errores, faltantes = 0, 0
+    regresiones: List[Dict[str, Any]] = []
+    for _ in range(repetitions):
+        for question in questions:
+            counter = LLMCallCounter()
+            start = time.perf_counter()
+            try:
+                final_state = graph.invoke(build_initial_state(question), config=graph_config({"callbacks": [counter]}))
+            except CassetteMissError as e:
+                print(f"📼 [{question}] {e}")
+                faltantes += 1
+                continue
+            except Exception as e:
+                print(f"⚠️ [{question}] {e}")
+                errores += 1
+                continue
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            messages = final_state.get("messages", [])
+            answer = messages[-1].content if messages else ""
+            sql_query = final_state.get("sql_query")
+
+            latencies.append(elapsed_ms)
+            calls.append(counter.calls)
+            tools.append(sum(1 for m in messages if m.type == "tool"))
+            print(f"   {counter.calls} llamadas LLM, {tools[-1]} tools, {elapsed_ms:.0f} ms | {question}")
+
+            if record:
+                cassette.record_answer(question, answer, sql_query, elapsed_ms)
+                continue
+            grabada = cassette.answers.get(question)
+            if grabada is None:
+                continue
+            distintos = [campo for campo, actual in (("sql_query", sql_query), ("answer", answer))
+                         if (grabada.get(campo) or "") != (actual or "")]
+            if distintos:
+                print(f"❗ Regresión en '{question}': cambió {', '.join(distintos)}")
+                regresiones.append({"pregunta": question, "campos": distintos})
+
+    return {
+        "preguntas": len(latencies),
+        "errores": errores,
+        "sin_grabar": faltantes,
+        "regresiones": regresiones,
+        "llamadas_promedio": round(statistics.mean(calls), 2) if calls else 0.0,
+        "tools_promedio": round(statistics.mean(tools), 2) if tools else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "promedio_ms": round(statistics.mean(latencies), 1) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Graba sesiones del agente o las reproduce offline (benchmark y regresión)")
+    parser.add_argument("--grabar", action="store_true", help="Grabar contra OpenAI y la BD real")
+    parser.add_argument("--duckdb", action="store_true", help="Con --grabar: copiar las tablas del agente a DuckDB")
+    parser.add_argument("--latencia", type=float, default=None,
+                        help="Escala de la latencia grabada en replay (0 = instantáneo, 1 = real)")
+    parser.add_argument("--repeticiones", type=int, default=1)
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    # Cada repetición tiene que volver a ejecutar el SQL (tools contra la BD local)
+    os.environ["SQL_CACHE_ENABLED"] = "0"
+
+    from llm_cassette import (
+        AGENT_OFFLINE_DB, LLM_CASSETTE_LATENCY, LLM_CASSETTE_PATH, OFFLINE_SCHEMA_CACHE_PATH, cassette_llm,
+        format_cassette_stats, get_cassette, offline_components, snapshot_to_duckdb, tables_with_types,
+    )
+    from main import REAL_SCHEMA, _run_kpi_rows, create_react_graph_real
+    from model_router import ROUTER_LARGE_MODEL, create_small_llm, format_router_stats
+    from reasoning_benchmark import DEFAULT_QUESTIONS
+    from schema_cache import schema_cache
+
+    if args.grabar:
+        from langchain_openai import ChatOpenAI
+
+        from config.environment import setup_environment
+        from database import create_database_connection
+        from etl_control import DATA_VERSION_QUERY
+
+        setup_environment()
+        llm = cassette_llm(ChatOpenAI(model=ROUTER_LARGE_MODEL, temperature=0, max_tokens=1500), mode="record")
+        small_llm = cassette_llm(create_small_llm(), mode="record")
+        graph = create_react_graph_real(llm, create_database_connection(), small_llm)
+        if args.duckdb:
+            if not AGENT_OFFLINE_DB.startswith("duckdb:///"):
+                sys.exit(f"AGENT_OFFLINE_DB no es DuckDB: {AGENT_OFFLINE_DB}")
+            snapshot_to_duckdb(_run_kpi_rows, tables_with_types(schema_cache, REAL_SCHEMA),
+                               AGENT_OFFLINE_DB[len("duckdb:///"):], DATA_VERSION_QUERY)
+    else:
+        latencia = LLM_CASSETTE_LATENCY if args.latencia is None else args.latencia
+        llm, small_llm, db = offline_components(latency_scale=latencia)
+        schema_cache.path = OFFLINE_SCHEMA_CACHE_PATH
+        graph = create_react_graph_real(llm, db, small_llm)
+
+    cassette = get_cassette(LLM_CASSETTE_PATH)
+    print(f"\n{'📼 Grabando' if args.grabar else '▶️ Reproduciendo'} {len(DEFAULT_QUESTIONS)} preguntas "
+          f"× {args.repeticiones}")
+    fila = run_questions(graph, cassette, DEFAULT_QUESTIONS, args.repeticiones, args.grabar)
+
+    print(f"\n   {'preguntas':>9} {'llamadas/preg':>13} {'tools/preg':>10} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'prom ms':>9} {'errores':>7} {'sin grabar':>10} {'regresiones':>11}")
+    print(f"   {fila['preguntas']:>9} {fila['llamadas_promedio']:>13.2f} {fila['tools_promedio']:>10.2f} "
+          f"{fila['p50_ms']:>9.0f} {fila['p95_ms']:>9.0f} {fila['promedio_ms']:>9.0f} {fila['errores']:>7} "
+          f"{fila['sin_grabar']:>10} {len(fila['regresiones']):>11}")
+    print(format_router_stats())
+    print(format_cassette_stats())
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"modo": "grabar" if args.grabar else "replay", "resultado": fila}, f, indent=2, ensure_ascii=False)
+        print(f"📝 Resultados guardados en {args.json}")
+
+    if not args.grabar and (fila["sin_grabar"] or fila["regresiones"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from agent_streaming import sse_events
+from auth import get_current_user, User
+from db_pool import DatabasePool, get_db
+
+router = APIRouter(prefix="/api/agent", tags=["agent"])
+
+# El grafo (LLM + conexión SQLDatabase + RAG) se construye una sola vez por
+# proceso, en la primera pregunta, para no cargar LangChain al importar el router.
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_agent_graph():
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                from langchain_openai import ChatOpenAI
+
+                from config.environment import setup_environment
+                from database import create_database_connection
+                from main import create_react_graph_real
+                from model_router import ROUTER_LARGE_MODEL, create_small_llm
+
+                setup_environment()
+                llm = ChatOpenAI(model=ROUTER_LARGE_MODEL, temperature=0, max_tokens=1500)
+                _graph = create_react_graph_real(llm, create_database_connection(), create_small_llm())
+    return _graph
+
+
+# --- Pregunta al agente con respuesta en streaming (SSE) ---
+@router.get("/stream")
+async def stream_agent_answer(
+    question: str = Query(..., min_length=1, max_length=1000),
+    user: User = Depends(get_current_user),
+):
+    """
+    Eventos: node, tool_start, tool_end, token, final, error.
+
+    El generador es síncrono (graph.stream); Starlette lo recorre en el
+    threadpool, así que no bloquea el event loop.
+    """
+    from main import stream_question_react
+
+    try:
+        graph = await run_in_threadpool(get_agent_graph)
+    except Exception as e:
+        print(f"❌ Error inicializando agente: {e}")
+        raise HTTPException(status_code=503, detail="Agente no disponible")
+
+    return StreamingResponse(
+        sse_events(stream_question_react(question, graph)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ========================================================================
+# AGENTE ASYNC (sesiones concurrentes sobre el pool compartido)
+# ========================================================================
+_async_agent = None
+_async_agent_lock = asyncio.Lock()
+
+
+async def get_async_agent(db: DatabasePool = Depends(get_db)):
+    global _async_agent
+    if _async_agent is None:
+        async with _async_agent_lock:
+            if _async_agent is None:
+                from langchain_openai import ChatOpenAI
+
+                from agent_async import AsyncAgent
+                from config.environment import setup_environment
+                from model_router import ROUTER_LARGE_MODEL, create_small_llm
+
+                setup_environment()
+                llm = ChatOpenAI(model=ROUTER_LARGE_MODEL, temperature=0, max_tokens=1500)
+                _async_agent = AsyncAgent(llm, db, small_llm=create_small_llm())
+    return _async_agent
+
+
+class AgentQuestion(BaseModel):
+    question: str = Field(..., min_length=1, max_length=1000)
+    session_id: Optional[str] = Field(None, max_length=64)
+
+
+# --- Pregunta al agente (async, no bloquea el worker) ---
+@router.post("/ask", response_model=Dict[str, Any])
+async def ask_agent(body: AgentQuestion, user: User = Depends(get_current_user), agent=Depends(get_async_agent)):
+    try:
+        result = await agent.ask(body.question, body.session_id)
+    except Exception as e:
+        print(f"❌ Error en agente: {e}")
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+    return {k: v for k, v in result.items() if k != "messages"}
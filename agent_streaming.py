@@ -0,0 +1,178 @@
+import json
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Sequence
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+from answer_cache import answer_cache
+
+# ========================================================================
+# STREAMING DEL GRAFO REACT (CLI y Server-Sent Events)
+# ========================================================================
+# En lugar de esperar a graph.invoke() se consume graph.stream() con los modos
+# "updates" (transiciones de nodo y tools), "messages" (tokens del LLM) y
+# "values" (estado final). Cada evento es un dict con "type":
+#   node        → un nodo terminó (assistant, tools, observer, ...)
+#   tool_start  → el LLM pidió un tool (nombre + argumentos)
+#   tool_end    → el tool respondió (duración, éxito, hit de caché SQL)
+#   token       → fragmento de la respuesta final
+#   final       → respuesta completa (mismo contenido que process_question_react)
+#   error       → el grafo falló
+STREAM_MODES = ["updates", "messages", "values"]
+# Solo los tokens de estos nodos son texto para el usuario (reasoning es interno)
+DEFAULT_TOKEN_NODES = ("assistant",)
+
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def _is_error(content: str) -> bool:
+    return "ERROR" in content or "SQL_SECURITY_ERROR" in content or "SQL_ERROR" in content
+
+
+def stream_graph_events(graph, initial_state: Dict[str, Any],
+                        token_nodes: Sequence[str] = DEFAULT_TOKEN_NODES,
+                        config: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """Eventos del grafo a medida que ocurren; el último es 'final' o 'error'"""
+    start = time.perf_counter()
+    tool_starts: Dict[str, float] = {}
+    final_state: Dict[str, Any] = {}
+    ttft_ms = None
+
+    try:
+        for mode, chunk in graph.stream(initial_state, config=config, stream_mode=STREAM_MODES):
+            if mode == "messages":
+                message, metadata = chunk
+                content = getattr(message, "content", None)
+                if metadata.get("langgraph_node") in token_nodes and isinstance(content, str) and content:
+                    if ttft_ms is None:
+                        ttft_ms = _elapsed_ms(start)
+                    yield {"type": "token", "text": content}
+
+            elif mode == "updates":
+                for node, update in chunk.items():
+                    yield {"type": "node", "node": node, "elapsed_ms": _elapsed_ms(start)}
+                    node_messages = update.get("messages", []) if isinstance(update, dict) else []
+                    for message in node_messages:
+                        if isinstance(message, AIMessage) and message.tool_calls:
+                            for tool_call in message.tool_calls:
+                                tool_starts[tool_call["id"]] = time.perf_counter()
+                                yield {"type": "tool_start", "tool": tool_call["name"], "args": tool_call["args"]}
+                        elif isinstance(message, ToolMessage):
+                            began = tool_starts.pop(message.tool_call_id, None)
+                            artifact = getattr(message, "artifact", None)
+                            yield {
+                                "type": "tool_end",
+                                "tool": message.name,
+                                "ms": _elapsed_ms(began) if began else None,
+                                "ok": not _is_error(str(message.content)),
+                                "cache_hit": artifact.get("cache_hit") if isinstance(artifact, dict) else None,
+                            }
+
+            elif mode == "values":
+                final_state = chunk
+    except Exception as e:
+        yield {"type": "error", "error": f"Error en proceso ReAct: {e}", "elapsed_ms": _elapsed_ms(start)}
+        return
+
+    messages = final_state.get("messages", [])
+    budget = final_state.get("budget")
+    response = messages[-1].content if messages and hasattr(messages[-1], "content") else "No se pudo generar respuesta."
+    yield {
+        "type": "final",
+        "source": "graph",
+        "response": response,
+        "messages": messages,
+        "attempts": final_state.get("attempt_count", 0),
+        "sql_query": final_state.get("sql_query"),
+        "result_rows": final_state.get("result_rows"),
+        "budget": budget.summary() if budget is not None else None,
+        "ttft_ms": ttft_ms,
+        "elapsed_ms": _elapsed_ms(start),
+    }
+
+
+def stream_answer(question: str, graph,
+                  build_state: Callable[[str], Dict[str, Any]],
+                  fast_path: Optional[Callable[[], Optional[Dict[str, Any]]]] = None,
+                  token_nodes: Sequence[str] = DEFAULT_TOKEN_NODES,
+                  config: Optional[Dict[str, Any]] = None,
+                  data_version: Optional[Callable[[], Optional[int]]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Versión streaming de process_question_react: caché → ruta rápida → grafo.
+
+    Los hits de caché y la ruta rápida emiten un único evento 'final'; el
+    grafo emite todos sus eventos. Los resultados se guardan en answer_cache.
+    data_version se lee dentro del generador (en el threadpool, no en el event loop).
+    """
+    start = time.perf_counter()
+    version = data_version() if data_version else None
+    cached = answer_cache.lookup(question, version)
+    if cached is not None:
+        yield {"type": "final", "source": "cache", **cached, "ttft_ms": _elapsed_ms(start), "elapsed_ms": _elapsed_ms(start)}
+        return
+
+    if fast_path is not None:
+        fast_result = fast_path()
+        if fast_result:
+            answer_cache.store(question, fast_result, _elapsed_ms(start), version)
+            yield {"type": "final", "source": "fast_path", **fast_result,
+                   "ttft_ms": _elapsed_ms(start), "elapsed_ms": _elapsed_ms(start)}
+            return
+
+    for event in stream_graph_events(graph, build_state(question), token_nodes, config):
+        if event["type"] == "final":
+            answer_cache.store(question, event, event["elapsed_ms"], version)
+        yield event
+
+
+# ========================================================================
+# CONSUMIDORES: CLI y SSE
+# ========================================================================
+def print_stream(events: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Imprime los eventos en el REPL y devuelve el resultado final"""
+    tokens_printed = False
+    result: Dict[str, Any] = {"response": "No se pudo generar respuesta.", "messages": [], "attempts": 0}
+    for event in events:
+        kind = event["type"]
+        if kind == "node":
+            print(f"   🔄 {event['node']} ({event['elapsed_ms'] / 1000:.1f}s)")
+        elif kind == "tool_start":
+            args = json.dumps(event["args"], ensure_ascii=False, default=str)
+            print(f"   🛠️ {event['tool']} ← {args[:120]}{'…' if len(args) > 120 else ''}")
+        elif kind == "tool_end":
+            estado = "✅" if event["ok"] else "❌"
+            cache = " ♻️ caché" if event.get("cache_hit") else ""
+            duracion = f"{event['ms']:.0f} ms" if event.get("ms") is not None else "—"
+            print(f"   {estado} {event['tool']} en {duracion}{cache}")
+        elif kind == "token":
+            if not tokens_printed:
+                print("\n" + "=" * 70)
+                print("🤖 RESPUESTA FINAL")
+                print("=" * 70)
+                tokens_printed = True
+            print(event["text"], end="", flush=True)
+        elif kind == "error":
+            print(f"❌ {event['error']}")
+            result = {"response": event["error"], "messages": [], "attempts": 0}
+        elif kind == "final":
+            result = event
+            if tokens_printed:
+                print()
+            else:
+                print("\n" + "=" * 70)
+                print("🤖 RESPUESTA FINAL")
+                print("=" * 70)
+                print(event["response"])
+            ttft = f"primer token {event['ttft_ms'] / 1000:.1f}s, " if event.get("ttft_ms") is not None else ""
+            print(f"\n⏱️ {ttft}total {event['elapsed_ms'] / 1000:.1f}s ({event['source']})")
+    return result
+
+
+def sse_events(events: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """Serializa los eventos como Server-Sent Events (sin los objetos Message)"""
+    for event in events:
+        payload = {k: v for k, v in event.items() if k != "messages"}
+        data = json.dumps(payload, ensure_ascii=False, default=str)
+        yield f"event: {event['type']}\ndata: {data}\n\n"
@@ -0,0 +1,276 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from kpi_fast_path import content_tokens, normalize_question
+from sede_mapping import SEDES
+
+# Embeddings opcionales: sin langchain_openai la similitud es solo léxica
+try:
+    from langchain_openai import OpenAIEmbeddings
+except ImportError:
+    OpenAIEmbeddings = None
+
+# ========================================================================
+# CACHÉ SEMÁNTICA DE RESPUESTAS DEL AGENTE
+# ========================================================================
+# Pregunta normalizada → respuesta final + SQL + filas. Una pregunta nueva
+# reutiliza la respuesta de otra equivalente (misma forma normalizada, mismas
+# palabras de contenido en otro orden o similitud de embeddings sobre el
+# umbral) mientras etl.data_version no cambie. Sin embeddings no hay
+# similitud aproximada: "propinas con tarjeta visa" no es "propinas con tarjeta".
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_EMBEDDINGS = os.getenv("ANSWER_CACHE_EMBEDDINGS", "1") == "1"
+ANSWER_CACHE_EMBEDDING_THRESHOLD = float(os.getenv("ANSWER_CACHE_EMBEDDING_THRESHOLD", "0.93"))
+
+# Tokens que cambian el resultado aunque el resto de la pregunta sea igual
+# ("ventas de enero" vs "ventas de febrero"): deben coincidir exactamente.
+DISCRIMINATING_TOKENS = {
+    "hoy", "ayer", "anteayer", "semana", "mes", "ano", "trimestre", "enero", "febrero", "marzo",
+    "abril", "mayo", "junio", "julio", "agosto", "septiembre", "setiembre", "octubre",
+    "noviembre", "diciembre", "lunes", "martes", "miercoles", "jueves", "viernes", "sabado",
+    "domingo", "manana", "tarde", "noche", "credito", "debito", "efectivo",
+    # Polaridad y orden: "productos mas vendidos" vs "productos menos vendidos" difieren en un token
+    "mas", "menos", "mayor", "mayores", "menor", "menores", "mejor", "mejores", "peor", "peores", "no",
+    "top", "ultimo", "ultimos", "ultima", "ultimas", "primero", "primeros", "primera", "primeras",
+} | {token for sede in SEDES for token in normalize_question(sede).split()}
+
+
+def discriminating_tokens(tokens: List[str]) -> frozenset:
+    return frozenset(t for t in tokens if t in DISCRIMINATING_TOKENS or any(c.isdigit() for c in t))
+
+
+@dataclass
+class AnswerEntry:
+    question: str
+    normalized: str
+    tokens: List[str]
+    response: str
+    sql_query: Optional[str]
+    result_rows: Optional[List[Dict[str, Any]]]
+    data_version: int
+    latency_ms: float
+    created_at: float = field(default_factory=time.time)
+    embedding: Optional[List[float]] = None
+    hits: int = 0
+
+    @property
+    def expired(self) -> bool:
+        return time.time() - self.created_at >= ANSWER_CACHE_TTL
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norma = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norma if norma else 0.0
+
+
+class AnswerCache:
+    """Caché pregunta → respuesta invalidada por la versión de datos del ETL"""
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, AnswerEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._embeddings = None
+        self._embeddings_failed = not (ANSWER_CACHE_EMBEDDINGS and OpenAIEmbeddings)
+        self._pending_embeddings: Dict[str, List[float]] = {}
+
+        # Última etl.data_version recibida de los agentes (cada uno lee la suya)
+        self._data_version = 0
+
+        self.stats = {
+            "lookups": 0, "hits_exact": 0, "hits_semantic": 0, "misses": 0,
+            "stores": 0, "invalidations": 0, "latency_saved_ms": 0.0,
+        }
+
+    # --- Versión de datos ----------------------------------------------
+    def data_version(self, version: Optional[int] = None) -> int:
+        """
+        Versión vigente tras registrar la que leyó el agente (None = la última conocida).
+
+        La versión solo avanza: agentes del mismo proceso sondean en momentos
+        distintos y el que va atrasado no debe vaciar la caché del otro.
+        """
+        with self._lock:
+            if version is not None and version > self._data_version:
+                if self._entries:
+                    print(f"🔄 Nueva versión de datos ({self._data_version} → {version}), invalidando respuestas cacheadas")
+                    self.stats["invalidations"] += 1
+                self._entries.clear()
+                self._data_version = version
+            return self._data_version
+
+    def clear(self) -> None:
+        with self._lock:
+            if self._entries:
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+
+    # --- Similitud -----------------------------------------------------
+    def _embed(self, normalized: str) -> Optional[List[float]]:
+        if self._embeddings_failed:
+            return None
+        try:
+            if self._embeddings is None:
+                self._embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+            return self._embeddings.embed_query(normalized)
+        except Exception as e:
+            print(f"⚠️ Embeddings no disponibles, la caché usa similitud léxica: {e}")
+            self._embeddings_failed = True
+            return None
+
+    def _find(self, normalized: str, tokens: List[str], embedding: Optional[List[float]]):
+        exact = self._entries.get(normalized)
+        if exact is not None:
+            return exact, "exact", 1.0
+
+        clave = discriminating_tokens(tokens)
+        mejor, mejor_score, metodo = None, 0.0, None
+        for entry in self._entries.values():
+            if discriminating_tokens(entry.tokens) != clave:
+                continue
+            if embedding is not None and entry.embedding is not None:
+                score = _cosine(embedding, entry.embedding)
+                if score >= ANSWER_CACHE_EMBEDDING_THRESHOLD and score > mejor_score:
+                    mejor, mejor_score, metodo = entry, score, "embedding"
+            elif mejor is None and set(tokens) == set(entry.tokens):
+                # Sin embeddings solo se reutiliza con las mismas palabras de contenido
+                mejor, mejor_score, metodo = entry, 1.0, "tokens"
+        return mejor, metodo, mejor_score
+
+    # --- API -----------------------------------------------------------
+    def answer(self, question: str, compute: Callable[[], Dict[str, Any]],
+               data_version: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Respuesta cacheada para la pregunta o compute() y guardado del resultado.
+
+        Args:
+            question: Pregunta del usuario
+            compute: Ejecuta el flujo completo (ruta rápida o grafo ReAct)
+            data_version: etl.data_version leída por el agente (None = la última conocida)
+
+        Returns:
+            Resultado de process_question_react; en un hit incluye 'cache'
+        """
+        start = time.perf_counter()
+        cached = self.lookup(question, data_version)
+        if cached is not None:
+            return cached
+        result = compute()
+        self.store(question, result, (time.perf_counter() - start) * 1000, data_version)
+        return result
+
+    def lookup(self, question: str, data_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Resultado cacheado equivalente a la pregunta, o None (cuenta como miss)"""
+        if not ANSWER_CACHE_ENABLED:
+            return None
+
+        start = time.perf_counter()
+        version = self.data_version(data_version)
+        normalized = normalize_question(question)
+        tokens = content_tokens(question)
+        embedding = self._embed(normalized) if normalized not in self._entries else None
+
+        with self._lock:
+            self.stats["lookups"] += 1
+            entry, metodo, score = self._find(normalized, tokens, embedding)
+            if entry is not None and (entry.expired or entry.data_version != version):
+                self._entries.pop(entry.normalized, None)
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                # Se reutiliza en store() para no pedir el embedding dos veces
+                if embedding is not None:
+                    self._pending_embeddings[normalized] = embedding
+                return None
+            entry.hits += 1
+            self._entries.move_to_end(entry.normalized)
+            saved_ms = max(entry.latency_ms - (time.perf_counter() - start) * 1000, 0.0)
+            self.stats["hits_exact" if metodo == "exact" else "hits_semantic"] += 1
+            self.stats["latency_saved_ms"] += saved_ms
+
+        print(f"💾 Respuesta desde caché ({metodo}, similitud {score:.2f}): '{entry.question}'")
+        return {
+            "response": entry.response,
+            "messages": [HumanMessage(content=question), AIMessage(content=entry.response)],
+            "attempts": 0,
+            "sql_query": entry.sql_query,
+            "result_rows": entry.result_rows,
+            "cache": {
+                "method": metodo,
+                "similarity": round(score, 3),
+                "matched_question": entry.question,
+                "data_version": entry.data_version,
+                "latency_saved_ms": round(saved_ms, 1),
+            },
+        }
+
+    def store(self, question: str, result: Dict[str, Any], latency_ms: float,
+              data_version: Optional[int] = None) -> None:
+        """Guarda el resultado de un miss junto con lo que costó calcularlo"""
+        if not ANSWER_CACHE_ENABLED:
+            return
+        version = self.data_version(data_version)
+        normalized = normalize_question(question)
+        embedding = self._pending_embeddings.pop(normalized, None)
+        if not self._cacheable(result):
+            return
+        self._store(AnswerEntry(
+            question=question,
+            normalized=normalized,
+            tokens=content_tokens(question),
+            response=result["response"],
+            sql_query=result.get("sql_query"),
+            result_rows=result.get("result_rows"),
+            data_version=version,
+            latency_ms=latency_ms,
+            embedding=embedding if embedding is not None else self._embed(normalized),
+        ))
+
+    @staticmethod
+    def _cacheable(result: Dict[str, Any]) -> bool:
+        # Errores del proceso, ejecuciones sin mensajes y respuestas cortadas por presupuesto no se guardan
+        response = result.get("response")
+        if (result.get("budget") or {}).get("exhausted"):
+            return False
+        return bool(response) and bool(result.get("messages")) and not response.startswith("Error en proceso ReAct")
+
+    def _store(self, entry: AnswerEntry) -> None:
+        with self._lock:
+            self._entries[entry.normalized] = entry
+            self._entries.move_to_end(entry.normalized)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.stats["stores"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        hits = self.stats["hits_exact"] + self.stats["hits_semantic"]
+        lookups = self.stats["lookups"]
+        return {
+            **self.stats,
+            "latency_saved_ms": round(self.stats["latency_saved_ms"], 1),
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+            "entries": len(self._entries),
+            "data_version": self._data_version,
+        }
+
+    def format_stats(self) -> str:
+        m = self.metrics()
+        hit_rate = f"{m['hit_rate'] * 100:.1f}%" if m["hit_rate"] is not None else "—"
+        return (
+            f"💾 Caché de respuestas: {m['entries']} entradas | hit rate {hit_rate} "
+            f"({m['hits_exact']} exactos, {m['hits_semantic']} semánticos, {m['misses']} misses) | "
+            f"latencia ahorrada {m['latency_saved_ms'] / 1000:.1f}s | versión de datos {m['data_version']}"
+        )
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,221 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+
+from result_encoding import parse_result
+
+# Conteo exacto opcional: sin tiktoken se estima ~4 caracteres por token
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# ========================================================================
+# PRESUPUESTO DE TOKENS DEL CONTEXTO DEL AGENTE
+# ========================================================================
+# Antes de cada llamada al LLM:
+#   1. Los ToolMessages de rondas anteriores se reemplazan por un resumen
+#      (filas, columnas y estadísticas); la última ronda va textual.
+#   2. Si aún se excede AGENT_CONTEXT_BUDGET_TOKENS, se acortan los textos
+#      antiguos del asistente y, como último recurso, las filas del último
+#      resultado.
+# Los mensajes del estado no se modifican: solo la lista enviada al LLM.
+AGENT_CONTEXT_BUDGET_TOKENS = int(os.getenv("AGENT_CONTEXT_BUDGET_TOKENS", "12000"))
+AGENT_CONTEXT_KEEP_ROUNDS = int(os.getenv("AGENT_CONTEXT_KEEP_ROUNDS", "1"))
+AGENT_CONTEXT_MODEL = os.getenv("AGENT_CONTEXT_MODEL", "gpt-4o")
+OLD_TEXT_MAX_CHARS = 600
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.encoding_for_model(AGENT_CONTEXT_MODEL)
+    except Exception:
+        _encoding = tiktoken.get_encoding("o200k_base")
+
+_stats_lock = threading.Lock()
+context_stats = {"llm_calls": 0, "tokens_before": 0, "tokens_after": 0, "tool_results_elided": 0, "over_budget": 0}
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(len(text) // 4, 1)
+
+
+def message_tokens(message: BaseMessage) -> int:
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content, default=str)
+    tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        tokens += count_tokens(json.dumps([{"name": tc["name"], "args": tc["args"]} for tc in tool_calls], default=str))
+    return tokens
+
+
+# ========================================================================
+# RESUMEN DE RESULTADOS
+# ========================================================================
+def _as_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def summarize_rows(rows: List[Dict[str, Any]], max_columns: int = 12) -> str:
+    """'N filas; columnas: a (num min..max, prom), b (texto, K distintos: x, y)'"""
+    if not rows:
+        return "0 filas"
+    columnas = list(rows[0].keys()) if isinstance(rows[0], dict) else []
+    partes = []
+    for columna in columnas[:max_columns]:
+        valores = [row.get(columna) for row in rows if isinstance(row, dict) and row.get(columna) is not None]
+        numeros = [_as_number(v) for v in valores]
+        if valores and all(n is not None for n in numeros):
+            partes.append(f"{columna} (num {min(numeros):g}..{max(numeros):g}, prom {sum(numeros) / len(numeros):g})")
+        else:
+            distintos = list(dict.fromkeys(str(v) for v in valores))
+            ejemplos = ", ".join(d[:30] for d in distintos[:3])
+            partes.append(f"{columna} (texto, {len(distintos)} distintos: {ejemplos})")
+    extra = f" (+{len(columnas) - max_columns} columnas)" if len(columnas) > max_columns else ""
+    return f"{len(rows)} filas; columnas: " + "; ".join(partes) + extra
+
+
+def summarize_tool_content(content: str) -> str:
+    if content == "EMPTY_RESULT" or content.startswith(("SQL_", "ERROR", "KPI_NO_ENCONTRADO")):
+        return content[:300]
+    result = parse_result(content)
+    if result is not None:
+        return f"[resultado resumido] {summarize_rows(result.records())}"
+    return f"[resultado resumido] {content[:300]}{'…' if len(content) > 300 else ''}"
+
+
+def _replace_content(message: BaseMessage, content: str) -> BaseMessage:
+    if isinstance(message, ToolMessage):
+        return ToolMessage(content=content, tool_call_id=message.tool_call_id, name=message.name,
+                           status=getattr(message, "status", "success"))
+    return message.model_copy(update={"content": content})
+
+
+def _trim_rows(content: str, max_tokens: int) -> str:
+    """Último recurso: conserva las primeras filas del último resultado que quepan"""
+    result = parse_result(content)
+    if result is None or not result.rows:
+        return content[: max_tokens * 4]
+    kept = len(result.rows)
+    while kept > 1 and count_tokens(result.head(kept).encode()) > max_tokens:
+        kept = max(kept // 2, 1)
+    return result.head(kept).encode() + f"\n[{kept} de {result.total_rows} filas; resto: {summarize_rows(result.records())}]"
+
+
+# ========================================================================
+# COMPACTACIÓN
+# ========================================================================
+def _recent_tool_ids(messages: Sequence[BaseMessage], keep_rounds: int) -> set:
+    """tool_call_id de las últimas keep_rounds rondas de tools (se envían textuales)"""
+    ids, rondas, en_ronda = set(), 0, False
+    for message in reversed(messages):
+        if isinstance(message, ToolMessage):
+            if not en_ronda:
+                rondas += 1
+                en_ronda = True
+            if rondas > keep_rounds:
+                break
+            ids.add(message.tool_call_id)
+        else:
+            en_ronda = False
+    return ids
+
+
+def compact_messages(messages: Sequence[BaseMessage], prefix: Sequence[BaseMessage] = (),
+                     budget: int = AGENT_CONTEXT_BUDGET_TOKENS,
+                     keep_rounds: int = AGENT_CONTEXT_KEEP_ROUNDS,
+                     suffix: Sequence[BaseMessage] = ()) -> Tuple[List[BaseMessage], Dict[str, int]]:
+    """
+    Lista a enviar al LLM: prefix + historial compactado dentro del presupuesto + suffix.
+
+    El suffix (contexto volátil del turno) va al final para no romper la caché
+    de prefijo del proveedor.
+
+    Returns:
+        (mensajes, {"before", "after", "elided"})
+    """
+    historial = list(messages)
+    fijos = list(prefix) + list(suffix)
+    before = sum(message_tokens(m) for m in fijos) + sum(message_tokens(m) for m in historial)
+
+    # 1. Resultados de rondas anteriores → resumen
+    recientes = _recent_tool_ids(historial, keep_rounds)
+    elided = 0
+    for i, message in enumerate(historial):
+        if isinstance(message, ToolMessage) and message.tool_call_id not in recientes:
+            content = message.content if isinstance(message.content, str) else str(message.content)
+            resumen = summarize_tool_content(content)
+            if len(resumen) < len(content):
+                historial[i] = _replace_content(message, resumen)
+                elided += 1
+
+    total = sum(message_tokens(m) for m in fijos) + sum(message_tokens(m) for m in historial)
+
+    # 2. Textos antiguos del asistente (razonamientos largos), salvo el último
+    if total > budget:
+        ultimo_ai = max((i for i, m in enumerate(historial) if isinstance(m, AIMessage)), default=-1)
+        for i, message in enumerate(historial):
+            if total <= budget:
+                break
+            if isinstance(message, AIMessage) and i != ultimo_ai and isinstance(message.content, str) \
+                    and len(message.content) > OLD_TEXT_MAX_CHARS:
+                antes = message_tokens(message)
+                historial[i] = _replace_content(message, message.content[:OLD_TEXT_MAX_CHARS] + " […]")
+                total -= antes - message_tokens(historial[i])
+
+    # 3. Filas del último resultado
+    if total > budget:
+        for i in range(len(historial) - 1, -1, -1):
+            message = historial[i]
+            if isinstance(message, ToolMessage) and message.tool_call_id in recientes:
+                antes = message_tokens(message)
+                disponible = max(budget - (total - antes), 200)
+                historial[i] = _replace_content(message, _trim_rows(message.content, disponible))
+                total -= antes - message_tokens(historial[i])
+                if total <= budget:
+                    break
+
+    return list(prefix) + historial + list(suffix), {"before": before, "after": total, "elided": elided}
+
+
+def prepare_llm_messages(prefix: Sequence[BaseMessage], messages: Sequence[BaseMessage],
+                         node: str = "assistant", suffix: Sequence[BaseMessage] = ()) -> List[BaseMessage]:
+    """compact_messages + registro de tokens ahorrados (usar en cada nodo que llama al LLM)"""
+    compactados, resumen = compact_messages(messages, prefix, suffix=suffix)
+    with _stats_lock:
+        context_stats["llm_calls"] += 1
+        context_stats["tokens_before"] += resumen["before"]
+        context_stats["tokens_after"] += resumen["after"]
+        context_stats["tool_results_elided"] += resumen["elided"]
+        if resumen["after"] > AGENT_CONTEXT_BUDGET_TOKENS:
+            context_stats["over_budget"] += 1
+    ahorrados = resumen["before"] - resumen["after"]
+    if ahorrados > 0:
+        print(f"✂️ Contexto {node}: {resumen['before']} → {resumen['after']} tokens "
+              f"(-{ahorrados}, {resumen['elided']} resultados resumidos)")
+    if resumen["after"] > AGENT_CONTEXT_BUDGET_TOKENS:
+        print(f"⚠️ Contexto {node} sobre el presupuesto: {resumen['after']}/{AGENT_CONTEXT_BUDGET_TOKENS} tokens")
+    return compactados
+
+
+def format_context_stats() -> str:
+    with _stats_lock:
+        stats = dict(context_stats)
+    ahorrados = stats["tokens_before"] - stats["tokens_after"]
+    pct = ahorrados / stats["tokens_before"] * 100 if stats["tokens_before"] else 0.0
+    return (f"✂️ Contexto: {stats['llm_calls']} llamadas LLM | {stats['tokens_after']} tokens enviados, "
+            f"{ahorrados} ahorrados ({pct:.1f}%) | {stats['tool_results_elided']} resultados resumidos | "
+            f"{stats['over_budget']} sobre presupuesto")
@@ -0,0 +1,408 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extras
+import psycopg2.pool
+from dotenv import load_dotenv
+from fastapi import APIRouter, Depends, HTTPException
+
+from auth import get_current_user, User
+
+try:
+    import asyncpg
+except ImportError:  # El driver async es opcional, psycopg2 sigue disponible
+    asyncpg = None
+
+load_dotenv()
+
+# ========================================================================
+# CONFIGURACIÓN DEL POOL
+# ========================================================================
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+DB_POOL_DRIVER = os.getenv("DB_POOL_DRIVER", "asyncpg" if asyncpg else "psycopg2").lower()
+
+
+class DatabaseError(Exception):
+    """Error de base de datos independiente del driver usado por el pool"""
+
+
+class QueryTimeoutError(DatabaseError):
+    """La consulta superó el statement_timeout configurado"""
+
+
+# Parámetros: siempre $1, $2, ... (estilo nativo de Postgres y de asyncpg).
+# Para psycopg2 se traducen a %(pN)s y los % literales se escapan; strings,
+# identificadores entre comillas y comentarios no se tocan salvo ese escape.
+_PARAM_RE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?\*/)|\$(\d+)|%""", re.DOTALL)
+
+
+def _placeholders(query: str) -> List[int]:
+    return [int(m.group(2)) for m in _PARAM_RE.finditer(query) if m.group(2)]
+
+
+def to_pyformat(query: str, params: Sequence[Any]) -> Tuple[str, Dict[str, Any]]:
+    """Consulta con $1, $2, ... → (consulta con %(pN)s, dict de parámetros) para psycopg2"""
+    def reemplazo(m):
+        if m.group(1):
+            return m.group(1).replace("%", "%%")
+        if m.group(2):
+            return f"%(p{m.group(2)})s"
+        return "%%"
+
+    return _PARAM_RE.sub(reemplazo, query), {f"p{i}": value for i, value in enumerate(params, start=1)}
+
+
+def resolve_database_url() -> str:
+    """Lee DATABASE_URL y la normaliza al esquema postgresql://"""
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise HTTPException(status_code=500, detail="DATABASE_URL no configurada")
+
+    if database_url.startswith("postgres://"):
+        database_url = database_url.replace("postgres://", "postgresql://", 1)
+
+    return database_url
+
+
+def get_sync_connection(statement_timeout_ms: Optional[int] = None):
+    """Conexión psycopg2 dedicada para scripts batch (ETL, refrescos, diagnósticos)"""
+    options = None
+    if statement_timeout_ms:
+        options = f"-c statement_timeout={int(statement_timeout_ms)}"
+    return psycopg2.connect(resolve_database_url(), options=options)
+
+
+# ========================================================================
+# POOL COMPARTIDO (psycopg2 en threads o asyncpg nativo)
+# ========================================================================
+class DatabasePool:
+    """Pool de conexiones compartido por todos los routers de la API"""
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        statement_timeout_ms: int = DB_STATEMENT_TIMEOUT_MS,
+        driver: str = DB_POOL_DRIVER,
+    ):
+        if driver == "asyncpg" and asyncpg is None:
+            print("⚠️ asyncpg no instalado, usando psycopg2 con pool de threads")
+            driver = "psycopg2"
+
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_timeout_ms = statement_timeout_ms
+        self.driver = driver
+
+        self._pool = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self._psycopg2_connections: Set[int] = set()
+        self._stats = {
+            "acquisitions": 0,
+            "waits": 0,
+            "wait_ms_total": 0.0,
+            "in_use": 0,
+            "queries": 0,
+            "query_ms_total": 0.0,
+            "errors": 0,
+            "timeouts": 0,
+        }
+
+    @property
+    def is_open(self) -> bool:
+        return self._pool is not None
+
+    async def open(self) -> None:
+        if self._pool is not None:
+            return
+
+        self._slots = asyncio.Semaphore(self.max_size)
+
+        if self.driver == "asyncpg":
+            self._pool = await asyncpg.create_pool(
+                self.dsn,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                server_settings={"statement_timeout": str(self.statement_timeout_ms)},
+            )
+        else:
+            self._pool = await asyncio.to_thread(
+                psycopg2.pool.ThreadedConnectionPool,
+                self.min_size,
+                self.max_size,
+                self.dsn,
+                options=f"-c statement_timeout={self.statement_timeout_ms}",
+            )
+
+        print(f"✅ Pool de base de datos abierto ({self.driver}, {self.min_size}-{self.max_size} conexiones)")
+
+    async def close(self) -> None:
+        if self._pool is None:
+            return
+
+        pool, self._pool = self._pool, None
+        if self.driver == "asyncpg":
+            await pool.close()
+        else:
+            await asyncio.to_thread(pool.closeall)
+            with self._lock:
+                self._psycopg2_connections.clear()
+
+        print("🔌 Pool de base de datos cerrado")
+
+    async def fetch_all(
+        self,
+        query: str,
+        params: Optional[Sequence[Any]] = None,
+        timeout_ms: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Ejecuta una consulta de lectura usando una conexión del pool.
+
+        Args:
+            query: Consulta SQL
+            params: Parámetros posicionales $1, $2, ... (iguales con asyncpg y psycopg2)
+            timeout_ms: statement_timeout específico para esta consulta
+
+        Returns:
+            Lista de filas como diccionarios
+        """
+        if params:
+            usados = _placeholders(query)
+            if not usados or max(usados) > len(params):
+                raise DatabaseError(f"Los parámetros van como $1..${len(params)} en la consulta "
+                                    f"(se recibieron {len(params)})")
+        if self._pool is None:
+            await self.open()
+
+        wait_start = time.perf_counter()
+        waited = self._slots.locked()
+        async with self._slots:
+            self._record_acquisition(waited, time.perf_counter() - wait_start)
+            query_start = time.perf_counter()
+            try:
+                if self.driver == "asyncpg":
+                    rows = await self._fetch_asyncpg(query, params, timeout_ms)
+                else:
+                    rows = await asyncio.to_thread(self._fetch_psycopg2, query, params, timeout_ms)
+            except QueryTimeoutError:
+                self._record_failure(timeout=True)
+                raise
+            except DatabaseError:
+                self._record_failure()
+                raise
+            finally:
+                self._record_release(time.perf_counter() - query_start)
+
+        return rows
+
+    async def _fetch_asyncpg(self, query, params, timeout_ms) -> List[Dict[str, Any]]:
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction(readonly=True):
+                    if timeout_ms:
+                        await conn.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+                    records = await conn.fetch(query, *(params or ()))
+            return [dict(record) for record in records]
+        except asyncpg.exceptions.QueryCanceledError as e:
+            raise QueryTimeoutError(str(e)) from e
+        except asyncpg.PostgresError as e:
+            raise DatabaseError(str(e)) from e
+
+    def _fetch_psycopg2(self, query, params, timeout_ms) -> List[Dict[str, Any]]:
+        if params:
+            query, params = to_pyformat(query, params)
+        conn = self._checkout_psycopg2()
+        broken = False
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                if timeout_ms:
+                    cursor.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+                cursor.execute(query, params)
+                rows = [dict(row) for row in cursor.fetchall()]
+            conn.rollback()  # Solo lectura: liberamos el snapshot antes de devolver la conexión
+            return rows
+        except psycopg2.errors.QueryCanceled as e:
+            conn.rollback()
+            raise QueryTimeoutError(str(e)) from e
+        except psycopg2.Error as e:
+            broken = conn.closed != 0 or isinstance(e, psycopg2.OperationalError)
+            if not broken:
+                conn.rollback()
+            raise DatabaseError(str(e)) from e
+        finally:
+            self._checkin_psycopg2(conn, close=broken)
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Conexión cruda del driver activo, con el mismo semáforo y métricas que fetch_all.
+
+        Para cursores del lado del servidor (sql_executor). Con psycopg2 la
+        transacción se descarta (rollback) al devolver la conexión.
+        """
+        if self._pool is None:
+            await self.open()
+
+        wait_start = time.perf_counter()
+        waited = self._slots.locked()
+        async with self._slots:
+            self._record_acquisition(waited, time.perf_counter() - wait_start)
+            query_start = time.perf_counter()
+            try:
+                if self.driver == "asyncpg":
+                    async with self._pool.acquire() as conn:
+                        yield conn
+                else:
+                    conn = await asyncio.to_thread(self._checkout_psycopg2)
+                    broken = False
+                    try:
+                        yield conn
+                    except Exception as e:
+                        # sql_executor envuelve los errores del driver en DatabaseError
+                        causa = e.__cause__ if isinstance(e, DatabaseError) else e
+                        broken = isinstance(causa, psycopg2.OperationalError)
+                        raise
+                    finally:
+                        broken = broken or conn.closed != 0
+                        if not broken:
+                            try:
+                                conn.rollback()
+                            except psycopg2.Error:
+                                broken = True
+                        self._checkin_psycopg2(conn, close=broken)
+            except Exception:
+                self._record_failure()
+                raise
+            finally:
+                self._record_release(time.perf_counter() - query_start)
+
+    # --- Conexiones psycopg2 ---------------------------------------------
+    def _checkout_psycopg2(self):
+        conn = self._pool.getconn()
+        with self._lock:
+            self._psycopg2_connections.add(id(conn))
+        return conn
+
+    def _checkin_psycopg2(self, conn, close: bool = False) -> None:
+        if close:
+            with self._lock:
+                self._psycopg2_connections.discard(id(conn))
+        self._pool.putconn(conn, close=close)
+
+    # --- Métricas -------------------------------------------------------
+    def _record_acquisition(self, waited: bool, wait_seconds: float) -> None:
+        with self._lock:
+            self._stats["acquisitions"] += 1
+            self._stats["in_use"] += 1
+            if waited:
+                self._stats["waits"] += 1
+            self._stats["wait_ms_total"] += wait_seconds * 1000
+
+    def _record_release(self, query_seconds: float) -> None:
+        with self._lock:
+            self._stats["in_use"] -= 1
+            self._stats["queries"] += 1
+            self._stats["query_ms_total"] += query_seconds * 1000
+
+    def _record_failure(self, timeout: bool = False) -> None:
+        with self._lock:
+            self._stats["errors"] += 1
+            if timeout:
+                self._stats["timeouts"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+
+        open_connections = None
+        if self._pool is not None:
+            if self.driver == "asyncpg":
+                open_connections = self._pool.get_size()
+            else:
+                # Conexiones distintas entregadas por el pool y aún no cerradas (sin leer internos de psycopg2)
+                with self._lock:
+                    open_connections = len(self._psycopg2_connections)
+
+        queries = stats["queries"] or 1
+        acquisitions = stats["acquisitions"] or 1
+        return {
+            "driver": self.driver,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "statement_timeout_ms": self.statement_timeout_ms,
+            "open_connections": open_connections,
+            "in_use": stats["in_use"],
+            "acquisitions": stats["acquisitions"],
+            "waits": stats["waits"],
+            "avg_wait_ms": round(stats["wait_ms_total"] / acquisitions, 2),
+            "queries": stats["queries"],
+            "avg_query_ms": round(stats["query_ms_total"] / queries, 2),
+            "errors": stats["errors"],
+            "timeouts": stats["timeouts"],
+        }
+
+
+# ========================================================================
+# CICLO DE VIDA Y DEPENDENCIA FASTAPI
+# ========================================================================
+_pool: Optional[DatabasePool] = None
+_pool_init_lock = asyncio.Lock()
+
+
+async def init_pool() -> DatabasePool:
+    """Abre el pool compartido (idempotente)"""
+    global _pool
+    async with _pool_init_lock:
+        if _pool is None:
+            pool = DatabasePool(resolve_database_url())
+            await pool.open()
+            _pool = pool
+    return _pool
+
+
+async def close_pool() -> None:
+    """Cierra el pool compartido al apagar la aplicación"""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def register_pool_lifecycle(app) -> None:
+    """Engancha apertura/cierre del pool al ciclo de vida de la app FastAPI"""
+    app.add_event_handler("startup", init_pool)
+    app.add_event_handler("shutdown", close_pool)
+
+
+async def get_db() -> DatabasePool:
+    """Dependencia FastAPI: entrega el pool compartido (lo abre si aún no existe)"""
+    if _pool is not None:
+        return _pool
+    try:
+        return await init_pool()
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error abriendo pool de base de datos: {e}")
+        raise HTTPException(status_code=503, detail="Base de datos no disponible")
+
+
+pool_router = APIRouter(prefix="/api/db", tags=["db"])
+
+
+@pool_router.get("/pool-metrics", response_model=Dict[str, Any])
+async def get_pool_metrics(user: User = Depends(get_current_user), db: DatabasePool = Depends(get_db)):
+    return db.metrics()
@@ -0,0 +1,105 @@
+import argparse
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+# ========================================================================
+# METADATOS DE CONTROL DEL ETL (schema etl)
+# ========================================================================
+CONTROL_SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Esquema_control_etl.sql")
+
+DATA_VERSION_QUERY = "SELECT version FROM etl.data_version WHERE id = 1"
+DATA_VERSION_POLL_SECONDS = float(os.getenv("DATA_VERSION_POLL_SECONDS", "30"))
+
+
+def ensure_control_schema(cursor) -> None:
+    """Crea (si no existen) las tablas del schema etl definidas en Esquema_control_etl.sql"""
+    with open(CONTROL_SCHEMA_FILE, encoding="utf-8") as f:
+        cursor.execute(f.read())
+
+
+def read_data_version(cursor) -> int:
+    """Versión de datos vigente (0 si el schema de control aún no existe)"""
+    cursor.execute(DATA_VERSION_QUERY)
+    row = cursor.fetchone()
+    if not row:
+        return 0
+    return int(row[0] if not isinstance(row, dict) else row["version"])
+
+
+def bump_data_version(cursor, origen: Optional[str] = None) -> int:
+    """
+    Incrementa la versión de datos. Debe llamarse dentro de la misma
+    transacción que publica la carga para que cachés y lectores vean
+    el cambio de forma atómica.
+    """
+    cursor.execute(
+        """
+        UPDATE etl.data_version
+        SET version = version + 1, origen = %s, updated_at = now()
+        WHERE id = 1
+        RETURNING version
+        """,
+        (origen,),
+    )
+    row = cursor.fetchone()
+    return int(row[0] if not isinstance(row, dict) else row["version"])
+
+
+class DataVersionPoller:
+    """
+    Lector de etl.data_version de un agente, consultado como máximo cada
+    poll_seconds. Cada agente tiene el suyo y entrega la versión leída a las
+    cachés en cada llamada, en vez de registrar un lector global en ellas.
+    """
+
+    def __init__(self, read: Callable[[], int], poll_seconds: float = DATA_VERSION_POLL_SECONDS):
+        self.read = read
+        self.poll_seconds = poll_seconds
+        self._version = 0
+        self._checked_at = 0.0
+        self._warning_shown = False
+        self._lock = threading.Lock()
+
+    def __call__(self) -> int:
+        if time.time() - self._checked_at < self.poll_seconds:
+            return self._version
+        with self._lock:
+            if time.time() - self._checked_at < self.poll_seconds:
+                return self._version
+            try:
+                self._version = int(self.read())
+            except Exception as e:
+                if not self._warning_shown:
+                    print(f"⚠️ etl.data_version no disponible, las cachés solo expirarán por TTL: {e}")
+                    self._warning_shown = True
+            self._checked_at = time.time()
+        return self._version
+
+
+def main():
+    from db_pool import get_sync_connection
+
+    parser = argparse.ArgumentParser(description="Control de metadatos del ETL")
+    parser.add_argument("accion", choices=["init", "version", "bump"])
+    parser.add_argument("--origen", default="manual", help="Etiqueta guardada junto a la nueva versión")
+    args = parser.parse_args()
+
+    conn = get_sync_connection()
+    try:
+        with conn.cursor() as cursor:
+            if args.accion == "init":
+                ensure_control_schema(cursor)
+                print("✅ Schema etl creado/actualizado")
+            elif args.accion == "bump":
+                print(f"✅ Nueva versión de datos: {bump_data_version(cursor, args.origen)}")
+            else:
+                print(f"📦 Versión de datos actual: {read_data_version(cursor)}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
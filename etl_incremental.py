@@ -0,0 +1,563 @@
+import argparse
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+import psycopg2.extras
+
+from etl_control import bump_data_version, ensure_control_schema
+from materialized_aggregates import mark_dirty_partitions, refresh_aggregates
+from sede_mapping import resolver_sede
+
+# ========================================================================
+# CARGA INCREMENTAL DEL MODELO ESTRELLA (dw.fact_ventas / dw.fact_transacciones)
+# ========================================================================
+# Reemplaza el TRUNCATE + INSERT de script_vistas.sql para las cargas diarias:
+#   - Solo lee las filas fuente con watermark > último valor cargado (etl.watermarks).
+#     La marca de agua es etl_row_version, que un trigger renueva en cada INSERT
+#     y UPDATE: las filas corregidas en la fuente se recargan, no solo las nuevas.
+#     Las filas borradas en la fuente no se propagan (requiere limpieza manual)
+#   - Las surrogate keys se resuelven con mapas en memoria de cada dimensión
+#     (una lectura por dimensión, no un subquery por fila)
+#   - Los tickets afectados se borran y reinsertan completos en lotes, y las
+#     transacciones se hacen upsert por id_transaccion
+#   - Todo ocurre en una transacción: los dashboards siguen viendo la carga
+#     anterior hasta el COMMIT
+ETL_BATCH_SIZE = int(os.getenv("ETL_BATCH_SIZE", "5000"))
+
+# Tablas fuente y columna de cambios usada como marca de agua (ver ensure_change_tracking)
+SOURCES = {
+    "informe_ventas": {
+        "table": "public.informe_ventas",
+        "watermark_column": "etl_row_version",
+        "target": "dw.fact_ventas",
+    },
+    "transacciones": {
+        "table": "public.transacciones",
+        "watermark_column": "etl_row_version",
+        "target": "dw.fact_transacciones",
+    },
+}
+
+# Se releen todas las líneas de cada ticket tocado para renumerar linea_ticket
+# (en orden de inserción: una línea corregida no cambia de posición)
+VENTAS_QUERY = """
+    SELECT
+        iv."ID_de_transacción",
+        CAST(iv."Fecha" AS DATE),
+        NULLIF(iv."Descripción", ''),
+        COALESCE(iv."Tipo_de_IVA", 'NO_ESPECIFICADO'),
+        iv."Sede_Normalizada",
+        iv."Forma_de_pago",
+        COALESCE(CAST(NULLIF(iv."Cantidad", '') AS NUMERIC(10,2)), 0),
+        COALESCE(CAST(NULLIF(iv."precio_unitario_calculado", '') AS NUMERIC(12,2)), 0),
+        COALESCE(CAST(NULLIF(iv."Precio_Bruto", '') AS NUMERIC(12,2)), 0),
+        COALESCE(CAST(NULLIF(iv."Precio_Neto", '') AS NUMERIC(12,2)), 0),
+        COALESCE(CAST(NULLIF(iv."IVA", '') AS NUMERIC(12,2)), 0)
+    FROM {table} iv
+    WHERE iv."ID_de_transacción" IN (
+        SELECT "ID_de_transacción" FROM {table}
+        WHERE {wm} > %(desde)s AND {wm} <= %(hasta)s
+    )
+      AND iv.{wm} <= %(hasta)s
+      AND iv."ID_de_transacción" != ''
+      AND iv."Fecha" IS NOT NULL
+      AND iv."Fecha" != ''
+    ORDER BY iv."ID_de_transacción", iv.id
+"""
+
+TRANSACCIONES_QUERY = """
+    SELECT
+        t."ID_de_transacción",
+        CAST(t."Fecha" AS DATE),
+        t."Tipo_de_tarjeta",
+        t."Últimos_4_dígitos",
+        t."Correo_electrónico",
+        t."Código_de_autorización",
+        t."Tipo_de_transacción",
+        t."Estado",
+        t."Método_de_pago",
+        t."Modo_de_captura",
+        CAST(t."Fecha" AS TIMESTAMP WITH TIME ZONE),
+        COALESCE(CAST(NULLIF(t."Total", '') AS NUMERIC(12,2)), 0),
+        COALESCE(CAST(NULLIF(t."Subtotal", '') AS NUMERIC(12,2)), 0),
+        COALESCE(CAST(NULLIF(t."Impuesto", '') AS NUMERIC(12,2)), 0),
+        COALESCE(CAST(NULLIF(t."Propina", '') AS NUMERIC(12,2)), 0),
+        COALESCE(CAST(NULLIF(t."Comisión", '') AS NUMERIC(12,2)), 0),
+        COALESCE(CAST(NULLIF(t."Depósitos", '') AS NUMERIC(12,2)), 0),
+        t."Referencia"
+    FROM {table} t
+    WHERE t.{wm} > %(desde)s AND t.{wm} <= %(hasta)s
+      AND t."ID_de_transacción" IS NOT NULL
+      AND t."ID_de_transacción" != ''
+      AND t."Fecha" IS NOT NULL
+      AND t."Fecha" != ''
+    ORDER BY t.{wm}
+"""
+
+INSERT_VENTAS_SQL = """
+    INSERT INTO dw.fact_ventas (
+        id_transaccion, linea_ticket, fecha_key, producto_sk, sede_sk,
+        pago_sk, cantidad, precio_unitario, precio_bruto, precio_neto, iva_monto
+    ) VALUES %s
+"""
+
+UPSERT_TRANSACCIONES_SQL = """
+    INSERT INTO dw.fact_transacciones (
+        id_transaccion, fecha_key, sede_sk, tarjeta_sk, correo_electronico,
+        codigo_autorizacion, tipo_transaccion, estado, metodo_pago, modo_captura,
+        fecha_transaccion, monto_total, subtotal, impuesto, propina, comision, depositos, referencia
+    ) VALUES %s
+    ON CONFLICT (id_transaccion) DO UPDATE SET
+        fecha_key = EXCLUDED.fecha_key,
+        sede_sk = EXCLUDED.sede_sk,
+        tarjeta_sk = EXCLUDED.tarjeta_sk,
+        correo_electronico = EXCLUDED.correo_electronico,
+        codigo_autorizacion = EXCLUDED.codigo_autorizacion,
+        tipo_transaccion = EXCLUDED.tipo_transaccion,
+        estado = EXCLUDED.estado,
+        metodo_pago = EXCLUDED.metodo_pago,
+        modo_captura = EXCLUDED.modo_captura,
+        fecha_transaccion = EXCLUDED.fecha_transaccion,
+        monto_total = EXCLUDED.monto_total,
+        subtotal = EXCLUDED.subtotal,
+        impuesto = EXCLUDED.impuesto,
+        propina = EXCLUDED.propina,
+        comision = EXCLUDED.comision,
+        depositos = EXCLUDED.depositos,
+        referencia = EXCLUDED.referencia
+"""
+
+
+# ========================================================================
+# REGLAS DE NEGOCIO (mismas que script_vistas.sql)
+# ========================================================================
+def categoria_producto(descripcion: str) -> str:
+    texto = descripcion.lower()
+    if "café" in texto or "coffee" in texto:
+        return "CAFÉ"
+    if "tarta" in texto or "pastel" in texto:
+        return "PASTELES"
+    if "sandwich" in texto or "sándwich" in texto:
+        return "SANDWICH"
+    return "OTROS"
+
+
+def categoria_pago(forma_pago: str) -> str:
+    texto = forma_pago.lower()
+    if "tarjeta" in texto or "crédito" in texto or "débito" in texto:
+        return "TARJETA"
+    if "efectivo" in texto:
+        return "EFECTIVO"
+    if "transferencia" in texto:
+        return "TRANSFERENCIA"
+    return "OTRO"
+
+
+# ========================================================================
+# MAPAS DE DIMENSIONES EN MEMORIA
+# ========================================================================
+# load: clave natural (todas las columnas menos la última) → surrogate key
+# insert / template / row: alta en bloque de los miembros que falten
+_DIMENSIONS = {
+    "fecha": {
+        "load": "SELECT fecha_completa, fecha_key FROM dw.dim_fecha",
+        "insert": """
+            INSERT INTO dw.dim_fecha (
+                fecha_key, fecha_completa, anio, trimestre, mes,
+                nombre_mes, dia_mes, dia_semana, nombre_dia_semana, es_fin_semana
+            )
+            SELECT
+                CAST(TO_CHAR(f, 'YYYYMMDD') AS INTEGER), f,
+                EXTRACT(YEAR FROM f), EXTRACT(QUARTER FROM f), EXTRACT(MONTH FROM f),
+                TO_CHAR(f, 'Month'), EXTRACT(DAY FROM f), EXTRACT(DOW FROM f),
+                TO_CHAR(f, 'Day'), EXTRACT(DOW FROM f) IN (0, 6)
+            FROM (VALUES %s) AS v(f)
+            ON CONFLICT (fecha_key) DO NOTHING
+        """,
+        "template": "(%s::date)",
+        "row": lambda fecha: (fecha,),
+    },
+    "producto": {
+        "load": "SELECT descripcion, tipo_iva, producto_sk FROM dw.dim_producto",
+        "insert": """
+            INSERT INTO dw.dim_producto (descripcion, tipo_iva, categoria) VALUES %s
+            ON CONFLICT (descripcion, tipo_iva) DO NOTHING
+        """,
+        "template": None,
+        "row": lambda key: (key[0], key[1], categoria_producto(key[0])),
+    },
+    "sede": {
+        "load": "SELECT nombre_sede, sede_sk FROM dw.dim_sede",
+        "insert": """
+            INSERT INTO dw.dim_sede (nombre_sede, region, ciudad) VALUES %s
+            ON CONFLICT (nombre_sede) DO NOTHING
+        """,
+        "template": None,
+        "row": lambda nombre: (nombre, "CHILE", "SANTIAGO"),
+    },
+    "pago": {
+        "load": "SELECT forma_pago, pago_sk FROM dw.dim_forma_pago",
+        "insert": """
+            INSERT INTO dw.dim_forma_pago (forma_pago, categoria_pago, descripcion) VALUES %s
+            ON CONFLICT (forma_pago) DO NOTHING
+        """,
+        "template": None,
+        "row": lambda forma: (forma, categoria_pago(forma), forma),
+    },
+    "tarjeta": {
+        "load": "SELECT tipo_tarjeta, ultimos_4_digitos, tarjeta_sk FROM dw.dim_tarjeta",
+        "insert": """
+            INSERT INTO dw.dim_tarjeta (tipo_tarjeta, ultimos_4_digitos, marca_tarjeta, modo_captura) VALUES %s
+            ON CONFLICT (tipo_tarjeta, ultimos_4_digitos) DO NOTHING
+        """,
+        "template": None,
+        # key = (tipo, últimos 4, modo de captura); el modo no forma parte de la clave natural
+        "row": lambda key: (key[0], key[1], key[0], key[2] or "NO_ESPECIFICADO"),
+    },
+}
+
+
+class DimensionMaps:
+    """Clave natural → surrogate key de cada dimensión, cargadas una vez por ejecución"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.maps: Dict[str, Dict[Any, int]] = {name: self._load(name) for name in _DIMENSIONS}
+        self.inserted = {name: 0 for name in _DIMENSIONS}
+
+    def _load(self, name: str) -> Dict[Any, int]:
+        self.cursor.execute(_DIMENSIONS[name]["load"])
+        return {
+            (row[0] if len(row) == 2 else tuple(row[:-1])): row[-1]
+            for row in self.cursor.fetchall()
+        }
+
+    def ensure(self, name: str, keys: Set[Any], extra: Optional[Dict[Any, Any]] = None) -> None:
+        """Inserta en bloque los miembros que faltan y recarga el mapa"""
+        current = self.maps[name]
+        missing = [key for key in keys if key is not None and self._natural(name, key) not in current]
+        if not missing:
+            return
+        spec = _DIMENSIONS[name]
+        psycopg2.extras.execute_values(
+            self.cursor, spec["insert"], [spec["row"](key) for key in missing], template=spec["template"]
+        )
+        self.inserted[name] += len(missing)
+        self.maps[name] = self._load(name)
+
+    @staticmethod
+    def _natural(name: str, key: Any) -> Any:
+        return key[:2] if name == "tarjeta" else key
+
+    def get(self, name: str, key: Any) -> Optional[int]:
+        if key is None:
+            return None
+        return self.maps[name].get(self._natural(name, key))
+
+
+# ========================================================================
+# MARCAS DE AGUA
+# ========================================================================
+def ensure_change_tracking(cursor, source: str) -> None:
+    """
+    Agrega (si falta) la columna de cambios a la tabla fuente, con su índice
+    y el trigger que la renueva. Las filas existentes se numeran una vez.
+    """
+    spec = SOURCES[source]
+    table, column = spec["table"], spec["watermark_column"]
+    trigger = f"trg_{source}_{column}"
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} BIGINT")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{source}_{column} ON {table} ({column})")
+    cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = %s::regclass", (trigger, table))
+    if cursor.fetchone():
+        return
+    cursor.execute(f"UPDATE {table} SET {column} = nextval('etl.row_version_seq') WHERE {column} IS NULL")
+    cursor.execute(f"""
+        CREATE TRIGGER {trigger} BEFORE INSERT ON {table}
+        FOR EACH ROW EXECUTE FUNCTION etl.touch_row_version()
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER {trigger}_upd BEFORE UPDATE ON {table}
+        FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION etl.touch_row_version()
+    """)
+
+
+def read_watermark(cursor, source: str) -> int:
+    """Último valor cargado; 0 si se guardó con otra columna (recarga completa, idempotente)"""
+    cursor.execute("SELECT watermark_column, last_value FROM etl.watermarks WHERE source_table = %s", (source,))
+    row = cursor.fetchone()
+    if not row or row[0] != SOURCES[source]["watermark_column"]:
+        return 0
+    return int(row[1])
+
+
+def source_high_water(cursor, source: str) -> int:
+    """
+    Valor máximo actual de la fuente: fija el límite superior del lote.
+
+    El lock SHARE espera a las escrituras en curso y bloquea las nuevas hasta
+    el COMMIT de la carga: una fila con un valor de secuencia menor que
+    aún no estaba confirmada no puede quedar bajo la marca de agua sin cargarse.
+    """
+    spec = SOURCES[source]
+    cursor.execute(f"LOCK TABLE {spec['table']} IN SHARE MODE")
+    cursor.execute(f"SELECT COALESCE(MAX({spec['watermark_column']}), 0) FROM {spec['table']}")
+    return int(cursor.fetchone()[0])
+
+
+def save_watermark(cursor, source: str, value: int, rows: int) -> None:
+    cursor.execute(
+        """
+        INSERT INTO etl.watermarks (source_table, watermark_column, last_value, rows_loaded, updated_at)
+        VALUES (%s, %s, %s, %s, now())
+        ON CONFLICT (source_table) DO UPDATE SET
+            watermark_column = EXCLUDED.watermark_column,
+            last_value = EXCLUDED.last_value,
+            rows_loaded = etl.watermarks.rows_loaded + EXCLUDED.rows_loaded,
+            updated_at = EXCLUDED.updated_at
+        """,
+        (source, SOURCES[source]["watermark_column"], value, rows),
+    )
+
+
+# ========================================================================
+# CARGA DE HECHOS
+# ========================================================================
+def _flush_ventas(cursor, dims: DimensionMaps, lineas: List[tuple], dirty: Set[int], batch_size: int) -> int:
+    """Borra los tickets del lote en dw.fact_ventas y los reinserta con las keys resueltas"""
+    if not lineas:
+        return 0
+
+    dims.ensure("fecha", {linea[2] for linea in lineas})
+    dims.ensure("producto", {(linea[3], linea[4]) for linea in lineas if linea[3]})
+    dims.ensure("sede", {resolver_sede(linea[5]) for linea in lineas})
+    dims.ensure("pago", {linea[6] for linea in lineas if linea[6] and linea[6] != "no_especificado"})
+
+    ids = sorted({linea[0] for linea in lineas})
+    cursor.execute(
+        "DELETE FROM dw.fact_ventas WHERE id_transaccion = ANY(%s) RETURNING fecha_key",
+        (ids,),
+    )
+    dirty.update(row[0] for row in cursor.fetchall() if row[0] is not None)
+
+    filas = []
+    for id_transaccion, linea_ticket, fecha, descripcion, tipo_iva, sede, forma_pago, *metricas in lineas:
+        fecha_key = dims.get("fecha", fecha)
+        dirty.add(fecha_key)
+        filas.append((
+            id_transaccion,
+            linea_ticket,
+            fecha_key,
+            dims.get("producto", (descripcion, tipo_iva) if descripcion else None),
+            dims.get("sede", resolver_sede(sede)),
+            dims.get("pago", forma_pago),
+            *metricas,
+        ))
+
+    psycopg2.extras.execute_values(cursor, INSERT_VENTAS_SQL, filas, page_size=batch_size)
+    return len(filas)
+
+
+def load_fact_ventas(conn, dims: DimensionMaps, desde: int, hasta: int, dirty: Set[int], batch_size: int) -> int:
+    """Carga incremental de dw.fact_ventas a nivel de ticket completo"""
+    spec = SOURCES["informe_ventas"]
+    query = VENTAS_QUERY.format(table=spec["table"], wm=spec["watermark_column"])
+
+    procesadas = 0
+    lineas: List[tuple] = []
+    ticket_actual = None
+    linea_ticket = 0
+
+    with conn.cursor() as cursor, conn.cursor(name="etl_incremental_ventas") as source:
+        source.itersize = batch_size
+        source.execute(query, {"desde": desde, "hasta": hasta})
+        for id_transaccion, *resto in source:
+            if id_transaccion != ticket_actual:
+                # Los lotes solo se cortan entre tickets para no partir un DELETE + INSERT
+                if len(lineas) >= batch_size:
+                    procesadas += _flush_ventas(cursor, dims, lineas, dirty, batch_size)
+                    lineas = []
+                ticket_actual = id_transaccion
+                linea_ticket = 0
+            linea_ticket += 1
+            lineas.append((id_transaccion, linea_ticket, *resto))
+        procesadas += _flush_ventas(cursor, dims, lineas, dirty, batch_size)
+
+    return procesadas
+
+
+def _flush_transacciones(cursor, dims: DimensionMaps, filas: Dict[str, tuple], dirty: Set[int], batch_size: int) -> int:
+    if not filas:
+        return 0
+
+    dims.ensure("fecha", {fila[1] for fila in filas.values()})
+    dims.ensure("tarjeta", {
+        (fila[2] or "NO_ESPECIFICADO", (fila[3] or "").strip()[:4], fila[9])
+        for fila in filas.values()
+        if fila[2] is not None or fila[3] is not None
+    })
+
+    # La sede de la transacción es la de sus líneas de venta (ya cargadas en esta transacción)
+    cursor.execute(
+        """
+        SELECT id_transaccion, MAX(sede_sk)
+        FROM dw.fact_ventas
+        WHERE id_transaccion = ANY(%s)
+        GROUP BY id_transaccion
+        """,
+        (list(filas.keys()),),
+    )
+    sede_por_ticket = dict(cursor.fetchall())
+
+    valores = []
+    for id_transaccion, (_, fecha, tipo_tarjeta, ultimos_4, *datos) in filas.items():
+        fecha_key = dims.get("fecha", fecha)
+        dirty.add(fecha_key)
+        tarjeta_key = None
+        if tipo_tarjeta is not None or ultimos_4 is not None:
+            tarjeta_key = (tipo_tarjeta or "NO_ESPECIFICADO", (ultimos_4 or "").strip()[:4], None)
+        valores.append((
+            id_transaccion,
+            fecha_key,
+            sede_por_ticket.get(id_transaccion),
+            dims.get("tarjeta", tarjeta_key),
+            *datos,
+        ))
+
+    psycopg2.extras.execute_values(cursor, UPSERT_TRANSACCIONES_SQL, valores, page_size=batch_size)
+    return len(valores)
+
+
+def load_fact_transacciones(conn, dims: DimensionMaps, desde: int, hasta: int, dirty: Set[int], batch_size: int) -> int:
+    """Upsert incremental de dw.fact_transacciones por id_transaccion"""
+    spec = SOURCES["transacciones"]
+    query = TRANSACCIONES_QUERY.format(table=spec["table"], wm=spec["watermark_column"])
+
+    procesadas = 0
+    # dict por id: un mismo lote no puede actualizar dos veces la misma fila en ON CONFLICT
+    filas: Dict[str, tuple] = {}
+
+    with conn.cursor() as cursor, conn.cursor(name="etl_incremental_transacciones") as source:
+        source.itersize = batch_size
+        source.execute(query, {"desde": desde, "hasta": hasta})
+        for fila in source:
+            filas[fila[0]] = fila
+            if len(filas) >= batch_size:
+                procesadas += _flush_transacciones(cursor, dims, filas, dirty, batch_size)
+                filas = {}
+        procesadas += _flush_transacciones(cursor, dims, filas, dirty, batch_size)
+
+    return procesadas
+
+
+_LOADERS = {
+    "informe_ventas": load_fact_ventas,
+    "transacciones": load_fact_transacciones,
+}
+
+
+def run_incremental_load(conn, full: bool = False, batch_size: int = ETL_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Ejecuta la carga incremental de todas las fuentes en una sola transacción.
+
+    Args:
+        conn: Conexión psycopg2
+        full: Ignora las marcas de agua y reprocesa todo (sin vaciar las tablas)
+        batch_size: Filas por lote de lectura y de escritura
+
+    Returns:
+        Resumen con filas, duración y filas/segundo por fuente
+    """
+    summary: Dict[str, Any] = {"sources": {}, "partitions": 0}
+    dirty: Set[int] = set()
+    start_total = time.perf_counter()
+
+    try:
+        with conn.cursor() as cursor:
+            ensure_control_schema(cursor)
+            dims = DimensionMaps(cursor)
+
+            # Ventas primero: fact_transacciones toma la sede desde fact_ventas
+            for source, loader in _LOADERS.items():
+                ensure_change_tracking(cursor, source)
+                desde = 0 if full else read_watermark(cursor, source)
+                hasta = source_high_water(cursor, source)
+                if hasta <= desde:
+                    print(f"✅ {source}: sin filas nuevas (watermark {desde})")
+                    summary["sources"][source] = {"rows": 0, "seconds": 0.0, "rows_per_second": 0.0}
+                    continue
+
+                print(f"🔄 {source}: cargando {SOURCES[source]['watermark_column']} ({desde}, {hasta}] → {SOURCES[source]['target']}")
+                start = time.perf_counter()
+                rows = loader(conn, dims, desde, hasta, dirty, batch_size)
+                seconds = time.perf_counter() - start
+                save_watermark(cursor, source, hasta, rows)
+
+                rate = rows / seconds if seconds > 0 else 0.0
+                summary["sources"][source] = {"rows": rows, "seconds": round(seconds, 2), "rows_per_second": round(rate, 1)}
+                print(f"   • {rows} filas en {seconds:.2f}s ({rate:,.0f} filas/s)")
+
+            dirty.discard(None)
+            summary["partitions"] = mark_dirty_partitions(cursor, dirty)
+            summary["dimension_members_added"] = dict(dims.inserted)
+            if any(stats["rows"] for stats in summary["sources"].values()):
+                summary["data_version"] = bump_data_version(cursor, "etl_incremental")
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    seconds_total = time.perf_counter() - start_total
+    rows_total = sum(stats["rows"] for stats in summary["sources"].values())
+    summary["rows"] = rows_total
+    summary["seconds"] = round(seconds_total, 2)
+    summary["rows_per_second"] = round(rows_total / seconds_total, 1) if seconds_total > 0 else 0.0
+    return summary
+
+
+def main():
+    from db_pool import get_sync_connection
+
+    parser = argparse.ArgumentParser(description="Carga incremental del modelo estrella (dw)")
+    subparsers = parser.add_subparsers(dest="accion", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Cargar filas nuevas desde la última marca de agua")
+    run_parser.add_argument("--full", action="store_true", help="Reprocesar todas las filas fuente (sin TRUNCATE)")
+    run_parser.add_argument("--batch-size", type=int, default=ETL_BATCH_SIZE, help="Filas por lote")
+    run_parser.add_argument("--refrescar-agregados", action="store_true",
+                            help="Refrescar bi.agg_* para las particiones tocadas al terminar")
+
+    subparsers.add_parser("status", help="Mostrar marcas de agua por fuente")
+
+    args = parser.parse_args()
+
+    conn = get_sync_connection()
+    try:
+        if args.accion == "run":
+            summary = run_incremental_load(conn, full=args.full, batch_size=args.batch_size)
+            print(f"✅ Carga completada: {summary['rows']} filas en {summary['seconds']}s "
+                  f"({summary['rows_per_second']:,.0f} filas/s), {summary['partitions']} particiones marcadas")
+            if args.refrescar_agregados and summary["partitions"]:
+                refresh_aggregates(conn)
+
+        else:
+            with conn.cursor() as cursor:
+                ensure_control_schema(cursor)
+                cursor.execute(
+                    "SELECT source_table, watermark_column, last_value, rows_loaded, updated_at "
+                    "FROM etl.watermarks ORDER BY source_table"
+                )
+                rows = cursor.fetchall()
+            conn.commit()
+            if not rows:
+                print("⚠️ Aún no hay cargas incrementales registradas")
+            for row in rows:
+                print(f"   • {row[0]}: {row[1]} = {row[2]} ({row[3]} filas acumuladas, {row[4]:%Y-%m-%d %H:%M})")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
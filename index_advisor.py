@@ -0,0 +1,345 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import time
+from typing import Any, Dict, List, Optional
+
+# ========================================================================
+# ASESOR DE ÍNDICES PARA LOS PREDICADOS CALIENTES DE KPIs Y DASHBOARDS
+# ========================================================================
+# 1. Ejecuta EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) sobre cada plantilla de
+#    KPI_REGISTRY y cada consulta de los routers (sales_queries.py)
+# 2. Detecta Seq Scans cuyos filtros / joins coinciden con un índice candidato
+# 3. Genera la migración (indices_kpi.sql) con los índices propuestos
+# 4. Con --aplicar crea los índices y repite la medición (antes / después)
+MIGRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "indices_kpi.sql")
+ADVISOR_STATEMENT_TIMEOUT_MS = int(os.getenv("ADVISOR_STATEMENT_TIMEOUT_MS", "120000"))
+
+# Función IMMUTABLE para poder indexar la fecha parseada. TO_TIMESTAMP es STABLE
+# por la zona horaria de la sesión; al volver a TIMESTAMP sin zona el resultado
+# solo depende del texto, así que marcarla IMMUTABLE es seguro.
+FECHA_FUNCTION_DDL = r"""CREATE OR REPLACE FUNCTION public.fecha_sumup(texto TEXT)
+RETURNS TIMESTAMP
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT CASE
+        WHEN texto ~ '^\d{2}-\d{2}-\d{4}' THEN TO_TIMESTAMP(texto, 'DD-MM-YYYY, HH24:MI')::TIMESTAMP
+        WHEN texto ~ '^\d{4}-\d{2}-\d{2}' THEN CAST(texto AS TIMESTAMP)
+    END
+$$;"""
+
+# table: relación (Relation Name en el plan)
+# trigger: regex sobre Filter / Hash Cond / Group Key / Index Cond de los Seq Scan de esa tabla
+CANDIDATE_INDEXES = {
+    "idx_transacciones_validas": {
+        "table": "transacciones",
+        "kind": "parcial + covering",
+        "trigger": r'"Estado"',
+        "reason": "Todas las plantillas filtran Estado IN ('Exitosa','Pagado') y luego hacen JOIN por ID",
+        "ddl": (
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transacciones_validas '
+            'ON public.transacciones ("ID de transacción") '
+            'INCLUDE ("Comisión", "Total", "Ejecutar como", "Fecha", "Últimos 4 dígitos") '
+            "WHERE \"Estado\" IN ('Exitosa', 'Pagado')"
+        ),
+    },
+    "idx_informe_ventas_ticket_positivo": {
+        "table": "informe_ventas",
+        "kind": "parcial + covering",
+        "trigger": r'"Precio \(Bruto\)" > ',
+        "reason": 'Las ventas se filtran por "Precio (Bruto)" > 0 y se agrupan/juntan por ticket',
+        "ddl": (
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_informe_ventas_ticket_positivo '
+            'ON public.informe_ventas ("ID de transacción") '
+            'INCLUDE ("Precio (Bruto)", "Precio (Neto)", "Cantidad", sede_sk) '
+            'WHERE "Precio (Bruto)" > 0'
+        ),
+    },
+    "idx_informe_ventas_sede_producto": {
+        "table": "informe_ventas",
+        "kind": "parcial + covering",
+        "trigger": r'sede_sk.*"Descripción"|"Descripción".*sede_sk',
+        "reason": "Ranking de productos por sede (GROUP BY sede_sk, Descripción)",
+        "ddl": (
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_informe_ventas_sede_producto '
+            'ON public.informe_ventas (sede_sk, "Descripción") '
+            'INCLUDE ("Precio (Bruto)") '
+            'WHERE "Precio (Bruto)" > 0'
+        ),
+    },
+    "idx_informe_ventas_descripcion_lower": {
+        "table": "informe_ventas",
+        "kind": "expresión + covering",
+        "trigger": r'lower\(.*"Descripción"',
+        "reason": "Las propinas se buscan con LOWER(\"Descripción\") = 'tip'",
+        "ddl": (
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_informe_ventas_descripcion_lower '
+            'ON public.informe_ventas (LOWER("Descripción")) '
+            'INCLUDE ("ID de transacción", "Precio (Neto)")'
+        ),
+    },
+    "idx_informe_ventas_fecha_sumup": {
+        "table": "informe_ventas",
+        "kind": "expresión",
+        "trigger": r'to_timestamp\("Fecha"',
+        "reason": (
+            'Timestamp parseado para filtros por rango; las consultas deben usar '
+            'public.fecha_sumup("Fecha") en lugar de TO_TIMESTAMP para aprovecharlo'
+        ),
+        "requires": FECHA_FUNCTION_DDL,
+        "ddl": (
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_informe_ventas_fecha_sumup '
+            'ON public.informe_ventas (public.fecha_sumup("Fecha"))'
+        ),
+    },
+}
+
+_PLAN_TEXT_KEYS = ("Filter", "Hash Cond", "Join Filter", "Group Key", "Sort Key", "Index Cond")
+
+
+# ========================================================================
+# RECOLECCIÓN DE CONSULTAS
+# ========================================================================
+def collect_queries(sources: List[str]) -> Dict[str, str]:
+    """Nombre → SQL de las fuentes pedidas ('kpi', 'sales', 'star')"""
+    queries: Dict[str, str] = {}
+    if "kpi" in sources:
+        # main.py importa LangChain/LangGraph: solo se carga si se piden los KPIs
+        from main import KPI_REGISTRY
+
+        queries.update({f"kpi:{name}": info["sql_template"] for name, info in KPI_REGISTRY.items()})
+    if "sales" in sources or "star" in sources:
+        from sales_queries import SALES_QUERIES, STAR_MODEL_QUERIES
+
+        if "sales" in sources:
+            queries.update({f"sales:{name}": sql for name, sql in SALES_QUERIES.items()})
+        if "star" in sources:
+            queries.update({f"star:{name}": sql for name, sql in STAR_MODEL_QUERIES.items()})
+    return queries
+
+
+# ========================================================================
+# EXPLAIN
+# ========================================================================
+def _walk(plan: Dict[str, Any]):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _walk(child)
+
+
+def explain_query(conn, sql: str, repetitions: int = 3) -> Dict[str, Any]:
+    """
+    EXPLAIN (ANALYZE, BUFFERS) de una consulta de solo lectura.
+
+    Se ejecuta `repetitions` veces y se reporta la mediana (la primera
+    ejecución suele pagar la lectura en frío). Siempre hace ROLLBACK.
+    """
+    statement = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql.strip().rstrip(";")
+    timings = []
+    plan = None
+    try:
+        with conn.cursor() as cursor:
+            for _ in range(max(repetitions, 1)):
+                cursor.execute(statement)
+                raw = cursor.fetchone()[0]
+                result = (json.loads(raw) if isinstance(raw, str) else raw)[0]
+                timings.append(result["Execution Time"])
+                plan = result
+    finally:
+        conn.rollback()
+
+    root = plan["Plan"]
+    seq_scans = []
+    for node in _walk(root):
+        if node.get("Node Type") == "Seq Scan":
+            seq_scans.append({
+                "table": node.get("Relation Name"),
+                "rows": node.get("Actual Rows", 0),
+                "removed": node.get("Rows Removed by Filter", 0),
+                "text": " ".join(str(node.get(key, "")) for key in _PLAN_TEXT_KEYS),
+            })
+    # Los Hash Join / Group Key de los padres también describen el acceso a la tabla
+    plan_text = " ".join(
+        str(node.get(key, "")) for node in _walk(root) for key in _PLAN_TEXT_KEYS
+    )
+    return {
+        "ms": round(statistics.median(timings), 2),
+        "planning_ms": round(plan.get("Planning Time", 0.0), 2),
+        "shared_hit": root.get("Shared Hit Blocks", 0),
+        "shared_read": root.get("Shared Read Blocks", 0),
+        "seq_scans": seq_scans,
+        "plan_text": plan_text,
+    }
+
+
+def propose_indexes(explained: Dict[str, Dict[str, Any]]) -> Dict[str, List[str]]:
+    """Índice candidato → consultas cuyo plan lo justifica"""
+    proposals: Dict[str, List[str]] = {}
+    for name, result in explained.items():
+        if "error" in result:
+            continue
+        scanned = {scan["table"] for scan in result["seq_scans"]}
+        for index_name, spec in CANDIDATE_INDEXES.items():
+            if spec["table"] not in scanned:
+                continue
+            if re.search(spec["trigger"], result["plan_text"], re.IGNORECASE):
+                proposals.setdefault(index_name, []).append(name)
+    return proposals
+
+
+# ========================================================================
+# MIGRACIÓN
+# ========================================================================
+def build_migration(index_names: List[str], proposals: Optional[Dict[str, List[str]]] = None) -> str:
+    lines = [
+        "-- ==========================================",
+        "-- ÍNDICES PARA KPIs Y DASHBOARDS (generado por index_advisor.py)",
+        "-- ==========================================",
+        "-- CREATE INDEX CONCURRENTLY no puede ir dentro de una transacción:",
+        "-- ejecutar con psql sin -1 / --single-transaction",
+        "",
+    ]
+    required = []
+    for index_name in index_names:
+        requires = CANDIDATE_INDEXES[index_name].get("requires")
+        if requires and requires not in required:
+            required.append(requires)
+    for ddl in required:
+        lines += [ddl, ""]
+
+    tables = []
+    for index_name in index_names:
+        spec = CANDIDATE_INDEXES[index_name]
+        lines.append(f"-- {index_name} ({spec['kind']}): {spec['reason']}")
+        if proposals and proposals.get(index_name):
+            lines.append(f"-- Consultas beneficiadas: {', '.join(proposals[index_name])}")
+        lines += [spec["ddl"] + ";", ""]
+        if spec["table"] not in tables:
+            tables.append(spec["table"])
+
+    lines += [f"ANALYZE public.{table};" for table in tables]
+    lines += ["", "-- Reversión:"]
+    lines += [f"-- DROP INDEX CONCURRENTLY IF EXISTS public.{name};" for name in index_names]
+    return "\n".join(lines) + "\n"
+
+
+def _statements(migration_sql: str) -> List[str]:
+    """Separa la migración en sentencias respetando el cuerpo $$ ... $$ de la función"""
+    statements, current, in_body = [], [], False
+    for line in migration_sql.splitlines():
+        if not current and (not line.strip() or line.lstrip().startswith("--")):
+            continue
+        current.append(line)
+        if line.count("$$") % 2 == 1:
+            in_body = not in_body
+        if not in_body and line.rstrip().endswith(";"):
+            statements.append("\n".join(current))
+            current = []
+    return statements
+
+
+def apply_migration(conn, migration_sql: str) -> None:
+    previous = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            for statement in _statements(migration_sql):
+                print(f"   ▶ {statement.splitlines()[0][:100]}")
+                cursor.execute(statement)
+    finally:
+        conn.autocommit = previous
+
+
+# ========================================================================
+# REPORTE
+# ========================================================================
+def run_explains(conn, queries: Dict[str, str], repetitions: int) -> Dict[str, Dict[str, Any]]:
+    explained = {}
+    for name, sql in queries.items():
+        try:
+            explained[name] = explain_query(conn, sql, repetitions)
+            result = explained[name]
+            scans = ", ".join(sorted({s["table"] for s in result["seq_scans"]})) or "—"
+            print(f"   • {name:<32} {result['ms']:>10.1f} ms | buffers hit/read "
+                  f"{result['shared_hit']}/{result['shared_read']} | seq scan: {scans}")
+        except Exception as e:
+            explained[name] = {"error": str(e).splitlines()[0]}
+            print(f"   ⚠️ {name}: {explained[name]['error']}")
+    return explained
+
+
+def print_comparison(before: Dict[str, Dict[str, Any]], after: Dict[str, Dict[str, Any]]) -> None:
+    print("\n📊 ANTES / DESPUÉS (mediana de EXPLAIN ANALYZE)")
+    print(f"   {'consulta':<32} {'antes ms':>10} {'después ms':>11} {'mejora':>8}")
+    total_before = total_after = 0.0
+    for name, result in before.items():
+        if "error" in result or "error" in after.get(name, {"error": True}):
+            continue
+        ms_before, ms_after = result["ms"], after[name]["ms"]
+        total_before += ms_before
+        total_after += ms_after
+        speedup = ms_before / ms_after if ms_after > 0 else float("inf")
+        print(f"   {name:<32} {ms_before:>10.1f} {ms_after:>11.1f} {speedup:>7.1f}x")
+    if total_after:
+        print(f"   {'TOTAL':<32} {total_before:>10.1f} {total_after:>11.1f} {total_before / total_after:>7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Asesor de índices para KPI_REGISTRY y routers /api/sales")
+    subparsers = parser.add_subparsers(dest="accion", required=True)
+
+    analyze_parser = subparsers.add_parser("analizar", help="EXPLAIN de todas las consultas y propuesta de índices")
+    analyze_parser.add_argument("--fuentes", nargs="+", choices=["kpi", "sales", "star"], default=["kpi", "sales", "star"])
+    analyze_parser.add_argument("--repeticiones", type=int, default=3, help="Ejecuciones por consulta (se usa la mediana)")
+    analyze_parser.add_argument("--salida", default=MIGRATION_FILE, help="Archivo de migración a generar")
+    analyze_parser.add_argument("--aplicar", action="store_true", help="Crear los índices y medir de nuevo")
+
+    migration_parser = subparsers.add_parser("migracion", help="Escribir la migración con todos los candidatos (sin BD)")
+    migration_parser.add_argument("--salida", default=MIGRATION_FILE)
+
+    args = parser.parse_args()
+
+    if args.accion == "migracion":
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(build_migration(list(CANDIDATE_INDEXES.keys())))
+        print(f"✅ Migración con {len(CANDIDATE_INDEXES)} índices escrita en {args.salida}")
+        return
+
+    from db_pool import get_sync_connection
+
+    queries = collect_queries(args.fuentes)
+    conn = get_sync_connection(statement_timeout_ms=ADVISOR_STATEMENT_TIMEOUT_MS)
+    try:
+        print(f"🔍 EXPLAIN ANALYZE de {len(queries)} consultas ({args.repeticiones} repeticiones)...")
+        before = run_explains(conn, queries, args.repeticiones)
+
+        proposals = propose_indexes(before)
+        if not proposals:
+            print("✅ Ningún Seq Scan coincide con los índices candidatos")
+            return
+
+        print("\n💡 ÍNDICES PROPUESTOS")
+        for index_name, beneficiadas in proposals.items():
+            spec = CANDIDATE_INDEXES[index_name]
+            print(f"   • {index_name} ({spec['kind']}) → {len(beneficiadas)} consultas: {spec['reason']}")
+
+        migration_sql = build_migration(list(proposals.keys()), proposals)
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(migration_sql)
+        print(f"\n📝 Migración escrita en {args.salida}")
+
+        if args.aplicar:
+            print("\n🔧 Aplicando migración...")
+            start = time.perf_counter()
+            apply_migration(conn, migration_sql)
+            print(f"✅ Índices creados en {time.perf_counter() - start:.1f}s")
+            print("\n🔍 Midiendo de nuevo...")
+            after = run_explains(conn, queries, args.repeticiones)
+            print_comparison(before, after)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
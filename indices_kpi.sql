@@ -0,0 +1,39 @@
+-- ==========================================
+-- ÍNDICES PARA KPIs Y DASHBOARDS (generado por index_advisor.py)
+-- ==========================================
+-- CREATE INDEX CONCURRENTLY no puede ir dentro de una transacción:
+-- ejecutar con psql sin -1 / --single-transaction
+
+CREATE OR REPLACE FUNCTION public.fecha_sumup(texto TEXT)
+RETURNS TIMESTAMP
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT CASE
+        WHEN texto ~ '^\d{2}-\d{2}-\d{4}' THEN TO_TIMESTAMP(texto, 'DD-MM-YYYY, HH24:MI')::TIMESTAMP
+        WHEN texto ~ '^\d{4}-\d{2}-\d{2}' THEN CAST(texto AS TIMESTAMP)
+    END
+$$;
+
+-- idx_transacciones_validas (parcial + covering): Todas las plantillas filtran Estado IN ('Exitosa','Pagado') y luego hacen JOIN por ID
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transacciones_validas ON public.transacciones ("ID de transacción") INCLUDE ("Comisión", "Total", "Ejecutar como", "Fecha", "Últimos 4 dígitos") WHERE "Estado" IN ('Exitosa', 'Pagado');
+
+-- idx_informe_ventas_ticket_positivo (parcial + covering): Las ventas se filtran por "Precio (Bruto)" > 0 y se agrupan/juntan por ticket
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_informe_ventas_ticket_positivo ON public.informe_ventas ("ID de transacción") INCLUDE ("Precio (Bruto)", "Precio (Neto)", "Cantidad", sede_sk) WHERE "Precio (Bruto)" > 0;
+
+-- idx_informe_ventas_sede_producto (parcial + covering): Ranking de productos por sede (GROUP BY sede_sk, Descripción)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_informe_ventas_sede_producto ON public.informe_ventas (sede_sk, "Descripción") INCLUDE ("Precio (Bruto)") WHERE "Precio (Bruto)" > 0;
+
+-- idx_informe_ventas_descripcion_lower (expresión + covering): Las propinas se buscan con LOWER("Descripción") = 'tip'
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_informe_ventas_descripcion_lower ON public.informe_ventas (LOWER("Descripción")) INCLUDE ("ID de transacción", "Precio (Neto)");
+
+-- idx_informe_ventas_fecha_sumup (expresión): Timestamp parseado para filtros por rango; las consultas deben usar public.fecha_sumup("Fecha") en lugar de TO_TIMESTAMP para aprovecharlo
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_informe_ventas_fecha_sumup ON public.informe_ventas (public.fecha_sumup("Fecha"));
+
+ANALYZE public.transacciones;
+ANALYZE public.informe_ventas;
+
+-- Reversión:
+-- DROP INDEX CONCURRENTLY IF EXISTS public.idx_transacciones_validas;
+-- DROP INDEX CONCURRENTLY IF EXISTS public.idx_informe_ventas_ticket_positivo;
+-- DROP INDEX CONCURRENTLY IF EXISTS public.idx_informe_ventas_sede_producto;
+-- DROP INDEX CONCURRENTLY IF EXISTS public.idx_informe_ventas_descripcion_lower;
+-- DROP INDEX CONCURRENTLY IF EXISTS public.idx_informe_ventas_fecha_sumup;
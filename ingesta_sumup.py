@@ -0,0 +1,425 @@
+import argparse
+import csv
+import io
+import os
+import re
+import resource
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import openpyxl
+except ImportError:  # Solo necesario para exportaciones .xlsx
+    openpyxl = None
+
+from sede_mapping import apply_sede_mapping
+
+# ========================================================================
+# INGESTA MASIVA DE EXPORTACIONES SUMUP (CSV / XLSX) VÍA COPY
+# ========================================================================
+# - Lee el archivo en streaming (csv.reader / openpyxl read_only), por bloques
+# - Normaliza encabezados al formato de las tablas crudas ("Precio (Bruto)" → "Precio_Bruto")
+# - Tipa una sola vez: además del texto original (que siguen leyendo las vistas)
+#   llena columnas tipadas fecha_ts y *_num
+# - Carga cada bloque con COPY ... FROM STDIN (CSV) a una tabla temporal y al
+#   final inserta en la tabla cruda solo los "ID_de_transacción" que no existían
+# El proceso mantiene en memoria un solo bloque, sin importar el tamaño del archivo.
+INGESTA_CHUNK_ROWS = int(os.getenv("INGESTA_CHUNK_ROWS", "20000"))
+
+TABLES = {
+    "informe_ventas": {
+        "table": "public.informe_ventas",
+        # Columna que solo aparece en esta exportación (autodetección del destino)
+        "firma": "Descripción",
+        "numericas": {
+            "Cantidad": "cantidad_num",
+            "Precio_Bruto": "precio_bruto_num",
+            "Precio_Neto": "precio_neto_num",
+            "IVA": "iva_num",
+            "precio_unitario_calculado": "precio_unitario_num",
+        },
+        # Un ticket tiene varias líneas con el mismo ID: no se deduplica dentro del archivo
+        "una_fila_por_id": False,
+    },
+    "transacciones": {
+        "table": "public.transacciones",
+        "firma": "Código_de_autorización",
+        "numericas": {
+            "Total": "total_num",
+            "Subtotal": "subtotal_num",
+            "Impuesto": "impuesto_num",
+            "Propina": "propina_num",
+            "Comisión": "comision_num",
+            "Depósitos": "depositos_num",
+        },
+        "una_fila_por_id": True,
+    },
+}
+
+ID_COLUMN = "ID_de_transacción"
+FECHA_COLUMN = "Fecha"
+
+# Formatos de fecha presentes en las exportaciones (los mismos que las consultas
+# manejaban por separado con TO_TIMESTAMP)
+_FORMATOS_FECHA = (
+    "%d-%m-%Y, %H:%M",
+    "%d-%m-%Y %H:%M",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+)
+
+_MILES_RE = re.compile(r"^-?\d{1,3}(\.\d{3})+$")
+
+
+# ========================================================================
+# NORMALIZACIÓN Y TIPADO
+# ========================================================================
+def normalizar_encabezado(nombre: Any) -> str:
+    """'Precio (Bruto)' → 'Precio_Bruto', 'ID de transacción' → 'ID_de_transacción'"""
+    texto = str(nombre or "").strip().replace("(", " ").replace(")", " ")
+    return re.sub(r"\s+", "_", texto.strip())
+
+
+def parse_fecha(valor: Any) -> Optional[datetime]:
+    """Acepta 'DD-MM-YYYY, HH24:MI', ISO y celdas datetime de Excel"""
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, datetime):
+        return valor
+    texto = str(valor).strip()
+    for formato in _FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato)
+        except ValueError:
+            continue
+    try:
+        return datetime.fromisoformat(texto)
+    except ValueError:
+        return None
+
+
+def parse_numero(valor: Any) -> Optional[Decimal]:
+    """Montos SumUp: '$ 3.500', '3500', '3.500,50', '3500.5' → Decimal"""
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, (int, float, Decimal)):
+        return Decimal(str(valor))
+    texto = str(valor).strip().replace("$", "").replace(" ", "").replace("\u00a0", "")
+    if not texto:
+        return None
+    if "," in texto and "." in texto:
+        # El último separador es el decimal
+        if texto.rfind(",") > texto.rfind("."):
+            texto = texto.replace(".", "").replace(",", ".")
+        else:
+            texto = texto.replace(",", "")
+    elif "," in texto:
+        texto = texto.replace(",", ".")
+    elif _MILES_RE.match(texto):
+        texto = texto.replace(".", "")
+    try:
+        return Decimal(texto)
+    except InvalidOperation:
+        return None
+
+
+def _texto(valor: Any) -> Optional[str]:
+    """Valor original como texto, igual que lo guardaba la carga manual"""
+    if valor is None:
+        return None
+    if isinstance(valor, datetime):
+        return valor.strftime("%Y-%m-%d %H:%M:%S")
+    return str(valor)
+
+
+# ========================================================================
+# LECTURA EN STREAMING
+# ========================================================================
+def _iter_csv(path: str) -> Iterator[Sequence[Any]]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        muestra = f.read(8192)
+        f.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=",;\t")
+        except csv.Error:
+            dialecto = csv.excel
+        yield from csv.reader(f, dialecto)
+
+
+def _iter_xlsx(path: str) -> Iterator[Sequence[Any]]:
+    if openpyxl is None:
+        raise RuntimeError("openpyxl no está instalado: pip install openpyxl para leer .xlsx")
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_filas(path: str) -> Tuple[List[str], Iterator[Sequence[Any]]]:
+    """Devuelve (encabezados normalizados, iterador de filas) sin cargar el archivo"""
+    filas = _iter_xlsx(path) if path.lower().endswith((".xlsx", ".xlsm")) else _iter_csv(path)
+    encabezados = [normalizar_encabezado(h) for h in next(filas, [])]
+    return encabezados, filas
+
+
+def detectar_destino(encabezados: List[str]) -> str:
+    for nombre, spec in TABLES.items():
+        if spec["firma"] in encabezados:
+            return nombre
+    raise ValueError(f"No se reconoce la exportación (encabezados: {', '.join(encabezados[:8])}...)")
+
+
+def iter_bloques(
+    encabezados: List[str],
+    filas: Iterator[Sequence[Any]],
+    destino: str,
+    columnas_destino: Sequence[str],
+    chunk_rows: int,
+    stats: Dict[str, int],
+) -> Iterator[Tuple[io.StringIO, int]]:
+    """
+    Convierte las filas a bloques CSV listos para COPY.
+
+    Cada bloque contiene las columnas de texto conocidas por la tabla destino
+    seguidas de fecha_ts y de las columnas *_num.
+    """
+    spec = TABLES[destino]
+    indices = {nombre: i for i, nombre in enumerate(encabezados)}
+    texto_cols = [c for c in encabezados if c in columnas_destino]
+    id_idx = indices.get(ID_COLUMN)
+    fecha_idx = indices.get(FECHA_COLUMN)
+    if id_idx is None:
+        raise ValueError(f"La exportación no trae la columna {ID_COLUMN}")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    en_bloque = 0
+    for fila in filas:
+        if not fila or fila[id_idx] in (None, ""):
+            stats["descartadas"] += 1
+            continue
+        fecha = parse_fecha(fila[fecha_idx]) if fecha_idx is not None and fecha_idx < len(fila) else None
+        if fecha_idx is not None and fecha is None:
+            stats["fechas_invalidas"] += 1
+
+        registro = [_texto(fila[indices[c]]) if indices[c] < len(fila) else None for c in texto_cols]
+        registro.append(fecha.isoformat(sep=" ") if fecha else None)
+        for original in spec["numericas"]:
+            idx = indices.get(original)
+            registro.append(parse_numero(fila[idx]) if idx is not None and idx < len(fila) else None)
+        writer.writerow(registro)
+
+        en_bloque += 1
+        stats["leidas"] += 1
+        if en_bloque >= chunk_rows:
+            buffer.seek(0)
+            yield buffer, en_bloque
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            en_bloque = 0
+
+    if en_bloque:
+        buffer.seek(0)
+        yield buffer, en_bloque
+
+
+# ========================================================================
+# CARGA EN POSTGRES
+# ========================================================================
+def ensure_typed_columns(cursor, destino: str) -> None:
+    """Agrega (si faltan) las columnas tipadas a la tabla cruda"""
+    spec = TABLES[destino]
+    columnas = ["ADD COLUMN IF NOT EXISTS fecha_ts TIMESTAMP"] + [
+        f"ADD COLUMN IF NOT EXISTS {tipada} NUMERIC(12,2)" for tipada in spec["numericas"].values()
+    ]
+    cursor.execute(f"ALTER TABLE {spec['table']} {', '.join(columnas)}")
+    cursor.execute(
+        f'CREATE INDEX IF NOT EXISTS idx_{destino}_id_transaccion ON {spec["table"]} ("{ID_COLUMN}")'
+    )
+
+
+def backfill_typed_columns(cursor, destino: str) -> int:
+    """Tipa en SQL las filas existentes que se cargaron antes de esta ingesta"""
+    spec = TABLES[destino]
+    numericas = ",\n            ".join(
+        f"""{tipada} = CASE WHEN TRIM("{original}") ~ '^-?[0-9]+(\\.[0-9]+)?$'
+                THEN CAST(TRIM("{original}") AS NUMERIC(12,2)) END"""
+        for original, tipada in spec["numericas"].items()
+    )
+    cursor.execute(
+        f"""
+        UPDATE {spec['table']} SET
+            fecha_ts = CASE
+                WHEN "Fecha" ~ '^[0-9]{{2}}-[0-9]{{2}}-[0-9]{{4}}' THEN TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')::TIMESTAMP
+                WHEN "Fecha" ~ '^[0-9]{{4}}-[0-9]{{2}}-[0-9]{{2}}' THEN CAST("Fecha" AS TIMESTAMP)
+            END,
+            {numericas}
+        WHERE fecha_ts IS NULL AND "Fecha" IS NOT NULL AND "Fecha" != ''
+        """
+    )
+    return cursor.rowcount
+
+
+def _columnas_tabla(cursor, destino: str) -> List[str]:
+    schema, table = TABLES[destino]["table"].split(".")
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s",
+        (schema, table),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _quote(columna: str) -> str:
+    return '"' + columna.replace('"', '""') + '"'
+
+
+def ingest_file(conn, path: str, destino: Optional[str] = None, chunk_rows: int = INGESTA_CHUNK_ROWS) -> Dict[str, Any]:
+    """
+    Ingresa una exportación SumUp a la tabla cruda correspondiente.
+
+    Args:
+        conn: Conexión psycopg2
+        path: Archivo .csv o .xlsx
+        destino: 'informe_ventas' | 'transacciones' (None = autodetectar)
+        chunk_rows: Filas por bloque COPY
+
+    Returns:
+        Estadísticas de lectura, inserción y throughput
+    """
+    encabezados, filas = iter_filas(path)
+    destino = destino or detectar_destino(encabezados)
+    spec = TABLES[destino]
+    stats = {"leidas": 0, "descartadas": 0, "fechas_invalidas": 0, "insertadas": 0}
+    start = time.perf_counter()
+
+    try:
+        with conn.cursor() as cursor:
+            ensure_typed_columns(cursor, destino)
+            columnas_destino = _columnas_tabla(cursor, destino)
+            ignoradas = [c for c in encabezados if c and c not in columnas_destino]
+            if ignoradas:
+                print(f"⚠️ Columnas sin equivalente en {spec['table']} (se omiten): {', '.join(ignoradas)}")
+
+            texto_cols = [c for c in encabezados if c in columnas_destino]
+            copy_cols = texto_cols + ["fecha_ts"] + list(spec["numericas"].values())
+            lista = ", ".join(_quote(c) for c in copy_cols)
+
+            # Staging de toda la corrida: la deduplicación se hace contra lo que
+            # existía antes, así un ticket partido entre bloques no se pierde
+            cursor.execute(
+                f"CREATE TEMP TABLE stg_ingesta ON COMMIT DROP AS SELECT {lista} FROM {spec['table']} WITH NO DATA"
+            )
+            for bloque, _ in iter_bloques(encabezados, filas, destino, columnas_destino, chunk_rows, stats):
+                cursor.copy_expert(f"COPY stg_ingesta ({lista}) FROM STDIN WITH (FORMAT csv)", bloque)
+
+            distinct = f"DISTINCT ON (s.{_quote(ID_COLUMN)}) " if spec["una_fila_por_id"] else ""
+            cursor.execute(
+                f"""
+                INSERT INTO {spec['table']} ({lista})
+                SELECT {distinct}{', '.join('s.' + _quote(c) for c in copy_cols)}
+                FROM stg_ingesta s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {spec['table']} t
+                    WHERE t.{_quote(ID_COLUMN)} = s.{_quote(ID_COLUMN)}
+                )
+                """
+            )
+            stats["insertadas"] = cursor.rowcount
+            # sede_sk se resuelve una vez aquí, no en cada consulta
+            apply_sede_mapping(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    seconds = time.perf_counter() - start
+    return _resumen(path, destino, stats, seconds, cargado=True)
+
+
+def benchmark_parse(path: str, chunk_rows: int = INGESTA_CHUNK_ROWS) -> Dict[str, Any]:
+    """Mide lectura + tipado + serialización CSV sin tocar la base de datos"""
+    encabezados, filas = iter_filas(path)
+    destino = detectar_destino(encabezados)
+    stats = {"leidas": 0, "descartadas": 0, "fechas_invalidas": 0, "insertadas": 0}
+    start = time.perf_counter()
+    for bloque, _ in iter_bloques(encabezados, filas, destino, encabezados, chunk_rows, stats):
+        bloque.getvalue()
+    return _resumen(path, destino, stats, time.perf_counter() - start)
+
+
+def _resumen(path: str, destino: str, stats: Dict[str, int], seconds: float, cargado: bool = False) -> Dict[str, Any]:
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    return {
+        "archivo": path,
+        "destino": destino,
+        **stats,
+        "omitidas_por_duplicado": stats["leidas"] - stats["insertadas"] if cargado else None,
+        "segundos": round(seconds, 2),
+        "filas_por_segundo": round(stats["leidas"] / seconds, 1) if seconds > 0 else 0.0,
+        "mb_por_segundo": round(size_mb / seconds, 2) if seconds > 0 else 0.0,
+        # ru_maxrss está en KB en Linux
+        "memoria_max_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _imprimir(resumen: Dict[str, Any]) -> None:
+    print(f"✅ {resumen['archivo']} → {resumen['destino']}")
+    print(f"   • Filas leídas: {resumen['leidas']} | insertadas: {resumen['insertadas']} "
+          f"| duplicadas: {resumen['omitidas_por_duplicado']} | descartadas: {resumen['descartadas']} "
+          f"| fechas inválidas: {resumen['fechas_invalidas']}")
+    print(f"   • {resumen['segundos']}s → {resumen['filas_por_segundo']:,.0f} filas/s, "
+          f"{resumen['mb_por_segundo']} MB/s, memoria máx {resumen['memoria_max_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta de exportaciones SumUp (CSV/XLSX) vía COPY")
+    subparsers = parser.add_subparsers(dest="accion", required=True)
+
+    load_parser = subparsers.add_parser("load", help="Cargar archivos en las tablas crudas")
+    load_parser.add_argument("archivos", nargs="+")
+    load_parser.add_argument("--destino", choices=list(TABLES.keys()), help="Forzar tabla destino")
+    load_parser.add_argument("--chunk-rows", type=int, default=INGESTA_CHUNK_ROWS)
+    load_parser.add_argument("--cargar-dw", action="store_true", help="Ejecutar etl_incremental al terminar")
+
+    bench_parser = subparsers.add_parser("benchmark", help="Medir throughput de lectura y tipado (sin BD)")
+    bench_parser.add_argument("archivos", nargs="+")
+    bench_parser.add_argument("--chunk-rows", type=int, default=INGESTA_CHUNK_ROWS)
+
+    backfill_parser = subparsers.add_parser("backfill", help="Tipar filas ya existentes en las tablas crudas")
+    backfill_parser.add_argument("--destino", choices=list(TABLES.keys()), nargs="+", default=list(TABLES.keys()))
+
+    args = parser.parse_args()
+
+    if args.accion == "benchmark":
+        for path in args.archivos:
+            _imprimir(benchmark_parse(path, args.chunk_rows))
+        return
+
+    from db_pool import get_sync_connection
+
+    conn = get_sync_connection()
+    try:
+        if args.accion == "load":
+            for path in args.archivos:
+                _imprimir(ingest_file(conn, path, args.destino, args.chunk_rows))
+            if args.cargar_dw:
+                from etl_incremental import run_incremental_load
+
+                summary = run_incremental_load(conn)
+                print(f"✅ DW actualizado: {summary['rows']} filas ({summary['rows_per_second']:,.0f} filas/s)")
+        else:
+            with conn.cursor() as cursor:
+                for destino in args.destino:
+                    ensure_typed_columns(cursor, destino)
+                    print(f"✅ {destino}: {backfill_typed_columns(cursor, destino)} filas tipadas")
+            conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import difflib
+import json
+import math
+import os
+import re
+import time
+import unicodedata
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from sede_mapping import SEDES
+
+# Embeddings opcionales: sin langchain_openai se usa solo keyword + difflib
+try:
+    from langchain_openai import OpenAIEmbeddings
+except ImportError:
+    OpenAIEmbeddings = None
+
+# ========================================================================
+# RUTA RÁPIDA DETERMINISTA PARA KPIs CONOCIDOS
+# ========================================================================
+# Antes del grafo ReAct se compara la pregunta con los keywords de
+# KPI_REGISTRY. Si la coincidencia supera el umbral se ejecuta el SQL
+# registrado directamente y la respuesta se redacta con UNA sola llamada al
+# LLM (o ninguna, con el renderizador de plantilla). Las preguntas ambiguas
+# o con filtros que las plantillas no soportan siguen por el grafo.
+FAST_PATH_ENABLED = os.getenv("KPI_FAST_PATH", "1") == "1"
+FAST_PATH_THRESHOLD = float(os.getenv("KPI_FAST_PATH_THRESHOLD", "0.82"))
+FAST_PATH_MARGIN = float(os.getenv("KPI_FAST_PATH_MARGIN", "0.05"))
+# "llm" = una llamada para la narrativa | "template" = sin LLM
+FAST_PATH_NARRATIVE = os.getenv("KPI_FAST_PATH_NARRATIVE", "llm")
+FAST_PATH_EMBEDDINGS = os.getenv("KPI_FAST_PATH_EMBEDDINGS", "0") == "1"
+FAST_PATH_MAX_ROWS = 50
+
+STOPWORDS = {
+    "a", "al", "como", "con", "cual", "cuales", "cuanto", "cuantos", "cuanta", "cuantas",
+    "dame", "de", "del", "dime", "el", "en", "es", "esta", "este", "hay", "la", "las",
+    "lo", "los", "me", "mi", "mis", "muestra", "muestrame", "nos", "nuestra", "nuestras",
+    "nuestro", "nuestros", "para", "podrias", "por", "que", "quiero", "saber", "se",
+    "son", "su", "sus", "un", "una", "y",
+}
+
+# Las plantillas de KPI_REGISTRY no tienen parámetros: si la pregunta acota
+# por fecha, sede concreta o cantidad, o invierte el orden ("menos vendidos"),
+# la responde el grafo.
+FILTER_PATTERNS = [
+    r"\b(hoy|ayer|anteayer|semana|mes|ano|trimestre|enero|febrero|marzo|abril|mayo|junio|julio"
+    r"|agosto|septiembre|setiembre|octubre|noviembre|diciembre|lunes|martes|miercoles|jueves"
+    r"|viernes|sabado|domingo|desde|hasta|entre|durante|ultimo|ultimos|ultima|ultimas)\b",
+    r"\b\d{1,2}[/-]\d{1,2}\b|\b(19|20)\d{2}\b",
+    r"\b(compara|comparar|versus|vs|por que|explica|predic|proyecc)\w*",
+    # Cantidades ("top 3 productos"): las plantillas tienen su propio LIMIT
+    r"\b\d+\b",
+    # Polaridad inversa: las plantillas ordenan de mayor a menor
+    r"\b(menos|menor|menores|peor|peores|no)\b",
+    # Sede concreta ("ventas por sede en tajamar"): las plantillas cubren todas
+    r"\b(" + "|".join(patron for info in SEDES.values() for patron in info["patrones"]) + r")\b",
+]
+_FILTER_RE = [re.compile(p) for p in FILTER_PATTERNS]
+
+_embedding_cache: Dict[str, Any] = {}
+
+
+def normalize_question(texto: str) -> str:
+    """Minúsculas, sin tildes ni puntuación y espacios colapsados"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^a-z0-9ñ\s]", " ", texto)
+    return re.sub(r"\s+", " ", texto).strip()
+
+
+def content_tokens(texto: str) -> List[str]:
+    """Tokens normalizados sin stopwords"""
+    return [t for t in normalize_question(texto).split() if t not in STOPWORDS]
+
+
+def _fuzzy_score(pregunta: List[str], keyword: List[str]) -> float:
+    """Mejor ratio de difflib entre el keyword y una ventana de la pregunta del mismo largo"""
+    if not pregunta or not keyword:
+        return 0.0
+    objetivo = " ".join(keyword)
+    largo = min(len(keyword), len(pregunta))
+    mejor = 0.0
+    for inicio in range(len(pregunta) - largo + 1):
+        ventana = " ".join(pregunta[inicio:inicio + largo])
+        mejor = max(mejor, difflib.SequenceMatcher(None, ventana, objetivo).ratio())
+    # Penaliza keywords largos cubiertos solo en parte por una pregunta corta
+    return mejor * largo / len(keyword)
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norma = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norma if norma else 0.0
+
+
+def _embedding_scores(question: str, registry: Dict[str, Dict[str, Any]]) -> Dict[str, float]:
+    if not (FAST_PATH_EMBEDDINGS and OpenAIEmbeddings):
+        return {}
+    try:
+        if "model" not in _embedding_cache:
+            _embedding_cache["model"] = OpenAIEmbeddings(model="text-embedding-3-small")
+            textos = [(name, kw) for name, info in registry.items() for kw in info.get("keywords", [])]
+            vectores = _embedding_cache["model"].embed_documents([kw for _, kw in textos])
+            _embedding_cache["keywords"] = [(name, vec) for (name, _), vec in zip(textos, vectores)]
+        vector = _embedding_cache["model"].embed_query(normalize_question(question))
+    except Exception as e:
+        print(f"⚠️ Embeddings no disponibles para la ruta rápida: {e}")
+        return {}
+    scores: Dict[str, float] = {}
+    for name, vec in _embedding_cache["keywords"]:
+        scores[name] = max(scores.get(name, 0.0), _cosine(vector, vec))
+    return scores
+
+
+# ========================================================================
+# MATCHER DE INTENCIÓN
+# ========================================================================
+def match_kpi(question: str, registry: Dict[str, Dict[str, Any]],
+              threshold: float = FAST_PATH_THRESHOLD) -> Optional[Dict[str, Any]]:
+    """
+    KPI del registro que responde la pregunta, o None si no hay certeza.
+
+    Keyword contenido en la pregunta → 1.0; si no, el mejor entre difflib
+    por ventana de tokens y similitud de embeddings (si está habilitada).
+    Se exige superar el umbral y una distancia mínima con el segundo KPI.
+    """
+    normalizada = normalize_question(question)
+    if any(patron.search(normalizada) for patron in _FILTER_RE):
+        return None
+
+    tokens = content_tokens(question)
+    embeddings = _embedding_scores(question, registry)
+    candidatos = []
+    for name, info in registry.items():
+        keywords = list(info.get("keywords", [])) + [name.replace("_", " ")]
+        score, metodo = 0.0, "fuzzy"
+        for keyword in keywords:
+            if f" {normalize_question(keyword)} " in f" {normalizada} ":
+                score, metodo = 1.0, "keyword"
+                break
+            score = max(score, _fuzzy_score(tokens, content_tokens(keyword)))
+        if metodo != "keyword" and embeddings.get(name, 0.0) > score:
+            score, metodo = embeddings[name], "embedding"
+        candidatos.append({"kpi": name, "score": round(score, 3), "method": metodo})
+
+    candidatos.sort(key=lambda c: c["score"], reverse=True)
+    if not candidatos or candidatos[0]["score"] < threshold:
+        return None
+    if len(candidatos) > 1 and candidatos[0]["score"] - candidatos[1]["score"] < FAST_PATH_MARGIN:
+        return None
+    return candidatos[0]
+
+
+# ========================================================================
+# NARRATIVA
+# ========================================================================
+def _formatear_valor(valor: Any) -> str:
+    if isinstance(valor, (int, float, Decimal)) and not isinstance(valor, bool):
+        numero = float(valor)
+        texto = f"{numero:,.0f}" if numero == int(numero) else f"{numero:,.2f}"
+        return texto.replace(",", "X").replace(".", ",").replace("X", ".")
+    return "—" if valor is None else str(valor)
+
+
+def render_template(kpi_name: str, kpi_info: Dict[str, Any], rows: List[Dict[str, Any]],
+                    max_rows: int = 15) -> str:
+    """Respuesta sin LLM: descripción del KPI y filas formateadas"""
+    if not rows:
+        return f"📊 {kpi_info['description']}\n\nNo hay datos disponibles para este indicador."
+    lineas = [f"📊 {kpi_info['description']}", ""]
+    for row in rows[:max_rows]:
+        lineas.append("• " + " | ".join(f"{col}: {_formatear_valor(val)}" for col, val in row.items()))
+    if len(rows) > max_rows:
+        lineas.append(f"… y {len(rows) - max_rows} filas más")
+    lineas += ["", f"Fuente: KPI oficial '{kpi_name}'"]
+    return "\n".join(lineas)
+
+
+def narrative_messages(question: str, kpi_info: Dict[str, Any], rows: List[Dict[str, Any]]) -> List[Any]:
+    """Prompt de la única llamada al LLM de la ruta rápida: redactar sobre resultados ya calculados"""
+    system = SystemMessage(content=(
+        "Eres un experto analista de datos para cafeterías como Bolsillo Coffee. "
+        "Recibes el resultado ya calculado de un KPI oficial. Responde la pregunta en español, "
+        "de forma clara para dueños de negocio, destacando cifras y hallazgos clave. "
+        "Usa solo los datos entregados; no inventes valores."
+    ))
+    human = HumanMessage(content=(
+        f"Pregunta: {question}\n"
+        f"KPI: {kpi_info['description']}\n"
+        f"Resultados (JSON):\n{json.dumps(rows[:FAST_PATH_MAX_ROWS], default=str, ensure_ascii=False)}"
+    ))
+    return [system, human]
+
+
+def narrate_with_llm(llm, question: str, kpi_info: Dict[str, Any], rows: List[Dict[str, Any]]) -> str:
+    return llm.invoke(narrative_messages(question, kpi_info, rows)).content
+
+
+# ========================================================================
+# PUNTO DE ENTRADA
+# ========================================================================
+def _match_for_fast_path(question: str, registry: Dict[str, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not FAST_PATH_ENABLED:
+        return None
+    match = match_kpi(question, registry)
+    if match:
+        print(f"⚡ Ruta rápida: KPI '{match['kpi']}' ({match['method']}, score {match['score']})")
+    return match
+
+
+def _fast_path_result(question: str, registry: Dict[str, Dict[str, Any]], match: Dict[str, Any],
+                      rows: List[Dict[str, Any]], response: Optional[str],
+                      start: float, sql_ms: float) -> Dict[str, Any]:
+    kpi_name = match["kpi"]
+    narrativa = "llm" if response is not None else "template"
+    if response is None:
+        response = render_template(kpi_name, registry[kpi_name], rows)
+
+    total_ms = (time.perf_counter() - start) * 1000
+    print(f"✅ Ruta rápida completada en {total_ms:.0f} ms (SQL {sql_ms:.0f} ms, narrativa: {narrativa})")
+    return {
+        "response": response,
+        "messages": [HumanMessage(content=question), AIMessage(content=response)],
+        "attempts": 0,
+        "sql_query": registry[kpi_name]["sql_template"],
+        "result_rows": rows,
+        "fast_path": {**match, "narrative": narrativa, "sql_ms": round(sql_ms, 1), "total_ms": round(total_ms, 1)},
+    }
+
+
+def try_fast_path(question: str, registry: Dict[str, Dict[str, Any]],
+                  run_sql: Callable[[str], List[Dict[str, Any]]], llm=None) -> Optional[Dict[str, Any]]:
+    """
+    Responde la pregunta sin el grafo si corresponde a un KPI conocido.
+
+    Args:
+        run_sql: ejecuta SQL y devuelve las filas como lista de dicts
+        llm: modelo para la narrativa; sin él se usa la plantilla
+
+    Returns:
+        Mismo formato que process_question_react más 'fast_path', o None
+        para continuar por el grafo (sin match, error SQL, deshabilitado).
+    """
+    start = time.perf_counter()
+    match = _match_for_fast_path(question, registry)
+    if not match:
+        return None
+
+    kpi_info = registry[match["kpi"]]
+    try:
+        rows = [dict(row) for row in run_sql(kpi_info["sql_template"])]
+    except Exception as e:
+        print(f"⚠️ Ruta rápida descartada, se continúa con el grafo: {str(e)[:200]}")
+        return None
+    sql_ms = (time.perf_counter() - start) * 1000
+
+    response = None
+    if llm is not None and FAST_PATH_NARRATIVE == "llm" and rows:
+        try:
+            response = narrate_with_llm(llm, question, kpi_info, rows)
+        except Exception as e:
+            print(f"⚠️ Narrativa LLM falló, se usa plantilla: {e}")
+    return _fast_path_result(question, registry, match, rows, response, start, sql_ms)
+
+
+async def try_fast_path_async(question: str, registry: Dict[str, Dict[str, Any]],
+                              run_sql: Callable[[str], Awaitable[List[Dict[str, Any]]]],
+                              llm=None) -> Optional[Dict[str, Any]]:
+    """Variante async de try_fast_path (run_sql y la narrativa se esperan con await)"""
+    start = time.perf_counter()
+    match = _match_for_fast_path(question, registry)
+    if not match:
+        return None
+
+    kpi_info = registry[match["kpi"]]
+    try:
+        rows = [dict(row) for row in await run_sql(kpi_info["sql_template"])]
+    except Exception as e:
+        print(f"⚠️ Ruta rápida descartada, se continúa con el grafo: {str(e)[:200]}")
+        return None
+    sql_ms = (time.perf_counter() - start) * 1000
+
+    response = None
+    if llm is not None and FAST_PATH_NARRATIVE == "llm" and rows:
+        try:
+            response = (await llm.ainvoke(narrative_messages(question, kpi_info, rows))).content
+        except Exception as e:
+            print(f"⚠️ Narrativa LLM falló, se usa plantilla: {e}")
+    return _fast_path_result(question, registry, match, rows, response, start, sql_ms)
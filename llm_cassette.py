@@ -0,0 +1,465 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import ConfigDict
+
+# DuckDB opcional: sin él, la BD local tiene que ser un Postgres (AGENT_OFFLINE_DB=postgresql://...)
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# sqlglot opcional: sin él, el SQL grabado (dialecto Postgres) llega tal cual a DuckDB
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:
+    sqlglot = None
+
+from model_router import ROUTER_LARGE_MODEL, ROUTER_SMALL_MODEL
+
+# ========================================================================
+# CASSETTE DEL LLM: GRABAR SESIONES REALES Y REPRODUCIRLAS SIN RED
+# ========================================================================
+# CassetteChatModel envuelve al ChatOpenAI de create_react_graph_real:
+#   record → llama al modelo real y agrega cada llamada (mensajes, tools,
+#            respuesta con tool_calls y usage, latencia) a un JSONL
+#   replay → devuelve la respuesta grabada para la misma conversación, sin
+#            OpenAI, con la latencia grabada escalada por LLM_CASSETTE_LATENCY
+# La clave de cada llamada ignora los SystemMessage (prompt, esquema,
+# presupuesto restante y otros datos volátiles) y los ids de tool_call: se
+# arma con el modelo, las preguntas, las tool_calls previas y el tool_choice.
+# Con LLM_CASSETTE_MATCH=strict también entra el contenido de los
+# ToolMessage: si la BD local devuelve otra cosa, la llamada no coincide y
+# el benchmark lo reporta como regresión.
+#
+#   LLM_CASSETTE=record python main.py    → graba contra OpenAI y la BD real
+#   AGENT_OFFLINE=1 python main.py        → replay + BD local (DuckDB o Postgres)
+AGENT_OFFLINE = os.getenv("AGENT_OFFLINE", "0") == "1"
+# off | record | replay
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE", "replay" if AGENT_OFFLINE else "off")
+LLM_CASSETTE_DIR = os.getenv(
+    "LLM_CASSETTE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cassettes"))
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", os.path.join(LLM_CASSETTE_DIR, "agent.jsonl"))
+# 0 = instantáneo, 1 = latencia grabada, 2 = el doble
+LLM_CASSETTE_LATENCY = float(os.getenv("LLM_CASSETTE_LATENCY", "0"))
+# calls | strict
+LLM_CASSETTE_MATCH = os.getenv("LLM_CASSETTE_MATCH", "calls")
+# duckdb:///ruta.duckdb o cualquier URI de SQLAlchemy (postgresql://localhost/portacafe)
+AGENT_OFFLINE_DB = os.getenv("AGENT_OFFLINE_DB", f"duckdb:///{os.path.join(LLM_CASSETTE_DIR, 'agent.duckdb')}")
+OFFLINE_SCHEMA_CACHE_PATH = os.path.join(LLM_CASSETTE_DIR, "schema_offline.json")
+CASSETTE_FORMAT = 1
+
+DUCKDB_TYPES = {
+    "text": "VARCHAR", "int": "BIGINT", "num": "DECIMAL(18,4)", "float": "DOUBLE", "date": "DATE",
+    "time": "TIME", "ts": "TIMESTAMP", "tstz": "TIMESTAMPTZ", "bool": "BOOLEAN", "json": "JSON",
+}
+
+
+class CassetteMissError(LookupError):
+    """Llamada sin respuesta grabada (la conversación se desvió de la sesión grabada)"""
+
+
+# ========================================================================
+# ARCHIVO DEL CASSETTE
+# ========================================================================
+def _content(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return json.dumps(message.content, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _signature(message: BaseMessage, strict: bool) -> Optional[List[Any]]:
+    """Lo que identifica a un mensaje en la clave (sin system prompt ni ids)"""
+    if message.type == "system":
+        return None
+    if message.type == "ai":
+        calls = [[c["name"], json.dumps(c.get("args") or {}, sort_keys=True, ensure_ascii=False, default=str)]
+                 for c in (getattr(message, "tool_calls", None) or [])]
+        return ["ai", _content(message), calls]
+    if message.type == "tool":
+        return ["tool", getattr(message, "name", None), _content(message) if strict else None]
+    return [message.type, _content(message)]
+
+
+def _message_record(message: BaseMessage) -> Dict[str, Any]:
+    """Mensaje de la petición para inspección (sin artifact: el ResultSet no se serializa)"""
+    record = {"type": message.type, "content": _content(message)}
+    if getattr(message, "tool_calls", None):
+        record["tool_calls"] = [{"name": c["name"], "args": c.get("args")} for c in message.tool_calls]
+    if message.type == "tool":
+        record["name"] = getattr(message, "name", None)
+        record["ms"] = (message.response_metadata or {}).get("duration_ms")
+    return record
+
+
+class Cassette:
+    """Llamadas grabadas (JSONL, una por línea) indexadas por clave de conversación"""
+
+    def __init__(self, path: str = LLM_CASSETTE_PATH, match: str = LLM_CASSETTE_MATCH):
+        self.path = path
+        self.strict = match == "strict"
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        self.answers: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"loaded": 0, "recorded": 0, "replayed": 0, "misses": 0, "simulated_ms": 0.0}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lineas = [json.loads(linea) for linea in f if linea.strip()]
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Cassette ilegible ({self.path}): {e}")
+            return
+        for entry in lineas:
+            if entry.get("format") != CASSETTE_FORMAT:
+                continue
+            if entry["type"] == "llm":
+                self._entries.setdefault(entry["key"], []).append(entry)
+                self.stats["loaded"] += 1
+            elif entry["type"] == "answer":
+                self.answers[entry["question"]] = entry
+        print(f"📼 Cassette {self.path}: {self.stats['loaded']} llamadas, {len(self.answers)} respuestas grabadas")
+
+    def key(self, model: str, messages: Sequence[BaseMessage], tool_choice: Any, tools: Sequence[str]) -> str:
+        firma = {
+            "model": model,
+            "tool_choice": tool_choice,
+            "tools": sorted(tools) if self.strict else bool(tools),
+            "messages": [s for s in (_signature(m, self.strict) for m in messages) if s is not None],
+        }
+        return hashlib.sha256(json.dumps(firma, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:32]
+
+    def lookup(self, key: str) -> Dict[str, Any]:
+        """Siguiente respuesta grabada para la clave (cíclica si se grabó varias veces)"""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats["misses"] += 1
+                raise CassetteMissError(f"Sin respuesta grabada para la llamada {key[:12]} en {self.path}")
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            self.stats["replayed"] += 1
+            return entries[index % len(entries)]
+
+    def record(self, key: str, model: str, messages: Sequence[BaseMessage], tool_choice: Any,
+               tools: Sequence[str], response: BaseMessage, latency_ms: float) -> None:
+        entry = {
+            "format": CASSETTE_FORMAT,
+            "type": "llm",
+            "key": key,
+            "model": model,
+            "tool_choice": tool_choice,
+            "tools": list(tools),
+            "request": [_message_record(m) for m in messages],
+            "response": messages_to_dict([response])[0],
+            "latency_ms": round(latency_ms, 1),
+            "recorded_at": time.time(),
+        }
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            self.stats["recorded"] += 1
+            self._append(entry)
+
+    def record_answer(self, question: str, answer: str, sql_query: Optional[str], elapsed_ms: float) -> None:
+        """Respuesta final de una pregunta grabada: referencia para las pruebas de regresión"""
+        entry = {"format": CASSETTE_FORMAT, "type": "answer", "question": question, "answer": answer,
+                 "sql_query": sql_query, "elapsed_ms": round(elapsed_ms, 1), "recorded_at": time.time()}
+        with self._lock:
+            self.answers[question] = entry
+            self._append(entry)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+    def simulate_latency(self, entry: Dict[str, Any], scale: float) -> float:
+        segundos = entry.get("latency_ms", 0.0) / 1000 * scale
+        with self._lock:
+            self.stats["simulated_ms"] += segundos * 1000
+        return segundos
+
+    def format_stats(self) -> str:
+        with self._lock:
+            stats = dict(self.stats)
+        return (f"📼 Cassette {os.path.basename(self.path)}: {stats['loaded']} grabadas al cargar, "
+                f"{stats['recorded']} nuevas | {stats['replayed']} reproducidas, {stats['misses']} sin coincidencia, "
+                f"{stats['simulated_ms'] / 1000:.1f}s de latencia simulada")
+
+
+_cassettes: Dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(path: str = LLM_CASSETTE_PATH) -> Cassette:
+    """Un Cassette por archivo: los tiers del router comparten el mismo JSONL"""
+    with _cassettes_lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path)
+        return _cassettes[path]
+
+
+# ========================================================================
+# MODELO DE CHAT GRABADOR / REPRODUCTOR
+# ========================================================================
+class CassetteChatModel(BaseChatModel):
+    """Chat model que graba (record) o reproduce (replay) las llamadas de otro modelo"""
+    model_config = ConfigDict(arbitrary_types_allowed=True, protected_namespaces=())
+
+    model_name: str = ROUTER_LARGE_MODEL
+    mode: str = "replay"
+    inner: Any = None  # Modelo real (solo en record)
+    cassette: Any = None
+    latency_scale: float = LLM_CASSETTE_LATENCY
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+
+    def bind_tools(self, tools: Sequence[Any], tool_choice: Any = None, **kwargs: Any):
+        # Metadato de tracing de with_structured_output; el modelo real lo agrega solo
+        kwargs.pop("ls_structured_output_format", None)
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], tool_choice=tool_choice, **kwargs)
+
+    def with_structured_output(self, schema, *, include_raw: bool = False, method: str = "function_calling", **kwargs):
+        # La implementación base ya es function calling (bind_tools + parser); "method" es de ChatOpenAI
+        return super().with_structured_output(schema, include_raw=include_raw, **kwargs)
+
+    def _request(self, messages: List[BaseMessage], kwargs: Dict[str, Any]):
+        tools = kwargs.get("tools") or []
+        names = [t.get("function", {}).get("name", "") for t in tools]
+        tool_choice = kwargs.get("tool_choice")
+        key = self.cassette.key(self.model_name, messages, tool_choice, names)
+        return key, names, tool_choice, tools
+
+    def _inner_runnable(self, tools: List[Dict[str, Any]], tool_choice: Any, kwargs: Dict[str, Any]):
+        if self.inner is None:
+            raise ValueError("CassetteChatModel en modo record necesita el modelo real (inner)")
+        extra = {k: v for k, v in kwargs.items() if k not in ("tools", "tool_choice")}
+        if tools:
+            return self.inner.bind_tools(tools, tool_choice=tool_choice, **extra)
+        return self.inner.bind(**extra) if extra else self.inner
+
+    @staticmethod
+    def _result(message: BaseMessage) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        key, names, tool_choice, tools = self._request(messages, kwargs)
+        if self.mode == "record":
+            start = time.perf_counter()
+            response = self._inner_runnable(tools, tool_choice, kwargs).invoke(messages, stop=stop)
+            self.cassette.record(key, self.model_name, messages, tool_choice, names, response,
+                                 (time.perf_counter() - start) * 1000)
+            return self._result(response)
+        entry = self.cassette.lookup(key)
+        time.sleep(self.cassette.simulate_latency(entry, self.latency_scale))
+        return self._result(messages_from_dict([entry["response"]])[0])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        key, names, tool_choice, tools = self._request(messages, kwargs)
+        if self.mode == "record":
+            start = time.perf_counter()
+            response = await self._inner_runnable(tools, tool_choice, kwargs).ainvoke(messages, stop=stop)
+            self.cassette.record(key, self.model_name, messages, tool_choice, names, response,
+                                 (time.perf_counter() - start) * 1000)
+            return self._result(response)
+        entry = self.cassette.lookup(key)
+        await asyncio.sleep(self.cassette.simulate_latency(entry, self.latency_scale))
+        return self._result(messages_from_dict([entry["response"]])[0])
+
+
+def cassette_llm(llm, model_name: Optional[str] = None, mode: str = LLM_CASSETTE_MODE,
+                 path: str = LLM_CASSETTE_PATH, latency_scale: float = LLM_CASSETTE_LATENCY):
+    """
+    Envuelve el modelo según el modo del cassette (off devuelve el mismo llm).
+
+    Args:
+        llm: modelo real; None en replay (no hace falta OpenAI)
+        model_name: nombre para la clave y los precios del router si llm es None
+    """
+    if mode == "off" or (llm is None and model_name is None):
+        return llm
+    if mode not in ("record", "replay"):
+        raise ValueError(f"LLM_CASSETTE desconocido: {mode} (off | record | replay)")
+    name = model_name or getattr(llm, "model_name", None) or getattr(llm, "model", None) or ROUTER_LARGE_MODEL
+    return CassetteChatModel(model_name=name, mode=mode, inner=llm, cassette=get_cassette(path),
+                             latency_scale=latency_scale)
+
+
+def format_cassette_stats() -> str:
+    with _cassettes_lock:
+        cassettes = list(_cassettes.values())
+    if not cassettes:
+        return "📼 Cassette: desactivado"
+    return "\n".join(c.format_stats() for c in cassettes)
+
+
+# ========================================================================
+# BASE DE DATOS LOCAL (SUSTITUTO DE POSTGRES SIN RED)
+# ========================================================================
+def _quoted(name: str) -> str:
+    return ".".join('"' + parte.replace('"', '""') + '"' for parte in name.split("."))
+
+
+# Fechas de la exportación: "DD-MM-YYYY, HH24:MI" guardadas como texto. Postgres
+# castea SUBSTRING("Fecha" FROM 1 FOR 10) a DATE (DateStyle DMY); DuckDB solo
+# acepta ISO, así que esos CAST prueban ISO y después el formato día-mes-año.
+DUCKDB_DATE_FORMAT = "%d-%m-%Y"
+
+
+def _text_date_cast(node):
+    if (isinstance(node, exp.Cast) and node.to.is_type(exp.DataType.Type.DATE)
+            and not isinstance(node.this, exp.Literal)):
+        valor = node.this.sql(dialect="duckdb")
+        return sqlglot.parse_one(
+            f"COALESCE(TRY_CAST({valor} AS DATE), "
+            f"CAST(TRY_STRPTIME(CAST({valor} AS VARCHAR), '{DUCKDB_DATE_FORMAT}') AS DATE))",
+            read="duckdb")
+    return node
+
+
+@lru_cache(maxsize=512)
+def postgres_to_duckdb(sql: str) -> str:
+    """Traduce el SQL de los agentes (Postgres) al dialecto de DuckDB; si no se puede, lo deja igual"""
+    if sqlglot is None:
+        return sql
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="postgres") if s is not None]
+        return ";\n".join(s.transform(_text_date_cast).sql(dialect="duckdb") for s in statements)
+    except sqlglot.errors.SqlglotError:
+        return sql
+
+
+class DuckDBDatabase:
+    """
+    Sustituto local del SQLDatabase de LangChain sobre un archivo DuckDB.
+
+    Solo expone lo que usan los agentes (_execute y get_table_info); sin
+    _engine, execute_with_sqldatabase ejecuta sin cursor con nombre ni
+    compuerta de costo (no hay EXPLAIN de Postgres). El SQL grabado se
+    traduce con postgres_to_duckdb (TO_TIMESTAMP, ~, ::NUMERIC, TO_CHAR...).
+    """
+
+    def __init__(self, path: str):
+        if duckdb is None:
+            raise ImportError("duckdb no está instalado (pip install duckdb) o usa AGENT_OFFLINE_DB=postgresql://...")
+        self.path = path
+        self._conn = duckdb.connect(path, read_only=True)
+        schemas = {r[0] for r in self._conn.execute("SELECT schema_name FROM information_schema.schemata").fetchall()}
+        # Las tablas de "public" se crean en ese schema; igual que en Postgres no se califican
+        self._search_path = ",".join(s for s in ("public", "main") if s in schemas) or "main"
+
+    def _execute(self, sql: str, fetch: str = "all") -> List[Dict[str, Any]]:
+        # Un cursor por llamada: las tools paralelas corren en threads distintos
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(f"SET search_path = '{self._search_path}'")
+            cursor.execute(postgres_to_duckdb(sql))
+            if cursor.description is None:
+                return []
+            columns = [d[0] for d in cursor.description]
+            rows = cursor.fetchall() if fetch == "all" else cursor.fetchmany(1)
+            return [dict(zip(columns, row)) for row in rows]
+        finally:
+            cursor.close()
+
+    def get_table_info(self) -> str:
+        rows = self._execute(
+            "SELECT table_schema, table_name, column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema NOT IN ('information_schema', 'pg_catalog') ORDER BY table_schema, table_name, ordinal_position")
+        tablas: Dict[str, List[str]] = {}
+        for row in rows:
+            name = row["table_name"] if row["table_schema"] in ("public", "main") else f"{row['table_schema']}.{row['table_name']}"
+            tablas.setdefault(name, []).append(f"{_quoted(row['column_name'])} {row['data_type']}")
+        return "\n".join(f"{name}({', '.join(columnas)})" for name, columnas in tablas.items())
+
+
+def offline_database(uri: str = AGENT_OFFLINE_DB):
+    """BD local para el modo offline: DuckDB (duckdb:///ruta) o un Postgres local vía SQLDatabase"""
+    if uri.startswith("duckdb:///"):
+        return DuckDBDatabase(uri[len("duckdb:///"):])
+    from langchain_community.utilities import SQLDatabase
+
+    return SQLDatabase.from_uri(uri)
+
+
+def snapshot_to_duckdb(run, tables: Dict[str, Sequence[Sequence[str]]], path: str,
+                       data_version_query: Optional[str] = None) -> Dict[str, int]:
+    """
+    Copia tablas/vistas de la BD real a un archivo DuckDB (las vistas quedan como tablas).
+
+    Args:
+        run: ejecuta SQL en la BD real y devuelve filas como dicts (p. ej. _run_kpi_rows)
+        tables: {tabla: [[columna, tipo abreviado de schema_cache]]}
+        data_version_query: si se da, se copia también etl.data_version
+
+    Returns:
+        {tabla: filas copiadas}
+    """
+    if duckdb is None:
+        raise ImportError("duckdb no está instalado (pip install duckdb)")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Se arma aparte y se reemplaza al final: un replay en curso nunca ve una BD a medias
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    copiadas: Dict[str, int] = {}
+    conn = duckdb.connect(tmp_path)
+    try:
+        for name, columns in tables.items():
+            full_name = name if "." in name else f"public.{name}"
+            conn.execute(f"CREATE SCHEMA IF NOT EXISTS {_quoted(full_name.split('.')[0])}")
+            definicion = ", ".join(f"{_quoted(c)} {DUCKDB_TYPES.get(t, 'VARCHAR')}" for c, t in columns)
+            conn.execute(f"CREATE TABLE {_quoted(full_name)} ({definicion})")
+            rows = run(f"SELECT * FROM {name}")
+            nombres = [c for c, _ in columns]
+            if rows:
+                placeholders = ", ".join("?" for _ in nombres)
+                conn.executemany(f"INSERT INTO {_quoted(full_name)} VALUES ({placeholders})",
+                                 [[row.get(c) for c in nombres] for row in rows])
+            copiadas[name] = len(rows)
+        if data_version_query:
+            rows = run(data_version_query)
+            conn.execute("CREATE SCHEMA IF NOT EXISTS etl")
+            conn.execute("CREATE TABLE etl.data_version (id INTEGER, version BIGINT)")
+            conn.execute("INSERT INTO etl.data_version VALUES (1, ?)", [int(rows[0]["version"]) if rows else 0])
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+    print(f"🦆 BD local {path}: " + ", ".join(f"{name} {n} filas" for name, n in copiadas.items()))
+    return copiadas
+
+
+def offline_components(latency_scale: float = LLM_CASSETTE_LATENCY, path: str = LLM_CASSETTE_PATH):
+    """(llm, small_llm, db) sin red: ambos tiers desde el cassette y la BD local"""
+    llm = cassette_llm(None, model_name=ROUTER_LARGE_MODEL, mode="replay", path=path, latency_scale=latency_scale)
+    small_llm = None
+    if ROUTER_SMALL_MODEL:
+        small_llm = cassette_llm(None, model_name=ROUTER_SMALL_MODEL, mode="replay", path=path,
+                                 latency_scale=latency_scale)
+    print(f"📴 Modo offline: LLM desde {path} (latencia ×{latency_scale:g}), BD {AGENT_OFFLINE_DB}")
+    return llm, small_llm, offline_database()
+
+
+def tables_with_types(schema_cache, tables: Iterable[str]) -> Dict[str, List[List[str]]]:
+    """{tabla: [[columna, tipo]]} de la foto del catálogo, para snapshot_to_duckdb"""
+    return {name: schema_cache.tables[name]["columns"] for name in tables if name in schema_cache.tables}
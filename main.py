@@ -1,9 +1,8 @@
 import logging
 import os
 import sys
-import json
 import traceback
-from typing import TypedDict, List, Dict, Optional, Any, Union
+from typing import TypedDict, List, Dict, Iterator, Optional, Any, Tuple, Union
 from enum import Enum
 from datetime import datetime
 
@@ -18,7 +17,7 @@ try:
     from langchain_core.output_parsers import StrOutputParser
     from langchain_core.runnables import RunnablePassthrough
     from langchain_core.prompts import PromptTemplate
-    from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage
+    from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
     from langchain_core.tools import tool
     from langchain_core.utils.function_calling import convert_to_openai_function
 except ImportError:
@@ -28,13 +27,35 @@ except ImportError:
 
 # LangGraph essentials
 from langgraph.graph import StateGraph, END, MessagesState
-from langgraph.prebuilt import ToolNode, tools_condition
+from langgraph.errors import GraphRecursionError
+from langgraph.prebuilt import tools_condition
 from langchain_openai import ChatOpenAI
 
 # Configuración inicial
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from config.environment import setup_environment, verify_openai_connection
 from database import create_database_connection
+from agent_budget import (
+    best_effort_message, final_instruction, format_budget_stats, graph_config, kpi_fallback_match,
+    kpi_fallback_message, new_budget, record_outcome, record_recursion_limit,
+)
+from agent_prelude import format_prelude_stats, record_question
+from agent_streaming import print_stream, stream_answer
+from answer_cache import answer_cache
+from context_budget import format_context_stats
+from etl_control import DATA_VERSION_QUERY, DataVersionPoller
+from kpi_fast_path import try_fast_path
+from llm_cassette import AGENT_OFFLINE, OFFLINE_SCHEMA_CACHE_PATH, cassette_llm, format_cassette_stats, offline_components
+from model_router import ROUTER_LARGE_MODEL, classify_step, compile_router, create_small_llm, format_router_stats
+from parallel_tools import ParallelToolNode, tool_call_args, tool_round
+from result_encoding import ResultSet, encode_for_llm, format_encoding_stats, parse_result
+from db_pool import QueryTimeoutError
+from sql_cost_gate import AGENT_STATEMENT_TIMEOUT_MS, SQLCostRejected, format_gate_stats, timeout_feedback
+from sql_executor import execute_with_sqldatabase
+from sql_repair import SQLRepairer, catalog_from_records, catalog_query, execute_with_repair, repair_note
+from schema_cache import schema_cache
+from sql_result_cache import fingerprint_sql, sql_result_cache
+from sql_validator import SQLValidator
 
 # ========================================================================
 # KPI REGISTRY (CATÁLOGO OFICIAL DE MÉTRICAS) - VERSIONES LIMPIAS
@@ -44,12 +65,12 @@ from database import create_database_connection
 KPI_REGISTRY = {
     "ventas_por_sede": {
         "description": "Ventas totales por sede excluyendo propinas",
-        "sql_template": '''WITH TransaccionesValidas AS (SELECT DISTINCT "ID de transacción" FROM transacciones WHERE "Estado" IN ('Exitosa', 'Pagado')), ventas_limpias AS (SELECT CASE WHEN iv."Cuenta" ILIKE '%plaza.bolsillo%' OR iv."Cuenta" ILIKE '%Plaza bolsillo%' THEN 'Plaza Bolsillo' WHEN iv."Cuenta" ILIKE '%merced%' THEN 'Merced' WHEN iv."Cuenta" ILIKE '%tajamar%' THEN 'Tajamar' ELSE COALESCE(iv."Cuenta", 'Desconocido') END AS sede, iv."ID de transacción", iv."Precio (Bruto)" AS venta_valor FROM informe_ventas iv INNER JOIN TransaccionesValidas tv ON iv."ID de transacción" = tv."ID de transacción" WHERE iv."Descripción" NOT ILIKE 'Tip' AND iv."Descripción" NOT ILIKE 'Propina' AND iv."Precio (Bruto)" > 0 ) SELECT COALESCE(sede, 'TOTAL GENERAL') AS cuenta, SUM(venta_valor) AS ventas_totales, COUNT(DISTINCT "ID de transacción") AS transacciones, ROUND(SUM(venta_valor) / NULLIF(COUNT(DISTINCT "ID de transacción"), 0), 0) AS ticket_promedio FROM ventas_limpias GROUP BY ROLLUP(sede) ORDER BY (sede IS NULL) ASC, ventas_totales DESC;''',
+        "sql_template": '''WITH TransaccionesValidas AS (SELECT DISTINCT "ID de transacción" FROM transacciones WHERE "Estado" IN ('Exitosa', 'Pagado')), ventas_limpias AS (SELECT iv.sede_sk, iv."ID de transacción", iv."Precio (Bruto)" AS venta_valor FROM informe_ventas iv INNER JOIN TransaccionesValidas tv ON iv."ID de transacción" = tv."ID de transacción" WHERE iv."Descripción" NOT ILIKE 'Tip' AND iv."Descripción" NOT ILIKE 'Propina' AND iv."Precio (Bruto)" > 0 ), por_sede AS (SELECT sede_sk, GROUPING(sede_sk) AS es_total, SUM(venta_valor) AS ventas_totales, COUNT(DISTINCT "ID de transacción") AS transacciones FROM ventas_limpias GROUP BY ROLLUP(sede_sk)) SELECT CASE WHEN ps.es_total = 1 THEN 'TOTAL GENERAL' ELSE COALESCE(ds.nombre_sede, 'Sede No Identificada') END AS cuenta, ps.ventas_totales, ps.transacciones, ROUND(ps.ventas_totales / NULLIF(ps.transacciones, 0), 0) AS ticket_promedio FROM por_sede ps LEFT JOIN dw.dim_sede ds ON ds.sede_sk = ps.sede_sk ORDER BY ps.es_total ASC, ps.ventas_totales DESC;''',
         "keywords": ["ventas por sede", "ventas totales sede", "total ventas por ubicacion"]
     },
     "top_productos": {
         "description": "Top 5 productos más vendidos por sede",
-        "sql_template": '''WITH ventas_sede_producto AS (SELECT CASE WHEN "Cuenta" IN ('Plaza bolsillo', 'plaza.bolsillo@gmail.com') THEN 'Sede Plaza Bolsillo' WHEN "Cuenta" IN ('merced', 'merced.158@gmail.com') THEN 'Sede Merced' WHEN "Cuenta" IN ('Tajamar', 'providencia.tajamar@gmail.com') THEN 'Sede Tajamar' ELSE "Cuenta" END AS sede_unificada, "Descripción" AS producto, SUM("Precio (Bruto)") AS ingresos_producto FROM informe_ventas WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Precio (Bruto)" > 0 GROUP BY 1, 2), ranking_productos AS (SELECT *, ROW_NUMBER() OVER (PARTITION BY sede_unificada ORDER BY ingresos_producto DESC) AS ranking FROM ventas_sede_producto) SELECT * FROM ranking_productos WHERE ranking <= 5 ORDER BY sede_unificada, ranking;''',
+        "sql_template": '''WITH ventas_sede_producto AS (SELECT sede_sk, "Descripción" AS producto, SUM("Precio (Bruto)") AS ingresos_producto FROM informe_ventas WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Precio (Bruto)" > 0 GROUP BY 1, 2), ranking_productos AS (SELECT *, ROW_NUMBER() OVER (PARTITION BY sede_sk ORDER BY ingresos_producto DESC) AS ranking FROM ventas_sede_producto) SELECT COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede_unificada, rp.producto, rp.ingresos_producto, rp.ranking FROM ranking_productos rp LEFT JOIN dw.dim_sede ds ON ds.sede_sk = rp.sede_sk WHERE rp.ranking <= 5 ORDER BY sede_unificada, rp.ranking;''',
         "keywords": ["top productos", "productos mas vendidos", "mejores ventas productos"]
     },
     "medios_pago": {
@@ -59,22 +80,22 @@ KPI_REGISTRY = {
     },
     "analisis_propinas": {
         "description": "Análisis de propinas por sede",
-        "sql_template": '''WITH transacciones_base AS (SELECT DISTINCT t."ID de transacción", CASE WHEN iv."Cuenta" IN ('Plaza bolsillo', 'plaza.bolsillo@gmail.com') THEN 'Sede Plaza Bolsillo' WHEN iv."Cuenta" IN ('merced', 'merced.158@gmail.com') THEN 'Sede Merced' WHEN iv."Cuenta" IN ('Tajamar', 'providencia.tajamar@gmail.com') THEN 'Sede Tajamar' ELSE iv."Cuenta" END AS sede_unificada FROM transacciones t INNER JOIN informe_ventas iv ON t."ID de transacción" = iv."ID de transacción" WHERE t."Estado" = 'Exitosa'), propinas AS (SELECT iv."ID de transacción", SUM(iv."Precio (Neto)") AS monto_propina FROM informe_ventas iv WHERE LOWER(iv."Descripción") = 'tip' GROUP BY iv."ID de transacción") SELECT tb.sede_unificada, COUNT(DISTINCT tb."ID de transacción") AS transacciones_totales, COUNT(DISTINCT p."ID de transacción") AS transacciones_con_propina, ROUND(COUNT(DISTINCT p."ID de transacción")::NUMERIC / NULLIF(COUNT(DISTINCT tb."ID de transacción"), 0) * 100, 2) AS tasa_conversion_propina_pct, SUM(p.monto_propina) AS propinas_totales, ROUND(SUM(p.monto_propina) / NULLIF(COUNT(DISTINCT p."ID de transacción"), 0), 0) AS propina_promedio FROM transacciones_base tb LEFT JOIN propinas p ON tb."ID de transacción" = p."ID de transacción" GROUP BY tb.sede_unificada ORDER BY tasa_conversion_propina_pct DESC;''',
+        "sql_template": '''WITH transacciones_base AS (SELECT DISTINCT t."ID de transacción", iv.sede_sk FROM transacciones t INNER JOIN informe_ventas iv ON t."ID de transacción" = iv."ID de transacción" WHERE t."Estado" = 'Exitosa'), propinas AS (SELECT iv."ID de transacción", SUM(iv."Precio (Neto)") AS monto_propina FROM informe_ventas iv WHERE LOWER(iv."Descripción") = 'tip' GROUP BY iv."ID de transacción") SELECT COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede_unificada, COUNT(DISTINCT tb."ID de transacción") AS transacciones_totales, COUNT(DISTINCT p."ID de transacción") AS transacciones_con_propina, ROUND(COUNT(DISTINCT p."ID de transacción")::NUMERIC / NULLIF(COUNT(DISTINCT tb."ID de transacción"), 0) * 100, 2) AS tasa_conversion_propina_pct, SUM(p.monto_propina) AS propinas_totales, ROUND(SUM(p.monto_propina) / NULLIF(COUNT(DISTINCT p."ID de transacción"), 0), 0) AS propina_promedio FROM transacciones_base tb LEFT JOIN propinas p ON tb."ID de transacción" = p."ID de transacción" LEFT JOIN dw.dim_sede ds ON ds.sede_sk = tb.sede_sk GROUP BY tb.sede_sk, ds.nombre_sede ORDER BY tasa_conversion_propina_pct DESC;''',
         "keywords": ["analisis propinas", "propinas por sede", "tasa conversion propina"]
     },
     "horas_pico": {
         "description": "Horas pico por sede",
-        "sql_template": '''SELECT EXTRACT(HOUR FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS hora_del_dia, COUNT(DISTINCT CASE WHEN "Cuenta" IN ('Plaza bolsillo', 'plaza.bolsillo@gmail.com') THEN "ID de transacción" END) AS sede_plaza_bolsillo, COUNT(DISTINCT CASE WHEN "Cuenta" IN ('merced', 'merced.158@gmail.com') THEN "ID de transacción" END) AS sede_merced, COUNT(DISTINCT CASE WHEN "Cuenta" IN ('Tajamar', 'providencia.tajamar@gmail.com') THEN "ID de transacción" END) AS sede_tajamar FROM informe_ventas WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Fecha" IS NOT NULL AND "Fecha" ~ '^\\d{2}-\\d{2}-\\d{4}, \\d{2}:\\d{2}' GROUP BY 1 ORDER BY 1 ASC;''',
+        "sql_template": '''SELECT EXTRACT(HOUR FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS hora_del_dia, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Plaza Bolsillo') THEN "ID de transacción" END) AS sede_plaza_bolsillo, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Merced') THEN "ID de transacción" END) AS sede_merced, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Tajamar') THEN "ID de transacción" END) AS sede_tajamar, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Persa Victor Manuel') THEN "ID de transacción" END) AS sede_persa_victor_manuel FROM informe_ventas WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Fecha" IS NOT NULL AND "Fecha" ~ '^\\d{2}-\\d{2}-\\d{4}, \\d{2}:\\d{2}' GROUP BY 1 ORDER BY 1 ASC;''',
         "keywords": ["horas pico", "peak hours", "horarios mas concurridos"]
     },
     "fidelidad_clientes": {
         "description": "Fidelidad de clientes por sede",
-        "sql_template": '''WITH ventas_limpias AS (SELECT CASE WHEN iv."Cuenta" IN ('Plaza bolsillo', 'plaza.bolsillo@gmail.com') THEN 'Sede Plaza Bolsillo' WHEN iv."Cuenta" IN ('merced', 'merced.158@gmail.com') THEN 'Sede Merced' WHEN iv."Cuenta" IN ('Tajamar', 'providencia.tajamar@gmail.com') THEN 'Sede Tajamar' ELSE iv."Cuenta" END AS nombre_sede, t."Últimos 4 dígitos" AS id_tarjeta, TO_CHAR(CAST(SUBSTRING(t."Fecha" FROM 1 FOR 10) AS DATE), 'YYYY-MM') AS mes_operacion, CAST(SUBSTRING(t."Fecha" FROM 1 FOR 10) AS DATE) AS fecha_dia FROM transacciones t INNER JOIN (SELECT "ID de transacción", "Cuenta" FROM informe_ventas GROUP BY 1, 2) iv ON t."ID de transacción" = iv."ID de transacción" WHERE t."Estado" = 'Exitosa' AND t."Últimos 4 dígitos" IS NOT NULL), comportamiento_mensual AS (SELECT nombre_sede, mes_operacion, id_tarjeta, COUNT(DISTINCT fecha_dia) AS dias_visitados_al_mes FROM ventas_limpias GROUP BY 1, 2, 3) SELECT nombre_sede, mes_operacion, COUNT(DISTINCT CASE WHEN dias_visitados_al_mes = 1 THEN id_tarjeta END) AS clientes_un_solo_dia, COUNT(DISTINCT CASE WHEN dias_visitados_al_mes = 2 THEN id_tarjeta END) AS clientes_recurrentes_2_veces, COUNT(DISTINCT CASE WHEN dias_visitados_al_mes > 2 THEN id_tarjeta END) AS clientes_fans_3_o_mas, ROUND((COUNT(DISTINCT CASE WHEN dias_visitados_al_mes >= 2 THEN id_tarjeta END)::numeric / NULLIF(COUNT(DISTINCT id_tarjeta), 0)) * 100, 2) AS tasa_fidelidad_mes_pct FROM comportamiento_mensual GROUP BY 1, 2 ORDER BY mes_operacion DESC;''',
+        "sql_template": '''WITH ventas_limpias AS (SELECT iv.sede_sk, t."Últimos 4 dígitos" AS id_tarjeta, TO_CHAR(CAST(SUBSTRING(t."Fecha" FROM 1 FOR 10) AS DATE), 'YYYY-MM') AS mes_operacion, CAST(SUBSTRING(t."Fecha" FROM 1 FOR 10) AS DATE) AS fecha_dia FROM transacciones t INNER JOIN (SELECT "ID de transacción", MAX(sede_sk) AS sede_sk FROM informe_ventas GROUP BY 1) iv ON t."ID de transacción" = iv."ID de transacción" WHERE t."Estado" = 'Exitosa' AND t."Últimos 4 dígitos" IS NOT NULL), comportamiento_mensual AS (SELECT sede_sk, mes_operacion, id_tarjeta, COUNT(DISTINCT fecha_dia) AS dias_visitados_al_mes FROM ventas_limpias GROUP BY 1, 2, 3) SELECT COALESCE(ds.nombre_sede, 'Sede No Identificada') AS nombre_sede, cm.mes_operacion, COUNT(DISTINCT CASE WHEN cm.dias_visitados_al_mes = 1 THEN cm.id_tarjeta END) AS clientes_un_solo_dia, COUNT(DISTINCT CASE WHEN cm.dias_visitados_al_mes = 2 THEN cm.id_tarjeta END) AS clientes_recurrentes_2_veces, COUNT(DISTINCT CASE WHEN cm.dias_visitados_al_mes > 2 THEN cm.id_tarjeta END) AS clientes_fans_3_o_mas, ROUND((COUNT(DISTINCT CASE WHEN cm.dias_visitados_al_mes >= 2 THEN cm.id_tarjeta END)::numeric / NULLIF(COUNT(DISTINCT cm.id_tarjeta), 0)) * 100, 2) AS tasa_fidelidad_mes_pct FROM comportamiento_mensual cm LEFT JOIN dw.dim_sede ds ON ds.sede_sk = cm.sede_sk GROUP BY cm.sede_sk, ds.nombre_sede, cm.mes_operacion ORDER BY cm.mes_operacion DESC;''',
         "keywords": ["fidelidad clientes", "clientes recurrentes", "tasa fidelidad"]
     },
     "comportamiento_compra": {
         "description": "Comportamiento de compra por sede",
-        "sql_template": '''WITH ventas_consolidadas AS (SELECT CASE WHEN iv."Cuenta" IN ('Plaza bolsillo', 'plaza.bolsillo@gmail.com') THEN 'Sede Plaza Bolsillo' WHEN iv."Cuenta" IN ('merced', 'merced.158@gmail.com') THEN 'Sede Merced' WHEN iv."Cuenta" IN ('Tajamar', 'providencia.tajamar@gmail.com') THEN 'Sede Tajamar' ELSE iv."Cuenta" END AS sede_unificada, t."ID de transacción", COUNT(*) AS total_items, SUM(iv."Precio (Bruto)") AS monto_boleta FROM transacciones t INNER JOIN informe_ventas iv ON t."ID de transacción" = iv."ID de transacción" WHERE t."Estado" = 'Exitosa' AND LOWER(iv."Descripción") NOT IN ('tip', 'importe personalizado') AND iv."Precio (Bruto)" > 0 GROUP BY 1, 2), SELECT sede_unificada, COUNT(CASE WHEN total_items = 1 THEN 1 END) AS ventas_solitarias, COUNT(CASE WHEN total_items > 1 THEN 1 END) AS ventas_con_acompanamiento, ROUND(COUNT(CASE WHEN total_items > 1 THEN 1 END)::numeric / NULLIF(COUNT(*), 0) * 100, 2) AS tasa_de_sugestion_exito_pct, ROUND(AVG(CASE WHEN total_items = 1 THEN monto_boleta END), 0) AS ticket_promedio_solo, ROUND(AVG(CASE WHEN total_items > 1 THEN monto_boleta END), 0) AS ticket_promedio_acompanado FROM ventas_consolidadas GROUP BY sede_unificada;''',
+        "sql_template": '''WITH ventas_consolidadas AS (SELECT iv.sede_sk, t."ID de transacción", COUNT(*) AS total_items, SUM(iv."Precio (Bruto)") AS monto_boleta FROM transacciones t INNER JOIN informe_ventas iv ON t."ID de transacción" = iv."ID de transacción" WHERE t."Estado" = 'Exitosa' AND LOWER(iv."Descripción") NOT IN ('tip', 'importe personalizado') AND iv."Precio (Bruto)" > 0 GROUP BY 1, 2) SELECT COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede_unificada, COUNT(CASE WHEN vc.total_items = 1 THEN 1 END) AS ventas_solitarias, COUNT(CASE WHEN vc.total_items > 1 THEN 1 END) AS ventas_con_acompanamiento, ROUND(COUNT(CASE WHEN vc.total_items > 1 THEN 1 END)::numeric / NULLIF(COUNT(*), 0) * 100, 2) AS tasa_de_sugestion_exito_pct, ROUND(AVG(CASE WHEN vc.total_items = 1 THEN vc.monto_boleta END), 0) AS ticket_promedio_solo, ROUND(AVG(CASE WHEN vc.total_items > 1 THEN vc.monto_boleta END), 0) AS ticket_promedio_acompanado FROM ventas_consolidadas vc LEFT JOIN dw.dim_sede ds ON ds.sede_sk = vc.sede_sk GROUP BY vc.sede_sk, ds.nombre_sede;''',
         "keywords": ["comportamiento compra", "ventas solitarias", "ticket promedio"]
     },
     "productos_global": {
@@ -84,7 +105,7 @@ KPI_REGISTRY = {
     },
     "horas_concurridas": {
         "description": "Horas del día más concurridas por sede",
-        "sql_template": '''SELECT DATE(TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS dia, CASE EXTRACT(DOW FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) WHEN 1 THEN 'Lunes' WHEN 2 THEN 'Martes' WHEN 3 THEN 'Miércoles' WHEN 4 THEN 'Jueves' WHEN 5 THEN 'Viernes' WHEN 6 THEN 'Sábado' WHEN 0 THEN 'Domingo' END AS dia_semana, EXTRACT(HOUR FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS hora_del_dia, COUNT(DISTINCT CASE WHEN "Cuenta" IN ('Plaza bolsillo', 'plaza.bolsillo@gmail.com') THEN "ID de transacción" END) AS plaza_bolsillo, COUNT(DISTINCT CASE WHEN "Cuenta" IN ('merced', 'merced.158@gmail.com') THEN "ID de transacción" END) AS merced, COUNT(DISTINCT CASE WHEN "Cuenta" IN ('Tajamar', 'providencia.tajamar@gmail.com') THEN "ID de transacción" END) AS tajamar FROM informe_ventas WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Fecha" IS NOT NULL GROUP BY 1,2,3 ORDER BY 1,3;''',
+        "sql_template": '''SELECT DATE(TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS dia, CASE EXTRACT(DOW FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) WHEN 1 THEN 'Lunes' WHEN 2 THEN 'Martes' WHEN 3 THEN 'Miércoles' WHEN 4 THEN 'Jueves' WHEN 5 THEN 'Viernes' WHEN 6 THEN 'Sábado' WHEN 0 THEN 'Domingo' END AS dia_semana, EXTRACT(HOUR FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS hora_del_dia, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Plaza Bolsillo') THEN "ID de transacción" END) AS plaza_bolsillo, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Merced') THEN "ID de transacción" END) AS merced, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Tajamar') THEN "ID de transacción" END) AS tajamar, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Persa Victor Manuel') THEN "ID de transacción" END) AS persa_victor_manuel FROM informe_ventas WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Fecha" IS NOT NULL GROUP BY 1,2,3 ORDER BY 1,3;''',
         "keywords": ["horas concurridas", "traffic hours", "peak times"]
     }
 }
@@ -94,14 +115,31 @@ KPI_REGISTRY = {
 # ========================================================================
 REAL_SCHEMA = {
     "transacciones": [
-        "ID de transacción", "Fecha", "Hora", "Cuenta", "Estado", "Ejecutar como", "Comisión"
+        "ID de transacción", "Fecha", "Hora", "Cuenta", "Estado", "Ejecutar como", "Comisión", "Total",
+        "Últimos 4 dígitos", "sede_sk"
     ],
     "informe_ventas": [
         "ID de transacción", "Fecha", "Hora", "Cuenta", "Descripción", "Cantidad", 
-        "Precio (Bruto)", "Precio (Neto)", "Últimos 4 dígitos"
+        "Precio (Bruto)", "Precio (Neto)", "Últimos 4 dígitos", "sede_sk"
+    ],
+    "dw.dim_sede": [
+        "sede_sk", "nombre_sede"
     ]
 }
 
+sql_validator = SQLValidator(REAL_SCHEMA)
+
+
+def _load_live_catalog():
+    """Columnas reales de las tablas de REAL_SCHEMA para la reparación de SQL"""
+    if schema_cache.loaded:
+        return schema_cache.columns(REAL_SCHEMA)
+    db = _lazy_components.get('db')
+    return catalog_from_records(db._execute(catalog_query(list(REAL_SCHEMA)))) if db else {}
+
+
+sql_repairer = SQLRepairer(REAL_SCHEMA, catalog_loader=_load_live_catalog)
+
 # ========================================================================
 # COMPONENTES GLOBALES
 # ========================================================================
@@ -109,6 +147,8 @@ _lazy_components = {}
 
 def get_database_schema(db):
     """Obtiene esquema técnico REAL de PostgreSQL"""
+    if schema_cache.loaded:
+        return schema_cache.describe(schema_cache.tables)
     try:
         raw_schema = db.get_table_info()
         print(f"\n✅ Esquema cargado ({len(raw_schema)} chars)")
@@ -120,8 +160,8 @@ def get_database_schema(db):
 # ========================================================================
 # NUEVA IMPLEMENTACIÓN: TOOL DE EJECUCIÓN SQL REAL
 # ========================================================================
-@tool
-def execute_sql(query: str) -> str:
+@tool(response_format="content_and_artifact")
+def execute_sql(query: str) -> Tuple[str, Dict[str, Any]]:
     """
     Ejecuta una consulta SQL contra la base de datos.
     
@@ -129,43 +169,49 @@ def execute_sql(query: str) -> str:
         query: Consulta SQL a ejecutar
         
     Returns:
-        Resultados serializados o mensaje de error como string
+        Tabla compacta con los resultados (columnas una sola vez) o mensaje de error
     """
+    # ♻️ Caché de resultados por huella de la consulta (whitespace, mayúsculas, comentarios)
+    fingerprint = fingerprint_sql(query)[:12]
+    artifact = {"cache_hit": False, "query": query, "fingerprint": fingerprint, "result": None}
+    data_version = _current_data_version()
+    cached = sql_result_cache.get(query, data_version)
+    if cached is not None:
+        print(f"♻️ RESULTADO SQL DESDE CACHÉ ({fingerprint})")
+        result = ResultSet.from_json(cached)
+        return encode_for_llm(result), {**artifact, "cache_hit": True, "result": result}
+    
+    # 🩹 Un identificador mal escrito se corrige localmente y se reintenta una vez
+    result, executed_query, fixes = execute_with_repair(query, _execute_sql_uncached, sql_repairer)
+    if isinstance(result, str):
+        return result, artifact
+    # 🗜️ Al LLM va la tabla compacta; el observer lee el ResultSet del artifact
+    sql_result_cache.put(executed_query, result.to_json(), data_version)
+    content = encode_for_llm(result)
+    if fixes:
+        content = f"{repair_note(fixes)}\n{content}"
+    return content, {**artifact, "query": executed_query, "repairs": fixes, "result": result}
+
+
+def sql_security_error(query: str) -> Optional[str]:
+    """Mensaje SQL_SECURITY_ERROR / SQL_VALIDATION_ERROR si la consulta no es válida, None si lo es"""
+    # 🔒 Un solo análisis (AST o tokens), cacheado por huella de la consulta
+    return sql_validator.validate(query)
+
+
+def _execute_sql_uncached(query: str) -> Union[str, ResultSet]:
+    """Validación de seguridad + ejecución real; ResultSet tipado o mensaje de error"""
     db = _lazy_components.get('db')
     
     if not db:
         return "ERROR: No hay conexión a base de datos disponible"
     
     # 🔒 VALIDACIÓN DE SEGURIDAD - SOLO SELECT
-    query_clean = query.strip().lower()
-    
-    # Verificar que empiece con SELECT o WITH
-    if not query_clean.startswith("select") and not query_clean.startswith("with"):
-        return "SQL_SECURITY_ERROR: Solo se permiten consultas SELECT"
-    
-    # Bloquear palabras clave peligrosas
-    forbidden_keywords = [
-        "insert",
-        "update", 
-        "delete",
-        "drop",
-        "alter", 
-        "truncate",
-        "grant",
-        "revoke",
-        "create",
-        "execute"
-    ]
-    
-    if any(keyword in query_clean for keyword in forbidden_keywords):
-        return "SQL_SECURITY_ERROR: Operación SQL no permitida"
+    security_error = sql_security_error(query)
+    if security_error:
+        return security_error
     
     try:
-        # 🔧 Usar la instancia única creada en _lazy_components
-        execute_query = _lazy_components.get("sql_tool")
-        if not execute_query:
-            return "ERROR: Herramienta SQL no inicializada"
-        
         # 🔍 LOGGING AVANZADO - Indicador visual claro
         print("\n" + "="*50)
         print("🔍 CONSULTA SQL DETECTADA")
@@ -178,7 +224,8 @@ def execute_sql(query: str) -> str:
         import time
         start_time = time.time()
             
-        result = execute_query.invoke({"query": query})
+        # Cursor del lado del servidor con tope de filas y resumen por columna
+        result = execute_with_sqldatabase(db, query)
         
         # ⏱️ Calcular duración
         end_time = time.time()
@@ -187,35 +234,19 @@ def execute_sql(query: str) -> str:
         # 📊 LOGGING DE RESULTADOS
         print(f"✅ CONSULTA COMPLETADA en {duration:.2f} segundos")
         
-        # Parsear resultado
-        if isinstance(result, str):
-            if "error" in result.lower() or "syntax" in result.lower():
-                print(f"❌ ERROR EN CONSULTA: {result}")
-                return result  # Devolvemos el error directamente
-            else:
-                try:
-                    parsed_result = json.loads(result)
-                    if isinstance(parsed_result, list) and len(parsed_result) == 0:
-                        print("📝 Resultado: EMPTY_RESULT (0 filas)")
-                        return "EMPTY_RESULT"
-                    else:
-                        row_count = len(parsed_result) if isinstance(parsed_result, list) else "N/A"
-                        print(f"📊 Resultado: {row_count} filas obtenidas")
-                        return json.dumps(parsed_result[:50], default=str)  # Limitamos resultados
-                except:
-                    if not result.strip():
-                        print("📝 Resultado: EMPTY_RESULT (contenido vacío)")
-                        return "EMPTY_RESULT"
-                    print(f"📄 Resultado: Texto plano ({len(result)} caracteres)")
-                    return result[:1000]  # Limitamos tamaño
+        if not result.rows:
+            print("📝 Resultado: EMPTY_RESULT (0 filas)")
         else:
-            if isinstance(result, list) and len(result) == 0:
-                print("📝 Resultado: EMPTY_RESULT (lista vacía)")
-                return "EMPTY_RESULT"
-            row_count = len(result) if isinstance(result, list) else "N/A"
-            print(f"📊 Resultado: {row_count} elementos obtenidos")
-            return json.dumps(result[:50], default=str)
-            
+            print(f"📊 Resultado: {result.total_rows}{'+' if result.capped else ''} filas obtenidas"
+                  + (f" (se envían {len(result.rows)} + resumen por columna)" if result.truncated else ""))
+        return result
+    
+    except SQLCostRejected as e:
+        # 🚧 Plan demasiado caro: el LLM recibe el nodo culpable para reescribir
+        return e.decision.feedback()
+    except QueryTimeoutError:
+        print(f"⏱️ CONSULTA CANCELADA POR statement_timeout ({AGENT_STATEMENT_TIMEOUT_MS} ms)")
+        return timeout_feedback(AGENT_STATEMENT_TIMEOUT_MS)
     except Exception as e:
         # Devolvemos el error real como string
         print(f"💥 ERROR FATAL EN CONSULTA: {str(e)}")
@@ -254,19 +285,21 @@ class AgentState(MessagesState):
     sql_query: Optional[str] = None
     execution_success: Optional[bool] = None
     result_rows: Optional[List[Dict]] = None
+    result_set: Optional[Any] = None  # ResultSet tipado del último execute_sql
+    sql_cache_hit: Optional[bool] = None
+    tool_results: Optional[List[Dict]] = None
     final_response: Optional[str] = None
     insights_analysis: Optional[str] = None
     attempt_count: int = 0
     rag_context_used: bool = False
     rag_queries_history: List[str] = Field(default_factory=list)  # Corrección
     rag_attempt_count: int = 0
+    budget: Optional[Any] = None  # AgentBudget de la pregunta (agent_budget.py)
 # ========================================================================
 # NODOS DEL GRAFO REACT REAL
 # ========================================================================
-def assistant_node(state: AgentState) -> Dict[str, Any]:
-    """Nodo Assistant mejorado con contexto de uso RAG"""
-    llm = _lazy_components.get('llm')
-    
+def build_state_context(state: AgentState) -> SystemMessage:
+    """Contexto operacional efímero (intentos, última query, RAG) para el LLM"""
     # Crear contexto operacional efímero
     intentos = state.get("attempt_count", 0)
     exito = state.get("execution_success", None)
@@ -297,6 +330,10 @@ ESTADO OPERACIONAL ACTUAL:
         else:
             estado_info += f"- Filas obtenidas: {len(result_rows) if isinstance(result_rows, list) else 'N/A'}"
     
+    budget = state.get("budget")
+    if budget is not None:
+        estado_info += f"\n- {budget.prompt_hint()}"
+    
     estado_info += """
 
 PLANIFICACIÓN SEMÁNTICA:
@@ -305,21 +342,55 @@ PLANIFICACIÓN SEMÁNTICA:
 3. Las reglas encontradas en documentos deben guiar las consultas SQL
 """
     
-    state_context = SystemMessage(content=estado_info)
-    
-    # Bind tools al LLM (todas las tools disponibles)
-    tools_to_bind = [execute_sql, get_kpi_sql]
-    if _lazy_components.get("retriever_tool"):
-        tools_to_bind.append(_lazy_components["retriever_tool"])
-    
-    bound_llm = llm.bind_tools(tools_to_bind)
-    
-    # Invocar LLM con contexto efímero + historial
-    response = bound_llm.invoke([state_context] + state["messages"])
+    return SystemMessage(content=estado_info)
+
+
+def assistant_node(state: AgentState) -> Dict[str, Any]:
+    """Nodo Assistant mejorado con contexto de uso RAG"""
+    router = _lazy_components["router"]
+    prelude = router.prelude
+    
+    # ⏳ Planificar contra el presupuesto restante de la pregunta
+    budget = state.get("budget")
+    decision = budget.plan() if budget is not None else "continue"
+    record_outcome(budget, decision)
+    if decision != "continue":
+        fallback = budget_fallback(state, decision)
+        if fallback is not None:
+            return {"messages": [fallback]}
+    
+    # Prefijo estático primero, contexto efímero del turno al final (caché de prefijo)
+    state_context = build_state_context(state)
+    
+    # 🔀 Decisiones baratas al modelo pequeño; SQL complejo y respuesta final al grande
+    step = classify_step(state, decision, KPI_REGISTRY)
+    if decision == "final":
+        # Última llamada: mismas tools en el historial, pero sin permitir usarlas
+        llm_messages = prelude.messages(state["messages"], [state_context, final_instruction(budget)])
+        response = router.invoke(step, llm_messages, kind="final", budget=budget)
+    else:
+        response = router.invoke(step, prelude.messages(state["messages"], [state_context]), budget=budget)
     
     return {"messages": [response]}
 
 
+def budget_fallback(state: AgentState, decision: str) -> Optional[AIMessage]:
+    """Respuesta sin LLM cuando ya no hay presupuesto; None para hacer la última llamada"""
+    budget = state["budget"]
+    if decision == "final" and state.get("result_set") is None:
+        # Sin resultados todavía: el KPI registrado más cercano responde sin otra vuelta
+        kpi_name = kpi_fallback_match(state.get("question", ""), KPI_REGISTRY)
+        if kpi_name:
+            try:
+                rows = _run_kpi_rows(KPI_REGISTRY[kpi_name]["sql_template"])
+                return kpi_fallback_message(kpi_name, KPI_REGISTRY[kpi_name], rows)
+            except Exception as e:
+                print(f"⚠️ KPI de respaldo falló: {e}")
+    if decision == "stop":
+        return best_effort_message(state, budget)
+    return None
+
+
 def should_continue(state: AgentState) -> str:
     """Decide si continuar con tools o terminar"""
     messages = state["messages"]
@@ -334,70 +405,86 @@ def should_continue(state: AgentState) -> str:
 
 
 def observer_node(state: AgentState) -> Dict[str, Any]:
-    """Observer Node con tracking avanzado de RAG"""
+    """Observer Node: agrega éxito, filas, tiempos y RAG de todos los tools de la ronda"""
     messages = state["messages"]
     
     if not messages:
         return {}
     
-    last_message = messages[-1]
+    # Todos los ToolMessages desde el último AIMessage (pueden ser varios en paralelo)
+    ronda = tool_round(messages)
+    if not ronda:
+        return {}
     
     # Estados actuales
     attempt_count = state.get("attempt_count", 0)
     rag_context_used = state.get("rag_context_used", False)
-    rag_queries_history = state.get("rag_queries_history", [])
+    rag_queries_history = list(state.get("rag_queries_history", []))
     rag_attempt_count = state.get("rag_attempt_count", 0)
     
-    # Solo procesamos ToolMessages
-    if not isinstance(last_message, ToolMessage):
-        return {}
-    
-    # Detectar éxito/fracaso
-    content = last_message.content
-    execution_success = True
-    if "ERROR" in content or "SQL_SECURITY_ERROR" in content or "SQL_ERROR" in content:
-        execution_success = False
-    
-    # Extraer SQL ejecutado si está disponible
-    sql_query = None
-    if (hasattr(last_message, 'tool_call') and 
-        last_message.tool_call and 
-        isinstance(last_message.tool_call, dict)):
-        
-        tool_call = last_message.tool_call
-        if tool_call.get('name') == 'execute_sql' and 'args' in tool_call:
-            args = tool_call['args']
-            if isinstance(args, dict) and 'query' in args:
-                sql_query = args['query']
-    
-    # Parsear resultados
+    sql_query = state.get("sql_query")
+    sql_cache_hit = None
     result_rows = None
-    if execution_success:
-        if content == "EMPTY_RESULT":
-            result_rows = []
-        else:
-            try:
-                result_rows = json.loads(content)
-                if not isinstance(result_rows, list):
-                    result_rows = None
-            except:
-                result_rows = None
-    
-    # Detectar uso de RAG y actualizar tracking
-    rag_used_in_this_call = False
-    if (hasattr(last_message, 'tool_call') and 
-        last_message.tool_call and 
-        isinstance(last_message.tool_call, dict) and
-        last_message.tool_call.get('name') == 'retrieve_documents'):
+    result_set = None
+    sql_success = None
+    tool_results = []
+    
+    for message in ronda:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        ok = not ("ERROR" in content or "SQL_SECURITY_ERROR" in content or "SQL_ERROR" in content)
+        args = tool_call_args(messages, message.tool_call_id)
+        artifact = getattr(message, 'artifact', None)
+        resumen = {
+            "tool": message.name,
+            "ok": ok,
+            "ms": (message.response_metadata or {}).get("duration_ms"),
+            "rows": None,
+            "cache_hit": None,
+        }
         
-        rag_used_in_this_call = True
-        rag_context_used = True
-        rag_attempt_count += 1
+        if message.name == 'execute_sql':
+            if isinstance(artifact, dict):
+                sql_query = artifact.get('query', args.get('query'))
+                resumen["cache_hit"] = artifact.get('cache_hit')
+                sql_cache_hit = bool(sql_cache_hit) or bool(artifact.get('cache_hit'))
+                if artifact.get('cache_hit'):
+                    print(f"♻️ Observer: resultado SQL servido desde caché ({artifact.get('fingerprint')})")
+            else:
+                sql_query = args.get('query', sql_query)
+            
+            # Resultado tipado del artifact (sin volver a parsear el texto enviado al LLM)
+            result = artifact.get('result') if isinstance(artifact, dict) else None
+            if result is None and ok:
+                result = parse_result(content)
+            if result is not None:
+                ok = True
+                resumen["ok"] = True
+                resumen["rows"] = result.total_rows
+                result_set = result
+                result_rows = result.records()
+            sql_success = ok if sql_success is None else (sql_success and ok)
+        
+        elif message.name == 'retrieve_documents':
+            # Detectar uso de RAG y actualizar tracking
+            rag_context_used = True
+            rag_attempt_count += 1
+            if args.get('query'):
+                rag_queries_history.append(args['query'])
         
-        # Extraer query RAG para historial
-        if 'args' in last_message.tool_call and 'query' in last_message.tool_call['args']:
-            query = last_message.tool_call['args']['query']
-            rag_queries_history.append(query)
+        tool_results.append(resumen)
+    
+    budget = state.get("budget")
+    if budget is not None:
+        budget.charge_sql(sum(1 for r in tool_results if r["tool"] == "execute_sql" and not r["cache_hit"]))
+    
+    execution_success = sql_success if sql_success is not None else all(r["ok"] for r in tool_results)
+    
+    if len(tool_results) > 1:
+        exitosos = sum(1 for r in tool_results if r["ok"])
+        pared = max((r["ms"] or 0) for r in tool_results)
+        suma = sum((r["ms"] or 0) for r in tool_results)
+        print(f"👁️ Observer: {len(tool_results)} tools ({exitosos} ✅, {len(tool_results) - exitosos} ❌) "
+              f"en {pared:.0f} ms de pared (secuencial: {suma:.0f} ms)")
     
     # Prevenir loops RAG excesivos (límite 3 intentos)
     if rag_attempt_count > 3:
@@ -407,20 +494,23 @@ def observer_node(state: AgentState) -> Dict[str, Any]:
         "attempt_count": attempt_count + 1,
         "execution_success": execution_success,
         "sql_query": sql_query,
+        "sql_cache_hit": sql_cache_hit,
         "result_rows": result_rows,
+        "result_set": result_set,
+        "tool_results": tool_results,
         "rag_context_used": rag_context_used,
         "rag_queries_history": rag_queries_history[-5:],  # Mantener últimas 5
         "rag_attempt_count": min(rag_attempt_count, 3)  # Limitar a 3 intentos
     }
 
-def create_react_graph_real(llm, db) -> StateGraph:
-    """Crea el grafo ReAct real con arquitectura RAG profesional"""
+def create_react_graph_real(llm, db, small_llm=None) -> StateGraph:
+    """Crea el grafo ReAct real con arquitectura RAG profesional (small_llm: tier pequeño del router)"""
     _lazy_components['llm'] = llm
     _lazy_components['db'] = db
-    
-    # 🔧 Inicializar QuerySQLDatabaseTool (sin cambios)
-    from langchain_community.tools import QuerySQLDatabaseTool
-    _lazy_components["sql_tool"] = QuerySQLDatabaseTool(db=db)
+    # Versión de datos propia del grafo síncrono; se entrega a las cachés en cada llamada
+    _lazy_components['data_version'] = DataVersionPoller(_read_data_version)
+    # 🗂️ Foto de information_schema (desde disco si el catálogo no cambió)
+    schema_cache.load(_run_kpi_rows)
     
     # 📚 INICIALIZACIÓN RAG - SOLO CONEXIÓN (sin indexación)
     try:
@@ -444,12 +534,17 @@ def create_react_graph_real(llm, db) -> StateGraph:
     # Crear workflow
     workflow = StateGraph(AgentState)
     
-    # Crear ToolNode con todas las tools disponibles
+    # Crear nodo de tools (paralelo) con todas las tools disponibles
     tools_list = [execute_sql, get_kpi_sql]
     if _lazy_components.get("retriever_tool"):
         tools_list.append(_lazy_components["retriever_tool"])
     
-    tool_node = ToolNode(tools_list)
+    tool_node = ParallelToolNode(tools_list)
+    # 🧩 Tools enlazadas y prompt estático renderizados una sola vez por grafo (uno por tier)
+    router = compile_router(llm, small_llm, tools_list, build_static_prompt,
+                            kpi_names=list(KPI_REGISTRY), sql_check=sql_security_error)
+    _lazy_components["router"] = router
+    _lazy_components["prelude"] = router.prelude
     
     # Agregar nodos
     workflow.add_node("assistant", assistant_node)
@@ -474,59 +569,135 @@ def create_react_graph_real(llm, db) -> StateGraph:
     workflow.add_edge("observer", "assistant")
     
     # Compilar grafo
-    compiled_graph = workflow.compile()
-    compiled_graph.max_iterations = 5  # Prevenir loops infinitos
-    
-    return compiled_graph
+    # El tope de pasos va en el config de invoke/stream (graph_config → recursion_limit)
+    return workflow.compile()
 
 
 # ========================================================================
 # FUNCIÓN PRINCIPAL DE PROCESAMIENTO
 # ========================================================================
+def _run_kpi_rows(sql: str) -> List[Dict[str, Any]]:
+    """Ejecuta SQL registrado y devuelve filas como dicts (ruta rápida de KPIs)"""
+    db = _lazy_components.get('db')
+    if not db:
+        raise RuntimeError("No hay conexión a base de datos disponible")
+    return db._execute(sql)
+
+
+def _read_data_version() -> int:
+    """Versión de datos del ETL (invalida la caché de respuestas)"""
+    rows = _run_kpi_rows(DATA_VERSION_QUERY)
+    return int(rows[0]["version"]) if rows else 0
+
+
+def _current_data_version() -> Optional[int]:
+    """Versión de datos del grafo síncrono (None si aún no se creó el grafo)"""
+    poller = _lazy_components.get('data_version')
+    return poller() if poller else None
+
+
 def process_question_react(question: str, graph) -> Dict[str, Any]:
-    """Procesa una pregunta usando el grafo ReAct real"""
-    
-    # Preparar mensaje inicial con contexto
+    """Procesa una pregunta: caché de respuestas → ruta rápida de KPIs → grafo ReAct"""
+    return answer_cache.answer(question, lambda: _process_question_uncached(question, graph), _current_data_version())
+
+
+def stream_question_react(question: str, graph) -> Iterator[Dict[str, Any]]:
+    """Como process_question_react pero emitiendo eventos (nodos, tools, tokens) al vuelo"""
+    return stream_answer(
+        question,
+        graph,
+        build_initial_state,
+        fast_path=lambda: try_fast_path(question, KPI_REGISTRY, _run_kpi_rows, _lazy_components.get('llm')),
+        data_version=_current_data_version,
+        config=graph_config(),
+    )
+
+
+def print_agent_stats() -> None:
+    """Métricas de cachés, validación, presupuesto y router (comando /cache y salida del REPL)"""
+    print(f"\n{answer_cache.format_stats()}")
+    print(format_context_stats())
+    print(format_encoding_stats())
+    print(format_gate_stats())
+    print(sql_validator.format_stats())
+    print(sql_repairer.format_stats())
+    print(schema_cache.format_stats())
+    print(format_budget_stats())
+    print(format_prelude_stats())
+    print(format_router_stats())
+    print(format_cassette_stats())
+    sql_stats = sql_result_cache.metrics()
+    print(f"♻️ Caché SQL: {sql_stats['entries']} consultas, {sql_stats['bytes'] / 1024:.0f} KB | "
+          f"{sql_stats['hits']} hits, {sql_stats['misses']} misses, {sql_stats['evictions']} desalojos")
+
+
+def build_schema_context(question: str) -> str:
+    """Tablas relevantes para la pregunta desde la foto del catálogo (lista estática si no hay foto)"""
+    context = schema_cache.schema_context(question, allowed=list(REAL_SCHEMA))
+    if context:
+        return context
+    return "\n".join(f"{table}: " + ", ".join(columns) for table, columns in REAL_SCHEMA.items())
+
+
+def build_static_prompt() -> str:
+    """Prompt igual para todas las preguntas (reglas + KPIs); se renderiza al compilar el grafo"""
     kpi_descriptions = "\n".join([f"- {name}: {info['description']}" for name, info in KPI_REGISTRY.items()])
-    initial_system_message = f"""Eres un experto analista de datos para cafeterías como Bolsillo Coffee.
+    return f"""Eres un experto analista de datos para cafeterías como Bolsillo Coffee.
 Tu tarea es responder preguntas sobre datos usando consultas SQL cuando sea necesario.
 
 REGLAS IMPORTANTES:
 1. SIEMPRE usa el tool execute_sql para ejecutar consultas SQL
 2. Puedes usar get_kpi_sql para obtener consultas predefinidas para métricas comunes
-3. Las tablas disponibles son: transacciones, informe_ventas
-4. Columnas válidas en transacciones: ID de transacción, Fecha, Hora, Cuenta, Estado, Ejecutar como, Comisión
-5. Columnas válidas en informe_ventas: ID de transacción, Fecha, Hora, Cuenta, Descripción, Cantidad, Precio (Bruto), Precio (Neto), Últimos 4 dígitos
-6. Excluir propinas con WHERE "Descripción" NOT ILIKE '%Tip%'
-7. Si obtienes un error, analízalo y genera una nueva consulta corregida
-8. Responde siempre en español y de forma clara para dueños de negocio
+3. Usa solo las tablas y columnas de ESQUEMA; los nombres con mayúsculas, espacios o tildes van entre comillas dobles
+4. Excluir propinas con WHERE "Descripción" NOT ILIKE '%Tip%'
+5. Para agrupar por sede usa GROUP BY sede_sk y JOIN dw.dim_sede (nombre_sede); no clasifiques "Cuenta" con CASE/ILIKE
+6. Si obtienes un error, analízalo y genera una nueva consulta corregida
+7. Responde siempre en español y de forma clara para dueños de negocio
 
 KPIs PREDEFINIDOS DISPONIBLES:
-{kpi_descriptions}
+{kpi_descriptions}"""
 
-Pregunta del usuario: """ + question
 
+def build_initial_state(question: str) -> Dict[str, Any]:
+    """Estado inicial del grafo: esquema relevante + pregunta (el prompt estático lo agrega el preludio)"""
+    prelude = _lazy_components.get("prelude")
+    if prelude is not None:
+        record_question(prelude)
     initial_state = {
         "question": question,
         "messages": [
-            SystemMessage(content=initial_system_message),
+            SystemMessage(content=f"ESQUEMA:\n{build_schema_context(question)}"),
             HumanMessage(content=question)
         ],
         "sql_query": None,
         "execution_success": None,
         "result_rows": None,
+        "result_set": None,
         "final_response": None,
         "insights_analysis": None,
-        "attempt_count": 0
+        "attempt_count": 0,
+        "budget": new_budget(),
     }
+    return initial_state
+
+
+def _process_question_uncached(question: str, graph) -> Dict[str, Any]:
+    """Procesa una pregunta usando el grafo ReAct real"""
+    
+    # ⚡ KPI conocido: SQL registrado directo + una sola llamada al LLM
+    fast_result = try_fast_path(question, KPI_REGISTRY, _run_kpi_rows, _lazy_components.get('llm'))
+    if fast_result:
+        return fast_result
+    
+    initial_state = build_initial_state(question)
     
     print(f"\n💬 '{question}'")
     print("-" * 60)
     print("🔄 Iniciando ciclo ReAct REAL con tool calling...")
     
     try:
-        # Aplicar límite de iteraciones manualmente si es necesario
-        final_state = graph.invoke(initial_state)
+        # recursion_limit es el tope duro; el presupuesto del estado corta antes
+        final_state = graph.invoke(initial_state, config=graph_config())
         
         # Extraer la respuesta final del último mensaje
         messages = final_state.get("messages", [])
@@ -538,7 +709,19 @@ Pregunta del usuario: """ + question
         return {
             'response': final_response,
             'messages': messages,
-            'attempts': final_state.get('attempt_count', 0)
+            'attempts': final_state.get('attempt_count', 0),
+            'sql_query': final_state.get('sql_query'),
+            'result_rows': final_state.get('result_rows'),
+            'budget': initial_state["budget"].summary(),
+        }
+    except GraphRecursionError:
+        record_recursion_limit()
+        print(f"⏳ recursion_limit alcanzado ({initial_state['budget'].describe()})")
+        return {
+            'response': "No alcancé a completar el análisis dentro del límite de pasos. Intenta acotar la pregunta.",
+            'messages': [],
+            'attempts': 0,
+            'budget': initial_state["budget"].summary(),
         }
     except Exception as e:
         error_msg = f"Error en proceso ReAct: {str(e)}"
@@ -558,12 +741,19 @@ def main():
     logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(message)s', datefmt='%H:%M:%S')
     
     try:
-        api_key = setup_environment()
-        if not verify_openai_connection(api_key):
-            raise ConnectionError("OpenAI no disponible")
-        
-        llm = ChatOpenAI(model="gpt-4o", temperature=0, max_tokens=1500)
-        db = create_database_connection()
+        if AGENT_OFFLINE:
+            # 📴 Sin red: ambos tiers del router desde el cassette y la BD local (DuckDB / Postgres)
+            llm, small_llm, db = offline_components()
+            schema_cache.path = OFFLINE_SCHEMA_CACHE_PATH
+        else:
+            api_key = setup_environment()
+            if not verify_openai_connection(api_key):
+                raise ConnectionError("OpenAI no disponible")
+            
+            # 📼 Con LLM_CASSETTE=record cada llamada queda grabada para reproducirla offline
+            llm = cassette_llm(ChatOpenAI(model=ROUTER_LARGE_MODEL, temperature=0, max_tokens=1500))
+            small_llm = cassette_llm(create_small_llm())
+            db = create_database_connection()
         
         print("\n" + "="*70)
         print("🚀 AGENTE SQL LANGGRAPH v5.0 - REACT REAL CON TOOL CALLING")
@@ -581,12 +771,14 @@ def main():
             print(f"   • {kpi_name}: {kpi_info['description']}")
         
         # Crear grafo ReAct real
-        graph = create_react_graph_real(llm, db)
+        graph = create_react_graph_real(llm, db, small_llm)
         print("\n⚡ Listo para consultas SQL con arquitectura ReAct REAL")
         
+        streaming = os.getenv("AGENT_STREAMING", "1") == "1"
         while True:
             q = input("\n💬 Bolsillo > ").strip()
             if q.lower() in ['salir', 'exit', 'q']: 
+                print_agent_stats()
                 break
             if not q: 
                 continue
@@ -599,16 +791,28 @@ def main():
                     print(f"     Palabras clave: {', '.join(kpi_info['keywords'])}")
                 continue
             
+            if q.lower() == '/stream':
+                streaming = not streaming
+                print(f"\n📡 Streaming {'activado' if streaming else 'desactivado'}")
+                continue
+            
+            if q.lower() == '/cache':
+                print_agent_stats()
+                continue
+            
             if q.lower() == '/schema':
                 schema = get_database_schema(db)
                 print(f"\n🗃️ ESQUEMA TÉCNICO:\n{schema}")
                 continue
             
-            result = process_question_react(q, graph)
-            print("\n" + "="*70)
-            print("🤖 RESPUESTA FINAL")
-            print("="*70)
-            print(result['response'])
+            if streaming:
+                result = print_stream(stream_question_react(q, graph))
+            else:
+                result = process_question_react(q, graph)
+                print("\n" + "="*70)
+                print("🤖 RESPUESTA FINAL")
+                print("="*70)
+                print(result['response'])
             
             # Mostrar detalles si se desea
             show_details = input("\n¿Ver detalles del proceso? (s/n): ").strip().lower()
@@ -621,6 +825,11 @@ def main():
             
             if result.get('attempts', 0) > 0:
                 print(f"\n🔄 Intentos: {result['attempts']}")
+            if result.get('cache'):
+                print(f"\n💾 Desde caché ({result['cache']['method']}), ahorro ~{result['cache']['latency_saved_ms'] / 1000:.1f}s | {answer_cache.format_stats()}")
+            if result.get('fast_path'):
+                fp = result['fast_path']
+                print(f"\n⚡ Ruta rápida: {fp['kpi']} ({fp['method']}, {fp['total_ms']:.0f} ms, narrativa {fp['narrative']})")
     
     except Exception as e:
         print(f"\n❌ Error crítico: {e}")
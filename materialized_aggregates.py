@@ -0,0 +1,401 @@
+import argparse
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from etl_control import bump_data_version, ensure_control_schema
+
+# ========================================================================
+# AGREGADOS MATERIALIZADOS DEL MODELO ESTRELLA
+# ========================================================================
+# Cada agregado guarda medidas aditivas por fecha_key / sede_sk calculadas
+# una sola vez desde dw.fact_ventas / dw.fact_transacciones (ya tipados),
+# de modo que las rutas solo suman filas pequeñas en lugar de recalcular
+# CAST + ILIKE + COUNT(DISTINCT) sobre las tablas crudas en cada lectura.
+#
+# El refresco es por partición: se borran y recalculan solo las fechas
+# afectadas por el último lote del ETL (etl.dirty_partitions).
+#
+# Nota: los SQL usan parámetros psycopg2, por eso los comodines van como %%.
+
+# CTE común: líneas del periodo a refrescar y su consolidación por ticket
+_TICKETS_CTE = """
+    lineas AS (
+        SELECT
+            fv.id_transaccion,
+            fv.fecha_key,
+            fv.sede_sk,
+            fv.producto_sk,
+            fv.cantidad,
+            fv.precio_bruto,
+            fv.precio_neto,
+            LOWER(TRIM(COALESCE(dp.descripcion, ''))) IN ('tip', 'propina') AS es_propina,
+            (COALESCE(dp.descripcion, '') ILIKE '%%tip%%'
+             OR COALESCE(dp.descripcion, '') ILIKE '%%propina%%') AS excluida_venta,
+            COALESCE(dp.descripcion, '') ILIKE '%%importe personalizado%%' AS es_importe_manual
+        FROM dw.fact_ventas fv
+        LEFT JOIN dw.dim_producto dp ON dp.producto_sk = fv.producto_sk
+        WHERE fv.fecha_key IS NOT NULL
+          AND (%(fechas)s::int[] IS NULL OR fv.fecha_key = ANY(%(fechas)s::int[]))
+    ),
+    tickets AS (
+        SELECT
+            id_transaccion,
+            fecha_key,
+            MAX(sede_sk) AS sede_sk,
+            SUM(precio_bruto) FILTER (WHERE NOT excluida_venta AND precio_bruto > 0) AS venta_bruta,
+            SUM(precio_neto) FILTER (WHERE NOT excluida_venta AND precio_bruto > 0) AS venta_neta,
+            COUNT(*) FILTER (WHERE NOT excluida_venta AND NOT es_importe_manual AND precio_bruto > 0) AS items,
+            SUM(precio_bruto) FILTER (WHERE NOT excluida_venta AND NOT es_importe_manual AND precio_bruto > 0) AS monto_items,
+            SUM(precio_neto) FILTER (WHERE es_propina) AS propina
+        FROM lineas
+        GROUP BY id_transaccion, fecha_key
+    )
+"""
+
+AGGREGATES = {
+    "agg_tickets_dia_sede": {
+        "description": "Tickets, ventas, comisiones, propinas y tamaño de boleta por día y sede",
+        "replaces": [
+            "bi.vw_dashboard_resumen", "bi.vw_analisis_propinas",
+            "semantic.sales_overview", "semantic.tips_analysis", "semantic.purchase_behavior",
+        ],
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS bi.agg_tickets_dia_sede (
+                fecha_key INTEGER NOT NULL,
+                sede_sk INTEGER,
+                transacciones BIGINT NOT NULL,
+                venta_bruta NUMERIC(14,2) NOT NULL,
+                venta_neta NUMERIC(14,2) NOT NULL,
+                comisiones NUMERIC(14,2) NOT NULL,
+                transacciones_exitosas BIGINT NOT NULL,
+                transacciones_con_propina BIGINT NOT NULL,
+                propinas_totales NUMERIC(14,2) NOT NULL,
+                tickets_un_item BIGINT NOT NULL,
+                tickets_multi_item BIGINT NOT NULL,
+                monto_tickets_un_item NUMERIC(14,2) NOT NULL,
+                monto_tickets_multi_item NUMERIC(14,2) NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_agg_tickets_dia_sede_fecha ON bi.agg_tickets_dia_sede (fecha_key);
+        """,
+        "refresh_sql": """
+            INSERT INTO bi.agg_tickets_dia_sede
+            WITH """ + _TICKETS_CTE + """
+            SELECT
+                t.fecha_key,
+                t.sede_sk,
+                COUNT(*) FILTER (WHERE t.venta_bruta > 0),
+                COALESCE(SUM(t.venta_bruta), 0),
+                COALESCE(SUM(t.venta_neta), 0),
+                COALESCE(SUM(ft.comision) FILTER (WHERE t.venta_bruta > 0), 0),
+                COUNT(*) FILTER (WHERE LOWER(COALESCE(ft.estado, '')) = 'exitosa'),
+                COUNT(*) FILTER (WHERE LOWER(COALESCE(ft.estado, '')) = 'exitosa' AND t.propina IS NOT NULL),
+                COALESCE(SUM(t.propina) FILTER (WHERE LOWER(COALESCE(ft.estado, '')) = 'exitosa'), 0),
+                COUNT(*) FILTER (WHERE LOWER(COALESCE(ft.estado, '')) = 'exitosa' AND t.items = 1),
+                COUNT(*) FILTER (WHERE LOWER(COALESCE(ft.estado, '')) = 'exitosa' AND t.items > 1),
+                COALESCE(SUM(t.monto_items) FILTER (WHERE LOWER(COALESCE(ft.estado, '')) = 'exitosa' AND t.items = 1), 0),
+                COALESCE(SUM(t.monto_items) FILTER (WHERE LOWER(COALESCE(ft.estado, '')) = 'exitosa' AND t.items > 1), 0)
+            FROM tickets t
+            LEFT JOIN dw.fact_transacciones ft ON ft.id_transaccion = t.id_transaccion
+            GROUP BY t.fecha_key, t.sede_sk
+        """,
+    },
+    "agg_horas_dia_sede": {
+        "description": "Tickets y venta bruta por día, sede y hora",
+        "replaces": [
+            "bi.vw_horas_pico", "semantic.peak_hours", "semantic.hourly_sales", "semantic.busy_hours",
+        ],
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS bi.agg_horas_dia_sede (
+                fecha_key INTEGER NOT NULL,
+                sede_sk INTEGER,
+                hora SMALLINT NOT NULL,
+                transacciones BIGINT NOT NULL,
+                venta_bruta NUMERIC(14,2) NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_agg_horas_dia_sede_fecha ON bi.agg_horas_dia_sede (fecha_key);
+        """,
+        "refresh_sql": """
+            INSERT INTO bi.agg_horas_dia_sede
+            WITH """ + _TICKETS_CTE + """
+            SELECT
+                t.fecha_key,
+                t.sede_sk,
+                EXTRACT(HOUR FROM ft.fecha_transaccion)::SMALLINT,
+                COUNT(*),
+                COALESCE(SUM(t.venta_bruta), 0)
+            FROM tickets t
+            JOIN dw.fact_transacciones ft ON ft.id_transaccion = t.id_transaccion
+            WHERE t.venta_bruta > 0
+              AND ft.fecha_transaccion IS NOT NULL
+            GROUP BY 1, 2, 3
+        """,
+    },
+    "agg_pago_dia_sede": {
+        "description": "Tickets, ventas y comisiones por día, sede y medio de pago",
+        "replaces": ["bi.vw_comportamiento_pago", "semantic.payment_methods"],
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS bi.agg_pago_dia_sede (
+                fecha_key INTEGER NOT NULL,
+                sede_sk INTEGER,
+                medio_pago VARCHAR(20) NOT NULL,
+                transacciones BIGINT NOT NULL,
+                ventas NUMERIC(14,2) NOT NULL,
+                comision NUMERIC(14,2) NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_agg_pago_dia_sede_fecha ON bi.agg_pago_dia_sede (fecha_key);
+        """,
+        "refresh_sql": """
+            INSERT INTO bi.agg_pago_dia_sede
+            WITH """ + _TICKETS_CTE + """,
+            ejecucion AS (
+                SELECT DISTINCT ON (t."ID_de_transacción")
+                    t."ID_de_transacción" AS id_transaccion,
+                    t."Ejecutar_como" AS ejecutar_como
+                FROM public.transacciones t
+                WHERE LOWER(COALESCE(t."Estado", '')) IN ('exitosa', 'pagado')
+                  AND t."ID_de_transacción" IN (SELECT id_transaccion FROM tickets)
+                ORDER BY t."ID_de_transacción", t."Ejecutar_como" NULLS LAST
+            )
+            SELECT
+                t.fecha_key,
+                t.sede_sk,
+                CASE
+                    WHEN UPPER(COALESCE(e.ejecutar_como, '')) IN ('DEBIT', 'DEBITO') THEN 'Débito'
+                    WHEN UPPER(COALESCE(e.ejecutar_como, '')) IN ('CREDIT', 'CREDITO') THEN 'Crédito'
+                    ELSE 'Efectivo'
+                END,
+                COUNT(*),
+                SUM(t.venta_bruta),
+                COALESCE(SUM(ft.comision), 0)
+            FROM tickets t
+            JOIN ejecucion e ON e.id_transaccion = t.id_transaccion
+            LEFT JOIN dw.fact_transacciones ft ON ft.id_transaccion = t.id_transaccion
+            WHERE t.venta_bruta > 0
+            GROUP BY 1, 2, 3
+        """,
+    },
+    "agg_productos_dia_sede": {
+        "description": "Unidades, ventas y tickets por día, sede y producto",
+        "replaces": ["bi.vw_productos_top", "semantic.top_products", "semantic.top_products_alternative"],
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS bi.agg_productos_dia_sede (
+                fecha_key INTEGER NOT NULL,
+                sede_sk INTEGER,
+                producto_sk INTEGER,
+                unidades NUMERIC(14,2) NOT NULL,
+                ventas_brutas NUMERIC(14,2) NOT NULL,
+                tickets BIGINT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_agg_productos_dia_sede_fecha ON bi.agg_productos_dia_sede (fecha_key);
+        """,
+        "refresh_sql": """
+            INSERT INTO bi.agg_productos_dia_sede
+            WITH """ + _TICKETS_CTE + """
+            SELECT
+                fecha_key,
+                sede_sk,
+                producto_sk,
+                COALESCE(SUM(cantidad), 0),
+                SUM(precio_bruto),
+                COUNT(DISTINCT id_transaccion)
+            FROM lineas
+            WHERE NOT excluida_venta
+              AND NOT es_importe_manual
+              AND precio_bruto > 0
+            GROUP BY 1, 2, 3
+        """,
+    },
+    "agg_visitas_tarjeta_dia": {
+        "description": "Presencia diaria de cada tarjeta por sede (base de fidelidad mensual)",
+        "replaces": ["bi.vw_fidelidad_clientes", "semantic.customer_loyalty"],
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS bi.agg_visitas_tarjeta_dia (
+                fecha_key INTEGER NOT NULL,
+                sede_sk INTEGER,
+                ultimos_4_digitos VARCHAR(4) NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_agg_visitas_tarjeta_dia_fecha ON bi.agg_visitas_tarjeta_dia (fecha_key);
+        """,
+        "refresh_sql": """
+            INSERT INTO bi.agg_visitas_tarjeta_dia
+            WITH """ + _TICKETS_CTE + """
+            SELECT DISTINCT
+                t.fecha_key,
+                t.sede_sk,
+                dt.ultimos_4_digitos
+            FROM tickets t
+            JOIN dw.fact_transacciones ft ON ft.id_transaccion = t.id_transaccion
+            JOIN dw.dim_tarjeta dt ON dt.tarjeta_sk = ft.tarjeta_sk
+            WHERE LOWER(COALESCE(ft.estado, '')) = 'exitosa'
+              AND COALESCE(dt.ultimos_4_digitos, '') != ''
+        """,
+    },
+}
+
+# Frescura de los agregados, expuesta por /api/sales/freshness
+FRESHNESS_QUERY = """
+SELECT
+    s.aggregate_name,
+    s.refreshed_at,
+    s.data_version,
+    s.full_refresh,
+    s.partitions_refreshed,
+    s.rows_written,
+    s.duration_ms,
+    EXTRACT(EPOCH FROM now() - s.refreshed_at)::BIGINT AS segundos_desde_refresco,
+    (SELECT COUNT(*) FROM etl.dirty_partitions) AS particiones_pendientes,
+    (SELECT MIN(marked_at) FROM etl.dirty_partitions) AS pendiente_desde
+FROM etl.materialization_status s
+ORDER BY s.aggregate_name;
+"""
+
+
+def create_aggregate_tables(cursor) -> None:
+    """Crea schema de control y tablas de agregados (idempotente)"""
+    ensure_control_schema(cursor)
+    cursor.execute("CREATE SCHEMA IF NOT EXISTS bi;")
+    for agg in AGGREGATES.values():
+        cursor.execute(agg["ddl"])
+
+
+def mark_dirty_partitions(cursor, fecha_keys: Iterable[int]) -> int:
+    """Registra fechas modificadas por el ETL para el próximo refresco"""
+    fecha_keys = sorted({int(k) for k in fecha_keys if k is not None})
+    if not fecha_keys:
+        return 0
+    cursor.execute(
+        """
+        INSERT INTO etl.dirty_partitions (fecha_key)
+        SELECT UNNEST(%s::int[])
+        ON CONFLICT (fecha_key) DO UPDATE SET marked_at = now()
+        """,
+        (fecha_keys,),
+    )
+    return len(fecha_keys)
+
+
+def refresh_aggregates(
+    conn,
+    fecha_keys: Optional[List[int]] = None,
+    full: bool = False,
+    only: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Refresca los agregados en una sola transacción.
+
+    Args:
+        conn: Conexión psycopg2
+        fecha_keys: Particiones explícitas; si es None se consumen las de etl.dirty_partitions
+        full: Reconstruye todo (TRUNCATE + INSERT)
+        only: Limita el refresco a ciertos agregados (requiere fecha_keys o full)
+
+    Returns:
+        Resumen con filas y duración por agregado
+    """
+    names = only or list(AGGREGATES.keys())
+    unknown = [name for name in names if name not in AGGREGATES]
+    if unknown:
+        raise ValueError(f"Agregados desconocidos: {', '.join(unknown)}")
+    if only and fecha_keys is None and not full:
+        raise ValueError("--solo requiere --fechas o --full para no consumir particiones de otros agregados")
+
+    summary: Dict[str, Any] = {"full": full, "partitions": 0, "aggregates": {}}
+    with conn.cursor() as cursor:
+        if not full and fecha_keys is None:
+            cursor.execute("DELETE FROM etl.dirty_partitions RETURNING fecha_key")
+            fecha_keys = sorted(row[0] for row in cursor.fetchall())
+            if not fecha_keys:
+                conn.rollback()
+                print("✅ Agregados al día: no hay particiones pendientes")
+                return summary
+        elif fecha_keys is not None:
+            # Las particiones refrescadas explícitamente dejan de estar pendientes
+            cursor.execute("DELETE FROM etl.dirty_partitions WHERE fecha_key = ANY(%s::int[])", (fecha_keys,))
+
+        summary["partitions"] = 0 if full else len(fecha_keys)
+        params = {"fechas": None if full else fecha_keys}
+        data_version = bump_data_version(cursor, "materialized_aggregates")
+
+        for name in names:
+            agg = AGGREGATES[name]
+            start = time.perf_counter()
+            if full:
+                cursor.execute(f"TRUNCATE bi.{name}")
+            else:
+                cursor.execute(f"DELETE FROM bi.{name} WHERE fecha_key = ANY(%s::int[])", (fecha_keys,))
+            cursor.execute(agg["refresh_sql"], params)
+            rows_written = cursor.rowcount
+            duration_ms = int((time.perf_counter() - start) * 1000)
+
+            cursor.execute(
+                """
+                INSERT INTO etl.materialization_status
+                    (aggregate_name, refreshed_at, data_version, full_refresh, partitions_refreshed, rows_written, duration_ms)
+                VALUES (%s, now(), %s, %s, %s, %s, %s)
+                ON CONFLICT (aggregate_name) DO UPDATE SET
+                    refreshed_at = EXCLUDED.refreshed_at,
+                    data_version = EXCLUDED.data_version,
+                    full_refresh = EXCLUDED.full_refresh,
+                    partitions_refreshed = EXCLUDED.partitions_refreshed,
+                    rows_written = EXCLUDED.rows_written,
+                    duration_ms = EXCLUDED.duration_ms
+                """,
+                (name, data_version, full, summary["partitions"], rows_written, duration_ms),
+            )
+            summary["aggregates"][name] = {"rows": rows_written, "duration_ms": duration_ms}
+            print(f"   • bi.{name}: {rows_written} filas en {duration_ms} ms")
+
+    conn.commit()
+    summary["data_version"] = data_version
+    return summary
+
+
+def main():
+    from db_pool import get_sync_connection
+
+    parser = argparse.ArgumentParser(description="Agregados materializados del modelo estrella")
+    subparsers = parser.add_subparsers(dest="accion", required=True)
+
+    subparsers.add_parser("init", help="Crear tablas de agregados y de control")
+
+    refresh_parser = subparsers.add_parser("refresh", help="Refrescar particiones pendientes")
+    refresh_parser.add_argument("--full", action="store_true", help="Reconstruir todos los agregados")
+    refresh_parser.add_argument("--fechas", nargs="+", type=int, help="fecha_key específicas (YYYYMMDD)")
+    refresh_parser.add_argument("--solo", nargs="+", choices=list(AGGREGATES.keys()), help="Refrescar solo estos agregados")
+
+    subparsers.add_parser("status", help="Mostrar frescura de cada agregado")
+
+    args = parser.parse_args()
+
+    conn = get_sync_connection()
+    try:
+        if args.accion == "init":
+            with conn.cursor() as cursor:
+                create_aggregate_tables(cursor)
+            conn.commit()
+            print(f"✅ {len(AGGREGATES)} agregados creados en schema bi")
+
+        elif args.accion == "refresh":
+            start = time.perf_counter()
+            modo = "completo" if args.full else (f"{len(args.fechas)} fechas" if args.fechas else "particiones pendientes")
+            print(f"🔄 Refrescando agregados ({modo})...")
+            summary = refresh_aggregates(conn, fecha_keys=args.fechas, full=args.full, only=args.solo)
+            if summary["aggregates"]:
+                print(f"✅ Refresco completado en {time.perf_counter() - start:.2f}s "
+                      f"(versión de datos {summary['data_version']})")
+
+        else:
+            with conn.cursor() as cursor:
+                cursor.execute(FRESHNESS_QUERY)
+                rows = cursor.fetchall()
+            if not rows:
+                print("⚠️ Ningún agregado refrescado todavía")
+            for row in rows:
+                print(f"   • {row[0]}: refrescado {row[1]:%Y-%m-%d %H:%M} "
+                      f"({row[7]}s atrás, versión {row[2]}, {row[5]} filas) | pendientes: {row[8]}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
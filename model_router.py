@@ -0,0 +1,320 @@
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from agent_budget import BUDGET_KPI_THRESHOLD
+from agent_prelude import AgentPrelude, compile_prelude, record_turn
+from kpi_fast_path import match_kpi, normalize_question
+
+# ========================================================================
+# ROUTER DE MODELOS: TIER PEQUEÑO PARA DECISIONES, GRANDE PARA NARRATIVA
+# ========================================================================
+# Antes un solo gpt-4o hacía todo: elegir KPI, reintentar tras SQL_ERROR,
+# corregir formato y redactar la explicación final. Ahora cada llamada del
+# grafo se clasifica en un paso y ROUTING_RULES decide el tier:
+#   kpi_selection, sql_simple, sql_retry, format_correction → small
+#   sql_synthesis (pregunta compleja), final_answer          → large
+# Si el modelo pequeño responde con baja confianza (tool desconocida, SQL que
+# no pasa el validador, KPI inexistente, formato inválido, respuesta truncada
+# o intenta redactar la respuesta final) se repite la llamada con el grande.
+#
+#   ROUTER_SMALL_MODEL=""                           → sin router (todo al grande)
+#   ROUTER_RULES="sql_retry=large,sql_simple=large" → sobrescribe reglas
+ROUTER_SMALL_MODEL = os.getenv("ROUTER_SMALL_MODEL", "gpt-4o-mini")
+ROUTER_LARGE_MODEL = os.getenv("ROUTER_LARGE_MODEL", "gpt-4o")
+
+TIERS = ("small", "large")
+DEFAULT_ROUTING_RULES = {
+    "kpi_selection": "small",
+    "sql_simple": "small",
+    "sql_retry": "small",
+    "format_correction": "small",
+    "sql_synthesis": "large",
+    "final_answer": "large",
+}
+
+# USD por millón de tokens (entrada, salida); ROUTER_PRICE_<MODELO>="entrada,salida" los sobrescribe
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+
+# Preguntas que piden SQL con varias agregaciones, comparaciones o ventanas
+COMPLEX_SQL_PATTERNS = [
+    r"\b(compar|versus|vs\b|frente a|tendencia|evolucion|crecimiento|variacion|caida)\w*",
+    r"\b(porcentaje|proporcion|participacion|ranking|acumulad|correlacion|cohorte|estacional)\w*",
+    r"\b(por que|explica|predic|proyecc|mes a mes|semana a semana|respecto)\w*",
+]
+_COMPLEX_RE = [re.compile(p) for p in COMPLEX_SQL_PATTERNS]
+# Dos o más "por <dimensión>" → agrupación múltiple
+_GROUP_BY_RE = re.compile(r"\bpor\s+\w+")
+
+_stats_lock = threading.Lock()
+router_stats: Dict[str, Any] = {
+    "tiers": {tier: {"calls": 0, "ms": 0.0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0} for tier in TIERS},
+    "steps": {},
+    "escalations": 0,
+    "escalation_reasons": {},
+}
+
+
+def _parse_rules(raw: str) -> Dict[str, str]:
+    reglas = {}
+    for parte in raw.split(","):
+        if "=" not in parte:
+            continue
+        step, tier = (p.strip() for p in parte.split("=", 1))
+        if tier in TIERS:
+            reglas[step] = tier
+        else:
+            print(f"⚠️ ROUTER_RULES: tier desconocido '{tier}' para '{step}' (se ignora)")
+    return reglas
+
+
+ROUTING_RULES = {**DEFAULT_ROUTING_RULES, **_parse_rules(os.getenv("ROUTER_RULES", ""))}
+
+
+def model_prices(model: Optional[str]) -> tuple:
+    override = os.getenv(f"ROUTER_PRICE_{(model or '').upper().replace('-', '_').replace('.', '_')}")
+    if override:
+        try:
+            entrada, salida = (float(v) for v in override.split(","))
+            return entrada, salida
+        except ValueError:
+            print(f"⚠️ Precio inválido para {model}: {override}")
+    return MODEL_PRICES.get(model or "", (0.0, 0.0))
+
+
+def create_small_llm(max_tokens: int = 1500):
+    """ChatOpenAI del tier pequeño, o None si ROUTER_SMALL_MODEL está vacío"""
+    if not ROUTER_SMALL_MODEL:
+        return None
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(model=ROUTER_SMALL_MODEL, temperature=0, max_tokens=max_tokens)
+
+
+# ========================================================================
+# CLASIFICACIÓN DEL PASO
+# ========================================================================
+def is_complex_question(question: str) -> bool:
+    normalizada = normalize_question(question)
+    if any(patron.search(normalizada) for patron in _COMPLEX_RE):
+        return True
+    return len(_GROUP_BY_RE.findall(normalizada)) >= 2
+
+
+def classify_step(state: Dict[str, Any], decision: str = "continue",
+                  registry: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+    """
+    Paso del grafo según el estado: qué tipo de decisión toma la próxima llamada.
+
+    Args:
+        decision: plan() del presupuesto; "final" fuerza la respuesta final
+        registry: KPI_REGISTRY para reconocer preguntas que resuelve get_kpi_sql
+    """
+    if decision == "final":
+        return "final_answer"
+    result_set = state.get("result_set")
+    if state.get("execution_success") and result_set is not None:
+        # Con filas solo queda explicar; sin filas hay que reformular la consulta
+        return "final_answer" if result_set.rows else "sql_retry"
+    if state.get("attempt_count", 0) > 0 and state.get("execution_success") is False:
+        return "sql_retry"
+    question = state.get("question", "")
+    if is_complex_question(question):
+        return "sql_synthesis"
+    if registry and match_kpi(question, registry, threshold=BUDGET_KPI_THRESHOLD):
+        return "kpi_selection"
+    return "sql_simple"
+
+
+# ========================================================================
+# ROUTER
+# ========================================================================
+@dataclass
+class ModelRouter:
+    """Un AgentPrelude por tier + reglas de ruteo y chequeo de confianza"""
+    preludes: Dict[str, AgentPrelude]
+    models: Dict[str, str]
+    rules: Dict[str, str] = field(default_factory=lambda: dict(ROUTING_RULES))
+    kpi_names: Sequence[str] = ()
+    sql_check: Optional[Callable[[str], Optional[str]]] = None
+
+    @property
+    def prelude(self) -> AgentPrelude:
+        """Preludio del tier grande (tools, mensajes y respaldo)"""
+        return self.preludes["large"]
+
+    def tier_for(self, step: str) -> str:
+        tier = self.rules.get(step, "large")
+        return tier if tier in self.preludes else "large"
+
+    # --- Confianza ------------------------------------------------------
+    def assess(self, response: Any, step: str) -> Optional[str]:
+        """Motivo de baja confianza en la respuesta del tier pequeño, o None si sirve"""
+        if isinstance(response, dict):
+            # with_structured_output(include_raw=True) → {"raw", "parsed", "parsing_error"}
+            parsed = response.get("parsed")
+            if parsed is None:
+                return "salida estructurada inválida"
+            if parsed.action == "final_answer":
+                # La narrativa final es del tier grande salvo que las reglas digan otra cosa
+                return None if step == "final_answer" else "respuesta final"
+            calls = [{"name": parsed.action, "args": {"query": parsed.query, "kpi_name": parsed.kpi_name}}]
+            raw = response.get("raw")
+        else:
+            calls = getattr(response, "tool_calls", None) or []
+            raw = response
+            if not calls:
+                if not (getattr(raw, "content", "") or "").strip():
+                    return "respuesta vacía"
+                return None if step == "final_answer" else "respuesta final"
+
+        if ((getattr(raw, "response_metadata", None) or {}).get("finish_reason")) == "length":
+            return "respuesta truncada"
+        tool_names = {t.name for t in self.prelude.tools}
+        for call in calls:
+            args = call.get("args") or {}
+            if call["name"] not in tool_names:
+                return f"tool desconocida ({call['name']})"
+            if call["name"] == "execute_sql":
+                query = (args.get("query") or "").strip()
+                if not query:
+                    return "execute_sql sin query"
+                error = self.sql_check(query) if self.sql_check else None
+                if error:
+                    return "SQL inválido"
+            if call["name"] == "get_kpi_sql" and self.kpi_names and args.get("kpi_name") not in self.kpi_names:
+                return f"KPI inexistente ({args.get('kpi_name')})"
+        return None
+
+    # --- Invocación -----------------------------------------------------
+    def invoke(self, step: str, messages: List[Any], kind: str = "bound",
+               check: Optional[Callable[[Any], Optional[str]]] = None, budget=None) -> Any:
+        """
+        Llama al tier del paso; si el pequeño responde con baja confianza, repite con el grande.
+
+        Args:
+            kind: "bound" (tools), "final" (tool_choice="none"), "structured" (ReActStep) o "llm" (sin tools)
+            check: chequeo de confianza propio (por defecto assess)
+            budget: AgentBudget al que se cobra cada llamada
+        """
+        tier = self.tier_for(step)
+        response = self._call(tier, step, kind, messages, budget)
+        reason = self._low_confidence(tier, step, response, check)
+        if reason:
+            self._record_escalation(step, reason)
+            response = self._call("large", step, kind, messages, budget)
+        return response
+
+    async def ainvoke(self, step: str, messages: List[Any], kind: str = "bound",
+                      check: Optional[Callable[[Any], Optional[str]]] = None, budget=None) -> Any:
+        """invoke con ainvoke del modelo"""
+        tier = self.tier_for(step)
+        response = await self._acall(tier, step, kind, messages, budget)
+        reason = self._low_confidence(tier, step, response, check)
+        if reason:
+            self._record_escalation(step, reason)
+            response = await self._acall("large", step, kind, messages, budget)
+        return response
+
+    def _runnable(self, tier: str, kind: str):
+        prelude = self.preludes[tier]
+        return {"bound": prelude.bound_llm, "final": prelude.final_llm,
+                "structured": prelude.structured_llm, "llm": prelude.llm}[kind]
+
+    def _call(self, tier: str, step: str, kind: str, messages: List[Any], budget) -> Any:
+        start = time.perf_counter()
+        response = self._runnable(tier, kind).invoke(messages)
+        self._record_call(tier, step, response, (time.perf_counter() - start) * 1000, budget)
+        return response
+
+    async def _acall(self, tier: str, step: str, kind: str, messages: List[Any], budget) -> Any:
+        start = time.perf_counter()
+        response = await self._runnable(tier, kind).ainvoke(messages)
+        self._record_call(tier, step, response, (time.perf_counter() - start) * 1000, budget)
+        return response
+
+    def _low_confidence(self, tier: str, step: str, response: Any,
+                        check: Optional[Callable[[Any], Optional[str]]]) -> Optional[str]:
+        if tier != "small":
+            return None
+        return check(response) if check is not None else self.assess(response, step)
+
+    # --- Métricas -------------------------------------------------------
+    def _record_call(self, tier: str, step: str, response: Any, ms: float, budget) -> None:
+        raw = response.get("raw") if isinstance(response, dict) else response
+        record_turn(self.preludes[tier], raw)
+        if budget is not None:
+            budget.charge_llm(raw)
+        usage = getattr(raw, "usage_metadata", None) or {}
+        entrada, salida = int(usage.get("input_tokens", 0)), int(usage.get("output_tokens", 0))
+        precio_entrada, precio_salida = model_prices(self.models.get(tier))
+        with _stats_lock:
+            stats = router_stats["tiers"][tier]
+            stats["calls"] += 1
+            stats["ms"] += ms
+            stats["input_tokens"] += entrada
+            stats["output_tokens"] += salida
+            stats["cost_usd"] += (entrada * precio_entrada + salida * precio_salida) / 1_000_000
+            pasos = router_stats["steps"].setdefault(step, {tier: 0 for tier in TIERS})
+            pasos[tier] += 1
+        print(f"🔀 Router: {step} → {tier} ({self.models.get(tier)}) {ms:.0f} ms")
+
+    @staticmethod
+    def _record_escalation(step: str, reason: str) -> None:
+        with _stats_lock:
+            router_stats["escalations"] += 1
+            router_stats["escalation_reasons"][reason] = router_stats["escalation_reasons"].get(reason, 0) + 1
+        print(f"⬆️ Router: baja confianza del modelo pequeño en {step} ({reason}) → modelo grande")
+
+
+def _model_name(llm) -> Optional[str]:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None)
+
+
+def compile_router(llm, small_llm, tools: Sequence[Any], render_static_prompt, structured_schema=None,
+                   kpi_names: Sequence[str] = (), sql_check: Optional[Callable[[str], Optional[str]]] = None) -> ModelRouter:
+    """
+    Compila un preludio por tier (mismo prompt estático y tools) y arma el router.
+
+    Args:
+        llm: modelo grande (respuesta final, SQL complejo y respaldo)
+        small_llm: modelo pequeño, o None para enviar todo al grande
+        sql_check: validador de SQL (None si la consulta es válida) para el chequeo de confianza
+    """
+    large = compile_prelude(llm, tools, render_static_prompt, structured_schema=structured_schema)
+    preludes = {"large": large}
+    models = {"large": _model_name(llm)}
+    if small_llm is not None:
+        # Mismo prefijo ya renderizado: ambos tiers comparten la caché de prefijo del proveedor
+        preludes["small"] = compile_prelude(small_llm, tools, lambda: large.static_prefix.content,
+                                            structured_schema=structured_schema)
+        models["small"] = _model_name(small_llm)
+    router = ModelRouter(preludes=preludes, models=models, kpi_names=list(kpi_names), sql_check=sql_check)
+    reglas = ", ".join(f"{step}={tier}" for step, tier in sorted(router.rules.items()))
+    print(f"🔀 Router de modelos: {' / '.join(f'{t}={m}' for t, m in models.items())} | {reglas}")
+    return router
+
+
+def format_router_stats() -> str:
+    with _stats_lock:
+        tiers = {tier: dict(stats) for tier, stats in router_stats["tiers"].items()}
+        steps = {step: dict(counts) for step, counts in router_stats["steps"].items()}
+        escalations = router_stats["escalations"]
+        reasons = ", ".join(f"{k}: {v}" for k, v in sorted(router_stats["escalation_reasons"].items())) or "—"
+    partes = []
+    for tier, stats in tiers.items():
+        promedio = stats["ms"] / stats["calls"] if stats["calls"] else 0.0
+        partes.append(f"{tier}: {stats['calls']} llamadas, {promedio:.0f} ms prom, "
+                      f"{stats['input_tokens']}+{stats['output_tokens']} tokens, ${stats['cost_usd']:.4f}")
+    pasos = ", ".join(f"{step} {c['small']}s/{c['large']}L" for step, c in sorted(steps.items())) or "—"
+    return (f"🔀 Router: {' | '.join(partes)} | {escalations} escaladas ({reasons})\n"
+            f"   Pasos: {pasos}")
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+# ========================================================================
+# EJECUCIÓN PARALELA DE TOOL CALLS
+# ========================================================================
+# Cuando el LLM pide varios tools en un mismo turno (p. ej. get_kpi_sql de dos
+# KPIs + execute_sql + retrieve_documents) se despachan a la vez y el turno
+# dura lo que el tool más lento, no la suma. Las consultas SQL se limitan con
+# un semáforo para no agotar las conexiones; los demás tools no tienen tope.
+# Cada ToolMessage lleva su duración en response_metadata["duration_ms"].
+AGENT_SQL_MAX_PARALLEL = int(os.getenv("AGENT_SQL_MAX_PARALLEL", "4"))
+AGENT_TOOL_WORKERS = int(os.getenv("AGENT_TOOL_WORKERS", "8"))
+SQL_TOOLS = {"execute_sql"}
+
+_executor = ThreadPoolExecutor(max_workers=AGENT_TOOL_WORKERS, thread_name_prefix="agent-tool")
+_sql_slots = threading.BoundedSemaphore(AGENT_SQL_MAX_PARALLEL)
+
+
+def pending_tool_calls(state: Dict[str, Any]) -> List[Dict[str, Any]]:
+    messages = state.get("messages", [])
+    last = messages[-1] if messages else None
+    if isinstance(last, AIMessage) and last.tool_calls:
+        return list(last.tool_calls)
+    return []
+
+
+def _error_message(tool_call: Dict[str, Any], error: Exception) -> ToolMessage:
+    return ToolMessage(
+        content=f"ERROR: {type(error).__name__}: {error}",
+        tool_call_id=tool_call["id"],
+        name=tool_call["name"],
+        status="error",
+    )
+
+
+def _finish(message: Any, tool_call: Dict[str, Any], start: float) -> ToolMessage:
+    if not isinstance(message, ToolMessage):
+        message = ToolMessage(content=str(message), tool_call_id=tool_call["id"], name=tool_call["name"])
+    message.response_metadata = {**(message.response_metadata or {}),
+                                 "duration_ms": round((time.perf_counter() - start) * 1000, 1)}
+    return message
+
+
+class ParallelToolNode:
+    """Reemplazo de ToolNode que ejecuta en paralelo los tool calls del último AIMessage"""
+
+    def __init__(self, tools: List[Any]):
+        self.tools_by_name = {t.name: t for t in tools}
+
+    def _lookup(self, tool_call: Dict[str, Any]):
+        tool = self.tools_by_name.get(tool_call["name"])
+        if tool is None:
+            available = ", ".join(self.tools_by_name)
+            raise ValueError(f"Tool '{tool_call['name']}' no existe. Disponibles: {available}")
+        return tool
+
+    # --- Síncrono (grafo de main.py / react_agent_rag.py) --------------
+    def _run_one(self, tool_call: Dict[str, Any], config: Optional[Dict[str, Any]]) -> ToolMessage:
+        start = time.perf_counter()
+        try:
+            tool = self._lookup(tool_call)
+            if tool_call["name"] in SQL_TOOLS:
+                with _sql_slots:
+                    message = tool.invoke({**tool_call, "type": "tool_call"}, config)
+            else:
+                message = tool.invoke({**tool_call, "type": "tool_call"}, config)
+        except Exception as e:
+            message = _error_message(tool_call, e)
+        return _finish(message, tool_call, start)
+
+    def __call__(self, state: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        tool_calls = pending_tool_calls(state)
+        if len(tool_calls) > 1:
+            print(f"⚡ Ejecutando {len(tool_calls)} tools en paralelo: {', '.join(tc['name'] for tc in tool_calls)}")
+        if len(tool_calls) == 1:
+            messages = [self._run_one(tool_calls[0], config)]
+        else:
+            # map conserva el orden de los tool calls
+            messages = list(_executor.map(lambda tc: self._run_one(tc, config), tool_calls))
+        return {"messages": messages}
+
+
+class AsyncParallelToolNode(ParallelToolNode):
+    """Variante async: asyncio.gather con semáforo para SQL (agent_async.py)"""
+
+    def __init__(self, tools: List[Any], sql_max_parallel: int = AGENT_SQL_MAX_PARALLEL):
+        super().__init__(tools)
+        self._sql_slots = asyncio.Semaphore(sql_max_parallel)
+
+    async def _arun_one(self, tool_call: Dict[str, Any], config: Optional[Dict[str, Any]]) -> ToolMessage:
+        start = time.perf_counter()
+        try:
+            tool = self._lookup(tool_call)
+            if tool_call["name"] in SQL_TOOLS:
+                async with self._sql_slots:
+                    message = await tool.ainvoke({**tool_call, "type": "tool_call"}, config)
+            else:
+                message = await tool.ainvoke({**tool_call, "type": "tool_call"}, config)
+        except Exception as e:
+            message = _error_message(tool_call, e)
+        return _finish(message, tool_call, start)
+
+    async def __call__(self, state: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        tool_calls = pending_tool_calls(state)
+        if len(tool_calls) > 1:
+            print(f"⚡ Ejecutando {len(tool_calls)} tools en paralelo: {', '.join(tc['name'] for tc in tool_calls)}")
+        messages = await asyncio.gather(*(self._arun_one(tc, config) for tc in tool_calls))
+        return {"messages": list(messages)}
+
+
+def tool_round(messages: List[Any]) -> List[ToolMessage]:
+    """ToolMessages posteriores al último AIMessage (la ronda recién ejecutada)"""
+    ronda: List[ToolMessage] = []
+    for message in reversed(messages):
+        if isinstance(message, ToolMessage):
+            ronda.append(message)
+        else:
+            break
+    return list(reversed(ronda))
+
+
+def tool_call_args(messages: List[Any], tool_call_id: str) -> Dict[str, Any]:
+    """Argumentos con que el LLM pidió el tool call indicado"""
+    for message in reversed(messages):
+        if isinstance(message, AIMessage):
+            for tool_call in message.tool_calls or []:
+                if tool_call["id"] == tool_call_id:
+                    return tool_call.get("args") or {}
+    return {}
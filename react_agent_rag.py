@@ -3,7 +3,8 @@ import os
 import sys
 import json
 import traceback
-from typing import TypedDict, List, Dict, Optional, Any, Union
+import uuid
+from typing import TypedDict, List, Dict, Iterator, Optional, Any, Tuple, Union, Literal
 from enum import Enum
 from datetime import datetime
 
@@ -18,7 +19,7 @@ try:
     from langchain_core.output_parsers import StrOutputParser
     from langchain_core.runnables import RunnablePassthrough
     from langchain_core.prompts import PromptTemplate
-    from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage
+    from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
     from langchain_core.tools import tool
     from langchain_core.utils.function_calling import convert_to_openai_function
 except ImportError:
@@ -28,13 +29,35 @@ except ImportError:
 
 # LangGraph essentials
 from langgraph.graph import StateGraph, END, MessagesState
-from langgraph.prebuilt import ToolNode, tools_condition
+from langgraph.errors import GraphRecursionError
+from langgraph.prebuilt import tools_condition
 from langchain_openai import ChatOpenAI
 
 # Configuración inicial
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from config.environment import setup_environment, verify_openai_connection
 from database import create_database_connection
+from agent_budget import (
+    best_effort_message, final_instruction, format_budget_stats, graph_config, kpi_fallback_match,
+    kpi_fallback_message, new_budget, record_outcome, record_recursion_limit,
+)
+from agent_prelude import format_prelude_stats, record_question
+from agent_streaming import print_stream, stream_answer
+from answer_cache import answer_cache
+from context_budget import format_context_stats
+from etl_control import DATA_VERSION_QUERY, DataVersionPoller
+from kpi_fast_path import try_fast_path
+from llm_cassette import format_cassette_stats
+from model_router import ROUTER_LARGE_MODEL, classify_step, compile_router, create_small_llm, format_router_stats
+from parallel_tools import ParallelToolNode, tool_call_args, tool_round
+from result_encoding import ResultSet, encode_for_llm, format_encoding_stats, parse_result
+from db_pool import QueryTimeoutError
+from sql_cost_gate import AGENT_STATEMENT_TIMEOUT_MS, SQLCostRejected, format_gate_stats, timeout_feedback
+from sql_executor import execute_with_sqldatabase
+from sql_repair import SQLRepairer, catalog_from_records, catalog_query, execute_with_repair, repair_note
+from schema_cache import schema_cache
+from sql_result_cache import fingerprint_sql, sql_result_cache
+from sql_validator import SQLValidator
 
 # ========================================================================
 # KPI REGISTRY (CATÁLOGO OFICIAL DE MÉTRICAS) - VERSIONES LIMPIAS
@@ -44,12 +67,12 @@ from database import create_database_connection
 KPI_REGISTRY = {
     "ventas_por_sede": {
         "description": "Ventas totales por sede excluyendo propinas",
-        "sql_template": '''WITH TransaccionesValidas AS (SELECT DISTINCT "ID de transacción" FROM transacciones WHERE "Estado" IN ('Exitosa', 'Pagado')), ventas_limpias AS (SELECT CASE WHEN iv."Cuenta" ILIKE '%plaza.bolsillo%' OR iv."Cuenta" ILIKE '%Plaza bolsillo%' THEN 'Plaza Bolsillo' WHEN iv."Cuenta" ILIKE '%merced%' THEN 'Merced' WHEN iv."Cuenta" ILIKE '%tajamar%' THEN 'Tajamar' ELSE COALESCE(iv."Cuenta", 'Desconocido') END AS sede, iv."ID de transacción", iv."Precio (Bruto)" AS venta_valor FROM informe_ventas iv INNER JOIN TransaccionesValidas tv ON iv."ID de transacción" = tv."ID de transacción" WHERE iv."Descripción" NOT ILIKE 'Tip' AND iv."Descripción" NOT ILIKE 'Propina' AND iv."Precio (Bruto)" > 0 ) SELECT COALESCE(sede, 'TOTAL GENERAL') AS cuenta, SUM(venta_valor) AS ventas_totales, COUNT(DISTINCT "ID de transacción") AS transacciones, ROUND(SUM(venta_valor) / NULLIF(COUNT(DISTINCT "ID de transacción"), 0), 0) AS ticket_promedio FROM ventas_limpias GROUP BY ROLLUP(sede) ORDER BY (sede IS NULL) ASC, ventas_totales DESC;''',
+        "sql_template": '''WITH TransaccionesValidas AS (SELECT DISTINCT "ID de transacción" FROM transacciones WHERE "Estado" IN ('Exitosa', 'Pagado')), ventas_limpias AS (SELECT iv.sede_sk, iv."ID de transacción", iv."Precio (Bruto)" AS venta_valor FROM informe_ventas iv INNER JOIN TransaccionesValidas tv ON iv."ID de transacción" = tv."ID de transacción" WHERE iv."Descripción" NOT ILIKE 'Tip' AND iv."Descripción" NOT ILIKE 'Propina' AND iv."Precio (Bruto)" > 0 ), por_sede AS (SELECT sede_sk, GROUPING(sede_sk) AS es_total, SUM(venta_valor) AS ventas_totales, COUNT(DISTINCT "ID de transacción") AS transacciones FROM ventas_limpias GROUP BY ROLLUP(sede_sk)) SELECT CASE WHEN ps.es_total = 1 THEN 'TOTAL GENERAL' ELSE COALESCE(ds.nombre_sede, 'Sede No Identificada') END AS cuenta, ps.ventas_totales, ps.transacciones, ROUND(ps.ventas_totales / NULLIF(ps.transacciones, 0), 0) AS ticket_promedio FROM por_sede ps LEFT JOIN dw.dim_sede ds ON ds.sede_sk = ps.sede_sk ORDER BY ps.es_total ASC, ps.ventas_totales DESC;''',
         "keywords": ["ventas por sede", "ventas totales sede", "total ventas por ubicacion"]
     },
     "top_productos": {
         "description": "Top 5 productos más vendidos por sede",
-        "sql_template": '''WITH ventas_sede_producto AS (SELECT CASE WHEN "Cuenta" IN ('Plaza bolsillo', 'plaza.bolsillo@gmail.com') THEN 'Sede Plaza Bolsillo' WHEN "Cuenta" IN ('merced', 'merced.158@gmail.com') THEN 'Sede Merced' WHEN "Cuenta" IN ('Tajamar', 'providencia.tajamar@gmail.com') THEN 'Sede Tajamar' ELSE "Cuenta" END AS sede_unificada, "Descripción" AS producto, SUM("Precio (Bruto)") AS ingresos_producto FROM informe_ventas WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Precio (Bruto)" > 0 GROUP BY 1, 2), ranking_productos AS (SELECT *, ROW_NUMBER() OVER (PARTITION BY sede_unificada ORDER BY ingresos_producto DESC) AS ranking FROM ventas_sede_producto) SELECT * FROM ranking_productos WHERE ranking <= 5 ORDER BY sede_unificada, ranking;''',
+        "sql_template": '''WITH ventas_sede_producto AS (SELECT sede_sk, "Descripción" AS producto, SUM("Precio (Bruto)") AS ingresos_producto FROM informe_ventas WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Precio (Bruto)" > 0 GROUP BY 1, 2), ranking_productos AS (SELECT *, ROW_NUMBER() OVER (PARTITION BY sede_sk ORDER BY ingresos_producto DESC) AS ranking FROM ventas_sede_producto) SELECT COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede_unificada, rp.producto, rp.ingresos_producto, rp.ranking FROM ranking_productos rp LEFT JOIN dw.dim_sede ds ON ds.sede_sk = rp.sede_sk WHERE rp.ranking <= 5 ORDER BY sede_unificada, rp.ranking;''',
         "keywords": ["top productos", "productos mas vendidos", "mejores ventas productos"]
     },
     "medios_pago": {
@@ -59,22 +82,22 @@ KPI_REGISTRY = {
     },
     "analisis_propinas": {
         "description": "Análisis de propinas por sede",
-        "sql_template": '''WITH transacciones_base AS (SELECT DISTINCT t."ID de transacción", CASE WHEN iv."Cuenta" IN ('Plaza bolsillo', 'plaza.bolsillo@gmail.com') THEN 'Sede Plaza Bolsillo' WHEN iv."Cuenta" IN ('merced', 'merced.158@gmail.com') THEN 'Sede Merced' WHEN iv."Cuenta" IN ('Tajamar', 'providencia.tajamar@gmail.com') THEN 'Sede Tajamar' ELSE iv."Cuenta" END AS sede_unificada FROM transacciones t INNER JOIN informe_ventas iv ON t."ID de transacción" = iv."ID de transacción" WHERE t."Estado" = 'Exitosa'), propinas AS (SELECT iv."ID de transacción", SUM(iv."Precio (Neto)") AS monto_propina FROM informe_ventas iv WHERE LOWER(iv."Descripción") = 'tip' GROUP BY iv."ID de transacción") SELECT tb.sede_unificada, COUNT(DISTINCT tb."ID de transacción") AS transacciones_totales, COUNT(DISTINCT p."ID de transacción") AS transacciones_con_propina, ROUND(COUNT(DISTINCT p."ID de transacción")::NUMERIC / NULLIF(COUNT(DISTINCT tb."ID de transacción"), 0) * 100, 2) AS tasa_conversion_propina_pct, SUM(p.monto_propina) AS propinas_totales, ROUND(SUM(p.monto_propina) / NULLIF(COUNT(DISTINCT p."ID de transacción"), 0), 0) AS propina_promedio FROM transacciones_base tb LEFT JOIN propinas p ON tb."ID de transacción" = p."ID de transacción" GROUP BY tb.sede_unificada ORDER BY tasa_conversion_propina_pct DESC;''',
+        "sql_template": '''WITH transacciones_base AS (SELECT DISTINCT t."ID de transacción", iv.sede_sk FROM transacciones t INNER JOIN informe_ventas iv ON t."ID de transacción" = iv."ID de transacción" WHERE t."Estado" = 'Exitosa'), propinas AS (SELECT iv."ID de transacción", SUM(iv."Precio (Neto)") AS monto_propina FROM informe_ventas iv WHERE LOWER(iv."Descripción") = 'tip' GROUP BY iv."ID de transacción") SELECT COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede_unificada, COUNT(DISTINCT tb."ID de transacción") AS transacciones_totales, COUNT(DISTINCT p."ID de transacción") AS transacciones_con_propina, ROUND(COUNT(DISTINCT p."ID de transacción")::NUMERIC / NULLIF(COUNT(DISTINCT tb."ID de transacción"), 0) * 100, 2) AS tasa_conversion_propina_pct, SUM(p.monto_propina) AS propinas_totales, ROUND(SUM(p.monto_propina) / NULLIF(COUNT(DISTINCT p."ID de transacción"), 0), 0) AS propina_promedio FROM transacciones_base tb LEFT JOIN propinas p ON tb."ID de transacción" = p."ID de transacción" LEFT JOIN dw.dim_sede ds ON ds.sede_sk = tb.sede_sk GROUP BY tb.sede_sk, ds.nombre_sede ORDER BY tasa_conversion_propina_pct DESC;''',
         "keywords": ["analisis propinas", "propinas por sede", "tasa conversion propina"]
     },
     "horas_pico": {
         "description": "Horas pico por sede",
-        "sql_template": '''SELECT EXTRACT(HOUR FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS hora_del_dia, COUNT(DISTINCT CASE WHEN "Cuenta" IN ('Plaza bolsillo', 'plaza.bolsillo@gmail.com') THEN "ID de transacción" END) AS sede_plaza_bolsillo, COUNT(DISTINCT CASE WHEN "Cuenta" IN ('merced', 'merced.158@gmail.com') THEN "ID de transacción" END) AS sede_merced, COUNT(DISTINCT CASE WHEN "Cuenta" IN ('Tajamar', 'providencia.tajamar@gmail.com') THEN "ID de transacción" END) AS sede_tajamar FROM informe_ventas WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Fecha" IS NOT NULL AND "Fecha" ~ '^\\d{2}-\\d{2}-\\d{4}, \\d{2}:\\d{2}' GROUP BY 1 ORDER BY 1 ASC;''',
+        "sql_template": '''SELECT EXTRACT(HOUR FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS hora_del_dia, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Plaza Bolsillo') THEN "ID de transacción" END) AS sede_plaza_bolsillo, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Merced') THEN "ID de transacción" END) AS sede_merced, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Tajamar') THEN "ID de transacción" END) AS sede_tajamar, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Persa Victor Manuel') THEN "ID de transacción" END) AS sede_persa_victor_manuel FROM informe_ventas WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Fecha" IS NOT NULL AND "Fecha" ~ '^\\d{2}-\\d{2}-\\d{4}, \\d{2}:\\d{2}' GROUP BY 1 ORDER BY 1 ASC;''',
         "keywords": ["horas pico", "peak hours", "horarios mas concurridos"]
     },
     "fidelidad_clientes": {
         "description": "Fidelidad de clientes por sede",
-        "sql_template": '''WITH ventas_limpias AS (SELECT CASE WHEN iv."Cuenta" IN ('Plaza bolsillo', 'plaza.bolsillo@gmail.com') THEN 'Sede Plaza Bolsillo' WHEN iv."Cuenta" IN ('merced', 'merced.158@gmail.com') THEN 'Sede Merced' WHEN iv."Cuenta" IN ('Tajamar', 'providencia.tajamar@gmail.com') THEN 'Sede Tajamar' ELSE iv."Cuenta" END AS nombre_sede, t."Últimos 4 dígitos" AS id_tarjeta, TO_CHAR(CAST(SUBSTRING(t."Fecha" FROM 1 FOR 10) AS DATE), 'YYYY-MM') AS mes_operacion, CAST(SUBSTRING(t."Fecha" FROM 1 FOR 10) AS DATE) AS fecha_dia FROM transacciones t INNER JOIN (SELECT "ID de transacción", "Cuenta" FROM informe_ventas GROUP BY 1, 2) iv ON t."ID de transacción" = iv."ID de transacción" WHERE t."Estado" = 'Exitosa' AND t."Últimos 4 dígitos" IS NOT NULL), comportamiento_mensual AS (SELECT nombre_sede, mes_operacion, id_tarjeta, COUNT(DISTINCT fecha_dia) AS dias_visitados_al_mes FROM ventas_limpias GROUP BY 1, 2, 3) SELECT nombre_sede, mes_operacion, COUNT(DISTINCT CASE WHEN dias_visitados_al_mes = 1 THEN id_tarjeta END) AS clientes_un_solo_dia, COUNT(DISTINCT CASE WHEN dias_visitados_al_mes = 2 THEN id_tarjeta END) AS clientes_recurrentes_2_veces, COUNT(DISTINCT CASE WHEN dias_visitados_al_mes > 2 THEN id_tarjeta END) AS clientes_fans_3_o_mas, ROUND((COUNT(DISTINCT CASE WHEN dias_visitados_al_mes >= 2 THEN id_tarjeta END)::numeric / NULLIF(COUNT(DISTINCT id_tarjeta), 0)) * 100, 2) AS tasa_fidelidad_mes_pct FROM comportamiento_mensual GROUP BY 1, 2 ORDER BY mes_operacion DESC;''',
+        "sql_template": '''WITH ventas_limpias AS (SELECT iv.sede_sk, t."Últimos 4 dígitos" AS id_tarjeta, TO_CHAR(CAST(SUBSTRING(t."Fecha" FROM 1 FOR 10) AS DATE), 'YYYY-MM') AS mes_operacion, CAST(SUBSTRING(t."Fecha" FROM 1 FOR 10) AS DATE) AS fecha_dia FROM transacciones t INNER JOIN (SELECT "ID de transacción", MAX(sede_sk) AS sede_sk FROM informe_ventas GROUP BY 1) iv ON t."ID de transacción" = iv."ID de transacción" WHERE t."Estado" = 'Exitosa' AND t."Últimos 4 dígitos" IS NOT NULL), comportamiento_mensual AS (SELECT sede_sk, mes_operacion, id_tarjeta, COUNT(DISTINCT fecha_dia) AS dias_visitados_al_mes FROM ventas_limpias GROUP BY 1, 2, 3) SELECT COALESCE(ds.nombre_sede, 'Sede No Identificada') AS nombre_sede, cm.mes_operacion, COUNT(DISTINCT CASE WHEN cm.dias_visitados_al_mes = 1 THEN cm.id_tarjeta END) AS clientes_un_solo_dia, COUNT(DISTINCT CASE WHEN cm.dias_visitados_al_mes = 2 THEN cm.id_tarjeta END) AS clientes_recurrentes_2_veces, COUNT(DISTINCT CASE WHEN cm.dias_visitados_al_mes > 2 THEN cm.id_tarjeta END) AS clientes_fans_3_o_mas, ROUND((COUNT(DISTINCT CASE WHEN cm.dias_visitados_al_mes >= 2 THEN cm.id_tarjeta END)::numeric / NULLIF(COUNT(DISTINCT cm.id_tarjeta), 0)) * 100, 2) AS tasa_fidelidad_mes_pct FROM comportamiento_mensual cm LEFT JOIN dw.dim_sede ds ON ds.sede_sk = cm.sede_sk GROUP BY cm.sede_sk, ds.nombre_sede, cm.mes_operacion ORDER BY cm.mes_operacion DESC;''',
         "keywords": ["fidelidad clientes", "clientes recurrentes", "tasa fidelidad"]
     },
     "comportamiento_compra": {
         "description": "Comportamiento de compra por sede",
-        "sql_template": '''WITH ventas_consolidadas AS (SELECT CASE WHEN iv."Cuenta" IN ('Plaza bolsillo', 'plaza.bolsillo@gmail.com') THEN 'Sede Plaza Bolsillo' WHEN iv."Cuenta" IN ('merced', 'merced.158@gmail.com') THEN 'Sede Merced' WHEN iv."Cuenta" IN ('Tajamar', 'providencia.tajamar@gmail.com') THEN 'Sede Tajamar' ELSE iv."Cuenta" END AS sede_unificada, t."ID de transacción", COUNT(*) AS total_items, SUM(iv."Precio (Bruto)") AS monto_boleta FROM transacciones t INNER JOIN informe_ventas iv ON t."ID de transacción" = iv."ID de transacción" WHERE t."Estado" = 'Exitosa' AND LOWER(iv."Descripción") NOT IN ('tip', 'importe personalizado') AND iv."Precio (Bruto)" > 0 GROUP BY 1, 2), SELECT sede_unificada, COUNT(CASE WHEN total_items = 1 THEN 1 END) AS ventas_solitarias, COUNT(CASE WHEN total_items > 1 THEN 1 END) AS ventas_con_acompanamiento, ROUND(COUNT(CASE WHEN total_items > 1 THEN 1 END)::numeric / NULLIF(COUNT(*), 0) * 100, 2) AS tasa_de_sugestion_exito_pct, ROUND(AVG(CASE WHEN total_items = 1 THEN monto_boleta END), 0) AS ticket_promedio_solo, ROUND(AVG(CASE WHEN total_items > 1 THEN monto_boleta END), 0) AS ticket_promedio_acompanado FROM ventas_consolidadas GROUP BY sede_unificada;''',
+        "sql_template": '''WITH ventas_consolidadas AS (SELECT iv.sede_sk, t."ID de transacción", COUNT(*) AS total_items, SUM(iv."Precio (Bruto)") AS monto_boleta FROM transacciones t INNER JOIN informe_ventas iv ON t."ID de transacción" = iv."ID de transacción" WHERE t."Estado" = 'Exitosa' AND LOWER(iv."Descripción") NOT IN ('tip', 'importe personalizado') AND iv."Precio (Bruto)" > 0 GROUP BY 1, 2) SELECT COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede_unificada, COUNT(CASE WHEN vc.total_items = 1 THEN 1 END) AS ventas_solitarias, COUNT(CASE WHEN vc.total_items > 1 THEN 1 END) AS ventas_con_acompanamiento, ROUND(COUNT(CASE WHEN vc.total_items > 1 THEN 1 END)::numeric / NULLIF(COUNT(*), 0) * 100, 2) AS tasa_de_sugestion_exito_pct, ROUND(AVG(CASE WHEN vc.total_items = 1 THEN vc.monto_boleta END), 0) AS ticket_promedio_solo, ROUND(AVG(CASE WHEN vc.total_items > 1 THEN vc.monto_boleta END), 0) AS ticket_promedio_acompanado FROM ventas_consolidadas vc LEFT JOIN dw.dim_sede ds ON ds.sede_sk = vc.sede_sk GROUP BY vc.sede_sk, ds.nombre_sede;''',
         "keywords": ["comportamiento compra", "ventas solitarias", "ticket promedio"]
     },
     "productos_global": {
@@ -84,7 +107,7 @@ KPI_REGISTRY = {
     },
     "horas_concurridas": {
         "description": "Horas del día más concurridas por sede",
-        "sql_template": '''SELECT DATE(TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS dia, CASE EXTRACT(DOW FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) WHEN 1 THEN 'Lunes' WHEN 2 THEN 'Martes' WHEN 3 THEN 'Miércoles' WHEN 4 THEN 'Jueves' WHEN 5 THEN 'Viernes' WHEN 6 THEN 'Sábado' WHEN 0 THEN 'Domingo' END AS dia_semana, EXTRACT(HOUR FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS hora_del_dia, COUNT(DISTINCT CASE WHEN "Cuenta" IN ('Plaza bolsillo', 'plaza.bolsillo@gmail.com') THEN "ID de transacción" END) AS plaza_bolsillo, COUNT(DISTINCT CASE WHEN "Cuenta" IN ('merced', 'merced.158@gmail.com') THEN "ID de transacción" END) AS merced, COUNT(DISTINCT CASE WHEN "Cuenta" IN ('Tajamar', 'providencia.tajamar@gmail.com') THEN "ID de transacción" END) AS tajamar FROM informe_ventas WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Fecha" IS NOT NULL GROUP BY 1,2,3 ORDER BY 1,3;''',
+        "sql_template": '''SELECT DATE(TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS dia, CASE EXTRACT(DOW FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) WHEN 1 THEN 'Lunes' WHEN 2 THEN 'Martes' WHEN 3 THEN 'Miércoles' WHEN 4 THEN 'Jueves' WHEN 5 THEN 'Viernes' WHEN 6 THEN 'Sábado' WHEN 0 THEN 'Domingo' END AS dia_semana, EXTRACT(HOUR FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS hora_del_dia, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Plaza Bolsillo') THEN "ID de transacción" END) AS plaza_bolsillo, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Merced') THEN "ID de transacción" END) AS merced, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Tajamar') THEN "ID de transacción" END) AS tajamar, COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Persa Victor Manuel') THEN "ID de transacción" END) AS persa_victor_manuel FROM informe_ventas WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Fecha" IS NOT NULL GROUP BY 1,2,3 ORDER BY 1,3;''',
         "keywords": ["horas concurridas", "traffic hours", "peak times"]
     }
 }
@@ -94,14 +117,32 @@ KPI_REGISTRY = {
 # ========================================================================
 REAL_SCHEMA = {
     "transacciones": [
-        "ID de transacción", "Fecha", "Hora", "Cuenta", "Estado", "Ejecutar como", "Comisión"
+        "ID de transacción", "Fecha", "Hora", "Cuenta", "Estado", "Ejecutar como", "Comisión", "Total",
+        "Últimos 4 dígitos", "sede_sk"
     ],
     "informe_ventas": [
         "ID de transacción", "Fecha", "Hora", "Cuenta", "Descripción", "Cantidad", 
-        "Precio (Bruto)", "Precio (Neto)", "Últimos 4 dígitos"
+        "Precio (Bruto)", "Precio (Neto)", "Últimos 4 dígitos", "sede_sk"
+    ],
+    "dw.dim_sede": [
+        "sede_sk", "nombre_sede"
     ]
 }
 
+sql_validator = SQLValidator(REAL_SCHEMA)
+
+
+def _load_live_catalog():
+    """Columnas reales de las tablas de REAL_SCHEMA para la reparación de SQL"""
+    if schema_cache.loaded:
+        return schema_cache.columns(REAL_SCHEMA)
+    db = _lazy_components.get('db')
+    return catalog_from_records(db._execute(catalog_query(list(REAL_SCHEMA)))) if db else {}
+
+
+# Cada reintento del LLM aquí cuesta reasoning + agente: 2 llamadas evitadas por reparación
+sql_repairer = SQLRepairer(REAL_SCHEMA, catalog_loader=_load_live_catalog, llm_calls_per_retry=2)
+
 # ========================================================================
 # COMPONENTES GLOBALES
 # ========================================================================
@@ -109,6 +150,8 @@ _lazy_components = {}
 
 def get_database_schema(db):
     """Obtiene esquema técnico REAL de PostgreSQL"""
+    if schema_cache.loaded:
+        return schema_cache.describe(schema_cache.tables)
     try:
         raw_schema = db.get_table_info()
         print(f"\n✅ Esquema cargado ({len(raw_schema)} chars)")
@@ -120,8 +163,8 @@ def get_database_schema(db):
 # ========================================================================
 # NUEVA IMPLEMENTACIÓN: TOOL DE EJECUCIÓN SQL REAL
 # ========================================================================
-@tool
-def execute_sql(query: str) -> str:
+@tool(response_format="content_and_artifact")
+def execute_sql(query: str) -> Tuple[str, Dict[str, Any]]:
     """
     Ejecuta una consulta SQL contra la base de datos.
     
@@ -129,43 +172,43 @@ def execute_sql(query: str) -> str:
         query: Consulta SQL a ejecutar
         
     Returns:
-        Resultados serializados o mensaje de error como string
+        Tabla compacta con los resultados (columnas una sola vez) o mensaje de error
     """
+    # ♻️ Caché de resultados por huella de la consulta (whitespace, mayúsculas, comentarios)
+    fingerprint = fingerprint_sql(query)[:12]
+    artifact = {"cache_hit": False, "query": query, "fingerprint": fingerprint, "result": None}
+    data_version = _current_data_version()
+    cached = sql_result_cache.get(query, data_version)
+    if cached is not None:
+        print(f"♻️ RESULTADO SQL DESDE CACHÉ ({fingerprint})")
+        result = ResultSet.from_json(cached)
+        return encode_for_llm(result), {**artifact, "cache_hit": True, "result": result}
+    
+    # 🩹 Un identificador mal escrito se corrige localmente y se reintenta una vez
+    result, executed_query, fixes = execute_with_repair(query, _execute_sql_uncached, sql_repairer)
+    if isinstance(result, str):
+        return result, artifact
+    # 🗜️ Al LLM va la tabla compacta; el observer lee el ResultSet del artifact
+    sql_result_cache.put(executed_query, result.to_json(), data_version)
+    content = encode_for_llm(result)
+    if fixes:
+        content = f"{repair_note(fixes)}\n{content}"
+    return content, {**artifact, "query": executed_query, "repairs": fixes, "result": result}
+
+
+def _execute_sql_uncached(query: str) -> Union[str, ResultSet]:
+    """Validación de seguridad + ejecución real; ResultSet tipado o mensaje de error"""
     db = _lazy_components.get('db')
     
     if not db:
         return "ERROR: No hay conexión a base de datos disponible"
     
-    # 🔒 VALIDACIÓN DE SEGURIDAD - SOLO SELECT
-    query_clean = query.strip().lower()
-    
-    # Verificar que empiece con SELECT o WITH
-    if not query_clean.startswith("select") and not query_clean.startswith("with"):
-        return "SQL_SECURITY_ERROR: Solo se permiten consultas SELECT"
-    
-    # Bloquear palabras clave peligrosas
-    forbidden_keywords = [
-        "insert",
-        "update", 
-        "delete",
-        "drop",
-        "alter", 
-        "truncate",
-        "grant",
-        "revoke",
-        "create",
-        "execute"
-    ]
-    
-    if any(keyword in query_clean for keyword in forbidden_keywords):
-        return "SQL_SECURITY_ERROR: Operación SQL no permitida"
+    # 🔒 VALIDACIÓN (AST o tokens, cacheada por huella): solo SELECT sobre REAL_SCHEMA
+    validation_error = sql_validator.validate(query)
+    if validation_error:
+        return validation_error
     
     try:
-        # 🔧 Usar la instancia única creada en _lazy_components
-        execute_query = _lazy_components.get("sql_tool")
-        if not execute_query:
-            return "ERROR: Herramienta SQL no inicializada"
-        
         # 🔍 LOGGING AVANZADO - Indicador visual claro
         print("\n" + "="*50)
         print("🔍 CONSULTA SQL DETECTADA")
@@ -178,7 +221,8 @@ def execute_sql(query: str) -> str:
         import time
         start_time = time.time()
             
-        result = execute_query.invoke({"query": query})
+        # Cursor del lado del servidor con tope de filas y resumen por columna
+        result = execute_with_sqldatabase(db, query)
         
         # ⏱️ Calcular duración
         end_time = time.time()
@@ -187,35 +231,19 @@ def execute_sql(query: str) -> str:
         # 📊 LOGGING DE RESULTADOS
         print(f"✅ CONSULTA COMPLETADA en {duration:.2f} segundos")
         
-        # Parsear resultado
-        if isinstance(result, str):
-            if "error" in result.lower() or "syntax" in result.lower():
-                print(f"❌ ERROR EN CONSULTA: {result}")
-                return result  # Devolvemos el error directamente
-            else:
-                try:
-                    parsed_result = json.loads(result)
-                    if isinstance(parsed_result, list) and len(parsed_result) == 0:
-                        print("📝 Resultado: EMPTY_RESULT (0 filas)")
-                        return "EMPTY_RESULT"
-                    else:
-                        row_count = len(parsed_result) if isinstance(parsed_result, list) else "N/A"
-                        print(f"📊 Resultado: {row_count} filas obtenidas")
-                        return json.dumps(parsed_result[:50], default=str)  # Limitamos resultados
-                except:
-                    if not result.strip():
-                        print("📝 Resultado: EMPTY_RESULT (contenido vacío)")
-                        return "EMPTY_RESULT"
-                    print(f"📄 Resultado: Texto plano ({len(result)} caracteres)")
-                    return result[:1000]  # Limitamos tamaño
+        if not result.rows:
+            print("📝 Resultado: EMPTY_RESULT (0 filas)")
         else:
-            if isinstance(result, list) and len(result) == 0:
-                print("📝 Resultado: EMPTY_RESULT (lista vacía)")
-                return "EMPTY_RESULT"
-            row_count = len(result) if isinstance(result, list) else "N/A"
-            print(f"📊 Resultado: {row_count} elementos obtenidos")
-            return json.dumps(result[:50], default=str)
-            
+            print(f"📊 Resultado: {result.total_rows}{'+' if result.capped else ''} filas obtenidas"
+                  + (f" (se envían {len(result.rows)} + resumen por columna)" if result.truncated else ""))
+        return result
+    
+    except SQLCostRejected as e:
+        # 🚧 Plan demasiado caro: el LLM recibe el nodo culpable para reescribir
+        return e.decision.feedback()
+    except QueryTimeoutError:
+        print(f"⏱️ CONSULTA CANCELADA POR statement_timeout ({AGENT_STATEMENT_TIMEOUT_MS} ms)")
+        return timeout_feedback(AGENT_STATEMENT_TIMEOUT_MS)
     except Exception as e:
         # Devolvemos el error real como string
         print(f"💥 ERROR FATAL EN CONSULTA: {str(e)}")
@@ -254,12 +282,16 @@ class AgentState(MessagesState):
     sql_query: Optional[str] = None
     execution_success: Optional[bool] = None
     result_rows: Optional[List[Dict]] = None
+    result_set: Optional[Any] = None  # ResultSet tipado del último execute_sql
+    sql_cache_hit: Optional[bool] = None
+    tool_results: Optional[List[Dict]] = None
     final_response: Optional[str] = None
     insights_analysis: Optional[str] = None
     attempt_count: int = 0
     rag_context_used: bool = False
     rag_queries_history: List[str] = Field(default_factory=list)  # Corrección
     rag_attempt_count: int = 0
+    budget: Optional[Any] = None  # AgentBudget de la pregunta (agent_budget.py)
 # ========================================================================
 # NODOS DEL GRAFO REACT REAL
 # ========================================================================
@@ -268,8 +300,6 @@ def assistant_node(state: AgentState) -> Dict[str, Any]:
     Nodo Assistant que RESPETA el reasoning previo.
     Extrae la acción del reasoning y la ejecuta.
     """
-    llm = _lazy_components.get('llm')
-    
     # Buscar el último reasoning en los mensajes
     last_reasoning = extract_last_reasoning(state["messages"])
     
@@ -287,15 +317,10 @@ def assistant_node(state: AgentState) -> Dict[str, Any]:
         print("⚠️ No se encontró reasoning. Invocando reasoning_node desde assistant.")
         return reasoning_node(state)
     
-    # Preparar tools para binding
-    tools_to_bind = [execute_sql, get_kpi_sql]
-    if _lazy_components.get("retriever_tool"):
-        tools_to_bind.append(_lazy_components["retriever_tool"])
-    
-    bound_llm = llm.bind_tools(tools_to_bind)
-    
-    # Invocar LLM con el contexto completo
-    response = bound_llm.invoke(state["messages"])
+    # Invocar LLM (tools ya enlazadas al construir el grafo) con el contexto completo
+    router = _lazy_components["router"]
+    step = classify_step(state, registry=KPI_REGISTRY)
+    response = router.invoke(step, router.prelude.messages(state["messages"]))
     
     return {"messages": [response]}
 
@@ -319,6 +344,25 @@ def should_continue(state: AgentState) -> str:
 # ========================================================================
 import re
 
+# "structured": razonamiento + acción + argumentos en UNA llamada con esquema (por defecto)
+# "text": formato REASONING/ACTION/PARAMETERS en prosa + corrección + assistant (línea base)
+REASONING_MODE = os.getenv("REACT_REASONING_MODE", "structured")
+MAX_REASONING_ATTEMPTS = 3
+
+
+def execution_context(state: AgentState) -> str:
+    """Contadores del estado que el LLM ve antes de decidir la siguiente acción"""
+    attempt_count = state.get("attempt_count", 0)
+    execution_success = state.get("execution_success", None)
+    sql_query = state.get("sql_query", None)
+    rag_attempt_count = state.get("rag_attempt_count", 0)
+    budget = state.get("budget")
+    return f"""=== CONTEXTO DE EJECUCIÓN ===
+- Intento actual: {attempt_count + 1}
+- Última ejecución: {'✅ ÉXITO' if execution_success else '❌ FALLÓ' if execution_success is not None else '⏳ PENDIENTE'}
+- Intentos RAG: {rag_attempt_count}/2
+- Última query: {sql_query[:100] + '...' if sql_query else 'N/A'}""" + (f"\n- {budget.prompt_hint()}" if budget is not None else "")
+
 def reasoning_node(state: AgentState) -> Dict[str, Any]:
     """
     Forzar al LLM a EXPLICITAR su razonamiento antes de actuar.
@@ -329,14 +373,8 @@ def reasoning_node(state: AgentState) -> Dict[str, Any]:
     if not llm:
         raise ValueError("LLM no inicializado en _lazy_components")
 
-    # Contadores del estado
-    attempt_count = state.get("attempt_count", 0)
-    execution_success = state.get("execution_success", None)
-    sql_query = state.get("sql_query", None)
-    rag_attempt_count = state.get("rag_attempt_count", 0)
-
     # Si ya se hizo más de 3 intentos, forzar final_answer
-    if attempt_count >= 3:
+    if state.get("attempt_count", 0) >= 3:
         print("🧠 MAX ATTEMPTS REACHED → Forzando final_answer")
         return {
             "messages": [AIMessage(content="ACTION: final_answer\nPARAMETERS: {\"response\": \"Respuesta parcial generada tras varios intentos.\"}")]
@@ -366,11 +404,7 @@ CONTINGENCY: [Qué harás si esta acción falla]
 - Ejemplo: "Si SQL falla, intentaré con KPI predefinido"
 - Ejemplo: "Si no hay resultados, ampliaré el rango de fechas"
 
-=== CONTEXTO DE EJECUCIÓN ===
-- Intento actual: {attempt_count + 1}
-- Última ejecución: {'✅ ÉXITO' if execution_success else '❌ FALLÓ' if execution_success is not None else '⏳ PENDIENTE'}
-- Intentos RAG: {rag_attempt_count}/2
-- Última query: {sql_query[:100] + '...' if sql_query else 'N/A'}
+{execution_context(state)}
 
 === REGLAS CRÍTICAS ===
 1. NUNCA uses una herramienta sin razonamiento previo
@@ -379,10 +413,12 @@ CONTINGENCY: [Qué harás si esta acción falla]
 """
 
     # Invocar LLM para generar razonamiento estructurado
-    response = llm.invoke([
-        SystemMessage(content=reasoning_prompt),
-        *state["messages"]
-    ])
+    # 🔀 Tier según el paso; el pequeño escala al grande si el formato no es válido
+    router = _lazy_components["router"]
+    prelude = router.prelude
+    response = router.invoke(classify_step(state, registry=KPI_REGISTRY),
+                             prelude.messages(state["messages"], [SystemMessage(content=reasoning_prompt)], "reasoning"),
+                             kind="llm", check=_reasoning_format_check)
 
     # Validar formato
     if not validate_reasoning_format(response.content):
@@ -395,12 +431,11 @@ Debes incluir: REASONING, ACTION, PARAMETERS, CONTINGENCY
 
 Reintenta con el formato correcto.
 """
-        corrected_response = llm.invoke([
-            SystemMessage(content=reasoning_prompt),
-            *state["messages"],
-            response,
-            HumanMessage(content=correction_prompt)
-        ])
+        corrected_response = router.invoke("format_correction", prelude.messages(
+            [*state["messages"], response],
+            [SystemMessage(content=reasoning_prompt), HumanMessage(content=correction_prompt)],
+            "reasoning",
+        ), kind="llm", check=_reasoning_format_check)
         response = corrected_response
 
     print(f"🧠 REASONING GENERADO:\n{response.content}")
@@ -409,71 +444,207 @@ Reintenta con el formato correcto.
 
 
 
+# ========================================================================
+# REASONING ESTRUCTURADO: UNA SOLA LLAMADA POR ITERACIÓN
+# ========================================================================
+class ReActStep(BaseModel):
+    """Paso ReAct: razonamiento, acción elegida y sus argumentos"""
+    reasoning: str = Field(description="Qué información se necesita, qué se tiene ya y qué errores previos considerar")
+    action: Literal["execute_sql", "get_kpi_sql", "retrieve_documents", "final_answer"]
+    query: Optional[str] = Field(default=None, description="SQL para execute_sql o búsqueda para retrieve_documents")
+    kpi_name: Optional[str] = Field(default=None, description="Nombre del KPI para get_kpi_sql")
+    response: Optional[str] = Field(default=None, description="Respuesta al usuario para final_answer")
+    contingency: str = Field(default="", description="Qué hacer si esta acción falla")
+
+
+STRUCTURED_REASONING_PROMPT = """
+Eres un agente analítico que sigue el patrón ReAct. En cada paso devuelves UN ReActStep:
+- reasoning: tu análisis (qué necesitas, qué datos ya tienes, errores previos)
+- action: execute_sql, get_kpi_sql, retrieve_documents o final_answer
+- query / kpi_name / response: solo el argumento que usa la acción elegida
+- contingency: qué harás si la acción falla
+
+REGLAS CRÍTICAS:
+1. execute_sql requiere query con una consulta SELECT completa
+2. get_kpi_sql requiere kpi_name de la lista de KPIs predefinidos
+3. Si es la 3ra iteración, DEBES dar final_answer aunque sea parcial
+"""
+
+
+def _tools_by_name() -> Dict[str, Any]:
+    return {t.name: t for t in _lazy_components["prelude"].tools}
+
+
+def step_to_message(step: ReActStep) -> AIMessage:
+    """
+    Convierte el paso en el mensaje que espera el grafo: texto de razonamiento
+    + tool_call con los argumentos validados contra el esquema del tool.
+    """
+    if step.action == "final_answer":
+        return AIMessage(content=step.response or "Respuesta final generada.")
+
+    tool = _tools_by_name().get(step.action)
+    if tool is None:
+        return AIMessage(content=f"La herramienta {step.action} no está disponible. {step.response or ''}".strip())
+
+    candidatos = {"query": step.query, "kpi_name": step.kpi_name}
+    args = {name: candidatos[name] for name in tool.args if candidatos.get(name) is not None}
+    try:
+        tool.tool_call_schema(**args)
+    except Exception as e:
+        # Sin reintento aquí: el ToolNode devuelve el error de validación y el
+        # siguiente paso lo corrige con el contexto completo
+        print(f"⚠️ Argumentos inválidos para {step.action}: {e}")
+
+    content = f"REASONING: {step.reasoning}"
+    if step.contingency:
+        content += f"\nCONTINGENCY: {step.contingency}"
+    return AIMessage(content=content, tool_calls=[{
+        "name": step.action, "args": args, "id": f"call_{uuid.uuid4().hex[:24]}", "type": "tool_call",
+    }])
+
+
+def structured_reasoning_node(state: AgentState) -> Dict[str, Any]:
+    """
+    Reasoning + acción + argumentos en una llamada con salida estructurada.
+    Reemplaza reasoning_node (con su reintento de formato) y assistant_node.
+    """
+    llm = _lazy_components.get('llm')
+    if not llm:
+        raise ValueError("LLM no inicializado en _lazy_components")
+
+    if state.get("attempt_count", 0) >= MAX_REASONING_ATTEMPTS:
+        print("🧠 MAX ATTEMPTS REACHED → Forzando final_answer")
+        return {"messages": [AIMessage(content="Respuesta parcial generada tras varios intentos.")]}
+
+    # ⏳ Planificar contra el presupuesto restante de la pregunta
+    budget = state.get("budget")
+    decision = budget.plan() if budget is not None else "continue"
+    record_outcome(budget, decision)
+    if decision != "continue":
+        fallback = budget_fallback(state, decision)
+        if fallback is not None:
+            return {"messages": [fallback]}
+
+    # Reglas y formato ReActStep van en el prefijo estático; el contexto del turno al final
+    router = _lazy_components["router"]
+    prelude = router.prelude
+    contexto = SystemMessage(content=execution_context(state))
+    route_step = classify_step(state, decision, KPI_REGISTRY)
+    if decision == "final":
+        # Última llamada: respuesta directa, sin tools
+        response = router.invoke(route_step, prelude.messages(
+            state["messages"], [contexto, final_instruction(budget)], "reasoning"), kind="final", budget=budget)
+        return {"messages": [AIMessage(content=response.content)]}
+
+    output = router.invoke(route_step, prelude.messages(state["messages"], [contexto], "reasoning"),
+                           kind="structured", budget=budget)
+    step = output["parsed"]
+    if step is None:
+        print(f"⚠️ ReActStep inválido: {output.get('parsing_error')}")
+        return {"messages": [AIMessage(content=output["raw"].content or "No se pudo generar respuesta.")]}
+    print(f"🧠 REASONING: {step.reasoning}\n   ACTION: {step.action}")
+    return {"messages": [step_to_message(step)]}
+
+
+def budget_fallback(state: AgentState, decision: str) -> Optional[AIMessage]:
+    """Respuesta sin LLM cuando ya no hay presupuesto; None para hacer la última llamada"""
+    budget = state["budget"]
+    if decision == "final" and state.get("result_set") is None:
+        # Sin resultados todavía: el KPI registrado más cercano responde sin otra vuelta
+        kpi_name = kpi_fallback_match(state.get("question", ""), KPI_REGISTRY)
+        if kpi_name:
+            try:
+                rows = _run_kpi_rows(KPI_REGISTRY[kpi_name]["sql_template"])
+                return kpi_fallback_message(kpi_name, KPI_REGISTRY[kpi_name], rows)
+            except Exception as e:
+                print(f"⚠️ KPI de respaldo falló: {e}")
+    if decision == "stop":
+        return best_effort_message(state, budget)
+    return None
+
+
 def observer_node(state: AgentState) -> Dict[str, Any]:
-    """Observer Node con tracking avanzado de RAG"""
+    """Observer Node: agrega éxito, filas, tiempos y RAG de todos los tools de la ronda"""
     messages = state["messages"]
     
     if not messages:
         return {}
     
-    last_message = messages[-1]
+    # Todos los ToolMessages desde el último AIMessage (pueden ser varios en paralelo)
+    ronda = tool_round(messages)
+    if not ronda:
+        return {}
     
     # Estados actuales
     attempt_count = state.get("attempt_count", 0)
     rag_context_used = state.get("rag_context_used", False)
-    rag_queries_history = state.get("rag_queries_history", [])
+    rag_queries_history = list(state.get("rag_queries_history", []))
     rag_attempt_count = state.get("rag_attempt_count", 0)
     
-    # Solo procesamos ToolMessages
-    if not isinstance(last_message, ToolMessage):
-        return {}
+    sql_query = state.get("sql_query")
+    sql_cache_hit = None
+    result_rows = None
+    result_set = None
+    sql_success = None
+    tool_results = []
     
-    # Detectar éxito/fracaso
-    content = last_message.content
-    execution_success = True
-    if "ERROR" in content or "SQL_SECURITY_ERROR" in content or "SQL_ERROR" in content:
-        execution_success = False
-    
-    # Extraer SQL ejecutado si está disponible
-    sql_query = None
-    if (hasattr(last_message, 'tool_call') and 
-        last_message.tool_call and 
-        isinstance(last_message.tool_call, dict)):
+    for message in ronda:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        ok = not ("ERROR" in content or "SQL_SECURITY_ERROR" in content or "SQL_ERROR" in content)
+        args = tool_call_args(messages, message.tool_call_id)
+        artifact = getattr(message, 'artifact', None)
+        resumen = {
+            "tool": message.name,
+            "ok": ok,
+            "ms": (message.response_metadata or {}).get("duration_ms"),
+            "rows": None,
+            "cache_hit": None,
+        }
         
-        tool_call = last_message.tool_call
-        if tool_call.get('name') == 'execute_sql' and 'args' in tool_call:
-            args = tool_call['args']
-            if isinstance(args, dict) and 'query' in args:
-                sql_query = args['query']
-    
-    # Parsear resultados
-    result_rows = None
-    if execution_success:
-        if content == "EMPTY_RESULT":
-            result_rows = []
-        else:
-            try:
-                result_rows = json.loads(content)
-                if not isinstance(result_rows, list):
-                    result_rows = None
-            except:
-                result_rows = None
-    
-    # Detectar uso de RAG y actualizar tracking
-    rag_used_in_this_call = False
-    if (hasattr(last_message, 'tool_call') and 
-        last_message.tool_call and 
-        isinstance(last_message.tool_call, dict) and
-        last_message.tool_call.get('name') == 'retrieve_documents'):
+        if message.name == 'execute_sql':
+            if isinstance(artifact, dict):
+                sql_query = artifact.get('query', args.get('query'))
+                resumen["cache_hit"] = artifact.get('cache_hit')
+                sql_cache_hit = bool(sql_cache_hit) or bool(artifact.get('cache_hit'))
+                if artifact.get('cache_hit'):
+                    print(f"♻️ Observer: resultado SQL servido desde caché ({artifact.get('fingerprint')})")
+            else:
+                sql_query = args.get('query', sql_query)
+            
+            # Resultado tipado del artifact (sin volver a parsear el texto enviado al LLM)
+            result = artifact.get('result') if isinstance(artifact, dict) else None
+            if result is None and ok:
+                result = parse_result(content)
+            if result is not None:
+                ok = True
+                resumen["ok"] = True
+                resumen["rows"] = result.total_rows
+                result_set = result
+                result_rows = result.records()
+            sql_success = ok if sql_success is None else (sql_success and ok)
         
-        rag_used_in_this_call = True
-        rag_context_used = True
-        rag_attempt_count += 1
+        elif message.name == 'retrieve_documents':
+            # Detectar uso de RAG y actualizar tracking
+            rag_context_used = True
+            rag_attempt_count += 1
+            if args.get('query'):
+                rag_queries_history.append(args['query'])
         
-        # Extraer query RAG para historial
-        if 'args' in last_message.tool_call and 'query' in last_message.tool_call['args']:
-            query = last_message.tool_call['args']['query']
-            rag_queries_history.append(query)
+        tool_results.append(resumen)
+    
+    budget = state.get("budget")
+    if budget is not None:
+        budget.charge_sql(sum(1 for r in tool_results if r["tool"] == "execute_sql" and not r["cache_hit"]))
+    
+    execution_success = sql_success if sql_success is not None else all(r["ok"] for r in tool_results)
+    
+    if len(tool_results) > 1:
+        exitosos = sum(1 for r in tool_results if r["ok"])
+        pared = max((r["ms"] or 0) for r in tool_results)
+        suma = sum((r["ms"] or 0) for r in tool_results)
+        print(f"👁️ Observer: {len(tool_results)} tools ({exitosos} ✅, {len(tool_results) - exitosos} ❌) "
+              f"en {pared:.0f} ms de pared (secuencial: {suma:.0f} ms)")
     
     # Prevenir loops RAG excesivos (límite 3 intentos)
     if rag_attempt_count > 3:
@@ -483,22 +654,25 @@ def observer_node(state: AgentState) -> Dict[str, Any]:
         "attempt_count": attempt_count + 1,
         "execution_success": execution_success,
         "sql_query": sql_query,
+        "sql_cache_hit": sql_cache_hit,
         "result_rows": result_rows,
+        "result_set": result_set,
+        "tool_results": tool_results,
         "rag_context_used": rag_context_used,
         "rag_queries_history": rag_queries_history[-5:],  # Mantener últimas 5
         "rag_attempt_count": min(rag_attempt_count, 3)  # Limitar a 3 intentos
     }
 
 
-def create_react_graph_real(llm, db) -> StateGraph:
-    """Crea el grafo ReAct REAL con nodo de reasoning explícito"""
+def create_react_graph_real(llm, db, reasoning_mode: str = REASONING_MODE, small_llm=None) -> StateGraph:
+    """Crea el grafo ReAct REAL con nodo de reasoning explícito (small_llm: tier pequeño del router)"""
     
     _lazy_components['llm'] = llm
     _lazy_components['db'] = db
-    
-    # Inicializar SQL tool
-    from langchain_community.tools import QuerySQLDatabaseTool
-    _lazy_components["sql_tool"] = QuerySQLDatabaseTool(db=db)
+    # Versión de datos propia del grafo síncrono; se entrega a las cachés en cada llamada
+    _lazy_components['data_version'] = DataVersionPoller(_read_data_version)
+    # 🗂️ Foto de information_schema (desde disco si el catálogo no cambió)
+    schema_cache.load(_run_kpi_rows)
     
     # Inicializar RAG tool
     try:
@@ -517,7 +691,29 @@ def create_react_graph_real(llm, db) -> StateGraph:
     if _lazy_components.get("retriever_tool"):
         tools_list.append(_lazy_components["retriever_tool"])
     
-    tool_node = ToolNode(tools_list)
+    tool_node = ParallelToolNode(tools_list)
+    # 🧩 Tools enlazadas, esquema ReActStep y prompt estático una sola vez por grafo (uno por tier)
+    if reasoning_mode == "structured":
+        router = compile_router(
+            llm, small_llm, tools_list, lambda: f"{build_static_prompt()}\n{STRUCTURED_REASONING_PROMPT}",
+            structured_schema=ReActStep, kpi_names=list(KPI_REGISTRY), sql_check=sql_validator.validate)
+    else:
+        router = compile_router(llm, small_llm, tools_list, build_static_prompt,
+                                kpi_names=list(KPI_REGISTRY), sql_check=sql_validator.validate)
+    _lazy_components["router"] = router
+    _lazy_components["prelude"] = router.prelude
+    
+    if reasoning_mode == "structured":
+        # reasoning → tools → observer → reasoning, una llamada LLM por iteración
+        workflow.add_node("reasoning", structured_reasoning_node)
+        workflow.add_node("tools", tool_node)
+        workflow.add_node("observer", observer_node)
+        workflow.set_entry_point("reasoning")
+        workflow.add_conditional_edges("reasoning", should_continue, {"tools": "tools", "end": END})
+        workflow.add_edge("tools", "observer")
+        workflow.add_edge("observer", "reasoning")
+        # El tope de pasos va en el config de invoke/stream (graph_config → recursion_limit)
+        return workflow.compile()
     
     # === AGREGAR NODOS ===
     workflow.add_node("reasoning", reasoning_node)      # ← NUEVO
@@ -552,59 +748,134 @@ def create_react_graph_real(llm, db) -> StateGraph:
     workflow.add_edge("observer", "reasoning")  # ← CAMBIADO: vuelve a reasoning, no assistant
     
     # Compilar
-    compiled_graph = workflow.compile()
-    compiled_graph.max_iterations = 15  # ← AUMENTADO de 5 a 15
-    
-    return compiled_graph
+    return workflow.compile()
 
 
 # ========================================================================
 # FUNCIÓN PRINCIPAL DE PROCESAMIENTO
 # ========================================================================
+def _run_kpi_rows(sql: str) -> List[Dict[str, Any]]:
+    """Ejecuta SQL registrado y devuelve filas como dicts (ruta rápida de KPIs)"""
+    db = _lazy_components.get('db')
+    if not db:
+        raise RuntimeError("No hay conexión a base de datos disponible")
+    return db._execute(sql)
+
+
+def _read_data_version() -> int:
+    """Versión de datos del ETL (invalida la caché de respuestas)"""
+    rows = _run_kpi_rows(DATA_VERSION_QUERY)
+    return int(rows[0]["version"]) if rows else 0
+
+
+def _current_data_version() -> Optional[int]:
+    """Versión de datos del grafo síncrono (None si aún no se creó el grafo)"""
+    poller = _lazy_components.get('data_version')
+    return poller() if poller else None
+
+
 def process_question_react(question: str, graph) -> Dict[str, Any]:
-    """Procesa una pregunta usando el grafo ReAct real"""
-    
-    # Preparar mensaje inicial con contexto
+    """Procesa una pregunta: caché de respuestas → ruta rápida de KPIs → grafo ReAct"""
+    return answer_cache.answer(question, lambda: _process_question_uncached(question, graph), _current_data_version())
+
+
+def stream_question_react(question: str, graph) -> Iterator[Dict[str, Any]]:
+    """Como process_question_react pero emitiendo eventos (nodos, tools, tokens) al vuelo"""
+    return stream_answer(
+        question,
+        graph,
+        build_initial_state,
+        fast_path=lambda: try_fast_path(question, KPI_REGISTRY, _run_kpi_rows, _lazy_components.get('llm')),
+        data_version=_current_data_version,
+        config=graph_config(),
+    )
+
+
+def print_agent_stats() -> None:
+    """Métricas de cachés, validación, presupuesto y router (comando /cache y salida del REPL)"""
+    print(f"\n{answer_cache.format_stats()}")
+    print(format_context_stats())
+    print(format_encoding_stats())
+    print(format_gate_stats())
+    print(sql_validator.format_stats())
+    print(sql_repairer.format_stats())
+    print(schema_cache.format_stats())
+    print(format_budget_stats())
+    print(format_prelude_stats())
+    print(format_router_stats())
+    print(format_cassette_stats())
+    sql_stats = sql_result_cache.metrics()
+    print(f"♻️ Caché SQL: {sql_stats['entries']} consultas, {sql_stats['bytes'] / 1024:.0f} KB | "
+          f"{sql_stats['hits']} hits, {sql_stats['misses']} misses, {sql_stats['evictions']} desalojos")
+
+
+def build_schema_context(question: str) -> str:
+    """Tablas relevantes para la pregunta desde la foto del catálogo (lista estática si no hay foto)"""
+    context = schema_cache.schema_context(question, allowed=list(REAL_SCHEMA))
+    if context:
+        return context
+    return "\n".join(f"{table}: " + ", ".join(columns) for table, columns in REAL_SCHEMA.items())
+
+
+def build_static_prompt() -> str:
+    """Prompt igual para todas las preguntas (reglas + KPIs); se renderiza al compilar el grafo"""
     kpi_descriptions = "\n".join([f"- {name}: {info['description']}" for name, info in KPI_REGISTRY.items()])
-    initial_system_message = f"""Eres un experto analista de datos para cafeterías como Bolsillo Coffee.
+    return f"""Eres un experto analista de datos para cafeterías como Bolsillo Coffee.
 Tu tarea es responder preguntas sobre datos usando consultas SQL cuando sea necesario.
 
 REGLAS IMPORTANTES:
 1. SIEMPRE usa el tool execute_sql para ejecutar consultas SQL
 2. Puedes usar get_kpi_sql para obtener consultas predefinidas para métricas comunes
-3. Las tablas disponibles son: transacciones, informe_ventas
-4. Columnas válidas en transacciones: ID de transacción, Fecha, Hora, Cuenta, Estado, Ejecutar como, Comisión
-5. Columnas válidas en informe_ventas: ID de transacción, Fecha, Hora, Cuenta, Descripción, Cantidad, Precio (Bruto), Precio (Neto), Últimos 4 dígitos
-6. Excluir propinas con WHERE "Descripción" NOT ILIKE '%Tip%'
-7. Si obtienes un error, analízalo y genera una nueva consulta corregida
-8. Responde siempre en español y de forma clara para dueños de negocio
+3. Usa solo las tablas y columnas de ESQUEMA; los nombres con mayúsculas, espacios o tildes van entre comillas dobles
+4. Excluir propinas con WHERE "Descripción" NOT ILIKE '%Tip%'
+5. Para agrupar por sede usa GROUP BY sede_sk y JOIN dw.dim_sede (nombre_sede); no clasifiques "Cuenta" con CASE/ILIKE
+6. Si obtienes un error, analízalo y genera una nueva consulta corregida
+7. Responde siempre en español y de forma clara para dueños de negocio
 
 KPIs PREDEFINIDOS DISPONIBLES:
-{kpi_descriptions}
+{kpi_descriptions}"""
 
-Pregunta del usuario: """ + question
 
+def build_initial_state(question: str) -> Dict[str, Any]:
+    """Estado inicial del grafo: esquema relevante + pregunta (el prompt estático lo agrega el preludio)"""
+    prelude = _lazy_components.get("prelude")
+    if prelude is not None:
+        record_question(prelude)
     initial_state = {
         "question": question,
         "messages": [
-            SystemMessage(content=initial_system_message),
+            SystemMessage(content=f"ESQUEMA:\n{build_schema_context(question)}"),
             HumanMessage(content=question)
         ],
         "sql_query": None,
         "execution_success": None,
         "result_rows": None,
+        "result_set": None,
         "final_response": None,
         "insights_analysis": None,
-        "attempt_count": 0
+        "attempt_count": 0,
+        "budget": new_budget(),
     }
+    return initial_state
+
+
+def _process_question_uncached(question: str, graph) -> Dict[str, Any]:
+    """Procesa una pregunta usando el grafo ReAct real"""
+    
+    # ⚡ KPI conocido: SQL registrado directo + una sola llamada al LLM
+    fast_result = try_fast_path(question, KPI_REGISTRY, _run_kpi_rows, _lazy_components.get('llm'))
+    if fast_result:
+        return fast_result
+    
+    initial_state = build_initial_state(question)
     
     print(f"\n💬 '{question}'")
     print("-" * 60)
     print("🔄 Iniciando ciclo ReAct REAL con tool calling...")
     
     try:
-        # Aplicar límite de iteraciones manualmente si es necesario
-        final_state = graph.invoke(initial_state)
+        # recursion_limit es el tope duro; el presupuesto del estado corta antes
+        final_state = graph.invoke(initial_state, config=graph_config())
         
         # Extraer la respuesta final del último mensaje
         messages = final_state.get("messages", [])
@@ -616,7 +887,19 @@ Pregunta del usuario: """ + question
         return {
             'response': final_response,
             'messages': messages,
-            'attempts': final_state.get('attempt_count', 0)
+            'attempts': final_state.get('attempt_count', 0),
+            'sql_query': final_state.get('sql_query'),
+            'result_rows': final_state.get('result_rows'),
+            'budget': initial_state["budget"].summary(),
+        }
+    except GraphRecursionError:
+        record_recursion_limit()
+        print(f"⏳ recursion_limit alcanzado ({initial_state['budget'].describe()})")
+        return {
+            'response': "No alcancé a completar el análisis dentro del límite de pasos. Intenta acotar la pregunta.",
+            'messages': [],
+            'attempts': 0,
+            'budget': initial_state["budget"].summary(),
         }
     except Exception as e:
         error_msg = f"Error en proceso ReAct: {str(e)}"
@@ -630,6 +913,13 @@ Pregunta del usuario: """ + question
 
 
 
+def _reasoning_format_check(response) -> Optional[str]:
+    """Chequeo de confianza del router para el reasoning en texto (la respuesta final la redacta el grande)"""
+    if not validate_reasoning_format(response.content):
+        return "formato inválido"
+    return "respuesta final" if re.search(r"ACTION:\s*final_answer", response.content) else None
+
+
 def validate_reasoning_format(content: str) -> bool:
     """
     Validar que el reasoning tenga la estructura obligatoria.
@@ -705,7 +995,7 @@ def main():
         if not verify_openai_connection(api_key):
             raise ConnectionError("OpenAI no disponible")
         
-        llm = ChatOpenAI(model="gpt-4o", temperature=0, max_tokens=1500)
+        llm = ChatOpenAI(model=ROUTER_LARGE_MODEL, temperature=0, max_tokens=1500)
         db = create_database_connection()
 
         
@@ -726,12 +1016,14 @@ def main():
             print(f"   • {kpi_name}: {kpi_info['description']}")
         
         # Crear grafo ReAct real
-        graph = create_react_graph_real(llm, db)
+        graph = create_react_graph_real(llm, db, small_llm=create_small_llm())
         print("\n⚡ Listo para consultas SQL con arquitectura ReAct REAL")
         
+        streaming = os.getenv("AGENT_STREAMING", "1") == "1"
         while True:
             q = input("\n💬 Bolsillo > ").strip()
             if q.lower() in ['salir', 'exit', 'q']: 
+                print_agent_stats()
                 break
             if not q: 
                 continue
@@ -744,16 +1036,28 @@ def main():
                     print(f"     Palabras clave: {', '.join(kpi_info['keywords'])}")
                 continue
             
+            if q.lower() == '/stream':
+                streaming = not streaming
+                print(f"\n📡 Streaming {'activado' if streaming else 'desactivado'}")
+                continue
+            
+            if q.lower() == '/cache':
+                print_agent_stats()
+                continue
+            
             if q.lower() == '/schema':
                 schema = get_database_schema(db)
                 print(f"\n🗃️ ESQUEMA TÉCNICO:\n{schema}")
                 continue
             
-            result = process_question_react(q, graph)
-            print("\n" + "="*70)
-            print("🤖 RESPUESTA FINAL")
-            print("="*70)
-            print(result['response'])
+            if streaming:
+                result = print_stream(stream_question_react(q, graph))
+            else:
+                result = process_question_react(q, graph)
+                print("\n" + "="*70)
+                print("🤖 RESPUESTA FINAL")
+                print("="*70)
+                print(result['response'])
             
             # Mostrar detalles si se desea
             show_details = input("\n¿Ver detalles del proceso? (s/n): ").strip().lower()
@@ -766,6 +1070,11 @@ def main():
             
             if result.get('attempts', 0) > 0:
                 print(f"\n🔄 Intentos: {result['attempts']}")
+            if result.get('cache'):
+                print(f"\n💾 Desde caché ({result['cache']['method']}), ahorro ~{result['cache']['latency_saved_ms'] / 1000:.1f}s | {answer_cache.format_stats()}")
+            if result.get('fast_path'):
+                fp = result['fast_path']
+                print(f"\n⚡ Ruta rápida: {fp['kpi']} ({fp['method']}, {fp['total_ms']:.0f} ms, narrativa {fp['narrative']})")
     
     except Exception as e:
         print(f"\n❌ Error crítico: {e}")
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import Any, Dict, List
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# ========================================================================
+# BENCHMARK: REASONING EN TEXTO vs ESTRUCTURADO (react_agent_rag.py)
+# ========================================================================
+# Corre las mismas preguntas por el grafo en los dos modos y reporta, por
+# pregunta respondida, cuántas llamadas al LLM se hicieron y el tiempo de
+# pared. Se invoca el grafo directo (sin caché de respuestas ni ruta rápida)
+# para medir solo el ciclo ReAct.
+#
+#   python reasoning_benchmark.py
+#   python reasoning_benchmark.py --modos text structured --repeticiones 2 --json bench.json
+DEFAULT_QUESTIONS = [
+    "¿Cuáles son las ventas por sede?",
+    "¿Cuáles son los productos más vendidos?",
+    "¿Cuánto dejan las propinas por sede?",
+    "¿Qué sede tiene el mayor ticket promedio?",
+    "¿Qué productos venden más en la tarde en Merced?",
+]
+
+
+class LLMCallCounter(BaseCallbackHandler):
+    """Cuenta invocaciones al modelo (chat o completions) durante una pregunta"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs) -> None:
+        self.calls += 1
+
+    def on_llm_start(self, serialized, prompts, **kwargs) -> None:
+        self.calls += 1
+
+
+def run_mode(llm, db, mode: str, questions: List[str], repetitions: int) -> Dict[str, Any]:
+    from agent_budget import graph_config
+    from react_agent_rag import build_initial_state, create_react_graph_real
+
+    graph = create_react_graph_real(llm, db, reasoning_mode=mode)
+    calls: List[int] = []
+    latencies: List[float] = []
+    errores = 0
+    for _ in range(repetitions):
+        for question in questions:
+            counter = LLMCallCounter()
+            start = time.perf_counter()
+            try:
+                final_state = graph.invoke(build_initial_state(question), config=graph_config({"callbacks": [counter]}))
+                messages = final_state.get("messages", [])
+                if not messages or not getattr(messages[-1], "content", ""):
+                    errores += 1
+                    continue
+            except Exception as e:
+                print(f"⚠️ [{mode}] {question}: {e}")
+                errores += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+            calls.append(counter.calls)
+            print(f"   [{mode}] {counter.calls} llamadas, {latencies[-1] / 1000:.1f}s | {question}")
+
+    return {
+        "modo": mode,
+        "respondidas": len(latencies),
+        "errores": errores,
+        "llamadas_promedio": round(statistics.mean(calls), 2) if calls else 0.0,
+        "llamadas_max": max(calls) if calls else 0,
+        "p50_ms": round(statistics.median(latencies), 1) if latencies else 0.0,
+        "promedio_ms": round(statistics.mean(latencies), 1) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Llamadas LLM y tiempo por pregunta: reasoning texto vs estructurado")
+    parser.add_argument("--modos", nargs="+", choices=["text", "structured"], default=["text", "structured"])
+    parser.add_argument("--repeticiones", type=int, default=1)
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    # La caché de resultados SQL haría que el segundo modo parezca más rápido
+    os.environ["SQL_CACHE_ENABLED"] = "0"
+
+    from langchain_openai import ChatOpenAI
+
+    from config.environment import setup_environment
+    from database import create_database_connection
+
+    setup_environment()
+    llm = ChatOpenAI(model="gpt-4o", temperature=0, max_tokens=1500)
+    db = create_database_connection()
+
+    resultados = [run_mode(llm, db, mode, DEFAULT_QUESTIONS, args.repeticiones) for mode in args.modos]
+
+    print(f"\n   {'modo':>10} {'respondidas':>11} {'llamadas/preg':>13} {'máx':>4} {'p50 ms':>9} {'prom ms':>9} {'errores':>7}")
+    for fila in resultados:
+        print(f"   {fila['modo']:>10} {fila['respondidas']:>11} {fila['llamadas_promedio']:>13.2f} {fila['llamadas_max']:>4} "
+              f"{fila['p50_ms']:>9.0f} {fila['promedio_ms']:>9.0f} {fila['errores']:>7}")
+    if len(resultados) == 2 and resultados[0]["llamadas_promedio"] and resultados[0]["promedio_ms"]:
+        antes, despues = resultados
+        print(f"\n📉 {antes['modo']} → {despues['modo']}: "
+              f"{1 - despues['llamadas_promedio'] / antes['llamadas_promedio']:.0%} menos llamadas, "
+              f"{1 - despues['promedio_ms'] / antes['promedio_ms']:.0%} menos tiempo por pregunta")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"resultados": resultados}, f, indent=2)
+        print(f"📝 Resultados guardados en {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime, time as dtime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence
+
+# ========================================================================
+# CODIFICACIÓN DE RESULTADOS SQL (execute_sql → LLM)
+# ========================================================================
+# Una lista de dicts repite el nombre de cada columna en cada fila: en KPIs
+# anchos (medios_pago, fidelidad_clientes) la mayoría de los tokens son
+# claves. El resultado se guarda tipado (ResultSet) en el artifact del
+# ToolMessage y al LLM se le envía en un formato compacto:
+#   - markdown:     tabla | a | b | (por defecto, la más legible para el LLM)
+#   - header_rows:  {"columns": [...], "rows": [[...], ...]}
+#   - columnar:     {"columns": [...], "data": [[col a], [col b]]}
+#   - json:         lista de dicts (formato anterior, línea base)
+# Medición por KPI: python result_encoding.py medir
+RESULT_FORMAT = os.getenv("AGENT_RESULT_FORMAT", "markdown")
+RESULT_MAX_ROWS = int(os.getenv("AGENT_RESULT_MAX_ROWS", "50"))
+RESULT_FORMATS = ("markdown", "header_rows", "columnar", "json")
+EMPTY_RESULT = "EMPTY_RESULT"
+# Avisos de una línea antes de la tabla (p. ej. la reparación automática de sql_repair)
+RESULT_NOTE_PREFIX = "[SQL "
+
+_stats_lock = threading.Lock()
+encoding_stats = {"results": 0, "json_bytes": 0, "encoded_bytes": 0, "json_tokens": 0, "encoded_tokens": 0}
+
+
+def plain_value(value: Any) -> Any:
+    """Valor nativo de JSON: Decimal → int/float, fechas → ISO"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (datetime, date, dtime)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return str(value)
+
+
+def _column_type(values: Sequence[Any]) -> str:
+    tipos = {type(v) for v in values if v is not None}
+    if not tipos:
+        return "null"
+    if tipos == {bool}:
+        return "bool"
+    if tipos <= {int}:
+        return "int"
+    if tipos <= {int, float}:
+        return "float"
+    return "text"
+
+
+@dataclass
+class ResultSet:
+    """Resultado tipado: columnas + filas como listas (sin repetir claves)"""
+    columns: List[str]
+    rows: List[List[Any]]
+    types: List[str]
+    total_rows: int
+    # Resultados grandes (sql_executor): estadísticas sobre todas las filas leídas
+    summary: Optional[Dict[str, Dict[str, Any]]] = None
+    capped: bool = False
+
+    @classmethod
+    def from_rows(cls, columns: Sequence[str], rows: List[List[Any]], total_rows: int) -> "ResultSet":
+        """Filas ya normalizadas con plain_value; los tipos se infieren de ellas"""
+        types = [_column_type([row[i] for row in rows]) for i in range(len(columns))]
+        return cls(columns=list(columns), rows=rows, types=types, total_rows=total_rows)
+
+    @classmethod
+    def from_records(cls, records: Sequence[Dict[str, Any]], max_rows: int = RESULT_MAX_ROWS) -> "ResultSet":
+        columns = list(records[0].keys()) if records else []
+        rows = [[plain_value(record.get(c)) for c in columns] for record in records[:max_rows]]
+        return cls.from_rows(columns, rows, len(records))
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_rows > len(self.rows)
+
+    def records(self) -> List[Dict[str, Any]]:
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
+    def column(self, name: str) -> List[Any]:
+        index = self.columns.index(name)
+        return [row[index] for row in self.rows]
+
+    def head(self, n: int) -> "ResultSet":
+        return ResultSet(columns=self.columns, rows=self.rows[:n], types=self.types, total_rows=self.total_rows,
+                         summary=self.summary, capped=self.capped)
+
+    # --- Serialización --------------------------------------------------
+    def to_json(self) -> str:
+        """header_rows con tipos: lo que se guarda en la caché SQL"""
+        return json.dumps({"columns": self.columns, "types": self.types, "rows": self.rows,
+                           "total_rows": self.total_rows, "summary": self.summary, "capped": self.capped},
+                          ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, text: str) -> "ResultSet":
+        data = json.loads(text)
+        return cls(columns=data["columns"], rows=data["rows"], types=data["types"], total_rows=data["total_rows"],
+                   summary=data.get("summary"), capped=data.get("capped", False))
+
+    def _total_label(self) -> str:
+        return f"{self.total_rows}+" if self.capped else str(self.total_rows)
+
+    def encode(self, fmt: str = RESULT_FORMAT) -> str:
+        if not self.rows:
+            return EMPTY_RESULT
+        if fmt == "json":
+            return json.dumps(self.records(), default=str)
+        if fmt == "header_rows":
+            payload = {"columns": self.columns, "rows": self.rows}
+        elif fmt == "columnar":
+            payload = {"columns": self.columns, "data": [self.column(c) for c in self.columns]}
+        elif fmt == "markdown":
+            return self._markdown()
+        else:
+            raise ValueError(f"Formato '{fmt}' no soportado. Disponibles: {', '.join(RESULT_FORMATS)}")
+        if self.truncated:
+            payload["total_rows"] = self._total_label() if self.capped else self.total_rows
+            if self.summary:
+                payload["summary"] = self.summary
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+    def _markdown(self) -> str:
+        def celda(value: Any) -> str:
+            if value is None:
+                return ""
+            if isinstance(value, float):
+                return f"{value:.6g}" if abs(value) < 1e6 else f"{value:.0f}"
+            return str(value).replace("|", "\\|").replace("\n", " ")
+
+        lines = ["| " + " | ".join(self.columns) + " |", "|" + "---|" * len(self.columns)]
+        lines.extend("| " + " | ".join(celda(v) for v in row) + " |" for row in self.rows)
+        if self.truncated:
+            lines.append(f"({len(self.rows)} de {self._total_label()} filas)")
+            if self.summary:
+                lines.append(f"Resumen de las {self._total_label()} filas:")
+                lines.extend(f"- {columna}: " + ", ".join(f"{k} {celda(v)}" for k, v in stats.items())
+                             for columna, stats in self.summary.items())
+        return "\n".join(lines)
+
+
+# ========================================================================
+# LECTURA DE CONTENIDO YA CODIFICADO (compactación de contexto)
+# ========================================================================
+_MD_SPLIT_RE = re.compile(r"(?<!\\)\|")
+_MD_TOTAL_RE = re.compile(r"^\((\d+) de (\d+)(\+?) filas\)$")
+
+
+def _md_value(text: str) -> Any:
+    text = text.strip().replace("\\|", "|")
+    if text == "":
+        return None
+    for caster in (int, float):
+        try:
+            return caster(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _parse_markdown(content: str) -> Optional[ResultSet]:
+    lines = [line.strip() for line in content.strip().splitlines()]
+    if len(lines) < 2 or not lines[0].startswith("|") or not lines[1].startswith("|---"):
+        return None
+    columns = [c.strip() for c in _MD_SPLIT_RE.split(lines[0].strip("|"))]
+    rows, total, capped = [], None, False
+    for line in lines[2:]:
+        match = _MD_TOTAL_RE.match(line)
+        if match:
+            total = int(match.group(2))
+            capped = bool(match.group(3))
+        elif line.startswith("|"):
+            rows.append([_md_value(c) for c in _MD_SPLIT_RE.split(line[1:-1])])
+    types = [_column_type([row[i] for row in rows if i < len(row)]) for i in range(len(columns))]
+    return ResultSet(columns=columns, rows=rows, types=types, total_rows=total or len(rows), capped=capped)
+
+
+def parse_result(content: str) -> Optional[ResultSet]:
+    """ResultSet desde cualquiera de los formatos; None si no es un resultado tabular"""
+    while content.startswith(RESULT_NOTE_PREFIX) and "\n" in content:
+        content = content.split("\n", 1)[1]
+    if content == EMPTY_RESULT:
+        return ResultSet(columns=[], rows=[], types=[], total_rows=0)
+    if content.lstrip().startswith("|"):
+        return _parse_markdown(content)
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(data, list) and all(isinstance(r, dict) for r in data):
+        return ResultSet.from_records(data, max_rows=len(data))
+    if isinstance(data, dict) and "columns" in data:
+        if "rows" in data:
+            rows = data["rows"]
+        elif "data" in data:
+            rows = [list(r) for r in zip(*data["data"])]
+        else:
+            return None
+        types = data.get("types") or [_column_type([row[i] for row in rows]) for i in range(len(data["columns"]))]
+        total = str(data.get("total_rows", len(rows)))
+        return ResultSet(columns=data["columns"], rows=rows, types=types, total_rows=int(total.rstrip("+")),
+                         summary=data.get("summary"), capped=total.endswith("+"))
+    return None
+
+
+# ========================================================================
+# MEDICIÓN
+# ========================================================================
+def measure_encodings(result: ResultSet) -> Dict[str, Dict[str, int]]:
+    """Bytes y tokens de cada formato para el mismo resultado"""
+    from context_budget import count_tokens
+
+    medidas = {}
+    for fmt in RESULT_FORMATS:
+        text = result.encode(fmt)
+        medidas[fmt] = {"bytes": len(text.encode("utf-8")), "tokens": count_tokens(text)}
+    return medidas
+
+
+def encode_for_llm(result: ResultSet, fmt: str = RESULT_FORMAT) -> str:
+    """Contenido del ToolMessage; registra la reducción frente a la lista de dicts"""
+    content = result.encode(fmt)
+    if result.rows and fmt != "json":
+        from context_budget import count_tokens
+
+        baseline = result.encode("json")
+        with _stats_lock:
+            encoding_stats["results"] += 1
+            encoding_stats["json_bytes"] += len(baseline.encode("utf-8"))
+            encoding_stats["encoded_bytes"] += len(content.encode("utf-8"))
+            encoding_stats["json_tokens"] += count_tokens(baseline)
+            encoding_stats["encoded_tokens"] += count_tokens(content)
+    return content
+
+
+def format_encoding_stats() -> str:
+    with _stats_lock:
+        stats = dict(encoding_stats)
+    if not stats["results"]:
+        return f"🗜️ Resultados ({RESULT_FORMAT}): sin resultados codificados"
+    ahorro_tokens = 1 - stats["encoded_tokens"] / stats["json_tokens"] if stats["json_tokens"] else 0.0
+    ahorro_bytes = 1 - stats["encoded_bytes"] / stats["json_bytes"] if stats["json_bytes"] else 0.0
+    return (f"🗜️ Resultados ({RESULT_FORMAT}): {stats['results']} codificados | "
+            f"{stats['encoded_tokens']} tokens vs {stats['json_tokens']} en JSON (-{ahorro_tokens:.1%}) | "
+            f"{stats['encoded_bytes']} vs {stats['json_bytes']} bytes (-{ahorro_bytes:.1%})")
+
+
+def measure_kpis(run_sql, registry: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, int]]]:
+    """Ejecuta cada KPI y mide sus codificaciones (mismas RESULT_MAX_ROWS filas que el agente)"""
+    medidas = {}
+    for kpi_name, kpi in registry.items():
+        try:
+            records = run_sql(kpi["sql_template"])
+        except Exception as e:
+            print(f"⚠️ {kpi_name}: {e}")
+            continue
+        medidas[kpi_name] = measure_encodings(ResultSet.from_records(records))
+    return medidas
+
+
+def print_measurements(medidas: Dict[str, Dict[str, Dict[str, int]]]) -> None:
+    otros = [fmt for fmt in RESULT_FORMATS if fmt != "json"]
+    print(f"\n{'KPI':<28} {'json tok':>9} " + " ".join(f"{fmt + ' tok':>16}" for fmt in otros))
+    for kpi_name, medida in medidas.items():
+        base = medida["json"]["tokens"] or 1
+        celdas = [f"{medida[fmt]['tokens']:>7} ({1 - medida[fmt]['tokens'] / base:>5.0%})" for fmt in otros]
+        print(f"{kpi_name:<28} {medida['json']['tokens']:>9} " + " ".join(f"{c:>16}" for c in celdas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokens y bytes por formato de resultado para cada KPI")
+    subparsers = parser.add_subparsers(dest="accion", required=True)
+    measure_parser = subparsers.add_parser("medir", help="Ejecutar los KPIs de KPI_REGISTRY y comparar formatos")
+    measure_parser.add_argument("--kpis", nargs="+", help="Solo estos KPIs")
+    measure_parser.add_argument("--json", help="Guardar las medidas en este archivo")
+    args = parser.parse_args()
+
+    import psycopg2.extras
+
+    from db_pool import get_sync_connection
+    # main.py importa LangChain/LangGraph: solo se carga al medir
+    from main import KPI_REGISTRY
+
+    registry = {k: v for k, v in KPI_REGISTRY.items() if not args.kpis or k in args.kpis}
+    conn = get_sync_connection()
+    try:
+        def run_sql(sql: str) -> List[Dict[str, Any]]:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                cursor.execute(sql)
+                return [dict(row) for row in cursor.fetchall()]
+
+        print(f"🔍 Midiendo {len(registry)} KPIs (máx {RESULT_MAX_ROWS} filas)...")
+        medidas = measure_kpis(run_sql, registry)
+    finally:
+        conn.close()
+
+    print_measurements(medidas)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(medidas, f, indent=2)
+        print(f"📝 Medidas guardadas en {args.json}")
+
+
+if __name__ == "__main__":
+    main()
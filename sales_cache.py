@@ -0,0 +1,321 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from auth import get_current_user, User
+from db_pool import DatabasePool, get_db
+from etl_control import DATA_VERSION_QUERY
+
+# ========================================================================
+# CONFIGURACIÓN DE LA CACHÉ DE RESULTADOS
+# ========================================================================
+SALES_CACHE_ENABLED = os.getenv("SALES_CACHE_ENABLED", "1") not in ("0", "false", "False")
+SALES_CACHE_MAX_ENTRIES = int(os.getenv("SALES_CACHE_MAX_ENTRIES", "256"))
+SALES_CACHE_DEFAULT_TTL = int(os.getenv("SALES_CACHE_DEFAULT_TTL", "900"))
+SALES_CACHE_DIR = os.getenv("SALES_CACHE_DIR")  # Backend compartido en disco (opcional)
+SALES_CACHE_VERSION_POLL_SECONDS = float(os.getenv("SALES_CACHE_VERSION_POLL_SECONDS", "30"))
+
+# TTL por endpoint (segundos). Los datos solo cambian con el ETL, así que el TTL
+# es una red de seguridad: la invalidación real viene de etl.data_version.
+ENDPOINT_TTLS = {
+    "overview": 900,
+    "tips-analysis": 1800,
+    "peak-hours": 1800,
+    "customer-loyalty": 3600,
+    "purchase-behavior": 1800,
+    "top-products": 1800,
+    "payment-methods": 1800,
+    "hourly-sales": 1800,
+    "products-global": 1800,
+    "busy-hours": 1800,
+}
+
+
+@dataclass
+class CacheEntry:
+    payload: bytes
+    etag: str
+    data_version: int
+    expires_at: float
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+
+class LRUBackend:
+    """Caché en memoria del proceso con desalojo LRU"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expired:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class FileBackend:
+    """Caché compartida entre workers de la misma máquina (un archivo por clave)"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        entry = CacheEntry(
+            payload=raw["payload"].encode("utf-8"),
+            etag=raw["etag"],
+            data_version=raw["data_version"],
+            expires_at=raw["expires_at"],
+        )
+        if entry.expired:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        raw = {
+            "payload": entry.payload.decode("utf-8"),
+            "etag": entry.etag,
+            "data_version": entry.data_version,
+            "expires_at": entry.expires_at,
+        }
+        # Escritura atómica: otro worker nunca ve un archivo a medio escribir
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(raw, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"⚠️ No se pudo escribir caché en disco: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+# ========================================================================
+# CACHÉ DE ENDPOINTS /api/sales
+# ========================================================================
+class SalesCache:
+    """Caché de respuestas por endpoint + query params, invalidada por versión de datos"""
+
+    def __init__(self):
+        self.memory = LRUBackend(SALES_CACHE_MAX_ENTRIES)
+        self.disk = FileBackend(SALES_CACHE_DIR) if SALES_CACHE_DIR else None
+
+        self._data_version = 0
+        self._version_checked_at = 0.0
+        self._version_lock = asyncio.Lock()
+        self._key_locks: Dict[str, asyncio.Lock] = {}
+        self._version_table_missing = False
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+
+    # --- Versión de datos ----------------------------------------------
+    async def data_version(self, db: DatabasePool) -> int:
+        """Versión vigente, consultada como máximo cada SALES_CACHE_VERSION_POLL_SECONDS"""
+        if time.time() - self._version_checked_at < SALES_CACHE_VERSION_POLL_SECONDS:
+            return self._data_version
+
+        async with self._version_lock:
+            if time.time() - self._version_checked_at < SALES_CACHE_VERSION_POLL_SECONDS:
+                return self._data_version
+            try:
+                rows = await db.fetch_all(DATA_VERSION_QUERY)
+                version = int(rows[0]["version"]) if rows else 0
+            except Exception as e:
+                if not self._version_table_missing:
+                    print(f"⚠️ etl.data_version no disponible, la caché solo expirará por TTL: {e}")
+                    self._version_table_missing = True
+                version = self._data_version
+
+            if version != self._data_version:
+                print(f"🔄 Nueva versión de datos ({self._data_version} → {version}), invalidando caché")
+                self._clear()
+            self._data_version = version
+            self._version_checked_at = time.time()
+            return version
+
+    def invalidate(self) -> None:
+        """Invalidación explícita (fin de ETL): vacía la caché y fuerza releer la versión"""
+        self._clear()
+        self._version_checked_at = 0.0
+
+    def _clear(self) -> None:
+        self.memory.clear()
+        if self.disk:
+            self.disk.clear()
+        self.stats["invalidations"] += 1
+
+    # --- Lectura / escritura -------------------------------------------
+    @staticmethod
+    def build_key(endpoint: str, request: Request, data_version: int) -> str:
+        params = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+        return f"v{data_version}:{endpoint}?{params}"
+
+    def _get(self, key: str) -> Optional[CacheEntry]:
+        entry = self.memory.get(key)
+        if entry is None and self.disk:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.memory.set(key, entry)
+        return entry
+
+    def _set(self, key: str, entry: CacheEntry) -> None:
+        self.memory.set(key, entry)
+        if self.disk:
+            self.disk.set(key, entry)
+
+    async def respond(
+        self,
+        request: Request,
+        endpoint: str,
+        db: DatabasePool,
+        loader: Callable[[], Awaitable[List[Dict[str, Any]]]],
+    ) -> Response:
+        """
+        Devuelve la respuesta cacheada del endpoint o ejecuta loader() y la guarda.
+
+        Args:
+            request: Request entrante (query params e If-None-Match)
+            endpoint: Nombre lógico del endpoint (clave de ENDPOINT_TTLS)
+            db: Pool usado para leer la versión de datos
+            loader: Corrutina que ejecuta la consulta SQL real
+
+        Returns:
+            Response JSON con ETag, o 304 si el cliente ya tiene la versión vigente
+        """
+        if not SALES_CACHE_ENABLED:
+            return self._build_response(self._encode(await loader(), 0), request, "BYPASS")
+
+        version = await self.data_version(db)
+        key = self.build_key(endpoint, request, version)
+
+        entry = self._get(key)
+        if entry is None:
+            # Un solo loader por clave: las cargas simultáneas del dashboard esperan al primero
+            lock = self._key_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                entry = self._get(key)
+                if entry is None:
+                    self.stats["misses"] += 1
+                    try:
+                        rows = await loader()
+                    finally:
+                        self._key_locks.pop(key, None)
+                    entry = self._encode(rows, version, ENDPOINT_TTLS.get(endpoint, SALES_CACHE_DEFAULT_TTL))
+                    self._set(key, entry)
+                    return self._build_response(entry, request, "MISS")
+
+        self.stats["hits"] += 1
+        return self._build_response(entry, request, "HIT")
+
+    @staticmethod
+    def _encode(rows: List[Dict[str, Any]], data_version: int, ttl: int = 0) -> CacheEntry:
+        payload = json.dumps(jsonable_encoder(rows), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha1(payload).hexdigest()[:16]
+        return CacheEntry(
+            payload=payload,
+            etag=f'"v{data_version}-{digest}"',
+            data_version=data_version,
+            expires_at=time.time() + ttl,
+        )
+
+    def _build_response(self, entry: CacheEntry, request: Request, status: str) -> Response:
+        headers = {
+            "ETag": entry.etag,
+            "Cache-Control": "private, no-cache",
+            "X-Cache": status,
+            "X-Data-Version": str(entry.data_version),
+        }
+        if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.payload, media_type="application/json", headers=headers)
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+            "entries_memory": len(self.memory),
+            "disk_backend": self.disk.directory if self.disk else None,
+            "data_version": self._data_version,
+        }
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+sales_cache = SalesCache()
+
+cache_router = APIRouter(prefix="/api/sales/cache", tags=["sales"])
+
+
+@cache_router.get("/stats", response_model=Dict[str, Any])
+async def get_cache_stats(user: User = Depends(get_current_user)):
+    return sales_cache.metrics()
+
+
+@cache_router.post("/invalidate", response_model=Dict[str, Any])
+async def invalidate_cache(user: User = Depends(get_current_user), db: DatabasePool = Depends(get_db)):
+    sales_cache.invalidate()
+    return {"invalidated": True, "data_version": await sales_cache.data_version(db)}
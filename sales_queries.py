@@ -0,0 +1,582 @@
+# ========================================================================
+# CONSULTAS DE LOS ROUTERS /api/sales
+# ========================================================================
+# Registro único de las consultas de los dashboards, igual que KPI_REGISTRY
+# para el agente. Los routers las ejecutan y index_advisor.py las analiza con
+# EXPLAIN sin tener que levantar la API.
+
+
+# --- Tablas crudas (sales_routes.py) ---
+SALES_QUERIES = {
+    "overview": """
+        WITH TransaccionesUnicas AS (
+            -- 1. OBTENER COMISIÓN ÚNICA POR ID
+            -- Agrupamos por ID para asegurar que solo tomamos el costo una vez
+            -- y filtramos duplicados de estado (Exitosa/Pagado).
+            SELECT
+                "ID de transacción",
+                MAX("Comisión") AS costo_comision, -- Asumimos que la comisión viene como valor positivo del costo
+                MAX("Total") AS total_pos -- Usamos esto para validar contra la venta detallada
+            FROM transacciones
+            WHERE "Estado" IN ('Exitosa', 'Pagado')
+            GROUP BY "ID de transacción"
+        ),
+
+        VentasPorTicket AS (
+            -- 2. AGRUPAR ÍTEMS EN UN SOLO TICKET (Pre-agregación)
+            -- Esto convierte las N filas de productos en 1 fila por Ticket con su Sede.
+            SELECT
+                iv."ID de transacción",
+
+                -- Sede ya resuelta en la ingesta (sede_mapping.py)
+                MAX(iv.sede_sk) AS sede_sk,
+
+                -- Sumamos los ítems del ticket
+                SUM(iv."Precio (Bruto)") AS ticket_bruto,
+                SUM(iv."Precio (Neto)") AS ticket_neto
+
+            FROM informe_ventas iv
+            WHERE
+                iv."Descripción" NOT ILIKE '%Tip%'
+                AND iv."Descripción" NOT ILIKE '%Propina%'
+                AND iv."Precio (Bruto)" > 0
+            GROUP BY iv."ID de transacción"
+        )
+
+        SELECT
+            CASE
+                WHEN GROUPING(vt.sede_sk) = 1 THEN '>> TOTAL CONSOLIDADO <<'
+                ELSE COALESCE(MAX(ds.nombre_sede), 'Sede No Identificada')
+            END AS cuenta,
+
+            -- KPI 1: Transacciones
+            COUNT(vt."ID de transacción") AS transacciones,
+
+            -- KPI 2: Venta Bruta (Lo que paga el cliente)
+            SUM(vt.ticket_bruto) AS venta_bruta,
+
+            -- KPI 3: Costo SumUp (Lo que se queda la plataforma)
+            SUM(tu.costo_comision) AS comisiones_sumup,
+
+            -- KPI 4: A DEPOSITAR (Caja - Comisión)
+            -- Este es el dinero que efectivamente entra al banco
+            (SUM(vt.ticket_bruto) - SUM(tu.costo_comision)) AS liquido_a_recibir,
+
+            -- KPI 5: Ticket Promedio
+            ROUND(SUM(vt.ticket_bruto) / NULLIF(COUNT(vt."ID de transacción"), 0), 0) AS ticket_promedio,
+
+            -- KPI 6: Margen Real Operativo (Venta Neta - Comisiones)
+            -- Importante: Dinero sin IVA y sin Comisión (Ganancia real antes de costos de insumos)
+            (SUM(vt.ticket_neto) - SUM(tu.costo_comision)) AS margen_operativo_real
+
+        FROM VentasPorTicket vt
+        INNER JOIN TransaccionesUnicas tu ON vt."ID de transacción" = tu."ID de transacción"
+        LEFT JOIN dw.dim_sede ds ON ds.sede_sk = vt.sede_sk
+        GROUP BY ROLLUP(vt.sede_sk)
+        ORDER BY GROUPING(vt.sede_sk) ASC, venta_bruta DESC;
+    """,
+    "tips-analysis": """
+        WITH transacciones_base AS (
+            SELECT DISTINCT
+                t."ID de transacción",
+                iv.sede_sk
+            FROM transacciones t
+            INNER JOIN informe_ventas iv ON t."ID de transacción" = iv."ID de transacción"
+            WHERE t."Estado" = 'Exitosa'
+        ),
+        propinas AS (
+            SELECT iv."ID de transacción", SUM(iv."Precio (Neto)") AS monto_propina
+            FROM informe_ventas iv
+            WHERE LOWER(iv."Descripción") = 'tip'
+            GROUP BY iv."ID de transacción"
+        )
+        SELECT
+            COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede_unificada,
+            COUNT(DISTINCT tb."ID de transacción") AS transacciones_totales,
+            COUNT(DISTINCT p."ID de transacción") AS transacciones_con_propina,
+            ROUND(COUNT(DISTINCT p."ID de transacción")::NUMERIC / NULLIF(COUNT(DISTINCT tb."ID de transacción"), 0) * 100, 2) AS tasa_conversion_propina_pct,
+            SUM(p.monto_propina) AS propinas_totales,
+            ROUND(SUM(p.monto_propina) / NULLIF(COUNT(DISTINCT p."ID de transacción"), 0), 0) AS propina_promedio
+        FROM transacciones_base tb
+        LEFT JOIN propinas p ON tb."ID de transacción" = p."ID de transacción"
+        LEFT JOIN dw.dim_sede ds ON ds.sede_sk = tb.sede_sk
+        GROUP BY tb.sede_sk, ds.nombre_sede
+        ORDER BY tasa_conversion_propina_pct DESC;
+    """,
+    "peak-hours": """
+        SELECT
+            EXTRACT(HOUR FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS hora_del_dia,
+            COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Plaza Bolsillo') THEN "ID de transacción" END) AS sede_plaza_bolsillo,
+            COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Merced') THEN "ID de transacción" END) AS sede_merced,
+            COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Tajamar') THEN "ID de transacción" END) AS sede_tajamar,
+            COUNT(DISTINCT CASE WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Persa Victor Manuel') THEN "ID de transacción" END) AS sede_persa_victor_manuel
+        FROM informe_ventas
+        WHERE "Descripción" NOT ILIKE '%Tip%'
+          AND "Descripción" NOT ILIKE '%Importe personalizado%'
+          AND "Fecha" IS NOT NULL
+          AND "Fecha" ~ '^\\d{2}-\\d{2}-\\d{4}, \\d{2}:\\d{2}'
+        GROUP BY 1 ORDER BY 1 ASC;
+    """,
+    "customer-loyalty": """
+        WITH ventas_limpias AS (
+            SELECT
+                iv.sede_sk,
+                t."Últimos 4 dígitos" AS id_tarjeta,
+                TO_CHAR(CAST(SUBSTRING(t."Fecha" FROM 1 FOR 10) AS DATE), 'YYYY-MM') AS mes_operacion,
+                CAST(SUBSTRING(t."Fecha" FROM 1 FOR 10) AS DATE) AS fecha_dia
+            FROM transacciones t
+            INNER JOIN (SELECT "ID de transacción", MAX(sede_sk) AS sede_sk FROM informe_ventas GROUP BY 1) iv ON t."ID de transacción" = iv."ID de transacción"
+            WHERE t."Estado" = 'Exitosa' AND t."Últimos 4 dígitos" IS NOT NULL
+        ),
+        comportamiento_mensual AS (
+            SELECT sede_sk, mes_operacion, id_tarjeta, COUNT(DISTINCT fecha_dia) AS dias_visitados_al_mes
+            FROM ventas_limpias GROUP BY 1, 2, 3
+        )
+        SELECT
+            COALESCE(ds.nombre_sede, 'Sede No Identificada') AS nombre_sede, cm.mes_operacion,
+            COUNT(DISTINCT CASE WHEN cm.dias_visitados_al_mes = 1 THEN cm.id_tarjeta END) AS clientes_un_solo_dia,
+            COUNT(DISTINCT CASE WHEN cm.dias_visitados_al_mes = 2 THEN cm.id_tarjeta END) AS clientes_recurrentes_2_veces,
+            COUNT(DISTINCT CASE WHEN cm.dias_visitados_al_mes > 2 THEN cm.id_tarjeta END) AS clientes_fans_3_o_mas,
+            ROUND((COUNT(DISTINCT CASE WHEN cm.dias_visitados_al_mes >= 2 THEN cm.id_tarjeta END)::numeric / NULLIF(COUNT(DISTINCT cm.id_tarjeta), 0)) * 100, 2) AS tasa_fidelidad_mes_pct
+        FROM comportamiento_mensual cm
+        LEFT JOIN dw.dim_sede ds ON ds.sede_sk = cm.sede_sk
+        GROUP BY cm.sede_sk, ds.nombre_sede, cm.mes_operacion
+        ORDER BY cm.mes_operacion DESC;
+    """,
+    "purchase-behavior": """
+        WITH ventas_consolidadas AS (
+            SELECT
+                iv.sede_sk,
+                t."ID de transacción",
+                COUNT(*) AS total_items,
+                SUM(iv."Precio (Bruto)") AS monto_boleta
+            FROM transacciones t
+            INNER JOIN informe_ventas iv ON t."ID de transacción" = iv."ID de transacción"
+            WHERE t."Estado" = 'Exitosa' AND LOWER(iv."Descripción") NOT IN ('tip', 'importe personalizado') AND iv."Precio (Bruto)" > 0
+            GROUP BY 1, 2
+        )
+        SELECT
+            COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede_unificada,
+            COUNT(CASE WHEN vc.total_items = 1 THEN 1 END) AS ventas_solitarias,
+            COUNT(CASE WHEN vc.total_items > 1 THEN 1 END) AS ventas_con_acompanamiento,
+            ROUND(COUNT(CASE WHEN vc.total_items > 1 THEN 1 END)::numeric / NULLIF(COUNT(*), 0) * 100, 2) AS tasa_de_sugestion_exito_pct,
+            ROUND(AVG(CASE WHEN vc.total_items = 1 THEN vc.monto_boleta END), 0) AS ticket_promedio_solo,
+            ROUND(AVG(CASE WHEN vc.total_items > 1 THEN vc.monto_boleta END), 0) AS ticket_promedio_acompanado
+        FROM ventas_consolidadas vc
+        LEFT JOIN dw.dim_sede ds ON ds.sede_sk = vc.sede_sk
+        GROUP BY vc.sede_sk, ds.nombre_sede;
+    """,
+    "top-products": """
+        WITH ventas_sede_producto AS (
+            SELECT
+                sede_sk,
+                "Descripción" AS producto,
+                SUM("Precio (Bruto)") AS ingresos_producto
+            FROM informe_ventas
+            WHERE "Descripción" NOT ILIKE '%Tip%' AND "Descripción" NOT ILIKE '%Importe personalizado%' AND "Precio (Bruto)" > 0
+            GROUP BY 1, 2
+        ),
+        ranking_productos AS (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY sede_sk ORDER BY ingresos_producto DESC) AS ranking
+            FROM ventas_sede_producto
+        )
+        SELECT
+            COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede_unificada,
+            rp.producto, rp.ingresos_producto, rp.ranking
+        FROM ranking_productos rp
+        LEFT JOIN dw.dim_sede ds ON ds.sede_sk = rp.sede_sk
+        WHERE rp.ranking <= 5
+        ORDER BY sede_unificada, rp.ranking;
+    """,
+    "payment-methods": """
+        WITH TransaccionesValidas AS (
+                 -- 1. BASE DE TRANSACCIONES (Igual al Overview pero inteligente)
+                 -- El problema del 55% efectivo es que tomábamos filas 'Pagado' que no dicen 'DEBIT'.
+                 -- Solución: Usamos DISTINCT ON para tomar 1 fila por ID.
+                 -- El ORDER BY ... NULLS LAST prioriza la fila que SÍ tiene dato (DEBIT/CREDIT).
+                 SELECT DISTINCT ON ("ID de transacción")
+                     "ID de transacción",
+                     "Ejecutar como", -- Aquí viene DEBIT, CREDIT o NULL
+                     "Comisión"
+                 FROM transacciones
+                 WHERE "Estado" IN ('Exitosa', 'Pagado')
+                 ORDER BY "ID de transacción", "Ejecutar como" NULLS LAST
+             ),
+             VentasPorTicket AS (
+                 -- 2. SUMA DE VENTA BRUTA (Igual al Overview)
+                 -- Agrupamos los items de informe_ventas por ticket.
+                 SELECT
+                     iv."ID de transacción",
+                     SUM(iv."Precio (Bruto)") AS venta_total_bruta
+                 FROM informe_ventas iv
+                 WHERE
+                     iv."Descripción" NOT ILIKE '%Tip%'
+                     AND iv."Descripción" NOT ILIKE '%Propina%'
+                     AND iv."Precio (Bruto)" > 0
+                 GROUP BY iv."ID de transacción"
+             ),
+             Consolidado AS (
+                 -- 3. UNIÓN FINAL (MATCH EXACTO)
+                 -- Hacemos INNER JOIN igual que en el Overview.
+                 -- Si la venta está en el Overview, estará aquí.
+                 SELECT
+                     -- Clasificación corregida
+                     CASE
+                         WHEN t."Ejecutar como" = 'DEBIT' THEN 'Débito'
+                         WHEN t."Ejecutar como" = 'CREDIT' THEN 'Crédito'
+                         -- Solo si realmente no hay dato de tarjeta, asumimos Efectivo
+                         ELSE 'Efectivo'
+                     END AS medio_pago_limpio,
+
+                     v.venta_total_bruta,
+                     COALESCE(t."Comisión", 0) AS comision
+
+                 FROM VentasPorTicket v
+                 INNER JOIN TransaccionesValidas t ON v."ID de transacción" = t."ID de transacción"
+             ),
+             AgrupacionFinal AS (
+                 -- 4. AGRUPACIÓN
+                 SELECT
+                     medio_pago_limpio,
+                     COUNT(*) AS total_transacciones,
+                     SUM(venta_total_bruta) AS ventas_totales,
+                     SUM(comision) AS comision_total
+                 FROM Consolidado
+                 GROUP BY ROLLUP(medio_pago_limpio)
+             )
+
+             SELECT
+                 COALESCE(medio_pago_limpio, 'TOTAL GENERAL') AS medio_de_pago,
+
+                 total_transacciones,
+                 -- % Transacciones
+                 ROUND(
+                     total_transacciones::numeric /
+                     NULLIF(MAX(CASE WHEN medio_pago_limpio IS NULL THEN total_transacciones END) OVER (), 0) * 100,
+                     2
+                 ) AS participacion_transacciones_pct,
+
+                 ventas_totales,
+                 -- % Ventas
+                 ROUND(
+                     ventas_totales /
+                     NULLIF(MAX(CASE WHEN medio_pago_limpio IS NULL THEN ventas_totales END) OVER (), 0) * 100,
+                     2
+                 ) AS participacion_ventas_pct,
+
+                 comision_total,
+                 -- Tasa Comisión
+                 ROUND(
+                     comision_total / NULLIF(ventas_totales, 0) * 100,
+                     2
+                 ) AS tasa_comision_pct
+
+             FROM AgrupacionFinal
+             ORDER BY (medio_pago_limpio IS NULL) ASC, ventas_totales DESC;
+    """,
+    "hourly-sales": """
+        WITH transacciones_limpias AS (
+            SELECT DISTINCT t."ID de transacción", t."Total" AS venta_bruta, t."Comisión" AS comision,
+            EXTRACT(HOUR FROM TO_TIMESTAMP(t."Fecha", 'YYYY-MM-DD HH24:MI:SS')) AS hora
+            FROM transacciones t WHERE t."Estado" = 'Exitosa' AND t."Fecha" IS NOT NULL
+        ),
+        sede_por_transaccion AS (
+            SELECT DISTINCT iv."ID de transacción", iv.sede_sk
+            FROM informe_ventas iv
+        )
+        SELECT COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede, t.hora, COUNT(*) AS transacciones, SUM(venta_bruta) AS ventas_brutas
+        FROM transacciones_limpias t
+        INNER JOIN sede_por_transaccion s ON t."ID de transacción" = s."ID de transacción"
+        LEFT JOIN dw.dim_sede ds ON ds.sede_sk = s.sede_sk
+        GROUP BY s.sede_sk, 1, 2 ORDER BY 1, 2;
+    """,
+    "products-global": """
+        WITH TotalRealEmpresa AS (
+              -- 1. CALCULAMOS EL TOTAL VERDADERO (~27M)
+              -- Incluimos TODO (incluso importe personalizado) para que el % Share sea honesto.
+              SELECT
+                  SUM("Precio (Bruto)") as gran_total_dinero,
+                  COUNT(DISTINCT "ID de transacción") as gran_total_tickets
+              FROM informe_ventas
+              WHERE
+                  "Descripción" NOT ILIKE '%tip%'
+                  AND "Descripción" NOT ILIKE '%propina%'
+                  AND "Precio (Bruto)" > 0
+          ),
+          BaseProductos AS (
+              -- 2. LISTA LIMPIA (Aquí SÍ filtramos 'Importe personalizado')
+              SELECT
+                  -- Normalización: Mayúscula inicial y quitamos espacios
+                  CASE
+                      WHEN "Descripción" IS NULL OR TRIM("Descripción") = '' THEN 'Producto Sin Nombre'
+                      ELSE TRIM(INITCAP("Descripción"))
+                  END AS producto_normalizado,
+
+                  "Cantidad",
+                  "Precio (Bruto)" AS monto_bruto,
+                  "ID de transacción"
+              FROM informe_ventas
+              WHERE
+                  "Descripción" NOT ILIKE '%tip%'
+                  AND "Descripción" NOT ILIKE '%propina%'
+                  -- FILTRO SOLICITADO: Eliminamos la venta manual
+                  AND "Descripción" NOT ILIKE '%Importe personalizado%'
+                  AND "Precio (Bruto)" > 0
+          )
+
+          SELECT
+              bp.producto_normalizado AS producto,
+
+              -- Unidades
+              SUM(bp."Cantidad") AS unidades_vendidas,
+
+              -- Ventas ($)
+              SUM(bp.monto_bruto) AS ventas_brutas,
+
+              -- Precio Promedio
+              ROUND(SUM(bp.monto_bruto) / NULLIF(SUM(bp."Cantidad"), 0), 0) AS precio_promedio,
+
+              -- Share de Ventas (%)
+              -- Se compara contra el TOTAL DE LA EMPRESA (incluyendo lo manual)
+              ROUND(
+                  (SUM(bp.monto_bruto) /
+                   NULLIF((SELECT gran_total_dinero FROM TotalRealEmpresa), 0)) * 100,
+                  2
+              ) as share_ventas_pct,
+
+              -- Tasa de Penetración (%)
+              ROUND(
+                  (COUNT(DISTINCT bp."ID de transacción")::numeric /
+                   NULLIF((SELECT gran_total_tickets FROM TotalRealEmpresa), 0)) * 100,
+                  2
+              ) as tasa_penetracion_pct
+
+          FROM BaseProductos bp
+          GROUP BY 1
+          ORDER BY ventas_brutas DESC
+          LIMIT 50;
+    """,
+    "busy-hours": """
+        SELECT
+            DATE(TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS dia,
+
+            CASE EXTRACT(DOW FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI'))
+                WHEN 1 THEN 'Lunes'
+                WHEN 2 THEN 'Martes'
+                WHEN 3 THEN 'Miércoles'
+                WHEN 4 THEN 'Jueves'
+                WHEN 5 THEN 'Viernes'
+                WHEN 6 THEN 'Sábado'
+                WHEN 0 THEN 'Domingo'
+            END AS dia_semana,
+
+            EXTRACT(HOUR FROM TO_TIMESTAMP("Fecha", 'DD-MM-YYYY, HH24:MI')) AS hora_del_dia,
+
+            COUNT(DISTINCT CASE
+                WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Plaza Bolsillo')
+                THEN "ID de transacción" END) AS plaza_bolsillo,
+
+            COUNT(DISTINCT CASE
+                WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Merced')
+                THEN "ID de transacción" END) AS merced,
+
+            COUNT(DISTINCT CASE
+                WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Tajamar')
+                THEN "ID de transacción" END) AS tajamar,
+
+            COUNT(DISTINCT CASE
+                WHEN sede_sk = (SELECT sede_sk FROM dw.dim_sede WHERE nombre_sede = 'Persa Victor Manuel')
+                THEN "ID de transacción" END) AS persa_victor_manuel
+
+        FROM informe_ventas
+        WHERE "Descripción" NOT ILIKE '%Tip%'
+          AND "Descripción" NOT ILIKE '%Importe personalizado%'
+          AND "Fecha" IS NOT NULL
+        GROUP BY 1,2,3
+        ORDER BY 1,3;
+    """,
+}
+
+
+# --- Modelo estrella / agregados bi.agg_* (sales_routes_star_model.py) ---
+STAR_MODEL_QUERIES = {
+    "overview": """
+        SELECT
+            COALESCE(ds.nombre_sede, '>> TOTAL CONSOLIDADO <<') AS cuenta,
+            SUM(a.transacciones) AS transacciones,
+            SUM(a.venta_bruta) AS venta_bruta,
+            SUM(a.comisiones) AS comisiones_sumup,
+            SUM(a.venta_bruta) - SUM(a.comisiones) AS liquido_a_recibir,
+            ROUND(SUM(a.venta_bruta) / NULLIF(SUM(a.transacciones), 0), 0) AS ticket_promedio,
+            SUM(a.venta_neta) - SUM(a.comisiones) AS margen_operativo_real
+        FROM bi.agg_tickets_dia_sede a
+        JOIN dw.dim_sede ds ON a.sede_sk = ds.sede_sk
+        GROUP BY ROLLUP(ds.nombre_sede)
+        ORDER BY (ds.nombre_sede IS NULL) ASC, venta_bruta DESC;
+    """,
+    "tips-analysis": """
+        SELECT
+            COALESCE(ds.nombre_sede, 'No Identificada') AS sede_unificada,
+            SUM(a.transacciones_exitosas) AS transacciones_totales,
+            SUM(a.transacciones_con_propina) AS transacciones_con_propina,
+            ROUND(SUM(a.transacciones_con_propina)::NUMERIC / NULLIF(SUM(a.transacciones_exitosas), 0) * 100, 2) AS tasa_conversion_propina_pct,
+            SUM(a.propinas_totales) AS propinas_totales,
+            ROUND(SUM(a.propinas_totales) / NULLIF(SUM(a.transacciones_con_propina), 0), 0) AS propina_promedio
+        FROM bi.agg_tickets_dia_sede a
+        LEFT JOIN dw.dim_sede ds ON a.sede_sk = ds.sede_sk
+        GROUP BY 1
+        ORDER BY tasa_conversion_propina_pct DESC NULLS LAST
+        LIMIT 10;
+    """,
+    "peak-hours": """
+        SELECT
+            a.hora AS hora_del_dia,
+            COALESCE(SUM(a.transacciones) FILTER (WHERE ds.nombre_sede = 'Plaza Bolsillo'), 0) AS sede_plaza_bolsillo,
+            COALESCE(SUM(a.transacciones) FILTER (WHERE ds.nombre_sede = 'Merced'), 0) AS sede_merced,
+            COALESCE(SUM(a.transacciones) FILTER (WHERE ds.nombre_sede = 'Tajamar'), 0) AS sede_tajamar,
+            COALESCE(SUM(a.transacciones) FILTER (WHERE ds.nombre_sede = 'Persa Victor Manuel'), 0) AS sede_persa_victor_manuel,
+            SUM(a.transacciones) AS total_transacciones
+        FROM bi.agg_horas_dia_sede a
+        LEFT JOIN dw.dim_sede ds ON a.sede_sk = ds.sede_sk
+        GROUP BY a.hora
+        ORDER BY hora_del_dia;
+    """,
+    "customer-loyalty": """
+        WITH comportamiento_mensual AS (
+            SELECT
+                COALESCE(ds.nombre_sede, 'No Identificada') AS nombre_sede,
+                TO_CHAR(TO_DATE(a.fecha_key::TEXT, 'YYYYMMDD'), 'YYYY-MM') AS mes_operacion,
+                a.ultimos_4_digitos AS id_tarjeta,
+                COUNT(*) AS dias_visitados_al_mes
+            FROM bi.agg_visitas_tarjeta_dia a
+            LEFT JOIN dw.dim_sede ds ON a.sede_sk = ds.sede_sk
+            GROUP BY 1, 2, 3
+        )
+        SELECT
+            nombre_sede,
+            mes_operacion,
+            COUNT(*) FILTER (WHERE dias_visitados_al_mes = 1) AS clientes_un_solo_dia,
+            COUNT(*) FILTER (WHERE dias_visitados_al_mes = 2) AS clientes_recurrentes_2_veces,
+            COUNT(*) FILTER (WHERE dias_visitados_al_mes > 2) AS clientes_fans_3_o_mas,
+            ROUND(COUNT(*) FILTER (WHERE dias_visitados_al_mes >= 2)::NUMERIC / NULLIF(COUNT(*), 0) * 100, 2) AS tasa_fidelidad_mes_pct
+        FROM comportamiento_mensual
+        GROUP BY nombre_sede, mes_operacion
+        ORDER BY mes_operacion DESC, nombre_sede
+        LIMIT 20;
+    """,
+    "purchase-behavior": """
+        SELECT
+            COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede_unificada,
+            SUM(a.tickets_un_item) AS ventas_solitarias,
+            SUM(a.tickets_multi_item) AS ventas_con_acompanamiento,
+            ROUND(SUM(a.tickets_multi_item)::NUMERIC / NULLIF(SUM(a.tickets_un_item + a.tickets_multi_item), 0) * 100, 2) AS tasa_de_sugestion_exito_pct,
+            ROUND(SUM(a.monto_tickets_un_item) / NULLIF(SUM(a.tickets_un_item), 0), 0) AS ticket_promedio_solo,
+            ROUND(SUM(a.monto_tickets_multi_item) / NULLIF(SUM(a.tickets_multi_item), 0), 0) AS ticket_promedio_acompanado
+        FROM bi.agg_tickets_dia_sede a
+        LEFT JOIN dw.dim_sede ds ON a.sede_sk = ds.sede_sk
+        GROUP BY 1;
+    """,
+    "top-products": """
+        WITH ventas_sede_producto AS (
+            SELECT
+                COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede_unificada,
+                dp.descripcion AS producto,
+                SUM(a.ventas_brutas) AS ingresos_producto
+            FROM bi.agg_productos_dia_sede a
+            JOIN dw.dim_producto dp ON a.producto_sk = dp.producto_sk
+            LEFT JOIN dw.dim_sede ds ON a.sede_sk = ds.sede_sk
+            GROUP BY 1, 2
+        ),
+        ranking_productos AS (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY sede_unificada ORDER BY ingresos_producto DESC) AS ranking
+            FROM ventas_sede_producto
+        )
+        SELECT * FROM ranking_productos WHERE ranking <= 5 ORDER BY sede_unificada, ranking;
+    """,
+    "payment-methods": """
+        WITH agrupacion_final AS (
+            SELECT
+                medio_pago,
+                SUM(transacciones) AS total_transacciones,
+                SUM(ventas) AS ventas_totales,
+                SUM(comision) AS comision_total
+            FROM bi.agg_pago_dia_sede
+            GROUP BY ROLLUP(medio_pago)
+        )
+        SELECT
+            COALESCE(medio_pago, 'TOTAL GENERAL') AS medio_de_pago,
+            total_transacciones,
+            ROUND(total_transacciones::NUMERIC * 100.0 /
+                  NULLIF(MAX(total_transacciones) FILTER (WHERE medio_pago IS NULL) OVER (), 0), 2) AS participacion_transacciones_pct,
+            ventas_totales,
+            ROUND(ventas_totales * 100.0 /
+                  NULLIF(MAX(ventas_totales) FILTER (WHERE medio_pago IS NULL) OVER (), 0), 2) AS participacion_ventas_pct,
+            comision_total,
+            ROUND(comision_total * 100.0 / NULLIF(ventas_totales, 0), 2) AS tasa_comision_pct
+        FROM agrupacion_final
+        ORDER BY (medio_pago IS NULL) ASC, ventas_totales DESC;
+    """,
+    "hourly-sales": """
+        SELECT
+            COALESCE(ds.nombre_sede, 'Sede No Identificada') AS sede,
+            a.hora,
+            SUM(a.transacciones) AS transacciones,
+            SUM(a.venta_bruta) AS ventas_brutas
+        FROM bi.agg_horas_dia_sede a
+        LEFT JOIN dw.dim_sede ds ON a.sede_sk = ds.sede_sk
+        GROUP BY 1, 2 ORDER BY 1, 2;
+    """,
+    "products-global": """
+        WITH total_real_empresa AS (
+            SELECT SUM(venta_bruta) AS gran_total_dinero, SUM(transacciones) AS gran_total_tickets
+            FROM bi.agg_tickets_dia_sede
+        ),
+        productos_agrupados AS (
+            SELECT
+                dp.descripcion AS producto,
+                dp.categoria,
+                SUM(a.unidades) AS unidades_vendidas,
+                SUM(a.ventas_brutas) AS ventas_brutas,
+                SUM(a.tickets) AS tickets_unicos
+            FROM bi.agg_productos_dia_sede a
+            JOIN dw.dim_producto dp ON a.producto_sk = dp.producto_sk
+            GROUP BY dp.descripcion, dp.categoria
+        )
+        SELECT
+            pa.producto,
+            pa.categoria,
+            pa.unidades_vendidas,
+            pa.ventas_brutas,
+            COALESCE(ROUND(pa.ventas_brutas / NULLIF(pa.unidades_vendidas, 0), 2), 0) AS precio_promedio_unitario,
+            COALESCE(ROUND(pa.ventas_brutas * 100 / NULLIF(t.gran_total_dinero, 0), 2), 0) AS share_ventas_pct,
+            COALESCE(ROUND(pa.tickets_unicos::NUMERIC * 100 / NULLIF(t.gran_total_tickets, 0), 2), 0) AS tasa_penetracion_pct,
+            pa.tickets_unicos
+        FROM productos_agrupados pa
+        CROSS JOIN total_real_empresa t
+        ORDER BY pa.ventas_brutas DESC
+        LIMIT 100;
+    """,
+    "busy-hours": """
+        SELECT
+            df.fecha_completa AS dia,
+            CASE df.dia_semana
+                WHEN 1 THEN 'Lunes'
+                WHEN 2 THEN 'Martes'
+                WHEN 3 THEN 'Miércoles'
+                WHEN 4 THEN 'Jueves'
+                WHEN 5 THEN 'Viernes'
+                WHEN 6 THEN 'Sábado'
+                WHEN 0 THEN 'Domingo'
+            END AS dia_semana,
+            a.hora AS hora_del_dia,
+            COALESCE(SUM(a.transacciones) FILTER (WHERE ds.nombre_sede = 'Plaza Bolsillo'), 0) AS plaza_bolsillo,
+            COALESCE(SUM(a.transacciones) FILTER (WHERE ds.nombre_sede = 'Merced'), 0) AS merced,
+            COALESCE(SUM(a.transacciones) FILTER (WHERE ds.nombre_sede = 'Tajamar'), 0) AS tajamar,
+            COALESCE(SUM(a.transacciones) FILTER (WHERE ds.nombre_sede = 'Persa Victor Manuel'), 0) AS persa_victor_manuel
+        FROM bi.agg_horas_dia_sede a
+        JOIN dw.dim_fecha df ON a.fecha_key = df.fecha_key
+        LEFT JOIN dw.dim_sede ds ON a.sede_sk = ds.sede_sk
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 3;
+    """,
+}
@@ -0,0 +1,242 @@
+import json
+import os
+import re
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from sql_repair import normalize_identifier, quote_identifier
+
+# ========================================================================
+# CACHÉ DEL ESQUEMA (information_schema) PARA EL PROMPT DEL AGENTE
+# ========================================================================
+# Al iniciar el agente se toma una foto de information_schema (public, dw, bi,
+# semantic): columnas, tipos y valores de ejemplo (pg_stats.most_common_vals,
+# sin recorrer tablas). La foto se guarda en disco junto con un hash del
+# catálogo; en el siguiente arranque solo se consulta el hash (una fila) y si
+# no cambió se reutiliza el archivo. Al prompt va una descripción compacta de
+# una línea por tabla, solo de las tablas relevantes para la pregunta:
+#   informe_ventas(vista) "ID de transacción" text, "Fecha" date, "Descripción" text ej 'Latte'|'Tip', ...
+SCHEMA_CACHE_PATH = os.getenv(
+    "SCHEMA_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".schema_cache.json"))
+SCHEMA_CACHE_SCHEMAS = [s.strip() for s in os.getenv("SCHEMA_CACHE_SCHEMAS", "public,dw,bi,semantic").split(",") if s.strip()]
+SCHEMA_SAMPLE_VALUES = int(os.getenv("SCHEMA_SAMPLE_VALUES", "3"))
+SCHEMA_CONTEXT_MAX_TABLES = int(os.getenv("SCHEMA_CONTEXT_MAX_TABLES", "4"))
+SCHEMA_SAMPLE_MAX_CHARS = 24
+SNAPSHOT_FORMAT = 1
+
+TYPE_ABBREVIATIONS = {
+    "character varying": "text", "character": "text", "text": "text", "integer": "int", "bigint": "int",
+    "smallint": "int", "numeric": "num", "double precision": "float", "real": "float", "date": "date",
+    "time without time zone": "time", "timestamp without time zone": "ts", "timestamp with time zone": "tstz",
+    "boolean": "bool", "jsonb": "json", "json": "json",
+}
+# Palabras de la pregunta que no ayudan a elegir tablas
+STOPWORDS = {
+    "cual", "cuales", "cuanto", "cuantos", "cuantas", "como", "donde", "para", "por", "con", "los", "las",
+    "del", "que", "una", "uno", "mas", "menos", "este", "esta", "ese", "esa", "entre", "desde", "hasta",
+    "dame", "muestra", "total", "fueron", "tiene", "tienen", "sobre", "cada",
+}
+
+
+def _schema_list() -> str:
+    return ", ".join("'" + s.replace("'", "''") + "'" for s in SCHEMA_CACHE_SCHEMAS)
+
+
+def catalog_hash_query() -> str:
+    """Una fila: hash de tablas/columnas/tipos; cambia con cualquier ALTER/CREATE VIEW"""
+    return (
+        "SELECT md5(string_agg(table_schema || '.' || table_name || '.' || column_name || ':' || data_type, ',' "
+        "ORDER BY table_schema, table_name, ordinal_position)) AS catalog_hash "
+        f"FROM information_schema.columns WHERE table_schema IN ({_schema_list()})"
+    )
+
+
+def columns_query() -> str:
+    return (
+        "SELECT c.table_schema, c.table_name, c.column_name, c.data_type, t.table_type "
+        "FROM information_schema.columns c JOIN information_schema.tables t "
+        "ON t.table_schema = c.table_schema AND t.table_name = c.table_name "
+        f"WHERE c.table_schema IN ({_schema_list()}) "
+        "ORDER BY c.table_schema, c.table_name, c.ordinal_position"
+    )
+
+
+def samples_query(limit: int = SCHEMA_SAMPLE_VALUES) -> str:
+    """Valores frecuentes desde las estadísticas del planner (solo tablas/matviews analizadas)"""
+    return (
+        "SELECT schemaname, tablename, attname, "
+        f"array_to_json((most_common_vals::text::text[])[1:{int(limit)}]) AS valores "
+        f"FROM pg_stats WHERE schemaname IN ({_schema_list()}) AND most_common_vals IS NOT NULL"
+    )
+
+
+def _table_name(schema: str, table: str) -> str:
+    return table if schema == "public" else f"{schema}.{table}"
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", normalize_identifier(text))
+
+
+def _stem(word: str) -> str:
+    """Raíz aproximada para comparar singular/plural: ventas/venta, sedes/sede"""
+    return word[:5] if len(word) > 5 else word.rstrip("s")
+
+
+class SchemaCache:
+    """Foto del catálogo persistida en disco + descripciones compactas por pregunta"""
+
+    def __init__(self, path: str = SCHEMA_CACHE_PATH):
+        self.path = path
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        self.catalog_hash: Optional[str] = None
+        self._lock = threading.Lock()
+        self._search_index: Dict[str, set] = {}
+        self.stats = {"source": None, "contexts": 0, "tables_injected": 0, "full_chars": 0, "injected_chars": 0}
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self.tables)
+
+    # --- Carga ----------------------------------------------------------
+    def load(self, run: Callable[[str], List[Dict[str, Any]]]) -> None:
+        """
+        Carga la foto del catálogo: desde disco si el hash coincide, si no desde la BD.
+
+        Args:
+            run: ejecuta SQL y devuelve filas como dicts (p. ej. _run_kpi_rows)
+        """
+        try:
+            rows = run(catalog_hash_query())
+            current_hash = rows[0]["catalog_hash"] if rows else None
+        except Exception as e:
+            print(f"⚠️ No se pudo leer el hash del catálogo: {e}")
+            current_hash = None
+
+        snapshot = self._read_disk()
+        if snapshot and (current_hash is None or snapshot["catalog_hash"] == current_hash):
+            self._install(snapshot, "disco" if current_hash else "disco (sin verificar)")
+            return
+        if current_hash is None:
+            return
+
+        try:
+            snapshot = self._snapshot(run, current_hash)
+        except Exception as e:
+            print(f"⚠️ No se pudo leer information_schema: {e}")
+            return
+        self._write_disk(snapshot)
+        self._install(snapshot, "base de datos")
+
+    def _snapshot(self, run: Callable[[str], List[Dict[str, Any]]], catalog_hash: str) -> Dict[str, Any]:
+        tables: Dict[str, Dict[str, Any]] = {}
+        for row in run(columns_query()):
+            name = _table_name(row["table_schema"], row["table_name"])
+            table = tables.setdefault(name, {"kind": "vista" if row["table_type"] == "VIEW" else "tabla",
+                                             "columns": [], "samples": {}})
+            table["columns"].append([row["column_name"], TYPE_ABBREVIATIONS.get(row["data_type"], row["data_type"])])
+        try:
+            for row in run(samples_query()):
+                table = tables.get(_table_name(row["schemaname"], row["tablename"]))
+                valores = row["valores"]
+                if isinstance(valores, str):
+                    valores = json.loads(valores)
+                if table is not None and valores:
+                    table["samples"][row["attname"]] = [str(v)[:SCHEMA_SAMPLE_MAX_CHARS] for v in valores]
+        except Exception as e:
+            # pg_stats puede no ser legible para el usuario del agente: seguimos sin ejemplos
+            print(f"⚠️ Sin valores de ejemplo para el esquema: {e}")
+        return {"format": SNAPSHOT_FORMAT, "catalog_hash": catalog_hash, "tables": tables}
+
+    def _read_disk(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return snapshot if snapshot.get("format") == SNAPSHOT_FORMAT else None
+
+    def _write_disk(self, snapshot: Dict[str, Any]) -> None:
+        # Escritura atómica, igual que FileBackend en sales_cache
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar el esquema en disco: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _install(self, snapshot: Dict[str, Any], source: str) -> None:
+        with self._lock:
+            self.tables = snapshot["tables"]
+            self.catalog_hash = snapshot["catalog_hash"]
+            self._search_index = {name: self._search_words(name, table) for name, table in self.tables.items()}
+            self.stats["source"] = source
+            self.stats["full_chars"] = len(self.describe(self.tables))
+        print(f"🗂️ Esquema cargado desde {source}: {len(self.tables)} tablas, hash {self.catalog_hash[:8]}")
+
+    @staticmethod
+    def _search_words(name: str, table: Dict[str, Any]) -> set:
+        textos = [name] + [column for column, _ in table["columns"]]
+        textos += [v for valores in table["samples"].values() for v in valores]
+        return {_stem(w) for texto in textos for w in _words(texto) if len(w) > 2}
+
+    # --- Consultas ------------------------------------------------------
+    def columns(self, tables: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+        """{tabla: [columnas]} de la foto (catálogo vivo para sql_repair)"""
+        wanted = set(tables) if tables is not None else set(self.tables)
+        return {name: [c for c, _ in t["columns"]] for name, t in self.tables.items() if name in wanted}
+
+    def describe_table(self, name: str) -> str:
+        table = self.tables[name]
+        partes = []
+        for column, data_type in table["columns"]:
+            parte = f"{quote_identifier(column)} {data_type}"
+            ejemplos = table["samples"].get(column)
+            if ejemplos and data_type == "text":
+                parte += " ej " + "|".join("'" + v + "'" for v in ejemplos)
+            partes.append(parte)
+        return f"{name}({table['kind']}) " + ", ".join(partes)
+
+    def describe(self, tables: Iterable[str]) -> str:
+        return "\n".join(self.describe_table(name) for name in tables if name in self.tables)
+
+    def relevant_tables(self, question: str, allowed: Optional[Sequence[str]] = None,
+                        max_tables: int = SCHEMA_CONTEXT_MAX_TABLES) -> List[str]:
+        """Tablas cuyo nombre, columnas o valores comparten palabras con la pregunta"""
+        candidates = [t for t in (allowed if allowed is not None else self.tables) if t in self.tables]
+        palabras = {_stem(w) for w in _words(question) if len(w) > 2 and w not in STOPWORDS}
+        scored = sorted(((len(palabras & self._search_index[t]), t) for t in candidates), key=lambda x: -x[0])
+        elegidas = [t for score, t in scored if score > 0][:max_tables]
+        # Sin coincidencias: todas las permitidas (acotadas) en vez de un prompt sin esquema
+        return elegidas or candidates[:max_tables]
+
+    def schema_context(self, question: str, allowed: Optional[Sequence[str]] = None) -> Optional[str]:
+        """Bloque de esquema para el prompt; None si aún no hay foto del catálogo"""
+        if not self.loaded:
+            return None
+        text = self.describe(self.relevant_tables(question, allowed))
+        with self._lock:
+            self.stats["contexts"] += 1
+            self.stats["tables_injected"] += text.count("\n") + 1
+            self.stats["injected_chars"] += len(text)
+        return text
+
+    def format_stats(self) -> str:
+        with self._lock:
+            stats = dict(self.stats)
+        if not stats["source"]:
+            return "🗂️ Esquema: sin foto del catálogo (se usa la lista estática)"
+        contextos = stats["contexts"] or 1
+        return (f"🗂️ Esquema ({stats['source']}): {len(self.tables)} tablas, {stats['full_chars']} chars completo | "
+                f"{stats['contexts']} prompts, {stats['tables_injected'] / contextos:.1f} tablas y "
+                f"{stats['injected_chars'] / contextos:.0f} chars promedio inyectados")
+
+
+schema_cache = SchemaCache()
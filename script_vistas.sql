@@ -196,6 +196,8 @@ SELECT 'Dim Sede' as dim, COUNT(*) as conteo FROM dw.dim_sede;
 -- ==========================================
 
 -- 1. LIMPIAR FACT TABLES EXISTENTES (para empezar limpio)
+-- Solo para la carga inicial: las cargas diarias usan python etl_incremental.py run,
+-- que no vacía las tablas mientras los dashboards las leen
 TRUNCATE dw.fact_ventas, dw.fact_transacciones RESTART IDENTITY;
 
 -- 2. CREAR FACT_VENTAS con manejo de duplicados
@@ -327,9 +329,21 @@ UNION ALL
 SELECT 
     'Dim Forma Pago' as tabla, COUNT(*) as registros FROM dw.dim_forma_pago
 UNION ALL
-SELECT 
+SELECT
     'Dim Tarjeta' as tabla, COUNT(*) as registros FROM dw.dim_tarjeta;
 
+-- 5. MARCAR PARTICIONES PARA REFRESCAR AGREGADOS (python materialized_aggregates.py refresh)
+-- La carga completa reescribe todas las fechas
+INSERT INTO etl.dirty_partitions (fecha_key)
+SELECT DISTINCT fecha_key FROM dw.fact_ventas WHERE fecha_key IS NOT NULL
+ON CONFLICT (fecha_key) DO UPDATE SET marked_at = now();
+
+-- 6. PUBLICAR NUEVA VERSIÓN DE DATOS (invalida la caché de /api/sales/*)
+-- Requiere Esquema_control_etl.sql
+UPDATE etl.data_version
+SET version = version + 1, origen = 'script_vistas.sql', updated_at = now()
+WHERE id = 1;
+
 
 -- ============ crear vistas ============
 
@@ -0,0 +1,268 @@
+import argparse
+import re
+from typing import Dict, List, Optional
+
+import psycopg2.extras
+
+# ========================================================================
+# MAPEO ÚNICO DE SEDES (alias crudo → dw.dim_sede.sede_sk)
+# ========================================================================
+# Fuente de verdad de la normalización de sedes. Antes cada KPI, ruta y vista
+# repetía su propio CASE "Cuenta" IN (...) / ILIKE '%merced%' por fila y las
+# variantes no coincidían (algunas omitían Persa Victor Manuel).
+#
+# Aquí cada valor crudo distinto ("Cuenta", "Sede_Normalizada", correo) se
+# resuelve una sola vez en Python, se guarda en dw.sede_alias y se aplica a la
+# columna indexada sede_sk de las tablas crudas. Las consultas agrupan por
+# sede_sk y hacen JOIN con dw.dim_sede para el nombre.
+SEDES = {
+    "Plaza Bolsillo": {
+        "alias": ["Plaza bolsillo", "plaza.bolsillo@gmail.com"],
+        "patrones": [r"plaza.*bolsillo"],
+    },
+    "Merced": {
+        "alias": ["merced", "merced.158@gmail.com"],
+        "patrones": [r"merced"],
+    },
+    "Tajamar": {
+        "alias": ["Tajamar", "providencia.tajamar@gmail.com"],
+        "patrones": [r"tajamar"],
+    },
+    "Persa Victor Manuel": {
+        "alias": [],
+        "patrones": [r"persa", r"victor.*manuel"],
+    },
+}
+
+# Columnas crudas que identifican la sede, en orden de prioridad.
+# Cada despliegue usa solo algunas (se ignoran las que no existen).
+RAW_SEDE_COLUMNS = {
+    "public.informe_ventas": ["Cuenta", "Sede_Normalizada"],
+    "public.transacciones": ["Cuenta", "Correo_electrónico"],
+}
+RAW_ID_COLUMNS = ["ID de transacción", "ID_de_transacción"]
+
+VALORES_SIN_SEDE = {"", "no_especificado"}
+
+SEDE_ALIAS_DDL = """
+    CREATE TABLE IF NOT EXISTS dw.sede_alias (
+        alias TEXT PRIMARY KEY,
+        sede_sk INTEGER NOT NULL REFERENCES dw.dim_sede (sede_sk),
+        regla VARCHAR(20) NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS idx_fact_ventas_sede_sk ON dw.fact_ventas (sede_sk);
+    CREATE INDEX IF NOT EXISTS idx_fact_transacciones_sede_sk ON dw.fact_transacciones (sede_sk);
+"""
+
+_ALIAS_INDEX = {
+    alias.strip().lower(): sede
+    for sede, spec in SEDES.items()
+    for alias in spec["alias"] + [sede]
+}
+_PATRONES = [
+    (re.compile(patron, re.IGNORECASE), sede)
+    for sede, spec in SEDES.items()
+    for patron in spec["patrones"]
+]
+
+
+def clave_alias(valor: Optional[str]) -> Optional[str]:
+    """Forma normalizada con la que se guarda y busca un alias"""
+    if valor is None:
+        return None
+    clave = str(valor).strip().lower()
+    return None if clave in VALORES_SIN_SEDE else clave
+
+
+def resolver_sede(valor: Optional[str]) -> Optional[str]:
+    """
+    Nombre canónico de la sede para un valor crudo.
+
+    Alias exacto → patrón → el propio valor (sede nueva que aún no está en SEDES).
+    """
+    clave = clave_alias(valor)
+    if clave is None:
+        return None
+    if clave in _ALIAS_INDEX:
+        return _ALIAS_INDEX[clave]
+    for patron, sede in _PATRONES:
+        if patron.search(clave):
+            return sede
+    return str(valor).strip()
+
+
+def _regla(valor: str) -> str:
+    clave = clave_alias(valor)
+    if clave in _ALIAS_INDEX:
+        return "alias"
+    if any(patron.search(clave) for patron, _ in _PATRONES):
+        return "patron"
+    return "sin_mapeo"
+
+
+def _existing_columns(cursor, table: str, candidates: List[str]) -> List[str]:
+    schema, name = table.split(".")
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s",
+        (schema, name),
+    )
+    existentes = {row[0] for row in cursor.fetchall()}
+    return [c for c in candidates if c in existentes]
+
+
+def _sede_expression(columnas: List[str], alias_tabla: str = "r") -> str:
+    partes = [f'NULLIF({alias_tabla}."{c}", \'\')' for c in columnas]
+    return f"LOWER(TRIM(COALESCE({', '.join(partes)})))"
+
+
+# ========================================================================
+# MANTENIMIENTO DE dim_sede / sede_alias
+# ========================================================================
+def ensure_sede_columns(cursor) -> None:
+    """Tabla de alias + columna sede_sk indexada en las tablas crudas"""
+    cursor.execute(SEDE_ALIAS_DDL)
+    for table in RAW_SEDE_COLUMNS:
+        short = table.split(".")[1]
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS sede_sk INTEGER")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{short}_sede_sk ON {table} (sede_sk)")
+
+
+def sync_sede_aliases(cursor) -> Dict[str, int]:
+    """
+    Registra en dw.dim_sede / dw.sede_alias todos los valores crudos aún no mapeados.
+
+    Returns:
+        Cantidad de sedes y alias nuevos
+    """
+    valores = set()
+    for table, candidatas in RAW_SEDE_COLUMNS.items():
+        columnas = _existing_columns(cursor, table, candidatas)
+        for columna in columnas:
+            cursor.execute(
+                f"""
+                SELECT DISTINCT r."{columna}" FROM {table} r
+                WHERE r."{columna}" IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM dw.sede_alias a WHERE a.alias = LOWER(TRIM(r."{columna}")))
+                """
+            )
+            valores.update(row[0] for row in cursor.fetchall() if clave_alias(row[0]))
+    # Las sedes canónicas siempre existen aunque aún no tengan ventas
+    valores.update(SEDES.keys())
+
+    nombres = sorted({resolver_sede(v) for v in valores})
+    psycopg2.extras.execute_values(
+        cursor,
+        """
+        INSERT INTO dw.dim_sede (nombre_sede, region, ciudad) VALUES %s
+        ON CONFLICT (nombre_sede) DO NOTHING
+        """,
+        [(nombre, "CHILE", "SANTIAGO") for nombre in nombres],
+    )
+    sedes_nuevas = cursor.rowcount
+
+    cursor.execute("SELECT nombre_sede, sede_sk FROM dw.dim_sede WHERE nombre_sede = ANY(%s)", (nombres,))
+    sede_sk = dict(cursor.fetchall())
+
+    alias_rows = {clave_alias(v): (clave_alias(v), sede_sk[resolver_sede(v)], _regla(v)) for v in valores}
+    psycopg2.extras.execute_values(
+        cursor,
+        """
+        INSERT INTO dw.sede_alias (alias, sede_sk, regla) VALUES %s
+        ON CONFLICT (alias) DO UPDATE SET sede_sk = EXCLUDED.sede_sk, regla = EXCLUDED.regla, updated_at = now()
+        """,
+        list(alias_rows.values()),
+    )
+    return {"sedes_nuevas": max(sedes_nuevas, 0), "alias": len(alias_rows)}
+
+
+def assign_sede_sk(cursor, table: str, solo_pendientes: bool = True) -> int:
+    """
+    Aplica dw.sede_alias a la columna sede_sk de una tabla cruda.
+
+    Las transacciones sin valor de sede reconocible heredan la sede de sus
+    líneas en informe_ventas.
+    """
+    columnas = _existing_columns(cursor, table, RAW_SEDE_COLUMNS[table])
+    if not columnas:
+        return 0
+    filtro = "r.sede_sk IS NULL" if solo_pendientes else "r.sede_sk IS DISTINCT FROM a.sede_sk"
+    cursor.execute(
+        f"""
+        UPDATE {table} r SET sede_sk = a.sede_sk
+        FROM dw.sede_alias a
+        WHERE a.alias = {_sede_expression(columnas)}
+          AND {filtro}
+        """
+    )
+    actualizadas = cursor.rowcount
+
+    if table == "public.transacciones":
+        ids = _existing_columns(cursor, "public.informe_ventas", RAW_ID_COLUMNS)
+        if ids and _existing_columns(cursor, table, ids[:1]):
+            id_col = ids[0]
+            cursor.execute(
+                f"""
+                UPDATE public.transacciones r SET sede_sk = iv.sede_sk
+                FROM (
+                    SELECT "{id_col}" AS id_transaccion, MAX(sede_sk) AS sede_sk
+                    FROM public.informe_ventas
+                    WHERE sede_sk IS NOT NULL
+                    GROUP BY 1
+                ) iv
+                WHERE r."{id_col}" = iv.id_transaccion
+                  AND r.sede_sk IS NULL
+                """
+            )
+            actualizadas += cursor.rowcount
+    return actualizadas
+
+
+def apply_sede_mapping(cursor, solo_pendientes: bool = True) -> Dict[str, int]:
+    """Sincroniza alias y llena sede_sk en todas las tablas crudas (idempotente)"""
+    ensure_sede_columns(cursor)
+    resumen = sync_sede_aliases(cursor)
+    # informe_ventas primero: transacciones hereda de sus líneas
+    for table in RAW_SEDE_COLUMNS:
+        resumen[table] = assign_sede_sk(cursor, table, solo_pendientes)
+    return resumen
+
+
+def main():
+    from db_pool import get_sync_connection
+
+    parser = argparse.ArgumentParser(description="Mapeo de sedes (dw.dim_sede / dw.sede_alias)")
+    subparsers = parser.add_subparsers(dest="accion", required=True)
+
+    sync_parser = subparsers.add_parser("sync", help="Registrar alias nuevos y llenar sede_sk")
+    sync_parser.add_argument("--recalcular", action="store_true",
+                             help="Reasignar sede_sk en todas las filas (tras cambiar SEDES)")
+    subparsers.add_parser("status", help="Mostrar alias registrados por sede")
+
+    args = parser.parse_args()
+
+    conn = get_sync_connection()
+    try:
+        with conn.cursor() as cursor:
+            if args.accion == "sync":
+                resumen = apply_sede_mapping(cursor, solo_pendientes=not args.recalcular)
+                print(f"✅ {resumen['alias']} alias sincronizados ({resumen['sedes_nuevas']} sedes nuevas)")
+                for table in RAW_SEDE_COLUMNS:
+                    print(f"   • {table}: {resumen[table]} filas con sede_sk asignada")
+            else:
+                cursor.execute(
+                    """
+                    SELECT ds.nombre_sede, a.regla, COUNT(*), STRING_AGG(a.alias, ', ' ORDER BY a.alias)
+                    FROM dw.sede_alias a JOIN dw.dim_sede ds ON ds.sede_sk = a.sede_sk
+                    GROUP BY 1, 2 ORDER BY 1, 2
+                    """
+                )
+                for nombre, regla, total, alias in cursor.fetchall():
+                    print(f"   • {nombre} [{regla}] {total}: {alias}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
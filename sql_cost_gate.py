@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from db_pool import DatabaseError
+
+# ========================================================================
+# COMPUERTA DE COSTO PARA SQL GENERADO POR EL LLM
+# ========================================================================
+# Antes de ejecutar, sql_executor obtiene el plan con EXPLAIN (FORMAT JSON).
+# La consulta se rechaza si:
+#   - el costo total estimado supera SQL_GATE_MAX_COST, o
+#   - algún JOIN estima más de SQL_GATE_MAX_JOIN_ROWS filas (típico de un
+#     producto cartesiano informe_ventas × transacciones)
+# El rechazo vuelve al modelo como SQL_COST_ERROR con el nodo culpable en
+# JSON para que reescriba la consulta. Las aceptadas corren con un
+# statement_timeout por sesión (AGENT_STATEMENT_TIMEOUT_MS).
+SQL_COST_GATE = os.getenv("SQL_COST_GATE", "1") == "1"
+SQL_GATE_MAX_COST = float(os.getenv("SQL_GATE_MAX_COST", "10000000"))
+SQL_GATE_MAX_JOIN_ROWS = float(os.getenv("SQL_GATE_MAX_JOIN_ROWS", "10000000"))
+AGENT_STATEMENT_TIMEOUT_MS = int(os.getenv("AGENT_STATEMENT_TIMEOUT_MS", "10000"))
+
+JOIN_NODES = {"Nested Loop", "Hash Join", "Merge Join"}
+
+SUGGESTIONS = {
+    "cartesiano": "Falta la condición de JOIN entre las tablas (p. ej. ON iv.\"ID de transacción\" = "
+                  "t.\"ID de transacción\"). Revisa cada JOIN.",
+    "filas_join": "Filtra por fecha o sede antes de unir, o agrega cada tabla por separado y une los agregados.",
+    "costo": "Usa un KPI registrado (get_kpi_sql) si existe, filtra por fecha/sede y evita COUNT(DISTINCT) "
+             "sobre tablas completas.",
+}
+
+_stats_lock = threading.Lock()
+gate_stats = {"checked": 0, "executed": 0, "blocked": 0, "timeouts": 0, "unplanned": 0,
+              "executed_cost": 0.0, "blocked_cost": 0.0}
+
+
+@dataclass
+class GateDecision:
+    accepted: bool
+    total_cost: Optional[float] = None
+    plan_rows: Optional[float] = None
+    reason: Optional[str] = None
+    node: Dict[str, Any] = field(default_factory=dict)
+
+    def feedback(self) -> str:
+        """Mensaje para el LLM (ToolMessage) cuando la consulta se rechaza"""
+        detalle = {
+            "motivo": self.reason,
+            "costo_estimado": round(self.total_cost or 0),
+            "limite_costo": round(SQL_GATE_MAX_COST),
+            "limite_filas_join": round(SQL_GATE_MAX_JOIN_ROWS),
+            "nodo": self.node,
+            "sugerencia": SUGGESTIONS.get(self.reason, ""),
+        }
+        return ("SQL_COST_ERROR: consulta rechazada antes de ejecutarse por su costo estimado. "
+                "Reescríbela y vuelve a intentar.\n" + json.dumps(detalle, ensure_ascii=False))
+
+
+class SQLCostRejected(DatabaseError):
+    """El plan estimado excede los límites de la compuerta"""
+
+    def __init__(self, decision: GateDecision):
+        super().__init__(decision.feedback())
+        self.decision = decision
+
+
+# ========================================================================
+# ANÁLISIS DEL PLAN
+# ========================================================================
+def parse_plan(explain_output: Any) -> Optional[Dict[str, Any]]:
+    """Nodo raíz del resultado de EXPLAIN (FORMAT JSON); acepta texto o JSON ya parseado"""
+    try:
+        plan = json.loads(explain_output) if isinstance(explain_output, str) else explain_output
+        return plan[0]["Plan"]
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def _walk(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def _relations(node: Dict[str, Any]) -> List[str]:
+    return list(dict.fromkeys(n["Relation Name"] for n in _walk(node) if n.get("Relation Name")))
+
+
+def _is_cartesian(node: Dict[str, Any]) -> bool:
+    """Nested Loop sin condición: ni Join Filter ni Index Cond en el lado interno"""
+    if node.get("Node Type") != "Nested Loop" or node.get("Join Filter"):
+        return False
+    hijos = node.get("Plans", [])
+    if len(hijos) < 2:
+        return False
+    return not any(n.get("Index Cond") or n.get("Recheck Cond") for n in _walk(hijos[1]))
+
+
+def _self_cost(node: Dict[str, Any]) -> float:
+    return node.get("Total Cost", 0.0) - sum(c.get("Total Cost", 0.0) for c in node.get("Plans", []))
+
+
+def _describe(node: Dict[str, Any]) -> Dict[str, Any]:
+    descripcion = {
+        "tipo": node.get("Node Type"),
+        "relaciones": _relations(node),
+        "filas_estimadas": round(node.get("Plan Rows", 0)),
+        "costo": round(node.get("Total Cost", 0)),
+    }
+    for clave in ("Join Filter", "Hash Cond", "Merge Cond", "Filter", "Group Key"):
+        if node.get(clave):
+            descripcion[clave.lower().replace(" ", "_")] = node[clave]
+    return descripcion
+
+
+def evaluate_plan(plan: Optional[Dict[str, Any]], max_cost: float = SQL_GATE_MAX_COST,
+                  max_join_rows: float = SQL_GATE_MAX_JOIN_ROWS) -> GateDecision:
+    """Decide si la consulta puede ejecutarse; sin plan (EXPLAIN falló) se deja pasar"""
+    if plan is None:
+        return GateDecision(accepted=True)
+    total_cost = plan.get("Total Cost", 0.0)
+    plan_rows = plan.get("Plan Rows")
+
+    joins = [n for n in _walk(plan) if n.get("Node Type") in JOIN_NODES and n.get("Plan Rows", 0) > max_join_rows]
+    if joins:
+        peor = max(joins, key=lambda n: n.get("Plan Rows", 0))
+        motivo = "cartesiano" if _is_cartesian(peor) else "filas_join"
+        return GateDecision(False, total_cost, plan_rows, motivo, _describe(peor))
+
+    if total_cost > max_cost:
+        # El nodo con mayor costo propio (sin contar a sus hijos) es el que hay que cambiar
+        peor = max(_walk(plan), key=_self_cost)
+        return GateDecision(False, total_cost, plan_rows, "costo", _describe(peor))
+
+    return GateDecision(True, total_cost, plan_rows)
+
+
+def check_plan(plan: Optional[Dict[str, Any]], log_prefix: str = "") -> GateDecision:
+    """evaluate_plan + métricas; lanza SQLCostRejected si la consulta no debe ejecutarse"""
+    if not SQL_COST_GATE:
+        return GateDecision(accepted=True, total_cost=(plan or {}).get("Total Cost"))
+    decision = evaluate_plan(plan)
+    with _stats_lock:
+        gate_stats["checked"] += 1
+        if plan is None:
+            gate_stats["unplanned"] += 1
+        if not decision.accepted:
+            gate_stats["blocked"] += 1
+            gate_stats["blocked_cost"] += decision.total_cost or 0.0
+    if not decision.accepted:
+        print(f"🚧 {log_prefix}Consulta bloqueada ({decision.reason}): costo {decision.total_cost:,.0f}, "
+              f"nodo {decision.node.get('tipo')} {decision.node.get('relaciones')}")
+        raise SQLCostRejected(decision)
+    return decision
+
+
+def record_executed(decision: GateDecision) -> None:
+    with _stats_lock:
+        gate_stats["executed"] += 1
+        gate_stats["executed_cost"] += decision.total_cost or 0.0
+
+
+def timeout_feedback(timeout_ms: int) -> str:
+    with _stats_lock:
+        gate_stats["timeouts"] += 1
+    return (f"SQL_TIMEOUT_ERROR: la consulta superó el statement_timeout de {timeout_ms} ms y fue cancelada. "
+            f"{SUGGESTIONS['costo']}")
+
+
+def format_gate_stats() -> str:
+    with _stats_lock:
+        stats = dict(gate_stats)
+    return (f"🚧 Compuerta SQL: {stats['executed']} ejecutadas (costo {stats['executed_cost']:,.0f}) | "
+            f"{stats['blocked']} bloqueadas (costo {stats['blocked_cost']:,.0f}) | "
+            f"{stats['timeouts']} timeouts | {stats['unplanned']} sin plan")
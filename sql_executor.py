@@ -0,0 +1,302 @@
+import asyncio
+import hashlib
+import heapq
+import os
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from db_pool import DatabaseError, DatabasePool, QueryTimeoutError
+from result_encoding import RESULT_MAX_ROWS, ResultSet, plain_value
+from sql_cost_gate import AGENT_STATEMENT_TIMEOUT_MS, check_plan, parse_plan, record_executed
+
+# ========================================================================
+# EJECUTOR SQL CONSCIENTE DEL TAMAÑO DEL RESULTADO
+# ========================================================================
+# Un SELECT * FROM informe_ventas ya no se trae entero a memoria:
+#   1. EXPLAIN estima las filas; sobre SQL_LIMIT_GUARD_ROWS la consulta se
+#      envuelve en SELECT * FROM (...) LIMIT SQL_EXECUTOR_ROW_CAP + 1; la
+#      compuerta de sql_cost_gate evalúa el plan final y puede rechazarla
+#   2. Se lee con un cursor del lado del servidor, de a SQL_EXECUTOR_FETCH_SIZE
+#      filas, bajo statement_timeout, y se corta al llegar a SQL_EXECUTOR_ROW_CAP
+#   3. Al LLM van las primeras RESULT_MAX_ROWS filas más un resumen por
+#      columna calculado sobre todo lo leído (n, nulos, min, max, suma,
+#      distintos estimados con un sketch KMV)
+SQL_EXECUTOR_FETCH_SIZE = int(os.getenv("SQL_EXECUTOR_FETCH_SIZE", "500"))
+SQL_EXECUTOR_ROW_CAP = int(os.getenv("SQL_EXECUTOR_ROW_CAP", "10000"))
+SQL_LIMIT_GUARD_ROWS = int(os.getenv("SQL_LIMIT_GUARD_ROWS", "50000"))
+DISTINCT_SKETCH_SIZE = 256
+
+_TRAILING_RE = re.compile(r"[\s;]+$")
+
+
+# ========================================================================
+# RESUMEN POR COLUMNA
+# ========================================================================
+class DistinctSketch:
+    """KMV: conserva los k hashes más pequeños; exacto mientras haya menos de k distintos"""
+
+    def __init__(self, k: int = DISTINCT_SKETCH_SIZE):
+        self.k = k
+        self._heap: List[int] = []  # max-heap (hashes negados)
+        self._members = set()
+
+    def add(self, value: Any) -> None:
+        h = int.from_bytes(hashlib.blake2b(repr(value).encode("utf-8"), digest_size=8).digest(), "big")
+        if h in self._members:
+            return
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, -h)
+            self._members.add(h)
+        elif h < -self._heap[0]:
+            self._members.discard(-heapq.heapreplace(self._heap, -h))
+            self._members.add(h)
+
+    def estimate(self) -> int:
+        if len(self._heap) < self.k:
+            return len(self._heap)
+        return int((self.k - 1) * (2 ** 64) / -self._heap[0])
+
+    @property
+    def exact(self) -> bool:
+        return len(self._heap) < self.k
+
+
+class ColumnSummary:
+    """Estadísticas incrementales de una columna sobre todas las filas leídas"""
+
+    def __init__(self):
+        self.count = 0
+        self.nulls = 0
+        self.min: Any = None
+        self.max: Any = None
+        self.total = 0
+        self.numeric = True
+        self.sketch = DistinctSketch()
+
+    def add(self, value: Any) -> None:
+        if value is None:
+            self.nulls += 1
+            return
+        self.count += 1
+        if self.numeric and isinstance(value, (int, float)) and not isinstance(value, bool):
+            self.total += value
+        else:
+            self.numeric = False
+        try:
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+        except TypeError:  # Tipos mezclados: se compara como texto
+            self.min, self.max = min(str(self.min), str(value)), max(str(self.max), str(value))
+        self.sketch.add(value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"n": self.count}
+        if self.nulls:
+            stats["nulos"] = self.nulls
+        if self.count:
+            stats["min"], stats["max"] = self.min, self.max
+            if self.numeric:
+                stats["suma"] = round(self.total, 2) if isinstance(self.total, float) else self.total
+            stats["distintos" if self.sketch.exact else "distintos≈"] = self.sketch.estimate()
+        return stats
+
+
+class StreamingResultBuilder:
+    """Acumula lotes de filas: muestra para el LLM + resumen de todo el flujo"""
+
+    def __init__(self, columns: Sequence[str], sample_rows: int = RESULT_MAX_ROWS,
+                 row_cap: int = SQL_EXECUTOR_ROW_CAP):
+        self.columns = list(columns)
+        self.sample_rows = sample_rows
+        self.row_cap = row_cap
+        self.sample: List[List[Any]] = []
+        self.summaries = [ColumnSummary() for _ in self.columns]
+        self.row_count = 0
+        self.capped = False
+
+    def add_rows(self, rows: Sequence[Sequence[Any]]) -> bool:
+        """Agrega un lote; False cuando se alcanzó el tope (dejar de leer)"""
+        for row in rows:
+            if self.row_count >= self.row_cap:
+                self.capped = True
+                return False
+            values = [plain_value(v) for v in row]
+            if len(self.sample) < self.sample_rows:
+                self.sample.append(values)
+            for summary, value in zip(self.summaries, values):
+                summary.add(value)
+            self.row_count += 1
+        return True
+
+    def result(self) -> ResultSet:
+        result = ResultSet.from_rows(self.columns, self.sample, self.row_count)
+        result.capped = self.capped
+        if result.truncated:
+            result.summary = {c: s.to_dict() for c, s in zip(self.columns, self.summaries)}
+        return result
+
+
+# ========================================================================
+# GUARDIA DE LIMIT
+# ========================================================================
+def apply_limit_guard(sql: str, estimated_rows: Optional[float], threshold: int = SQL_LIMIT_GUARD_ROWS,
+                      row_cap: int = SQL_EXECUTOR_ROW_CAP) -> Tuple[str, bool]:
+    """(consulta a ejecutar, si se agregó LIMIT) según la estimación del planificador"""
+    if estimated_rows is None or estimated_rows <= threshold:
+        return sql, False
+    inner = _TRAILING_RE.sub("", sql)
+    # Salto de línea antes del paréntesis: un comentario -- final no se come el cierre
+    return f"SELECT * FROM (\n{inner}\n) AS resultado_limitado LIMIT {row_cap + 1}", True
+
+
+def _log_guard(estimated_rows: Optional[float], guarded: bool, row_cap: int, prefix: str = "") -> None:
+    if guarded:
+        print(f"🛡️ {prefix}Planificador estima {estimated_rows:,.0f} filas: se agrega LIMIT {row_cap + 1}")
+
+
+def _log_result(builder: StreamingResultBuilder, start: float, prefix: str = "") -> None:
+    if builder.capped:
+        print(f"✂️ {prefix}Lectura cortada en {builder.row_count} filas (tope del ejecutor) "
+              f"en {time.perf_counter() - start:.2f}s")
+
+
+def _database_error(error: Exception) -> DatabaseError:
+    if isinstance(error, DatabaseError):
+        return error
+    if type(error).__name__ in ("QueryCanceled", "QueryCanceledError"):
+        return QueryTimeoutError(str(error))
+    return DatabaseError(str(error))
+
+
+# ========================================================================
+# EJECUCIÓN (psycopg2 síncrono y asyncpg)
+# ========================================================================
+def _explain_psycopg2(conn, sql: str) -> Optional[Dict[str, Any]]:
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql)
+            return parse_plan(cursor.fetchone()[0])
+    except Exception:
+        # El error real (si lo hay) lo reportará la consulta misma
+        conn.rollback()
+        return None
+
+
+def execute_streaming(conn, sql: str, fetch_size: int = SQL_EXECUTOR_FETCH_SIZE,
+                      row_cap: int = SQL_EXECUTOR_ROW_CAP, sample_rows: int = RESULT_MAX_ROWS,
+                      statement_timeout_ms: Optional[int] = AGENT_STATEMENT_TIMEOUT_MS,
+                      log_prefix: str = "") -> ResultSet:
+    """
+    Ejecuta con un cursor con nombre (server-side) sobre una conexión psycopg2.
+
+    La consulta corre en una transacción READ ONLY que se descarta al terminar:
+    una escritura que pase el validador falla en la base, no después.
+
+    Raises:
+        SQLCostRejected si la compuerta de costo rechaza el plan;
+        DatabaseError / QueryTimeoutError si la consulta falla
+    """
+    plan = _explain_psycopg2(conn, sql)
+    query, guarded = apply_limit_guard(sql, (plan or {}).get("Plan Rows"), row_cap=row_cap)
+    _log_guard((plan or {}).get("Plan Rows"), guarded, row_cap, log_prefix)
+    if guarded:
+        plan = _explain_psycopg2(conn, query) or plan
+    start = time.perf_counter()
+    try:
+        decision = check_plan(plan, log_prefix)
+        # SET TRANSACTION debe ser lo primero de la transacción: se cierra la del EXPLAIN
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute("SET TRANSACTION READ ONLY")
+            if statement_timeout_ms:
+                cursor.execute("SET LOCAL statement_timeout = %s", (int(statement_timeout_ms),))
+        with conn.cursor(name=f"agent_{uuid.uuid4().hex[:12]}") as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(query)
+            batch = cursor.fetchmany(fetch_size)
+            builder = StreamingResultBuilder([d[0] for d in cursor.description or []], sample_rows, row_cap)
+            while batch and builder.add_rows(batch):
+                batch = cursor.fetchmany(fetch_size)
+    except Exception as e:
+        raise _database_error(e) from e
+    finally:
+        if not conn.closed:
+            conn.rollback()
+    record_executed(decision)
+    _log_result(builder, start, log_prefix)
+    return builder.result()
+
+
+def execute_with_sqldatabase(db, sql: str, **kwargs) -> ResultSet:
+    """execute_streaming sobre el engine del SQLDatabase de LangChain (agentes síncronos)"""
+    engine = getattr(db, "_engine", None)
+    if engine is None or engine.dialect.driver != "psycopg2":
+        # Sin cursores con nombre ni compuerta: ejecución completa, muestra de RESULT_MAX_ROWS
+        return ResultSet.from_records(db._execute(sql))
+    conn = engine.raw_connection()
+    try:
+        return execute_streaming(conn, sql, **kwargs)
+    finally:
+        conn.close()
+
+
+async def _explain_asyncpg(conn, sql: str) -> Optional[Dict[str, Any]]:
+    try:
+        async with conn.transaction():  # SAVEPOINT: un EXPLAIN fallido no aborta la transacción
+            return parse_plan(await conn.fetchval("EXPLAIN (FORMAT JSON) " + sql))
+    except Exception:
+        return None
+
+
+async def _stream_asyncpg(conn, sql: str, fetch_size: int, row_cap: int, sample_rows: int,
+                          statement_timeout_ms: Optional[int], prefix: str) -> ResultSet:
+    async with conn.transaction(readonly=True):
+        plan = await _explain_asyncpg(conn, sql)
+        query, guarded = apply_limit_guard(sql, (plan or {}).get("Plan Rows"), row_cap=row_cap)
+        _log_guard((plan or {}).get("Plan Rows"), guarded, row_cap, prefix)
+        if guarded:
+            plan = await _explain_asyncpg(conn, query) or plan
+        decision = check_plan(plan, prefix)
+
+        if statement_timeout_ms:
+            await conn.execute(f"SET LOCAL statement_timeout = {int(statement_timeout_ms)}")
+        start = time.perf_counter()
+        statement = await conn.prepare(query)
+        builder = StreamingResultBuilder([a.name for a in statement.get_attributes()], sample_rows, row_cap)
+        batch = []
+        async for record in statement.cursor(prefetch=fetch_size):
+            batch.append(tuple(record))
+            if len(batch) >= fetch_size:
+                if not builder.add_rows(batch):
+                    break
+                batch = []
+        else:
+            builder.add_rows(batch)
+    record_executed(decision)
+    _log_result(builder, start, prefix)
+    return builder.result()
+
+
+async def execute_streaming_async(db: DatabasePool, sql: str, fetch_size: int = SQL_EXECUTOR_FETCH_SIZE,
+                                  row_cap: int = SQL_EXECUTOR_ROW_CAP, sample_rows: int = RESULT_MAX_ROWS,
+                                  statement_timeout_ms: Optional[int] = AGENT_STATEMENT_TIMEOUT_MS,
+                                  log_prefix: str = "") -> ResultSet:
+    """
+    Variante para el DatabasePool compartido (agent_async.py).
+
+    Raises:
+        SQLCostRejected, DatabaseError / QueryTimeoutError (como DatabasePool.fetch_all)
+    """
+    try:
+        async with db.connection() as conn:
+            if db.driver == "asyncpg":
+                return await _stream_asyncpg(conn, sql, fetch_size, row_cap, sample_rows,
+                                             statement_timeout_ms, log_prefix)
+            return await asyncio.to_thread(execute_streaming, conn, sql, fetch_size, row_cap, sample_rows,
+                                           statement_timeout_ms, log_prefix)
+    except Exception as e:
+        raise _database_error(e) from e
@@ -0,0 +1,280 @@
+import difflib
+import os
+import re
+import threading
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from result_encoding import RESULT_NOTE_PREFIX
+from sql_result_cache import sql_token_spans
+from sql_validator import FROM_FUNCTIONS
+
+# ========================================================================
+# REPARACIÓN LOCAL DE SQL ANTES DE VOLVER AL LLM
+# ========================================================================
+# Cuando execute_sql falla por un identificador (SQL_VALIDATION_ERROR o
+# "column ... does not exist"), se intenta corregir la consulta aquí mismo:
+#   - "ID de transaccion" / "ID_de_transacción" / id_de_transaccion → "ID de transacción"
+#     (tildes, guiones bajos de las vistas estrella, mayúsculas y comillas)
+#   - fecha sin comillas → "Fecha" (Postgres pliega a minúsculas)
+#   - informe_venta / dim_sede → informe_ventas / dw.dim_sede
+# Se reintenta una sola vez; si la reparación no alcanza, el error original
+# vuelve al LLM. Cada reparación exitosa ahorra un ciclo completo del grafo
+# (1 llamada LLM en main.py, 2 en react_agent_rag.py con el reasoning).
+SQL_REPAIR_ENABLED = os.getenv("SQL_REPAIR_ENABLED", "1") == "1"
+SQL_REPAIR_FUZZY_CUTOFF = float(os.getenv("SQL_REPAIR_FUZZY_CUTOFF", "0.85"))
+AMBIGUITY_MARGIN = 0.03
+
+_REPAIRABLE_ERROR_RE = re.compile(r"SQL_VALIDATION_ERROR|does not exist|no existe", re.IGNORECASE)
+
+
+def normalize_identifier(name: str) -> str:
+    """Sin tildes, minúsculas, '_' como espacio: 'ID_de_Transacción' → 'id de transaccion'"""
+    sin_tildes = "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c))
+    return " ".join(sin_tildes.lower().replace("_", " ").split())
+
+
+def quote_identifier(name: str) -> str:
+    if re.fullmatch(r"[a-z_][a-z0-9_]*", name):
+        return name
+    return '"' + name.replace('"', '""') + '"'
+
+
+def is_repairable_error(content: str) -> bool:
+    return bool(_REPAIRABLE_ERROR_RE.search(content or "")) and not content.startswith("SQL_SECURITY_ERROR")
+
+
+class SQLRepairer:
+    """Corrige identificadores contra el esquema permitido (+ catálogo vivo opcional)"""
+
+    def __init__(self, schema: Dict[str, Sequence[str]], catalog_loader: Optional[Callable[[], Dict[str, List[str]]]] = None,
+                 llm_calls_per_retry: int = 1, fuzzy_cutoff: float = SQL_REPAIR_FUZZY_CUTOFF):
+        self.schema = {table.lower(): list(columns) for table, columns in schema.items()}
+        self.catalog_loader = catalog_loader
+        self.llm_calls_per_retry = llm_calls_per_retry
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self._catalog_loaded = catalog_loader is None
+        self._lock = threading.Lock()
+        self._rebuild_indexes()
+        self.stats = {"attempts": 0, "repaired": 0, "failed": 0, "no_candidate": 0, "llm_calls_avoided": 0}
+
+    def _rebuild_indexes(self) -> None:
+        self.columns = sorted({c for columns in self.schema.values() for c in columns})
+        self._columns_by_norm: Dict[str, List[str]] = {}
+        for column in self.columns:
+            self._columns_by_norm.setdefault(normalize_identifier(column), []).append(column)
+        self._tables_by_norm: Dict[str, str] = {}
+        for table in self.schema:
+            self._tables_by_norm[normalize_identifier(table)] = table
+            self._tables_by_norm.setdefault(normalize_identifier(table.split(".")[-1]), table)
+
+    def _load_catalog(self) -> None:
+        """Columnas reales (information_schema) de las mismas tablas, una vez por proceso"""
+        if self._catalog_loaded:
+            return
+        with self._lock:
+            if self._catalog_loaded:
+                return
+            try:
+                catalog = self.catalog_loader()
+            except Exception as e:
+                print(f"⚠️ Catálogo no disponible para reparar SQL: {e}")
+                self._catalog_loaded = True
+                return
+            if not catalog:
+                return  # Aún sin conexión: se reintenta en la próxima reparación
+            self._catalog_loaded = True
+            for table, columns in catalog.items():
+                if table.lower() in self.schema:
+                    known = self.schema[table.lower()]
+                    known.extend(c for c in columns if c not in known)
+            self._rebuild_indexes()
+
+    # --- Coincidencias --------------------------------------------------
+    def _best(self, normalized: str, candidates: Sequence[str]) -> Optional[str]:
+        scored = sorted(((difflib.SequenceMatcher(None, normalized, c).ratio(), c) for c in candidates), reverse=True)
+        if not scored or scored[0][0] < self.fuzzy_cutoff:
+            return None
+        if len(scored) > 1 and scored[0][0] - scored[1][0] < AMBIGUITY_MARGIN:
+            return None  # Ambiguo: mejor que decida el LLM
+        return scored[0][1]
+
+    def match_column(self, name: str, fuzzy: bool = True) -> Optional[str]:
+        normalized = normalize_identifier(name)
+        exact = self._columns_by_norm.get(normalized, [])
+        if len(exact) == 1:
+            return exact[0]
+        if exact or not fuzzy:
+            return None
+        best = self._best(normalized, list(self._columns_by_norm))
+        if best and len(self._columns_by_norm[best]) == 1:
+            return self._columns_by_norm[best][0]
+        return None
+
+    def match_table(self, name: str) -> Optional[str]:
+        normalized = normalize_identifier(name)
+        if normalized in self._tables_by_norm:
+            return self._tables_by_norm[normalized]
+        best = self._best(normalized, list(self._tables_by_norm))
+        return self._tables_by_norm[best] if best else None
+
+    # --- Reparación -----------------------------------------------------
+    def repair(self, sql: str) -> Optional[Tuple[str, List[str]]]:
+        """(consulta corregida, ['viejo → nuevo', ...]) o None si no hay nada que corregir"""
+        self._load_catalog()
+        tokens = sql_token_spans(sql)
+        lower = [text.lower() if kind == "word" else None for kind, text, _, _ in tokens]
+
+        # Nombres que define la propia consulta: alias (AS x), CTEs y alias de tablas
+        defined = set()
+        for i, (kind, text, _, _) in enumerate(tokens[:-1]):
+            if lower[i] == "as":
+                siguiente_kind, siguiente = tokens[i + 1][0], tokens[i + 1][1]
+                defined.add(siguiente[1:-1] if siguiente_kind == "ident" else siguiente.lower())
+            if lower[i] and i + 2 < len(tokens) and lower[i + 1] == "as" and tokens[i + 2][1] == "(":
+                defined.add(lower[i])
+
+        replacements: List[Tuple[int, int, str, str]] = []
+        funciones: List[Optional[str]] = []  # Función de cada paréntesis abierto: EXTRACT(x FROM "Fecha")
+        i = 0
+        while i < len(tokens):
+            kind, text, start, end = tokens[i]
+            anterior = lower[i - 1] if i else None
+            siguiente = tokens[i + 1][1] if i + 1 < len(tokens) else ""
+            if text == "(":
+                funciones.append(anterior)
+            elif text == ")" and funciones:
+                funciones.pop()
+
+            # Tabla tras FROM / JOIN (esquema.tabla se evalúa completo)
+            es_tabla = anterior == "join" or (anterior == "from" and not (funciones and funciones[-1] in FROM_FUNCTIONS)
+                                              and not (i > 1 and lower[i - 2] == "distinct"))
+            if es_tabla and kind in ("word", "ident") and siguiente != "(":
+                fin, partes, j = end, [text.strip('"')], i
+                while j + 2 < len(tokens) and tokens[j + 1][1] == "." and tokens[j + 2][0] in ("word", "ident"):
+                    j += 2
+                    partes.append(tokens[j][1].strip('"'))
+                    fin = tokens[j][3]
+                nombre = ".".join(partes)
+                comparable = nombre.lower()[len("public."):] if nombre.lower().startswith("public.") else nombre.lower()
+                if comparable not in self.schema and comparable not in defined:
+                    tabla = self.match_table(comparable)
+                    if tabla:
+                        replacements.append((start, fin, nombre, tabla))
+                i = j + 1
+                continue
+
+            if kind == "ident" and siguiente != ".":
+                nombre = text[1:-1].replace('""', '"')
+                if nombre not in self.columns and nombre not in defined and anterior != "as":
+                    columna = self.match_column(nombre)
+                    if columna:
+                        replacements.append((start, end, text, quote_identifier(columna)))
+            elif kind == "word" and siguiente not in (".", "(") and anterior != "as":
+                # Sin comillas solo se corrige si equivale exactamente (sin tildes ni mayúsculas) a una columna
+                if lower[i] not in defined and lower[i] not in self.columns:
+                    columna = self.match_column(text, fuzzy=False)
+                    if columna and columna != lower[i]:
+                        replacements.append((start, end, text, quote_identifier(columna)))
+            i += 1
+
+        if not replacements:
+            return None
+        repaired = sql
+        for start, end, _, nuevo in sorted(replacements, reverse=True):
+            repaired = repaired[:start] + nuevo + repaired[end:]
+        fixes = list(dict.fromkeys(f"{viejo} → {nuevo}" for _, _, viejo, nuevo in replacements))
+        return repaired, fixes
+
+    # --- Métricas -------------------------------------------------------
+    def record(self, outcome: str) -> None:
+        with self._lock:
+            self.stats[outcome] += 1
+            if outcome == "repaired":
+                self.stats["llm_calls_avoided"] += self.llm_calls_per_retry
+
+    def format_stats(self) -> str:
+        with self._lock:
+            stats = dict(self.stats)
+        return (f"🩹 Reparación SQL: {stats['repaired']}/{stats['attempts']} consultas corregidas localmente | "
+                f"{stats['llm_calls_avoided']} llamadas LLM evitadas | {stats['failed']} fallidas, "
+                f"{stats['no_candidate']} sin corrección posible")
+
+
+def catalog_query(tables: Sequence[str]) -> str:
+    """Columnas reales de las tablas permitidas (information_schema)"""
+    condiciones = []
+    for table in tables:
+        schema, _, name = table.rpartition(".")
+        condiciones.append(f"(table_schema = '{schema or 'public'}' AND table_name = '{name}')")
+    return ("SELECT table_schema, table_name, column_name FROM information_schema.columns WHERE "
+            + " OR ".join(condiciones) + " ORDER BY table_schema, table_name, ordinal_position")
+
+
+def catalog_from_records(records: Sequence[Dict[str, Any]]) -> Dict[str, List[str]]:
+    catalog: Dict[str, List[str]] = {}
+    for record in records:
+        table = record["table_name"] if record["table_schema"] == "public" else f"{record['table_schema']}.{record['table_name']}"
+        catalog.setdefault(table, []).append(record["column_name"])
+    return catalog
+
+
+def repair_note(fixes: List[str]) -> str:
+    """Aviso para el LLM: así usa los nombres correctos en las siguientes consultas"""
+    return f"{RESULT_NOTE_PREFIX}corregido automáticamente: " + "; ".join(fixes) + "]"
+
+
+# ========================================================================
+# EJECUCIÓN CON UN REINTENTO LOCAL
+# ========================================================================
+def _repair_candidate(repairer: SQLRepairer, query: str, error: str) -> Optional[Tuple[str, List[str]]]:
+    if not SQL_REPAIR_ENABLED or not is_repairable_error(error):
+        return None
+    repairer.record("attempts")
+    candidate = repairer.repair(query)
+    if candidate is None:
+        repairer.record("no_candidate")
+        return None
+    print(f"🩹 Reparando SQL localmente: {'; '.join(candidate[1])}")
+    return candidate
+
+
+def execute_with_repair(query: str, run: Callable[[str], Union[str, Any]],
+                        repairer: SQLRepairer) -> Tuple[Union[str, Any], str, List[str]]:
+    """
+    run(query) devuelve un resultado o un mensaje de error (str).
+
+    Returns:
+        (resultado o error original, consulta ejecutada, correcciones aplicadas)
+    """
+    result = run(query)
+    if not isinstance(result, str):
+        return result, query, []
+    candidate = _repair_candidate(repairer, query, result)
+    if candidate is None:
+        return result, query, []
+    repaired, fixes = candidate
+    retry = run(repaired)
+    if isinstance(retry, str):
+        repairer.record("failed")
+        return result, query, []
+    repairer.record("repaired")
+    return retry, repaired, fixes
+
+
+async def execute_with_repair_async(query: str, run: Callable[[str], Awaitable[Union[str, Any]]],
+                                    repairer: SQLRepairer) -> Tuple[Union[str, Any], str, List[str]]:
+    """execute_with_repair con un run asíncrono (agent_async.py)"""
+    result = await run(query)
+    if not isinstance(result, str):
+        return result, query, []
+    candidate = _repair_candidate(repairer, query, result)
+    if candidate is None:
+        return result, query, []
+    repaired, fixes = candidate
+    retry = await run(repaired)
+    if isinstance(retry, str):
+        repairer.record("failed")
+        return result, query, []
+    repairer.record("repaired")
+    return retry, repaired, fixes
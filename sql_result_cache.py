@@ -0,0 +1,191 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Tuple
+
+# ========================================================================
+# CACHÉ DE RESULTADOS SQL DEL TOOL execute_sql
+# ========================================================================
+# Las consultas se identifican por una huella de su forma canónica: sin
+# comentarios ni espacios extra, palabras clave e identificadores sin comillas
+# en minúsculas (Postgres los pliega igual) y literales numéricos normalizados.
+# Los strings y los identificadores entre comillas se conservan tal cual.
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "1") == "1"
+SQL_CACHE_MAX_BYTES = int(os.getenv("SQL_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+SQL_CACHE_MAX_ENTRY_BYTES = int(os.getenv("SQL_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+SQL_CACHE_TTL = int(os.getenv("SQL_CACHE_TTL", "3600"))
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+    |(?P<string>[eE]?'(?:[^']|'')*')
+    |(?P<ident>"(?:[^"]|"")*")
+    |(?P<number>\d+\.\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?|\d+(?:[eE][+-]?\d+)?)
+    |(?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    |(?P<space>\s+)
+    |(?P<op>::|<=|>=|<>|!=|\|\||[^\s\w])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def _canonical_number(literal: str) -> str:
+    try:
+        value = Decimal(literal)
+    except InvalidOperation:
+        return literal
+    if value == value.to_integral_value():
+        return str(int(value))
+    return format(value.normalize(), "f")
+
+
+def sql_token_spans(sql: str) -> List[Tuple[str, str, int, int]]:
+    """(tipo, texto, inicio, fin) de cada token, sin comentarios ni espacios"""
+    return [(m.lastgroup, m.group(), m.start(), m.end()) for m in _TOKEN_RE.finditer(sql)
+            if m.lastgroup not in ("comment", "space")]
+
+
+def tokenize_sql(sql: str) -> List[Tuple[str, str]]:
+    """(tipo, texto) de cada token, sin comentarios ni espacios"""
+    return [(kind, text) for kind, text, _, _ in sql_token_spans(sql)]
+
+
+def canonicalize_sql(sql: str) -> str:
+    """Forma canónica de la consulta (base de la huella)"""
+    tokens = []
+    for kind, text in tokenize_sql(sql):
+        if kind == "word":
+            tokens.append(text.lower())
+        elif kind == "number":
+            tokens.append(_canonical_number(text))
+        else:
+            tokens.append(text)
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    return " ".join(tokens)
+
+
+def fingerprint_sql(sql: str) -> str:
+    return hashlib.sha256(canonicalize_sql(sql).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class SQLCacheEntry:
+    content: str
+    nbytes: int
+    data_version: int
+    expires_at: float
+    hits: int = 0
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+
+class SQLResultCache:
+    """LRU acotada por bytes de resultados serializados de execute_sql"""
+
+    def __init__(self, max_bytes: int = SQL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, SQLCacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Última etl.data_version recibida de los agentes (cada uno lee la suya)
+        self._data_version = 0
+
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "skipped_large": 0, "invalidations": 0}
+
+    def data_version(self, version: Optional[int] = None) -> int:
+        """Versión vigente tras registrar la que leyó el agente (solo avanza, None = la última conocida)"""
+        with self._lock:
+            if version is not None and version > self._data_version:
+                if self._entries:
+                    self.stats["invalidations"] += 1
+                self._entries.clear()
+                self._bytes = 0
+                self._data_version = version
+            return self._data_version
+
+    def clear(self) -> None:
+        with self._lock:
+            if self._entries:
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+
+    def get(self, sql: str, data_version: Optional[int] = None) -> Optional[str]:
+        """Resultado cacheado de la consulta o None (data_version: la leída por el agente)"""
+        if not SQL_CACHE_ENABLED:
+            return None
+        version = self.data_version(data_version)
+        key = fingerprint_sql(sql)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.expired or entry.data_version != version):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            entry.hits += 1
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry.content
+
+    def put(self, sql: str, content: str, data_version: Optional[int] = None) -> bool:
+        """Guarda el resultado serializado; False si excede SQL_CACHE_MAX_ENTRY_BYTES"""
+        if not SQL_CACHE_ENABLED:
+            return False
+        key = fingerprint_sql(sql)
+        nbytes = len(content.encode("utf-8")) + len(key)
+        if nbytes > SQL_CACHE_MAX_ENTRY_BYTES:
+            self.stats["skipped_large"] += 1
+            return False
+        entry = SQLCacheEntry(
+            content=content,
+            nbytes=nbytes,
+            data_version=self.data_version(data_version),
+            expires_at=time.time() + SQL_CACHE_TTL,
+        )
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats["evictions"] += 1
+            self.stats["stores"] += 1
+        return True
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "data_version": self._data_version,
+        }
+
+
+def is_cacheable_result(content: str) -> bool:
+    """Solo se cachean resultados exitosos (mismo criterio de error que observer_node)"""
+    if not content or content.lower().startswith("error"):
+        return False
+    return not any(marker in content for marker in ("ERROR", "SQL_SECURITY_ERROR", "SQL_ERROR"))
+
+
+sql_result_cache = SQLResultCache()
@@ -0,0 +1,284 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from sql_result_cache import fingerprint_sql, tokenize_sql
+
+# Parser SQL real opcional: sin sqlglot se valida sobre los tokens
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:
+    sqlglot = None
+    exp = None
+
+# ========================================================================
+# VALIDADOR SQL DEL AGENTE (reemplaza la búsqueda de subcadenas)
+# ========================================================================
+# La consulta se analiza una vez (AST con sqlglot o tokens) y se acepta solo si:
+#   - es una única sentencia SELECT / WITH, sin DML/DDL ni funciones peligrosas
+#   - lee solo tablas de REAL_SCHEMA (o CTEs definidas en la misma consulta)
+#   - sus columnas existen en esas tablas o son alias de la propia consulta
+# Las palabras se comparan como tokens, no como subcadenas: "Ejecutar como"
+# o una columna updated_at ya no se toman por DML. Los identificadores
+# desconocidos vuelven al LLM con la lista de columnas válidas antes de
+# tocar la base de datos. El resultado se guarda por huella de la consulta.
+SQL_VALIDATOR_CACHE_SIZE = int(os.getenv("SQL_VALIDATOR_CACHE_SIZE", "512"))
+SQL_VALIDATOR_PARSER = os.getenv("SQL_VALIDATOR_PARSER", "sqlglot" if sqlglot else "tokens")
+
+FORBIDDEN_WORDS = {
+    "insert", "update", "delete", "merge", "drop", "alter", "truncate", "create", "grant", "revoke",
+    "copy", "call", "do", "execute", "vacuum", "reindex", "cluster", "listen", "notify", "refresh",
+    "into",  # SELECT ... INTO crea una tabla
+}
+DANGEROUS_FUNCTIONS = {
+    "pg_sleep", "pg_read_file", "pg_read_binary_file", "pg_ls_dir", "pg_stat_file", "pg_terminate_backend",
+    "pg_cancel_backend", "pg_reload_conf", "set_config", "lo_import", "lo_export", "dblink", "dblink_exec",
+    "query_to_xml", "current_setting",
+}
+# FROM que no introduce una tabla: EXTRACT(DOW FROM ...), SUBSTRING(x FROM 2), IS DISTINCT FROM
+FROM_FUNCTIONS = {"extract", "substring", "trim", "overlay", "position"}
+# Palabras sin comillas que no son columnas (ruta por tokens): palabras clave,
+# campos de EXTRACT, tipos y literales. El resto debe ser columna o alias.
+SQL_KEYWORDS = {
+    "select", "with", "recursive", "materialized", "distinct", "from", "where", "and", "or", "not", "in",
+    "is", "null", "as", "on", "using", "join", "left", "right", "inner", "outer", "full", "cross", "natural",
+    "lateral", "group", "by", "order", "having", "limit", "offset", "fetch", "next", "first", "last",
+    "only", "rows", "row", "asc", "desc", "nulls", "case", "when", "then", "else", "end", "between",
+    "like", "ilike", "similar", "to", "escape", "union", "all", "intersect", "except", "any", "some",
+    "exists", "over", "partition", "range", "groups", "preceding", "following", "unbounded", "current",
+    "window", "filter", "within", "ordinality", "true", "false", "unknown", "interval", "at", "time",
+    "zone", "collate", "array", "cast", "for", "leading", "trailing", "both", "placing", "values",
+    "current_date", "current_time", "current_timestamp", "localtime", "localtimestamp",
+    "century", "decade", "year", "quarter", "month", "week", "day", "hour", "minute", "second",
+    "milliseconds", "microseconds", "dow", "isodow", "doy", "epoch", "isoyear", "timezone",
+    "int", "integer", "smallint", "bigint", "numeric", "decimal", "real", "double", "precision", "float",
+    "money", "text", "varchar", "char", "character", "varying", "boolean", "bool", "date", "timestamp",
+    "timestamptz", "without", "json", "jsonb",
+}
+
+_AST_FORBIDDEN = tuple(getattr(exp, name) for name in (
+    "Insert", "Update", "Delete", "Merge", "Drop", "Create", "Alter", "AlterTable", "TruncateTable",
+    "Command", "Grant", "Copy", "Lock", "Into",
+) if exp is not None and hasattr(exp, name))
+_AST_ROOTS = tuple(getattr(exp, name) for name in ("Select", "Union", "Intersect", "Except")
+                   if exp is not None and hasattr(exp, name))
+
+
+class SQLValidator:
+    """Valida consultas contra un esquema {tabla: [columnas]} con caché por huella"""
+
+    def __init__(self, schema: Dict[str, Sequence[str]], cache_size: int = SQL_VALIDATOR_CACHE_SIZE,
+                 parser: str = SQL_VALIDATOR_PARSER):
+        self.tables: Dict[str, Set[str]] = {name.lower(): set(columns) for name, columns in schema.items()}
+        self.columns: Set[str] = set().union(*self.tables.values()) if self.tables else set()
+        # Partes de los nombres de tabla (esquema y tabla) para no confundirlas con columnas
+        self._table_words: Set[str] = {part for name in self.tables for part in name.split(".")} | {"public"}
+        self.parser = parser if sqlglot is not None else "tokens"
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"validated": 0, "cache_hits": 0, "security_rejections": 0, "unknown_identifiers": 0,
+                      "parse_fallbacks": 0}
+
+    def validate(self, sql: str) -> Optional[str]:
+        """None si la consulta es válida; si no, el mensaje para el LLM"""
+        key = fingerprint_sql(sql)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                return self._cache[key]
+
+        error = self._validate_ast(sql) if self.parser == "sqlglot" else self._validate_tokens(sql)
+
+        with self._lock:
+            self.stats["validated"] += 1
+            if error and error.startswith("SQL_SECURITY_ERROR"):
+                self.stats["security_rejections"] += 1
+            elif error:
+                self.stats["unknown_identifiers"] += 1
+            self._cache[key] = error
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return error
+
+    # --- Mensajes -------------------------------------------------------
+    def _unknown_table(self, table: str) -> str:
+        return (f"SQL_VALIDATION_ERROR: la tabla '{table}' no está permitida. "
+                f"Tablas disponibles: {', '.join(sorted(self.tables))}")
+
+    def _unknown_column(self, column: str, table: Optional[str] = None) -> str:
+        if table:
+            disponibles = ", ".join(f'"{c}"' for c in sorted(self.tables[table]))
+            return f'SQL_VALIDATION_ERROR: la columna "{column}" no existe en {table}. Columnas de {table}: {disponibles}'
+        disponibles = "; ".join(f"{t}: " + ", ".join(f'"{c}"' for c in sorted(cols))
+                                for t, cols in sorted(self.tables.items()))
+        return (f'SQL_VALIDATION_ERROR: la columna "{column}" no existe (las columnas con mayúsculas, '
+                f"espacios o tildes van entre comillas dobles). Columnas válidas: {disponibles}")
+
+    # --- Validación con sqlglot ----------------------------------------
+    def _validate_ast(self, sql: str) -> Optional[str]:
+        try:
+            statements = [s for s in sqlglot.parse(sql, read="postgres") if s is not None]
+        except sqlglot.errors.SqlglotError:
+            # Sintaxis de Postgres que el parser no cubre: no se rechaza por eso
+            with self._lock:
+                self.stats["parse_fallbacks"] += 1
+            return self._validate_tokens(sql)
+
+        if len(statements) != 1:
+            return "SQL_SECURITY_ERROR: Solo se permite una sentencia por consulta"
+        root = statements[0]
+        if not isinstance(root, _AST_ROOTS):
+            return "SQL_SECURITY_ERROR: Solo se permiten consultas SELECT"
+        if _AST_FORBIDDEN and root.find(*_AST_FORBIDDEN) is not None:
+            return "SQL_SECURITY_ERROR: Operación SQL no permitida"
+        for function in root.find_all(exp.Anonymous):
+            if str(function.name).lower() in DANGEROUS_FUNCTIONS:
+                return f"SQL_SECURITY_ERROR: Función no permitida: {function.name}"
+
+        ctes = {cte.alias_or_name.lower() for cte in root.find_all(exp.CTE)}
+        # Nombres definidos por la propia consulta: alias de columnas y de tablas/subconsultas
+        defined: Set[str] = set()
+        for alias in root.find_all(exp.Alias):
+            defined.update((alias.alias, alias.alias.lower()))
+        for table_alias in root.find_all(exp.TableAlias):
+            defined.update((table_alias.name, table_alias.name.lower()))
+            defined.update(c.name for c in table_alias.columns)
+
+        alias_to_table: Dict[str, Optional[str]] = {}
+        for table in root.find_all(exp.Table):
+            if not isinstance(table.this, exp.Identifier):
+                continue  # Funciones en FROM (generate_series, unnest)
+            name = table.name.lower()
+            full = f"{table.db.lower()}.{name}" if table.db and table.db.lower() != "public" else name
+            if not table.db and name in ctes:
+                alias_to_table[(table.alias or name).lower()] = None
+                continue
+            if full not in self.tables:
+                return self._unknown_table(full)
+            alias_to_table[(table.alias or name).lower()] = full
+
+        for column in root.find_all(exp.Column):
+            if not isinstance(column.this, exp.Identifier):
+                continue  # tabla.*
+            name = column.name
+            key = name if column.this.quoted else name.lower()
+            qualifier = column.table.lower() if column.table else None
+            if qualifier and alias_to_table.get(qualifier):
+                table = alias_to_table[qualifier]
+                if key not in self.tables[table]:
+                    return self._unknown_column(name, table)
+            elif qualifier:
+                continue  # Columna de una CTE o subconsulta: se valida donde se define
+            elif key not in self.columns and key not in defined and key not in ctes:
+                return self._unknown_column(name)
+        return None
+
+    # --- Validación por tokens (sin sqlglot) ----------------------------
+    def _validate_tokens(self, sql: str) -> Optional[str]:
+        tokens = tokenize_sql(sql)
+        while tokens and tokens[-1] == ("op", ";"):
+            tokens.pop()
+        if not tokens:
+            return "SQL_SECURITY_ERROR: Solo se permiten consultas SELECT"
+        if ("op", ";") in tokens:
+            return "SQL_SECURITY_ERROR: Solo se permite una sentencia por consulta"
+
+        primera = next((text.lower() for kind, text in tokens if text != "("), "")
+        if primera not in ("select", "with"):
+            return "SQL_SECURITY_ERROR: Solo se permiten consultas SELECT"
+
+        words = [text.lower() if kind == "word" else None for kind, text in tokens]
+        for i, word in enumerate(words):
+            if word in FORBIDDEN_WORDS:
+                return "SQL_SECURITY_ERROR: Operación SQL no permitida"
+            if word in DANGEROUS_FUNCTIONS and i + 1 < len(tokens) and tokens[i + 1][1] == "(":
+                return f"SQL_SECURITY_ERROR: Función no permitida: {tokens[i][1]}"
+
+        ctes, defined = self._token_definitions(tokens, words)
+        error = self._check_token_tables(tokens, words, ctes)
+        if error:
+            return error
+
+        # Identificadores: columna del esquema, alias o calificador (x."col"). Sin comillas
+        # Postgres los pliega a minúsculas: fecha no es "Fecha"
+        for i, (kind, text) in enumerate(tokens):
+            if kind == "ident":
+                name = text[1:-1].replace('""', '"')
+            elif kind == "word" and words[i] not in SQL_KEYWORDS:
+                name = words[i]
+            else:
+                continue
+            if i and words[i - 1] == "as":
+                continue
+            if i + 1 < len(tokens) and tokens[i + 1][1] in (".", "("):
+                continue  # Calificador o función
+            if kind == "word" and (name in self._table_words or name in ctes or (i and tokens[i - 1][1] == "::")):
+                continue  # Tabla, CTE o tipo de un cast
+            if name not in self.columns and name not in defined:
+                return self._unknown_column(name)
+        return None
+
+    @staticmethod
+    def _token_definitions(tokens: List[Tuple[str, str]], words: List[Optional[str]]) -> Tuple[Set[str], Set[str]]:
+        """Nombres de CTEs (x AS ( ...) y alias definidos con AS o implícitos (FROM transacciones t)"""
+        ctes: Set[str] = set()
+        defined: Set[str] = set()
+        for i in range(len(tokens) - 1):
+            if words[i] == "as":
+                kind, text = tokens[i + 1]
+                if kind == "ident":
+                    defined.add(text[1:-1].replace('""', '"'))
+                elif kind == "word":
+                    defined.add(text.lower())
+            if words[i] and i + 2 < len(tokens) and words[i + 1] == "as" and tokens[i + 2][1] == "(":
+                ctes.add(words[i])
+            # Alias sin AS: nombre que sigue directamente a una expresión, tabla o subconsulta
+            kind, text = tokens[i + 1]
+            expresion = (tokens[i][0] in ("ident", "number", "string") or tokens[i][1] == ")"
+                         or words[i] == "end" or (words[i] is not None and words[i] not in SQL_KEYWORDS))
+            nombre = kind == "ident" or (kind == "word" and words[i + 1] not in SQL_KEYWORDS)
+            if expresion and nombre and (i + 2 >= len(tokens) or tokens[i + 2][1] not in (".", "(")):
+                defined.add(text[1:-1].replace('""', '"') if kind == "ident" else words[i + 1])
+        return ctes, defined
+
+    def _check_token_tables(self, tokens: List[Tuple[str, str]], words: List[Optional[str]],
+                            ctes: Set[str]) -> Optional[str]:
+        funciones: List[Optional[str]] = []  # Función de cada paréntesis abierto
+        for i, (kind, text) in enumerate(tokens):
+            if text == "(":
+                funciones.append(words[i - 1] if i else None)
+                continue
+            if text == ")":
+                if funciones:
+                    funciones.pop()
+                continue
+            if words[i] not in ("from", "join"):
+                continue
+            if words[i] == "from" and ((funciones and funciones[-1] in FROM_FUNCTIONS)
+                                       or (i and words[i - 1] == "distinct")):
+                continue
+            # Nombre (posiblemente esquema.tabla) que sigue a FROM / JOIN
+            partes, j = [], i + 1
+            while j < len(tokens) and tokens[j][0] in ("word", "ident"):
+                partes.append(tokens[j][1].lower() if tokens[j][0] == "word" else tokens[j][1][1:-1].lower())
+                if j + 1 < len(tokens) and tokens[j + 1][1] == ".":
+                    j += 2
+                    continue
+                break
+            if not partes or (j + 1 < len(tokens) and tokens[j + 1][1] == "("):
+                continue  # Subconsulta o función en FROM
+            name = ".".join(partes[1:] if partes[0] == "public" and len(partes) > 1 else partes)
+            if name not in self.tables and name not in ctes:
+                return self._unknown_table(name)
+        return None
+
+    def format_stats(self) -> str:
+        with self._lock:
+            stats = dict(self.stats)
+        return (f"🧾 Validador SQL ({self.parser}): {stats['validated']} analizadas, {stats['cache_hits']} desde caché | "
+                f"{stats['security_rejections']} bloqueadas por seguridad, {stats['unknown_identifiers']} con "
+                f"identificadores desconocidos (viajes a la BD evitados)")
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Módulos planos en la raíz del repo; embeddings apagados para que las pruebas no usen red
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ANSWER_CACHE_EMBEDDINGS", "0")
+os.environ.setdefault("KPI_FAST_PATH_EMBEDDINGS", "0")
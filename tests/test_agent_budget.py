@@ -0,0 +1,45 @@
+import time
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from agent_budget import AGENT_FINAL_RESERVE_SECONDS, AgentBudget  # noqa: E402
+
+
+def _budget(**kwargs) -> AgentBudget:
+    return AgentBudget(**{"deadline_seconds": 60, "max_llm_calls": 5, "max_tokens": 1000, "max_sql": 3, **kwargs})
+
+
+def test_fresh_budget_continues():
+    budget = _budget()
+    assert budget.plan() == "continue" and budget.exhausted_reason is None
+
+
+@pytest.mark.parametrize("cambios, decision, motivo", [
+    ({"llm_calls": 4}, "final", "llamadas_llm"),
+    ({"llm_calls": 5}, "stop", "llamadas_llm"),
+    ({"tokens": 900}, "final", "tokens"),
+    ({"tokens": 1000}, "stop", "tokens"),
+    ({"sql_executions": 3}, "final", "consultas_sql"),
+])
+def test_limits(cambios, decision, motivo):
+    budget = _budget(**cambios)
+    assert budget.plan() == decision
+    assert budget.exhausted_reason == motivo
+
+
+def test_deadline():
+    assert _budget(started=time.monotonic() - 61).plan() == "stop"
+    assert _budget(started=time.monotonic() - 60 + AGENT_FINAL_RESERVE_SECONDS / 2).plan() == "final"
+
+
+def test_charges():
+    class Respuesta:
+        usage_metadata = {"total_tokens": 120}
+
+    budget = _budget()
+    budget.charge_llm(Respuesta())
+    budget.charge_llm(object())
+    budget.charge_sql(2)
+    assert (budget.llm_calls, budget.tokens, budget.sql_executions) == (2, 120, 2)
@@ -0,0 +1,77 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from answer_cache import AnswerCache, AnswerEntry  # noqa: E402
+from kpi_fast_path import content_tokens, normalize_question  # noqa: E402
+
+
+def _cache_with(*questions: str) -> AnswerCache:
+    cache = AnswerCache()
+    for question in questions:
+        cache._store(AnswerEntry(
+            question=question, normalized=normalize_question(question), tokens=content_tokens(question),
+            response=f"respuesta: {question}", sql_query=None, result_rows=None, data_version=0, latency_ms=100.0,
+        ))
+    return cache
+
+
+def _find(cache: AnswerCache, question: str):
+    return cache._find(normalize_question(question), content_tokens(question), None)
+
+
+def test_exact_match():
+    cache = _cache_with("¿Cuáles son las ventas por sede?")
+    entry, metodo, _ = _find(cache, "cuales son las ventas por sede")
+    assert entry is not None and metodo == "exact"
+
+
+def test_same_content_words_in_other_order_match():
+    cache = _cache_with("ventas por sede totales")
+    entry, metodo, _ = _find(cache, "totales de ventas por sede")
+    assert entry is not None and metodo == "tokens"
+
+
+@pytest.mark.parametrize("cached, question", [
+    ("propinas pagadas con tarjeta", "propinas pagadas con tarjeta visa"),
+    ("ventas de cafe por sede", "ventas de cafe americano por sede"),
+    ("productos vendidos por sede", "productos vendidos"),
+])
+def test_extra_qualifier_does_not_share_answers(cached, question):
+    cache = _cache_with(cached)
+    entry, _, _ = _find(cache, question)
+    assert entry is None
+
+
+@pytest.mark.parametrize("cached, question", [
+    ("productos mas vendidos", "productos menos vendidos"),
+    ("sede con mayor ticket promedio", "sede con menor ticket promedio"),
+    ("mejor sede en ventas", "peor sede en ventas"),
+    ("top productos por ventas", "productos por ventas"),
+    ("ventas del ultimo mes", "ventas del primero mes"),
+    ("clientes que volvieron", "clientes que no volvieron"),
+])
+def test_antonyms_do_not_share_answers(cached, question):
+    cache = _cache_with(cached)
+    entry, _, _ = _find(cache, question)
+    assert entry is None
+
+
+@pytest.mark.parametrize("cached, question", [
+    ("ventas de enero", "ventas de febrero"),
+    ("ventas en merced", "ventas en tajamar"),
+    ("top 5 productos", "top 3 productos"),
+])
+def test_filters_do_not_share_answers(cached, question):
+    cache = _cache_with(cached)
+    entry, _, _ = _find(cache, question)
+    assert entry is None
+
+
+def test_data_version_only_moves_forward():
+    cache = AnswerCache()
+    cache.store("ventas por sede", {"response": "r", "messages": ["m"]}, 10.0, data_version=2)
+    # Un agente con la versión atrasada no invalida las respuestas de la nueva
+    assert cache.lookup("ventas por sede", data_version=1) is not None
+    assert cache.lookup("ventas por sede", data_version=3) is None
+    assert cache.data_version() == 3
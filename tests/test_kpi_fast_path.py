@@ -0,0 +1,35 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from kpi_fast_path import match_kpi  # noqa: E402
+
+REGISTRY = {
+    "ventas_por_sede": {"keywords": ["ventas por sede", "ventas totales sede", "total ventas por ubicacion"]},
+    "top_productos": {"keywords": ["top productos", "productos mas vendidos", "mejores ventas productos"]},
+    "medios_pago": {"keywords": ["medios de pago", "distribucion pagos", "metodos pago"]},
+    "horas_concurridas": {"keywords": ["horas pico", "peak hours", "horarios mas concurridos"]},
+}
+
+
+@pytest.mark.parametrize("question, kpi", [
+    ("¿Cuáles son las ventas por sede?", "ventas_por_sede"),
+    ("Dame los productos más vendidos", "top_productos"),
+    ("¿Cuáles son las horas pico?", "horas_concurridas"),
+])
+def test_known_kpi_matches(question, kpi):
+    match = match_kpi(question, REGISTRY)
+    assert match is not None and match["kpi"] == kpi
+
+
+@pytest.mark.parametrize("question", [
+    "ventas por sede en tajamar",
+    "ventas por sede en Persa Víctor Manuel",
+    "top 3 productos",
+    "productos menos vendidos",
+    "peores ventas productos",
+    "ventas por sede de enero",
+    "compara las ventas por sede",
+])
+def test_filtered_questions_go_to_graph(question):
+    assert match_kpi(question, REGISTRY) is None
@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("sqlglot")
+pytest.importorskip("langchain_core")
+main = pytest.importorskip("main")
+
+from llm_cassette import DuckDBDatabase, postgres_to_duckdb, snapshot_to_duckdb  # noqa: E402
+
+NUMERICAS = {"Comisión", "Total", "Cantidad", "Precio (Bruto)", "Precio (Neto)"}
+
+# Filas con el mismo formato que la exportación: fechas "DD-MM-YYYY, HH24:MI" como texto
+FILAS = {
+    "dw.dim_sede": [{"sede_sk": 1, "nombre_sede": "Merced"}, {"sede_sk": 2, "nombre_sede": "Tajamar"}],
+    "transacciones": [
+        {"ID de transacción": "a1", "Fecha": "23-02-2025, 10:15", "Hora": "10:15", "Cuenta": "merced",
+         "Estado": "Exitosa", "Ejecutar como": "x", "Comisión": 50, "Total": 2000,
+         "Últimos 4 dígitos": "1234", "sede_sk": 1},
+        {"ID de transacción": "a2", "Fecha": "24-02-2025, 18:40", "Hora": "18:40", "Cuenta": "tajamar",
+         "Estado": "Exitosa", "Ejecutar como": "x", "Comisión": 20, "Total": 1500,
+         "Últimos 4 dígitos": "1234", "sede_sk": 2},
+    ],
+    "informe_ventas": [
+        {"ID de transacción": "a1", "Fecha": "23-02-2025, 10:15", "Hora": "10:15", "Cuenta": "merced",
+         "Descripción": "Cafe", "Cantidad": 1, "Precio (Bruto)": 2000, "Precio (Neto)": 1600,
+         "Últimos 4 dígitos": "1234", "sede_sk": 1},
+        {"ID de transacción": "a2", "Fecha": "24-02-2025, 18:40", "Hora": "18:40", "Cuenta": "tajamar",
+         "Descripción": "Tip", "Cantidad": 1, "Precio (Bruto)": 500, "Precio (Neto)": 500,
+         "Últimos 4 dígitos": "1234", "sede_sk": 2},
+        {"ID de transacción": "a2", "Fecha": "24-02-2025, 18:40", "Hora": "18:40", "Cuenta": "tajamar",
+         "Descripción": "Medialuna", "Cantidad": 1, "Precio (Bruto)": 1000, "Precio (Neto)": 800,
+         "Últimos 4 dígitos": "1234", "sede_sk": 2},
+    ],
+}
+
+
+def _tipo(columna: str) -> str:
+    if columna == "sede_sk":
+        return "int"
+    return "num" if columna in NUMERICAS else "text"
+
+
+@pytest.fixture(scope="module")
+def db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("replay") / "agent.duckdb")
+    tables = {name: [[c, _tipo(c)] for c in columnas] for name, columnas in main.REAL_SCHEMA.items()}
+    snapshot_to_duckdb(lambda sql: FILAS[sql[len("SELECT * FROM "):]], tables, path)
+    return DuckDBDatabase(path)
+
+
+@pytest.mark.parametrize("kpi", sorted(main.KPI_REGISTRY))
+def test_kpi_template_runs_on_duckdb_snapshot(db, kpi):
+    rows = db._execute(main.KPI_REGISTRY[kpi]["sql_template"])
+    assert rows, f"{kpi} no devolvió filas en la BD local"
+
+
+def test_text_dates_use_day_month_year():
+    import datetime
+
+    import duckdb
+
+    sql = postgres_to_duckdb("SELECT CAST(SUBSTRING('23-02-2025, 10:15' FROM 1 FOR 10) AS DATE)")
+    assert duckdb.connect().execute(sql).fetchone()[0] == datetime.date(2025, 2, 23)
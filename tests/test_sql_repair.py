@@ -0,0 +1,28 @@
+from sql_repair import SQLRepairer
+
+SCHEMA = {
+    "transacciones": ["ID de transacción", "Fecha", "Cuenta", "Total", "Comisión", "sede_sk"],
+    "dw.dim_sede": ["sede_sk", "nombre_sede"],
+}
+
+
+def test_repairs_accents_and_case():
+    repaired, fixes = SQLRepairer(SCHEMA).repair('SELECT SUM("Comision") FROM transacciones')
+    assert repaired == 'SELECT SUM("Comisión") FROM transacciones'
+    assert fixes == ['"Comision" → "Comisión"']
+
+
+def test_repairs_unquoted_column_and_table():
+    repaired, _ = SQLRepairer(SCHEMA).repair("SELECT fecha FROM transaccion")
+    assert repaired == 'SELECT "Fecha" FROM transacciones'
+
+
+def test_keeps_extract_and_aliases():
+    repairer = SQLRepairer(SCHEMA)
+    assert repairer.repair('SELECT EXTRACT(DOW FROM "Fecha") AS dia FROM transacciones ORDER BY dia') is None
+    assert repairer.repair('SELECT ds.nombre_sede FROM public.transacciones t JOIN dw.dim_sede ds '
+                           'ON t.sede_sk = ds.sede_sk') is None
+
+
+def test_unrelated_identifier_is_left_for_the_llm():
+    assert SQLRepairer(SCHEMA).repair('SELECT "Propina" FROM transacciones') is None
@@ -0,0 +1,17 @@
+from sql_result_cache import canonicalize_sql, fingerprint_sql
+
+
+def test_fingerprint_ignores_formatting():
+    a = 'SELECT "Total" FROM transacciones WHERE "Total" > 10.0;'
+    b = 'select  "Total"\nFROM transacciones -- filtro\nwhere "Total" > 10'
+    assert fingerprint_sql(a) == fingerprint_sql(b)
+
+
+def test_fingerprint_keeps_literals_and_quoted_identifiers():
+    base = fingerprint_sql("SELECT \"Total\" FROM transacciones WHERE \"Cuenta\" = 'merced'")
+    assert base != fingerprint_sql("SELECT \"Total\" FROM transacciones WHERE \"Cuenta\" = 'Merced'")
+    assert base != fingerprint_sql("SELECT \"total\" FROM transacciones WHERE \"Cuenta\" = 'merced'")
+
+
+def test_canonical_form_normalizes_numbers_and_keywords():
+    assert canonicalize_sql("SELECT 10.50 FROM t;") == canonicalize_sql("select 10.5 from T")
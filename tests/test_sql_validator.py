@@ -0,0 +1,65 @@
+import pytest
+
+import sql_validator
+from sql_validator import SQLValidator
+
+SCHEMA = {
+    "transacciones": ["ID de transacción", "Fecha", "Hora", "Cuenta", "Estado", "Ejecutar como", "Total", "sede_sk"],
+    "informe_ventas": ["ID de transacción", "Fecha", "Descripción", "Cantidad", "Precio (Bruto)", "sede_sk"],
+    "dw.dim_sede": ["sede_sk", "nombre_sede"],
+}
+
+PARSERS = ["tokens"] + (["sqlglot"] if sql_validator.sqlglot is not None else [])
+
+
+@pytest.fixture(params=PARSERS)
+def validator(request):
+    return SQLValidator(SCHEMA, parser=request.param)
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT "Cuenta", SUM("Total") AS total FROM transacciones GROUP BY "Cuenta" ORDER BY total DESC',
+    'SELECT t."Total" total FROM transacciones t ORDER BY total DESC',
+    'SELECT "Ejecutar como" FROM transacciones',
+    'SELECT SUM("Total")::numeric AS s FROM public.transacciones;',
+    'SELECT EXTRACT(DOW FROM TO_TIMESTAMP("Fecha", \'DD-MM-YYYY\')) AS dia, COUNT(*) FROM informe_ventas GROUP BY 1',
+    'WITH x AS (SELECT "Cuenta", COUNT(*) n FROM transacciones GROUP BY 1) SELECT x.n FROM x',
+    'SELECT ds.nombre_sede, COUNT(*) FROM transacciones tr JOIN dw.dim_sede ds ON tr.sede_sk = ds.sede_sk '
+    'GROUP BY ds.nombre_sede',
+    'SELECT CASE WHEN "Total" > 0 THEN 1 ELSE 0 END AS positivo FROM transacciones',
+])
+def test_valid_queries(validator, sql):
+    assert validator.validate(sql) is None
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * INTO copia FROM transacciones",
+    "DELETE FROM transacciones",
+    "SELECT 1; DROP TABLE transacciones",
+    "SELECT pg_sleep(10)",
+])
+def test_security_rejections(validator, sql):
+    assert validator.validate(sql).startswith("SQL_SECURITY_ERROR")
+
+
+@pytest.mark.parametrize("sql, identifier", [
+    ("select updated_at from transacciones", "updated_at"),
+    ("SELECT fecha FROM transacciones", "fecha"),
+    ('SELECT "Fecha" FROM transacciones WHERE monto > 0', "monto"),
+    ('SELECT "Propina" FROM transacciones', "Propina"),
+])
+def test_unknown_columns(validator, sql, identifier):
+    error = validator.validate(sql)
+    assert error.startswith("SQL_VALIDATION_ERROR") and f'"{identifier}"' in error
+
+
+def test_unknown_table(validator):
+    error = validator.validate('SELECT "Total" FROM ventas_secretas')
+    assert error.startswith("SQL_VALIDATION_ERROR") and "ventas_secretas" in error
+
+
+def test_results_are_cached_by_fingerprint():
+    validator = SQLValidator(SCHEMA, parser="tokens")
+    validator.validate('SELECT "Total" FROM transacciones')
+    validator.validate('select   "Total"\nfrom transacciones -- comentario')
+    assert validator.stats["validated"] == 1 and validator.stats["cache_hits"] == 1